@@ -56,6 +56,7 @@ def default_config():
         "actions": [],
         "debug_rules": False,
         "rule_optimizer": True,
+        "event_processing_workers": 0,
         "log_level": {
             "cmk.mkeventd": cmk.utils.log.INFO,
             "cmk.mkeventd.EventServer": cmk.utils.log.INFO,
@@ -67,6 +68,7 @@ def default_config():
         "log_rulehits": False,
         "log_messages": False,
         "retention_interval": 60,
+        "status_journal_interval": 5,
         "housekeeping_interval": 60,
         "statistics_interval": 5,
         "history_lifetime": 365,  # days
@@ -24,12 +24,15 @@
 # to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
 # Boston, MA 02110-1301 USA.
 
+import array
+import marshal
 import os
 import string
-import subprocess
 import threading
 import time
 
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple  # pylint: disable=unused-import
+
 import six
 
 import cmk.ec.actions
@@ -49,6 +52,8 @@ class History(object):
         self._lock = threading.Lock()
         self._mongodb = MongoDB()
         self._active_history_period = ActiveHistoryPeriod()
+        self._index_lock = threading.Lock()
+        self._file_indexes = {}  # type: Dict[Any, HistoryFileIndex]
         self.reload_configuration(config)
 
     def reload_configuration(self, config):
@@ -402,6 +407,10 @@ def _expire_logfiles(settings, config, logger, lock_history, flush):
                     logger.info("Deleting log file %s (age %s)" %
                                 (path, cmk.utils.render.date_and_time(path.stat().st_mtime)))
                     path.unlink()
+            # Also remove the indexes of the deleted log files
+            for path in settings.paths.history_dir.value.glob('*.idx'):
+                if flush or not path.with_suffix('.log').exists():
+                    path.unlink()
         except Exception as e:
             if settings.options.debug:
                 raise
@@ -410,90 +419,48 @@ def _expire_logfiles(settings, config, logger, lock_history, flush):
 
 def _get_files(history, logger, query):
     filters, limit = query.filters, query.limit
-    history_entries = []
+    history_entries = []  # type: List[List[Any]]
     if not history._settings.paths.history_dir.value.exists():
         return []
 
     logger.debug("Filters: %r", filters)
     logger.debug("Limit: %r", limit)
 
-    # Be aware: The order here is important. It must match the order of the fields
-    # in the history file entries (See get_event_history_from_file). The fields in
-    # the file are currectly in the same order as StatusTableHistory.columns.
-    #
-    # Please note: Keep this in sync with livestatus/src/TableEventConsole.cc.
-    grepping_filters = [
-        'event_id',
-        'event_text',
-        'event_comment',
-        'event_host',
-        'event_host_regex',
-        'event_contact',
-        'event_application',
-        'event_rule_id',
-        'event_owner',
-        'event_ipaddress',
-        'event_core_host',
-    ]
-
-    # Optimization: use grep in order to reduce amount of read lines based on
-    # some frequently used filters.
-    #
-    # It's ok if the filters don't match 100% accurately on the right lines. If in
-    # doubt, you can output more lines than necessary. This is only a kind of
-    # prefiltering.
-    greptexts = []
-    for column_name, operator_name, _predicate, argument in filters:
-        # Make sure that the greptexts are in the same order as in the
-        # actual logfiles. They will be joined with ".*"!
-        try:
-            nr = grepping_filters.index(column_name)
-            if operator_name in ['=' '~~']:
-                greptexts.append((nr, str(argument)))
-        except Exception:
-            pass
-
-    greptexts.sort()
-    greptexts = [x[1] for x in greptexts]
-    logger.debug("Texts for grep: %r", greptexts)
-
-    time_filters = [f for f in filters if f[0].split("_")[-1] == "time"]
-    logger.debug("Time filters: %r", time_filters)
-
-    # We do not want to open all files. So our strategy is:
-    # look for "time" filters and first apply the filter to
-    # the first entry and modification time of the file. Only
-    # if at least one of both timestamps is accepted then we
-    # take that file into account.
-    # Use the later logfiles first, to get the newer log entries
-    # first. When a limit is reached, the newer entries should
-    # be processed in most cases. We assume that now.
-    # To keep a consistent order of log entries, we should care
-    # about sorting the log lines in reverse, but that seems to
-    # already be done by the GUI, so we don't do that twice. Skipping
-    # this # will lead into some lines of a single file to be limited in
-    # wrong order. But this should be better than before.
-    for ts, path in sorted(((int(str(path.name)[:-4]), path)
-                            for path in history._settings.paths.history_dir.value.glob('*.log')),
-                           reverse=True):
+    # Optimization: Use the indexes of the log files to read only the lines which
+    # may match the filters on frequently used columns. The filters are applied
+    # to the lines nevertheless, the index only has to find all candidates.
+    index_filters = _get_index_filters(filters)
+    logger.debug("Index filters: %r", index_filters)
+
+    min_time, max_time = _get_time_range(filters)
+    logger.debug("Time range: %r - %r", min_time, max_time)
+
+    # Use the later logfiles first, to get the newer log entries first. The
+    # lines of each file are read in reverse order, so the reading can stop as
+    # soon as the limit is reached.
+    paths = sorted(((int(str(path.name)[:-4]), path)
+                    for path in history._settings.paths.history_dir.value.glob('*.log')),
+                   reverse=True)
+    for nr, (ts, path) in enumerate(paths):
         if limit is not None and limit <= 0:
             break
-        first_entry, last_entry = _get_logfile_timespan(path)
-        for _column_name, _operator_name, predicate, _argument in time_filters:
-            if predicate(first_entry):
-                break
-            if predicate(last_entry):
-                break
-        else:
-            # If no filter matches but we *have* filters
-            # then we skip this file. It cannot contain
-            # any useful entry for us.
-            if len(time_filters):
-                if history._settings.options.debug:
-                    history._logger.info("Skipping logfile %s.log because of time filter" % ts)
-                continue  # skip this file
-
-        new_entries = _parse_history_file(history, path, query, greptexts, limit, history._logger)
+
+        try:
+            with history._index_lock:
+                index = _get_history_file_index(history, path, is_current=nr == 0)
+        except Exception as e:
+            if history._settings.options.debug:
+                raise
+            logger.exception("Cannot index history file %s: %s" % (path, e))
+            continue
+
+        if index.first_time is None or index.last_time < min_time or index.first_time > max_time:
+            if history._settings.options.debug:
+                history._logger.info("Skipping logfile %s.log because of time filter" % ts)
+            continue  # skip this file
+
+        new_entries = _parse_history_file(history, path, index, query, index_filters,
+                                          (min_time, max_time), limit, history._logger)
         history_entries += new_entries
         if limit is not None:
             limit -= len(new_entries)
@@ -501,36 +468,271 @@ def _get_files(history, logger, query):
     return history_entries
 
 
-def _parse_history_file(history, path, query, greptexts, limit, logger):
-    entries = []
-    line_no = 0
-    # If we have greptexts we pre-filter the file using the extremely
-    # fast GNU Grep
-    # Revert lines from the log file to have the newer lines processed first
-    cmd = 'tac %s' % cmk.ec.actions.quote_shell_string(str(path))
-    if greptexts:
-        cmd += " | egrep -i -e %s" % cmk.ec.actions.quote_shell_string(".*".join(greptexts))
-    grep = subprocess.Popen(cmd, shell=True, close_fds=True, stdout=subprocess.PIPE)  # nosec
-
-    for line in grep.stdout:
-        line_no += 1
-        if limit is not None and len(entries) > limit:
-            grep.kill()
-            grep.wait()
-            break
+def _get_index_filters(filters):
+    # type: (List[Tuple[str, str, Any, Any]]) -> List[Tuple[str, List[Any]]]
+    """Returns the filters which can be resolved using the indexes of the log files"""
+    index_filters = []
+    for column_name, operator_name, _predicate, argument in filters:
+        if column_name not in HistoryFileIndex.column_positions:
+            continue
+        if operator_name == "=":
+            index_filters.append((column_name, [argument]))
+        elif operator_name == "in":
+            index_filters.append((column_name, list(argument)))
+    return index_filters
+
+
+def _get_time_range(filters):
+    # type: (List[Tuple[str, str, Any, Any]]) -> Tuple[float, float]
+    """Returns the range of history_time values which may match the filters"""
+    min_time, max_time = float("-inf"), float("inf")
+    for column_name, operator_name, _predicate, argument in filters:
+        if column_name != "history_time":
+            continue
+        if operator_name in [">", ">=", "="]:
+            min_time = max(min_time, argument)
+        if operator_name in ["<", "<=", "="]:
+            max_time = min(max_time, argument)
+    return min_time, max_time
+
+
+def _parse_history_file(history, path, index, query, index_filters, time_range, limit, logger):
+    entries = []  # type: List[List[Any]]
+    min_time, max_time = time_range
+
+    line_numbers = None  # type: Optional[Set[int]]
+    for column_name, values in index_filters:
+        found = index.line_numbers(column_name, values)
+        line_numbers = found if line_numbers is None else line_numbers & found
+
+    with path.open(mode="rb") as f:
+        for line_nr, line in _read_history_file_reversed(f, index, line_numbers):
+            if limit is not None and len(entries) >= limit:
+                break
 
-        try:
-            parts = line.decode('utf-8').rstrip('\n').split('\t')
-            _convert_history_line(history, parts)
-            values = [line_no] + parts
-            if query.filter_row(values):
-                entries.append(values)
-        except Exception as e:
-            logger.exception("Invalid line '%s' in history file %s: %s" % (line, path, e))
+            try:
+                # Check the time before decoding the whole line. The entries of a
+                # file are ordered by time, older entries do not need to be read.
+                line_time = float(line.split('\t', 1)[0])
+                if line_time > max_time:
+                    continue
+                if line_time < min_time:
+                    break
+
+                parts = line.decode('utf-8').split('\t')
+                _convert_history_line(history, parts)
+                values = [line_nr + 1] + parts
+                if query.filter_row(values):
+                    entries.append(values)
+            except Exception as e:
+                logger.exception("Invalid line '%s' in history file %s: %s" % (line, path, e))
 
     return entries
 
 
+def _read_history_file_reversed(f, index, line_numbers=None, lines_per_read=1000):
+    # type: (Any, HistoryFileIndex, Optional[Set[int]], int) -> Iterator[Tuple[int, str]]
+    """Yields the numbers and texts of the indexed lines of a log file, the last one first
+
+    When line_numbers are given, only these lines are read."""
+    offsets = index.offsets
+    if line_numbers is not None:
+        for line_nr in sorted(line_numbers, reverse=True):
+            f.seek(offsets[line_nr])
+            yield line_nr, f.readline().rstrip('\n')
+        return
+
+    line_nr, end = len(offsets), index.size
+    while line_nr > 0:
+        first_line_nr = max(0, line_nr - lines_per_read)
+        f.seek(offsets[first_line_nr])
+        lines = f.read(end - offsets[first_line_nr]).split('\n')
+        for nr in xrange(line_nr - 1, first_line_nr - 1, -1):
+            yield nr, lines[nr - first_line_nr]
+        line_nr, end = first_line_nr, offsets[first_line_nr]
+
+
+def _get_history_file_index(history, path, is_current):
+    # type: (History, Any, bool) -> HistoryFileIndex
+    """Returns the index of a log file, updated to the lines appended since the last query
+
+    Only the index of the current log file is kept in memory. The indexes are saved
+    next to the log files. The index of the current log file is saved when it has
+    doubled its size, to keep the effort of saving it proportional to its size."""
+    index_path = path.with_suffix('.idx')
+    index = history._file_indexes.get(path)
+    if index is None:
+        index = HistoryFileIndex.load(index_path)
+
+    index.update(path)
+    if index.num_lines > index.num_saved_lines and \
+            (not is_current or index.num_lines >= 2 * index.num_saved_lines):
+        try:
+            index.save(index_path)
+        except (IOError, OSError) as e:
+            # Not critical: The log file is indexed again by the next query
+            history._logger.error("Cannot save index %s: %s" % (index_path, e))
+
+    if is_current:
+        history._file_indexes = {path: index}
+    return index
+
+
+class HistoryFileIndex(object):
+    """Index of the lines of a log file by the values of frequently filtered columns
+
+    The index holds the offsets of all lines and the numbers of the lines per
+    value of the indexed columns. The event IDs are indexed in blocks of IDs
+    (with pairs of event ID and line number) to keep the number of keys small."""
+    version = 1
+
+    # Positions of the indexed columns in the lines of the log files
+    column_positions = {
+        "event_id": 4,
+        "event_host": 11,
+        "event_application": 13,
+        "event_rule_id": 17,
+    }
+    event_id_block_bits = 8
+
+    def __init__(self):
+        super(HistoryFileIndex, self).__init__()
+        self.inode = None  # type: Optional[int]
+        self.size = 0  # Number of indexed bytes of the log file
+        self.first_time = None  # type: Optional[float]
+        self.last_time = None  # type: Optional[float]
+        self.offsets = array.array('l')
+        self.postings = {column_name: {} for column_name in self.column_positions
+                        }  # type: Dict[str, Dict[Any, array.array]]
+        self.num_saved_lines = 0
+
+    @property
+    def num_lines(self):
+        # type: () -> int
+        return len(self.offsets)
+
+    @classmethod
+    def load(cls, index_path):
+        index = cls()
+        try:
+            with index_path.open(mode="rb") as f:
+                data = marshal.loads(f.read())
+            if data["version"] != cls.version:
+                return index
+
+            index.inode = data["inode"]
+            index.size = data["size"]
+            index.first_time = data["first_time"]
+            index.last_time = data["last_time"]
+            index.offsets.fromstring(data["offsets"])
+            for column_name, postings in data["postings"].iteritems():
+                for value, line_numbers in postings.iteritems():
+                    index.postings[column_name][value] = array.array('I', line_numbers)
+        except (IOError, OSError, EOFError, ValueError, TypeError, KeyError):
+            return cls()  # Missing or broken: Index the log file again
+
+        index.num_saved_lines = index.num_lines
+        return index
+
+    def save(self, index_path):
+        postings = {}
+        for column_name, column_postings in self.postings.iteritems():
+            postings[column_name] = {
+                value: line_numbers.tostring()
+                for value, line_numbers in column_postings.iteritems()
+            }
+
+        data = {
+            "version": self.version,
+            "inode": self.inode,
+            "size": self.size,
+            "first_time": self.first_time,
+            "last_time": self.last_time,
+            "offsets": self.offsets.tostring(),
+            "postings": postings,
+        }
+        tmp_path = index_path.parent / (index_path.name + ".new")
+        with tmp_path.open(mode="wb") as f:
+            f.write(marshal.dumps(data))
+        tmp_path.rename(index_path)
+        self.num_saved_lines = self.num_lines
+
+    def update(self, path, bytes_per_read=4 * 1024 * 1024):
+        """Indexes the complete lines which have been appended to the log file"""
+        with path.open(mode="rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self.inode or stat.st_size < self.size:
+                self.__init__()  # The log file has been replaced
+                self.inode = stat.st_ino
+
+            f.seek(self.size)
+            rest = ""
+            while True:
+                chunk = f.read(bytes_per_read)
+                if not chunk:
+                    break
+                data = rest + chunk
+                end = data.rfind("\n") + 1
+                self._add_lines(data[:end])
+                rest = data[end:]
+
+    def _add_lines(self, data):
+        offsets = self.offsets
+        id_postings = self.postings["event_id"]
+        value_postings = [(self.postings[column_name], position)
+                          for column_name, position in self.column_positions.iteritems()
+                          if column_name != "event_id"]
+        num_columns = max(self.column_positions.itervalues()) + 1
+
+        offset = self.size
+        for line in data.split("\n")[:-1]:
+            line_nr = len(offsets)
+            offsets.append(offset)
+            offset += len(line) + 1
+
+            parts = line.split("\t", num_columns)
+            if len(parts) < num_columns:
+                continue  # Invalid line, will also be skipped by the query
+            try:
+                line_time = float(parts[0])
+                event_id = int(parts[4])
+            except ValueError:
+                continue
+
+            if self.first_time is None:
+                self.first_time = line_time
+            if self.last_time is None or line_time > self.last_time:
+                self.last_time = line_time
+
+            block = id_postings.get(event_id >> self.event_id_block_bits)
+            if block is None:
+                block = id_postings[event_id >> self.event_id_block_bits] = array.array('I')
+            block.extend((event_id, line_nr))
+
+            for postings, position in value_postings:
+                line_numbers = postings.get(parts[position])
+                if line_numbers is None:
+                    line_numbers = postings[parts[position]] = array.array('I')
+                line_numbers.append(line_nr)
+
+        self.size = offset
+
+    def line_numbers(self, column_name, values):
+        # type: (str, List[Any]) -> Set[int]
+        """Returns the numbers of the lines having one of the values in the column"""
+        postings = self.postings[column_name]
+        found = set()  # type: Set[int]
+        for value in values:
+            if column_name == "event_id":
+                block = postings.get(value >> self.event_id_block_bits, ())
+                found.update(block[i + 1] for i in xrange(0, len(block), 2) if block[i] == value)
+            else:
+                if isinstance(value, unicode):
+                    value = value.encode("utf-8")
+                found.update(postings.get(value, ()))
+        return found
+
+
 # Speed-critical function for converting string representation
 # of log line back to Python values
 def _convert_history_line(history, values):
@@ -583,19 +785,6 @@ def _unsplit(s):
     return s
 
 
-def _get_logfile_timespan(path):
-    try:
-        with path.open(encoding="utf-8") as f:
-            first_entry = float(f.readline().split('\t', 1)[0])
-    except Exception:
-        first_entry = 0.0
-    try:
-        last_entry = path.stat().st_mtime
-    except Exception:
-        last_entry = 0.0
-    return first_entry, last_entry
-
-
 # Rip out/replace any characters which have a special meaning in the UTF-8
 # encoded history files, see e.g. quote_tab. In theory this shouldn't be
 # necessary, because there are a bunch of bytes which are not contained in any
@@ -33,7 +33,9 @@
 
 import abc
 import ast
+from collections import OrderedDict
 import errno
+import heapq
 import json
 import os
 import pprint
@@ -45,7 +47,7 @@ import sys
 import threading
 import time
 import traceback
-from typing import Any, Dict, List, Optional, Tuple, Union  # pylint: disable=unused-import
+from typing import Any, Dict, List, Optional, Set, Tuple, Union  # pylint: disable=unused-import
 
 import pathlib2 as pathlib
 import six
@@ -56,6 +58,8 @@ import cmk.utils.defines
 import cmk.ec.actions
 import cmk.ec.export
 import cmk.ec.history
+import cmk.ec.pipeline
+import cmk.ec.rule_prefilter
 import cmk.ec.settings
 import cmk.ec.snmp
 import cmk.utils.log
@@ -592,9 +596,9 @@ class Perfcounters(object):
 
         self._logger = logger.getChild("Perfcounters")
 
-    def count(self, counter):
+    def count(self, counter, amount=1):
         with self._lock:
-            self._counters[counter] += 1
+            self._counters[counter] += amount
 
     def count_time(self, counter, ptime):
         with self._lock:
@@ -667,6 +671,10 @@ class Perfcounters(object):
 
 
 class EventServer(ECServerThread):
+    # Maximum number of lines received at once from a socket and handed over
+    # to a worker of the event pipeline
+    _batch_size = 200
+
     month_names = {
         "Jan": 1,
         "Feb": 2,
@@ -711,6 +719,12 @@ class EventServer(ECServerThread):
         self._rule_matcher = RuleMatcher(self._logger, config)
         self._event_creator = EventCreator(self._logger, config)
 
+        # Received lines are classified by the worker processes of the pipeline
+        # (when enabled) using the rules the pipeline has been started with
+        self._pipeline = None  # type: Optional[cmk.ec.pipeline.EventPipeline]
+        self._pipeline_rules = []  # type: List[Dict[str, Any]]
+        self._received_lines = []  # type: List[Tuple[six.text_type, Any]]
+
         self.create_pipe()
         self.open_eventsocket()
         self.open_syslog()
@@ -882,6 +896,11 @@ class EventServer(ECServerThread):
         return os.open(str(self.settings.paths.event_pipe.value), os.O_RDWR | os.O_NONBLOCK)
 
     def handle_snmptrap(self, trap, ipaddress):
+        # Keep the order of the events: Process the lines received before
+        if self._pipeline is not None:
+            self._dispatch_received_lines()
+            for results in self._pipeline.results(wait=True):
+                self._process_classified_lines(results)
         self.process_event(self._event_creator.create_event_from_trap(trap, ipaddress))
 
     def serve(self):
@@ -911,9 +930,11 @@ class EventServer(ECServerThread):
         client_sockets = {}
         select_timeout = 1
         while not self._terminate_event.is_set():
+            self._update_pipeline()
+            pipeline_list = [self._pipeline] if self._pipeline is not None else []
             try:
-                readable = select.select(listen_list + client_sockets.keys(), [], [],
-                                         select_timeout)[0]
+                readable = select.select(listen_list + client_sockets.keys() + pipeline_list, [],
+                                         [], select_timeout)[0]
             except select.error as e:
                 if e[0] == errno.EINTR:
                     continue
@@ -1003,7 +1024,7 @@ class EventServer(ECServerThread):
 
             # Read events from builtin syslog server
             if self._syslog is not None and self._syslog.fileno() in readable:
-                self.process_raw_lines(*self._syslog.recvfrom(4096))
+                self._receive_syslog_messages()
 
             # Read events from builtin snmptrap server
             if self._snmptrap is not None and self._snmptrap.fileno() in readable:
@@ -1025,6 +1046,101 @@ class EventServer(ECServerThread):
             except StopIteration:
                 select_timeout = 1  # restore default select timeout
 
+            if self._pipeline is not None:
+                self._dispatch_received_lines()
+                for results in self._pipeline.results():
+                    self._process_classified_lines(results)
+
+        self._stop_pipeline()
+
+    def _receive_syslog_messages(self):
+        # Drain the socket as far as possible: During bursts of messages the
+        # socket buffer overflows when only one message is read per select()
+        for _unused in xrange(self._batch_size):
+            try:
+                self.process_raw_lines(*self._syslog.recvfrom(4096, socket.MSG_DONTWAIT))
+            except socket.error as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    break
+                raise
+
+    def _update_pipeline(self):
+        # The pipeline is started with the current rules. Restart it when the
+        # rules or the number of workers have changed.
+        num_workers = self._config["event_processing_workers"]
+        if self._pipeline is not None and (num_workers != self._pipeline.num_workers or
+                                           self._pipeline_rules is not self._rules):
+            # Not while holding the configuration lock: Processing the pending
+            # results needs the lock of the event status
+            self._stop_pipeline()
+
+        if self._pipeline is None and num_workers:
+            # The workers are forked from this process: Make sure they do not get
+            # rules which are compiled at the moment
+            with self._lock_configuration:
+                self._pipeline_rules = self._rules
+                self._pipeline = cmk.ec.pipeline.EventPipeline(self._logger, num_workers,
+                                                               self.classify_lines)
+
+    def _stop_pipeline(self):
+        if self._pipeline is None:
+            return
+        self._dispatch_received_lines()
+        for results in self._pipeline.results(wait=True):
+            self._process_classified_lines(results)
+        self._pipeline.close()
+        self._pipeline = None
+        self._pipeline_rules = []
+
+    def _dispatch_received_lines(self):
+        lines, self._received_lines = self._received_lines, []
+        for start in xrange(0, len(lines), self._batch_size):
+            # Process the oldest results first when the workers are too busy
+            while self._pipeline.is_full():
+                self._process_classified_lines(self._pipeline.next_result() or [])
+            self._pipeline.submit(lines[start:start + self._batch_size])
+
+    def _process_classified_lines(self, results):
+        rules = self._pipeline_rules
+        for event, hits, num_rule_tries in results:
+
+            def handler(event=event, hits=hits, num_rule_tries=num_rule_tries):
+                if event is None:
+                    return  # The line could not be processed by the worker
+                self._perfcounters.count("rule_tries", num_rule_tries)
+                self._process_rule_hits(event, [(rules[nr], result) for nr, result in hits])
+
+            try:
+                self.process_raw_data(handler)
+            except Exception as e:
+                self._logger.exception('Exception handling a log line (skipping this one): %s' % e)
+
+    def classify_lines(self, lines):
+        """Creates the events of received lines and finds the rules hit by them
+
+        This is done by the worker processes of the pipeline and must not change
+        the state of the event daemon. Returns the event, the hit rules (by their
+        position) with the match results and the number of rule tries per line."""
+        positions = dict((id(rule), nr) for nr, rule in enumerate(self._rules))
+        results = []
+        for line, address in lines:
+            num_rule_tries = [0]
+
+            def rule_matches(rule, event, num_rule_tries=num_rule_tries):
+                num_rule_tries[0] += 1
+                return self._event_rule_matches(rule, event)
+
+            try:
+                event = self.create_event_from_line(line, address)
+                self.do_translate_hostname(event)
+                hits = self._find_rule_hits(event, rule_matches)
+                results.append((event, [(positions[id(rule)], result) for rule, result in hits],
+                                num_rule_tries[0]))
+            except Exception as e:
+                self._logger.exception('Exception handling a log line (skipping this one): %s' % e)
+                results.append((None, [], num_rule_tries[0]))
+        return results
+
     # Processes incoming data, just a wrapper between the real data and the
     # handler function to record some statistics etc.
     def process_raw_data(self, handler):
@@ -1043,7 +1159,9 @@ class EventServer(ECServerThread):
         lines = data.splitlines()
         for line in lines:
             line = scrub_and_decode(line.rstrip())
-            if line:
+            if line and self._pipeline is not None:
+                self._received_lines.append((line, address))
+            elif line:
                 try:
 
                     def handler(line=line):
@@ -1091,71 +1209,79 @@ class EventServer(ECServerThread):
         #    time is elapsed.
         # 2. Automatically delete all events that are in state "open"
         #    and whose livetime is elapsed.
+        # 3. Activate the delayed events whose delay is elapsed.
         events_to_delete = []
-        events = self._event_status.events()
         now = time.time()
-        for nr, event in enumerate(events):
+        for event in self._event_status.events_in_phase("counting"):
             rule = self._rule_by_id.get(event["rule_id"])
 
-            if event["phase"] == "counting":
-                # Event belongs to a rule that does not longer exist? It
-                # will never reach its count. Better delete it.
-                if not rule:
-                    self._logger.info("Deleting orphaned event %d created by obsolete rule %s" %
-                                      (event["id"], event["rule_id"]))
-                    event["phase"] = "closed"
-                    self._history.add(event, "ORPHANED")
-                    events_to_delete.append(nr)
-
-                elif "count" not in rule and "expect" not in rule:
-                    self._logger.info(
-                        "Count-based event %d belonging to rule %s: rule does not "
-                        "count/expect anymore. Deleting event." % (event["id"], event["rule_id"]))
-                    event["phase"] = "closed"
-                    self._history.add(event, "NOCOUNT")
-                    events_to_delete.append(nr)
-
-                # handle counting
-                elif "count" in rule:
-                    count = rule["count"]
-                    if count.get("algorithm") in ["tokenbucket", "dynabucket"]:
-                        last_token = event.get("last_token", event["first"])
-                        secs_per_token = count["period"] / float(count["count"])
-                        if count["algorithm"] == "dynabucket":  # get fewer tokens if count is lower
-                            if event["count"] <= 1:
-                                secs_per_token = count["period"]
-                            else:
-                                secs_per_token *= (float(count["count"]) / float(event["count"]))
-                        elapsed_secs = now - last_token
-                        new_tokens = int(elapsed_secs / secs_per_token)
-                        if new_tokens:
-                            if self.settings.options.debug:
-                                self._logger.info(
-                                    "Rule %s/%s, event %d: got %d new tokens" %
-                                    (rule["pack"], rule["id"], event["id"], new_tokens))
-                            event["count"] = max(0, event["count"] - new_tokens)
-                            event[
-                                "last_token"] = last_token + new_tokens * secs_per_token  # not now! would be unfair
-                            if event["count"] == 0:
-                                self._logger.info(
-                                    "Rule %s/%s, event %d: again without allowed rate, dropping event"
-                                    % (rule["pack"], rule["id"], event["id"]))
-                                event["phase"] = "closed"
-                                self._history.add(event, "COUNTFAILED")
-                                events_to_delete.append(nr)
+            # Event belongs to a rule that does not longer exist? It
+            # will never reach its count. Better delete it.
+            if not rule:
+                self._logger.info("Deleting orphaned event %d created by obsolete rule %s" %
+                                  (event["id"], event["rule_id"]))
+                event["phase"] = "closed"
+                self._history.add(event, "ORPHANED")
+                events_to_delete.append(event)
 
-                    else:  # algorithm 'interval'
-                        if event["first"] + count["period"] <= now:  # End of period reached
+            elif "count" not in rule and "expect" not in rule:
+                self._logger.info(
+                    "Count-based event %d belonging to rule %s: rule does not "
+                    "count/expect anymore. Deleting event." % (event["id"], event["rule_id"]))
+                event["phase"] = "closed"
+                self._history.add(event, "NOCOUNT")
+                events_to_delete.append(event)
+
+            # handle counting
+            elif "count" in rule:
+                count = rule["count"]
+                if count.get("algorithm") in ["tokenbucket", "dynabucket"]:
+                    last_token = event.get("last_token", event["first"])
+                    secs_per_token = count["period"] / float(count["count"])
+                    if count["algorithm"] == "dynabucket":  # get fewer tokens if count is lower
+                        if event["count"] <= 1:
+                            secs_per_token = count["period"]
+                        else:
+                            secs_per_token *= (float(count["count"]) / float(event["count"]))
+                    elapsed_secs = now - last_token
+                    new_tokens = int(elapsed_secs / secs_per_token)
+                    if new_tokens:
+                        if self.settings.options.debug:
+                            self._logger.info("Rule %s/%s, event %d: got %d new tokens" %
+                                              (rule["pack"], rule["id"], event["id"], new_tokens))
+                        event["count"] = max(0, event["count"] - new_tokens)
+                        event[
+                            "last_token"] = last_token + new_tokens * secs_per_token  # not now! would be unfair
+                        self._event_status.reindex_event(event)
+                        if event["count"] == 0:
                             self._logger.info(
-                                "Rule %s/%s: reached only %d out of %d events within %d seconds. "
-                                "Resetting to zero." % (rule["pack"], rule["id"], event["count"],
-                                                        count["count"], count["period"]))
+                                "Rule %s/%s, event %d: again without allowed rate, dropping event" %
+                                (rule["pack"], rule["id"], event["id"]))
                             event["phase"] = "closed"
                             self._history.add(event, "COUNTFAILED")
-                            events_to_delete.append(nr)
+                            events_to_delete.append(event)
+
+                else:  # algorithm 'interval'
+                    if event["first"] + count["period"] <= now:  # End of period reached
+                        self._logger.info(
+                            "Rule %s/%s: reached only %d out of %d events within %d seconds. "
+                            "Resetting to zero." % (rule["pack"], rule["id"], event["count"],
+                                                    count["count"], count["period"]))
+                        event["phase"] = "closed"
+                        self._history.add(event, "COUNTFAILED")
+                        events_to_delete.append(event)
+
+        # The events whose delay or livetime is elapsed are taken from the time
+        # ordered index instead of looking at all events
+        expired_events = self._event_status.pop_expired_events(now)
+        for event in expired_events:
+            rule = self._rule_by_id.get(event["rule_id"])
+
+            if event["phase"] == "counting":
+                continue  # handled above
 
             # Handle delayed actions
-            elif event["phase"] == "delayed":
+            if event["phase"] == "delayed":
                 delay_until = event.get("delay_until", 0)  # should always be present
                 if now >= delay_until:
                     self._logger.info("Delayed event %d of rule %s is now activated." %
@@ -1169,7 +1295,7 @@ class EventServer(ECServerThread):
                         if rule.get("autodelete"):
                             event["phase"] = "closed"
                             self._history.add(event, "AUTODELETE")
-                            events_to_delete.append(nr)
+                            events_to_delete.append(event)
 
                     else:
                         self._logger.info("Cannot do rule action: rule %s not present anymore." %
@@ -1181,14 +1307,18 @@ class EventServer(ECServerThread):
                     allowed_phases = event.get("live_until_phases", ["open"])
                     if event["phase"] in allowed_phases:
                         event["phase"] = "closed"
-                        events_to_delete.append(nr)
+                        events_to_delete.append(event)
                         self._logger.info("Livetime of event %d (rule %s) exceeded. Deleting event."
                                           % (event["id"], event["rule_id"]))
                         self._history.add(event, "EXPIRED")
 
-        # Do delayed deletion now (was delayed in order to keep list indices OK)
-        for nr in events_to_delete[::-1]:
-            self._event_status.remove_event(events[nr])
+        for event in events_to_delete:
+            self._event_status.remove_event(event)
+
+        # Schedule the remaining events again, they might have been opened or
+        # their other deadline has not been reached yet
+        for event in expired_events:
+            self._event_status.reindex_event(event)
 
     def hk_check_expected_messages(self):
         now = time.time()
@@ -1232,9 +1362,8 @@ class EventServer(ECServerThread):
                 # First look for case 1: rule that already have at least one hit
                 # and this events in the state "counting" exist.
                 events_to_delete = []
-                events = self._event_status.events()
-                for nr, event in enumerate(events):
-                    if event["rule_id"] == rule["id"] and event["phase"] == "counting":
+                for event in self._event_status.events_of_rule(rule["id"]):
+                    if event["phase"] == "counting":
                         # time has elapsed. Now lets see if we have reached
                         # the neccessary count:
                         if event["count"] < expected_count:  # no -> trigger alarm
@@ -1247,15 +1376,15 @@ class EventServer(ECServerThread):
                                                            expected_count))
                             self._history.add(event, "COUNTREACHED")
                         # Counting event is no longer needed.
-                        events_to_delete.append(nr)
+                        events_to_delete.append(event)
                         break
 
                 # Ou ou, no event found at all.
                 else:
                     self._handle_absent_event(rule, 0, expected_count, interval_start)
 
-                for nr in events_to_delete[::-1]:
-                    self._event_status.remove_event(events[nr])
+                for event in events_to_delete:
+                    self._event_status.remove_event(event)
 
     def _handle_absent_event(self, rule, event_count, expected_count, interval_start):
         now = time.time()
@@ -1271,10 +1400,9 @@ class EventServer(ECServerThread):
         merge_event = None
         merge = rule["expect"].get("merge", "open")
         if merge != "never":
-            for event in self._event_status.events():
-                if event["rule_id"] == rule["id"] and \
-                        (event["phase"] == "open" or
-                         (event["phase"] == "ack" and merge == "acked")):
+            for event in self._event_status.events_of_rule(rule["id"]):
+                if event["phase"] == "open" or \
+                        (event["phase"] == "ack" and merge == "acked"):
                     merge_event = event
                     break
 
@@ -1287,6 +1415,7 @@ class EventServer(ECServerThread):
             # Better rewrite (again). Rule might have changed. Also we have changed
             # the text and the user might have his own text added via set_text.
             self.rewrite_event(rule, merge_event, {}, set_first=False)
+            self._event_status.reindex_event(merge_event)
             self._history.add(merge_event, "COUNTFAILED")
         else:
             # Create artifical event from scratch. Make sure that all important
@@ -1317,6 +1446,7 @@ class EventServer(ECServerThread):
             self._history.add(event, "COUNTFAILED")
             cmk.ec.actions.event_has_opened(self._history, self.settings, self._config,
                                             self._logger, self, self._event_columns, rule, event)
+            self._event_status.reindex_event(event)
             if rule.get("autodelete"):
                 event["phase"] = "closed"
                 self._history.add(event, "AUTODELETE")
@@ -1336,6 +1466,7 @@ class EventServer(ECServerThread):
         self._rules = []
         self._rule_by_id = {}
         self._rule_hash = {}  # Speedup-Hash for rule execution
+        self._rule_prefilter = None  # type: Optional[cmk.ec.rule_prefilter.RulePrefilter]
         count_disabled = 0
         count_rules = 0
         count_unspecific = 0
@@ -1402,6 +1533,11 @@ class EventServer(ECServerThread):
         self._logger.info(
             "Compiled %d active rules (ignoring %d disabled rules)" % (count_rules, count_disabled))
         if self._config["rule_optimizer"]:
+            # Preselects the rules of the hash by the literal texts of their message patterns
+            self._rule_prefilter = cmk.ec.rule_prefilter.RulePrefilter(self._rules)
+            self._logger.info(
+                "Rule prefilter: %d literals, %d rules without literal" %
+                (self._rule_prefilter.num_literals, self._rule_prefilter.num_unconditional))
             self._logger.info("Rule hash: %d rules - %d hashed, %d unspecific" % (len(
                 self._rules), len(self._rules) - count_unspecific, count_unspecific))
             for facility in range(23) + [31]:
@@ -1475,6 +1611,9 @@ class EventServer(ECServerThread):
                                                          (100.0 * count / float(total_count))))
 
     def process_line(self, line, address):
+        self.process_event(self.create_event_from_line(line, address))
+
+    def create_event_from_line(self, line, address):
         line = line.rstrip()
         if self._config["debug_rules"]:
             if address:
@@ -1482,23 +1621,24 @@ class EventServer(ECServerThread):
             else:
                 self._logger.info(u"Processing message '%s'" % line)
 
-        event = self._event_creator.create_event_from_line(line, address)
-        self.process_event(event)
+        return self._event_creator.create_event_from_line(line, address)
 
     def process_event(self, event):
         self.do_translate_hostname(event)
+        self._process_rule_hits(event, self._find_rule_hits(event, self.event_rule_matches))
 
-        # Log all incoming messages into a syslog-like text file if that is enabled
-        if self._config["log_messages"]:
-            self.log_message(event)
-
-        # Rule optimizer
+    def _find_rule_hits(self, event, rule_matches):
+        # Tries the rules in order until a rule is hit which does not skip its
+        # rule pack. Returns the hit rules together with their match results.
+        # This does not change the state of the event daemon.
         if self._config["rule_optimizer"]:
-            self._hash_stats[event["facility"]][event["priority"]] += 1
-            rule_candidates = self._rule_hash.get(event["facility"], {}).get(event["priority"], [])
+            rule_candidates = self._rule_prefilter.select(
+                self._rule_hash.get(event["facility"], {}).get(event["priority"], []),
+                event["text"])
         else:
             rule_candidates = self._rules
 
+        hits = []
         skip_pack = None
         for rule in rule_candidates:
             if skip_pack and rule["pack"] == skip_pack:
@@ -1506,109 +1646,124 @@ class EventServer(ECServerThread):
             skip_pack = None  # new pack, reset skipping
 
             try:
-                result = self.event_rule_matches(rule, event)
+                result = rule_matches(rule, event)
             except Exception as e:
                 self._logger.exception('  Exception during matching:\n%s' % e)
                 result = False
 
             if result:  # A tuple with (True/False, {match_info}).. O.o
-                self._perfcounters.count("rule_hits")
-                cancelling, match_groups = result
+                hits.append((rule, result))
+                if rule.get("drop") != "skip_pack":
+                    break
+                skip_pack = rule["pack"]
+        return hits
 
-                if self._config["debug_rules"]:
-                    self._logger.info("  matching groups:\n%s" % pprint.pformat(match_groups))
+    def _process_rule_hits(self, event, hits):
+        # Log all incoming messages into a syslog-like text file if that is enabled
+        if self._config["log_messages"]:
+            self.log_message(event)
 
-                self._event_status.count_rule_match(rule["id"])
-                if self._config["log_rulehits"]:
-                    self._logger.info("Rule '%s/%s' hit by message %s/%s - '%s'." %
-                                      (rule["pack"], rule["id"], SyslogFacility(event["facility"]),
-                                       SyslogPriority(event["priority"]), event["text"]))
+        # Rule optimizer
+        if self._config["rule_optimizer"]:
+            self._hash_stats[event["facility"]][event["priority"]] += 1
 
-                if rule.get("drop"):
-                    if rule["drop"] == "skip_pack":
-                        skip_pack = rule["pack"]
-                        if self._config["debug_rules"]:
-                            self._logger.info("  skipping this rule pack (%s)" % skip_pack)
-                        continue
-                    else:
-                        self._perfcounters.count("drops")
-                        return
+        for rule, (cancelling, match_groups) in hits:
+            self._perfcounters.count("rule_hits")
 
-                if cancelling:
-                    self._event_status.cancel_events(self, self._event_columns, event, match_groups,
-                                                     rule)
-                    return
-                else:
-                    # Remember the rule id that this event originated from
-                    event["rule_id"] = rule["id"]
-
-                    # Lookup the monitoring core hosts and add the core host
-                    # name to the event when one can be matched
-                    # For the moment we have no rule/condition matching on this
-                    # field. So we only add the core host info for matched events.
-                    self._add_core_host_to_new_event(event)
-
-                    # Attach optional contact group information for visibility
-                    # and eventually for notifications
-                    self._add_rule_contact_groups_to_event(rule, event)
-
-                    # Store groups from matching this event. In order to make
-                    # persistence easier, we do not safe them as list but join
-                    # them on ASCII-1.
-                    event["match_groups"] = match_groups.get("match_groups_message", ())
-                    event["match_groups_syslog_application"] = match_groups.get(
-                        "match_groups_syslog_application", ())
-                    self.rewrite_event(rule, event, match_groups)
-
-                    if "count" in rule:
-                        count = rule["count"]
-                        # Check if a matching event already exists that we need to
-                        # count up. If the count reaches the limit, the event will
-                        # be opened and its rule actions performed.
-                        existing_event = \
-                            self._event_status.count_event(self, event, rule, count)
-                        if existing_event:
-                            if "delay" in rule:
-                                if self._config["debug_rules"]:
-                                    self._logger.info("Event opening will be delayed for %d seconds"
-                                                      % rule["delay"])
-                                existing_event["delay_until"] = time.time() + rule["delay"]
-                                existing_event["phase"] = "delayed"
-                            else:
-                                cmk.ec.actions.event_has_opened(
-                                    self._history, self.settings, self._config, self._logger, self,
-                                    self._event_columns, rule, existing_event)
+            if self._config["debug_rules"]:
+                self._logger.info("  matching groups:\n%s" % pprint.pformat(match_groups))
 
-                            self._history.add(existing_event, "COUNTREACHED")
+            self._event_status.count_rule_match(rule["id"])
+            if self._config["log_rulehits"]:
+                self._logger.info("Rule '%s/%s' hit by message %s/%s - '%s'." %
+                                  (rule["pack"], rule["id"], SyslogFacility(event["facility"]),
+                                   SyslogPriority(event["priority"]), event["text"]))
 
-                            if "delay" not in rule and rule.get("autodelete"):
-                                existing_event["phase"] = "closed"
-                                self._history.add(existing_event, "AUTODELETE")
-                                with self._event_status.lock:
-                                    self._event_status.remove_event(existing_event)
-                    elif "expect" in rule:
-                        self._event_status.count_expected_event(self, event)
-                    else:
+            if rule.get("drop"):
+                if rule["drop"] == "skip_pack":
+                    if self._config["debug_rules"]:
+                        self._logger.info("  skipping this rule pack (%s)" % rule["pack"])
+                    continue
+                else:
+                    self._perfcounters.count("drops")
+                    return
+
+            if cancelling:
+                self._event_status.cancel_events(self, self._event_columns, event, match_groups,
+                                                 rule)
+                return
+            else:
+                # Remember the rule id that this event originated from
+                event["rule_id"] = rule["id"]
+
+                # Lookup the monitoring core hosts and add the core host
+                # name to the event when one can be matched
+                # For the moment we have no rule/condition matching on this
+                # field. So we only add the core host info for matched events.
+                self._add_core_host_to_new_event(event)
+
+                # Attach optional contact group information for visibility
+                # and eventually for notifications
+                self._add_rule_contact_groups_to_event(rule, event)
+
+                # Store groups from matching this event. In order to make
+                # persistence easier, we do not safe them as list but join
+                # them on ASCII-1.
+                event["match_groups"] = match_groups.get("match_groups_message", ())
+                event["match_groups_syslog_application"] = match_groups.get(
+                    "match_groups_syslog_application", ())
+                self.rewrite_event(rule, event, match_groups)
+
+                if "count" in rule:
+                    count = rule["count"]
+                    # Check if a matching event already exists that we need to
+                    # count up. If the count reaches the limit, the event will
+                    # be opened and its rule actions performed.
+                    existing_event = self._event_status.count_event(self, event, rule, count)
+                    if existing_event:
                         if "delay" in rule:
                             if self._config["debug_rules"]:
                                 self._logger.info(
                                     "Event opening will be delayed for %d seconds" % rule["delay"])
-                            event["delay_until"] = time.time() + rule["delay"]
-                            event["phase"] = "delayed"
+                            existing_event["delay_until"] = time.time() + rule["delay"]
+                            existing_event["phase"] = "delayed"
                         else:
-                            event["phase"] = "open"
-
-                        if self.new_event_respecting_limits(event):
-                            if event["phase"] == "open":
-                                cmk.ec.actions.event_has_opened(self._history, self.settings,
-                                                                self._config, self._logger, self,
-                                                                self._event_columns, rule, event)
-                                if rule.get("autodelete"):
-                                    event["phase"] = "closed"
-                                    self._history.add(event, "AUTODELETE")
-                                    with self._event_status.lock:
-                                        self._event_status.remove_event(event)
-                    return
+                            cmk.ec.actions.event_has_opened(
+                                self._history, self.settings, self._config, self._logger, self,
+                                self._event_columns, rule, existing_event)
+                        self._event_status.reindex_event(existing_event)
+
+                        self._history.add(existing_event, "COUNTREACHED")
+
+                        if "delay" not in rule and rule.get("autodelete"):
+                            existing_event["phase"] = "closed"
+                            self._history.add(existing_event, "AUTODELETE")
+                            with self._event_status.lock:
+                                self._event_status.remove_event(existing_event)
+                elif "expect" in rule:
+                    self._event_status.count_expected_event(self, event)
+                else:
+                    if "delay" in rule:
+                        if self._config["debug_rules"]:
+                            self._logger.info(
+                                "Event opening will be delayed for %d seconds" % rule["delay"])
+                        event["delay_until"] = time.time() + rule["delay"]
+                        event["phase"] = "delayed"
+                    else:
+                        event["phase"] = "open"
+
+                    if self.new_event_respecting_limits(event):
+                        if event["phase"] == "open":
+                            cmk.ec.actions.event_has_opened(self._history, self.settings,
+                                                            self._config, self._logger, self,
+                                                            self._event_columns, rule, event)
+                            self._event_status.reindex_event(event)
+                            if rule.get("autodelete"):
+                                event["phase"] = "closed"
+                                self._history.add(event, "AUTODELETE")
+                                with self._event_status.lock:
+                                    self._event_status.remove_event(event)
+                return
 
         # End of loop over rules.
         if self._config["archive_orphans"]:
@@ -1669,20 +1824,21 @@ class EventServer(ECServerThread):
     def event_rule_matches(self, rule, event):
         self._perfcounters.count("rule_tries")
         with self._lock_configuration:
-            result = self._rule_matcher.event_rule_matches_non_inverted(rule, event)
-            if rule.get("invert_matching"):
-                if result is False:
-                    result = False, {}
-                    if self._config["debug_rules"]:
-                        self._logger.info(
-                            "  Rule would not match, but due to inverted matching does.")
-                else:
-                    result = False
-                    if self._config["debug_rules"]:
-                        self._logger.info(
-                            "  Rule would match, but due to inverted matching does not.")
+            return self._event_rule_matches(rule, event)
 
-            return result
+    def _event_rule_matches(self, rule, event):
+        result = self._rule_matcher.event_rule_matches_non_inverted(rule, event)
+        if rule.get("invert_matching"):
+            if result is False:
+                result = False, {}
+                if self._config["debug_rules"]:
+                    self._logger.info("  Rule would not match, but due to inverted matching does.")
+            else:
+                result = False
+                if self._config["debug_rules"]:
+                    self._logger.info("  Rule would match, but due to inverted matching does not.")
+
+        return result
 
     # Rewrite texts and compute other fields in the event
     def rewrite_event(self, rule, event, groups, set_first=True):
@@ -2818,12 +2974,14 @@ class StatusTableEvents(StatusTable):
         self._event_status = event_status
 
     def _enumerate(self, query):
-        for event in self._event_status.get_events():
-            # Optimize filters that are set by the check_mkevents active check. Since users
-            # may have a lot of those checks running, it is a good idea to optimize this.
-            if query.only_host and event["host"] not in query.only_host:
-                continue
+        # Optimize filters that are set by the check_mkevents active check. Since users
+        # may have a lot of those checks running, it is a good idea to optimize this.
+        if query.only_host:
+            events = self._event_status.events_of_hosts(query.only_host)
+        else:
+            events = self._event_status.get_events()
 
+        for event in events:
             row = []
             for column_name in self.column_names:
                 try:
@@ -3168,6 +3326,7 @@ class StatusServer(ECServerThread):
             event["contact"] = contact
         if user:
             event["owner"] = user
+        self._event_status.reindex_event(event)
         self._history.add(event, "UPDATE", user)
 
     def handle_command_create(self, arguments):
@@ -3187,6 +3346,7 @@ class StatusServer(ECServerThread):
         event["state"] = int(newstate)
         if user:
             event["owner"] = user
+        self._event_status.reindex_event(event)
         self._history.add(event, "CHANGESTATE", user)
 
     def handle_command_reload(self):
@@ -3229,6 +3389,7 @@ class StatusServer(ECServerThread):
         event = self._event_status.event(int(event_id))
         if user:
             event["owner"] = user
+            self._event_status.reindex_event(event)
 
         if action_id == "@NOTIFY":
             cmk.ec.actions.do_notify(
@@ -3288,6 +3449,7 @@ def run_eventd(terminate_main_event, settings, config, lock_configuration, histo
     now = time.time()
     next_housekeeping = now + config["housekeeping_interval"]
     next_retention = now + config["retention_interval"]
+    next_journal = now + config["status_journal_interval"]
     next_statistics = now + config["statistics_interval"]
     next_replication = 0  # force immediate replication after restart
 
@@ -3298,7 +3460,7 @@ def run_eventd(terminate_main_event, settings, config, lock_configuration, histo
                 # maximum 60 seconds. That way changes of the interval from a very
                 # high to a low value will never require more than 60 seconds
 
-                event_list = [next_housekeeping, next_retention, next_statistics]
+                event_list = [next_housekeeping, next_retention, next_journal, next_statistics]
                 if is_replication_slave(config):
                     event_list.append(next_replication)
 
@@ -3314,6 +3476,12 @@ def run_eventd(terminate_main_event, settings, config, lock_configuration, histo
                     with event_status.lock:
                         event_status.save_status()
                     next_retention = now + config["retention_interval"]
+                    next_journal = now + config["status_journal_interval"]
+
+                elif now > next_journal:
+                    with event_status.lock:
+                        event_status.save_journal()
+                    next_journal = now + config["status_journal_interval"]
 
                 if now > next_statistics:
                     perfcounters.do_statistics()
@@ -3367,17 +3535,20 @@ class EventStatus(object):
         self.lock = threading.Lock()
         self._history = history
         self._logger = logger
+        self._journal_generation = 0
+        self._num_journal_records = 0
         self.flush()
 
     def reload_configuration(self, config):
         self._config = config
 
     def flush(self):
-        self._events = []
         self._next_event_id = 1
         self._rule_stats = {}
         self._interval_starts = {}  # needed for expecting rules
-        self._initialize_event_limit_status()
+        self._set_events([])
+        self._reset_journal_changes()
+        self._snapshot_needed = True
 
         # TODO: might introduce some performance counters, like:
         # - number of received messages
@@ -3385,19 +3556,165 @@ class EventStatus(object):
         # - number of rule misses
 
     def events(self):
-        return self._events
+        return self._events.values()
 
     def event(self, eid):
-        for event in self._events:
-            if event["id"] == eid:
-                return event
+        return self._events.get(eid)
+
+    def events_of_rule(self, rule_id):
+        """Returns the events created by a rule, oldest first"""
+        return self._events_by_rule.get(rule_id, {}).values()
+
+    def events_in_phase(self, phase):
+        return self._events_by_phase.get(phase, {}).values()
+
+    def events_of_hosts(self, hostnames):
+        """Returns the events of the given hosts, oldest first"""
+        events = []
+        for hostname in hostnames:
+            events += self._events_by_host.get(hostname, {}).values()
+        return sorted(events, key=lambda e: e["id"])
+
+    # The open events are held in an OrderedDict (event id -> event, oldest first)
+    # together with several indexes, which are ordered the same way. The keys an
+    # event is indexed with are remembered, because the events are modified in
+    # place. After changing the host, the phase, the delay or the livetime of an
+    # event that is already stored, reindex_event() has to be called.
+    def _set_events(self, events):
+        self._events = OrderedDict()  # type: OrderedDict
+        self._index_keys = {}  # type: Dict[int, Tuple[Any, Any, str]]
+        self._events_by_rule = {}  # type: Dict[Any, OrderedDict]
+        self._events_by_rule_and_host = {}  # type: Dict[Tuple[Any, Any], OrderedDict]
+        self._events_by_host = {}  # type: Dict[Any, OrderedDict]
+        self._events_by_phase = {}  # type: Dict[str, OrderedDict]
+
+        # Heap of (deadline, event id) for the "delay_until" and "live_until" times of
+        # the events. It may contain outdated entries, which are skipped when popped.
+        self._deadlines = []  # type: List[Tuple[float, int]]
+        self._scheduled_deadlines = {}  # type: Dict[int, Tuple[Optional[float], Optional[float]]]
+
+        self.num_existing_events = 0
+        self.num_existing_events_by_host = {}  # type: Dict[Any, int]
+        self.num_existing_events_by_rule = {}  # type: Dict[Any, int]
+
+        for event in events:
+            self._add_event(event)
+
+    def _add_event(self, event):
+        self._events[event["id"]] = event
+        self.num_existing_events += 1
+        self._index_event(event)
+        self._schedule_event(event)
+
+    def _delete_event(self, event_id):
+        event = self._events.pop(event_id)
+        self.num_existing_events -= 1
+        self._unindex_event(event_id)
+        self._scheduled_deadlines.pop(event_id, None)
+        self._changed_events[event_id] = "archive"
+        return event
+
+    def _indexes(self, index_keys):
+        rule_id, host, phase = index_keys
+        return [
+            (self._events_by_rule, rule_id),
+            (self._events_by_rule_and_host, (rule_id, host)),
+            (self._events_by_host, host),
+            (self._events_by_phase, phase),
+        ]
+
+    def _index_event(self, event):
+        event_id = event["id"]
+        index_keys = self._index_keys[event_id] = (event["rule_id"], event["host"], event["phase"])
+        for index, key in self._indexes(index_keys):
+            index.setdefault(key, OrderedDict())[event_id] = event
+        self._count_event_add(index_keys)
+
+    def _unindex_event(self, event_id):
+        index_keys = self._index_keys.pop(event_id)
+        for index, key in self._indexes(index_keys):
+            self._remove_from_index(index, key, event_id)
+        self._count_event_remove(index_keys)
+
+    def _insert_into_index(self, index, key, event):
+        entries = index.setdefault(key, OrderedDict())
+        if entries and next(reversed(entries)) > event["id"]:
+            # Keep the entries ordered by age
+            entries[event["id"]] = event
+            index[key] = OrderedDict(sorted(entries.iteritems()))
+        else:
+            entries[event["id"]] = event
+
+    def _remove_from_index(self, index, key, event_id):
+        entries = index[key]
+        del entries[event_id]
+        if not entries:
+            del index[key]
+
+    def reindex_event(self, event):
+        """Update the indexes and the journal after a stored event has been changed"""
+        event_id = event["id"]
+        if event_id not in self._events:
+            return  # not stored (anymore)
+
+        self._changed_events.setdefault(event_id, "update")
+
+        old_keys = self._index_keys[event_id]
+        new_keys = (event["rule_id"], event["host"], event["phase"])
+        if old_keys != new_keys:
+            # Only move the event in the indexes with changed keys to keep it's position
+            # in the other ones
+            for (index, old_key), (_unused, new_key) in zip(
+                    self._indexes(old_keys), self._indexes(new_keys)):
+                if old_key != new_key:
+                    self._remove_from_index(index, old_key, event_id)
+                    self._insert_into_index(index, new_key, event)
+            self._count_event_remove(old_keys)
+            self._count_event_add(new_keys)
+            self._index_keys[event_id] = new_keys
+
+        self._schedule_event(event)
+
+    def _schedule_event(self, event):
+        event_id = event["id"]
+        delay_until = event.get("delay_until") if event["phase"] == "delayed" else None
+        deadlines = delay_until, event.get("live_until")
+        if self._scheduled_deadlines.get(event_id) == deadlines:
+            return
+        self._scheduled_deadlines[event_id] = deadlines
+
+        for deadline in deadlines:
+            if deadline is not None:
+                heapq.heappush(self._deadlines, (deadline, event_id))
+
+        # Get rid of the outdated entries from time to time
+        if len(self._deadlines) > 2 * len(self._events) + 1000:
+            self._deadlines = [(deadline, event_id)
+                               for event_id, deadlines in self._scheduled_deadlines.iteritems()
+                               for deadline in deadlines
+                               if deadline is not None]
+            heapq.heapify(self._deadlines)
+
+    def pop_expired_events(self, now):
+        """Returns the events whose delay or livetime has been reached
+
+        The events are not scheduled anymore. Call reindex_event() for the events
+        that are kept to schedule them again."""
+        expired = OrderedDict()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _deadline, event_id = heapq.heappop(self._deadlines)
+            event = self._events.get(event_id)
+            if event is not None:
+                expired[event_id] = event
+                self._scheduled_deadlines.pop(event_id, None)
+        return expired.values()
 
     # Return beginning of current expectation interval. For new rules
     # we start with the next interval in future.
     def interval_start(self, rule_id, interval):
         if rule_id not in self._interval_starts:
             start = self.next_interval_start(interval, time.time())
-            self._interval_starts[rule_id] = start
+            self._set_interval_start(rule_id, start)
             return start
         else:
             start = self._interval_starts[rule_id]
@@ -3407,9 +3724,13 @@ class EventStatus(object):
             next_interval = self.next_interval_start(interval, time.time())
             if start > next_interval:
                 start = next_interval
-                self._interval_starts[rule_id] = start
+                self._set_interval_start(rule_id, start)
             return start
 
+    def _set_interval_start(self, rule_id, start):
+        self._interval_starts[rule_id] = start
+        self._changed_interval_starts.add(rule_id)
+
     def next_interval_start(self, interval, previous_start):
         if isinstance(interval, tuple):
             length, offset = interval
@@ -3427,27 +3748,100 @@ class EventStatus(object):
     def start_next_interval(self, rule_id, interval):
         current_start = self.interval_start(rule_id, interval)
         next_start = self.next_interval_start(interval, current_start)
-        self._interval_starts[rule_id] = next_start
+        self._set_interval_start(rule_id, next_start)
         self._logger.debug("Rule %s: next interval starts %s (i.e. now + %.2f sec)" %
                            (rule_id, next_start, time.time() - next_start))
 
     def pack_status(self):
         return {
             "next_event_id": self._next_event_id,
-            "events": self._events,
+            "events": self.events(),
             "rule_stats": self._rule_stats,
             "interval_starts": self._interval_starts,
         }
 
     def unpack_status(self, status):
         self._next_event_id = status["next_event_id"]
-        self._events = status["events"]
+        self._set_events(status["events"])
         self._rule_stats = status["rule_stats"]
         self._interval_starts = status["interval_starts"]
+        self._reset_journal_changes()
+        self._snapshot_needed = True
+
+    # The state is persisted in two files: The status file is a snapshot of the whole
+    # state. The changes made after the snapshot are appended to the journal file in
+    # short intervals (status_journal_interval), one record per line:
+    #
+    #   ("generation", N)                 first line, refers to the snapshot
+    #   ("new", EVENT), ("update", EVENT) event created or changed
+    #   ("archive", EVENT_ID)             event removed
+    #   ("next_event_id", ID)
+    #   ("rule_stats", {RULE_ID: COUNT})  a count of None is a reset counter
+    #   ("interval_starts", {RULE_ID: START})
+    #
+    # When the journal has grown too much, a new snapshot is written during the
+    # retention and the journal is started over. After a crash at most the changes
+    # of the last status_journal_interval are lost.
+    def _reset_journal_changes(self):
+        self._changed_events = OrderedDict()  # type: OrderedDict
+        self._changed_rule_stats = set()  # type: Set[str]
+        self._changed_interval_starts = set()  # type: Set[str]
+
+    def _journal_records(self):
+        records = []  # type: List[Tuple[str, Any]]
+        for event_id, what in self._changed_events.iteritems():
+            if what == "archive":
+                records.append((what, event_id))
+            else:
+                records.append((what, self._events[event_id]))
+        if records:
+            records.append(("next_event_id", self._next_event_id))
+        if self._changed_rule_stats:
+            records.append(
+                ("rule_stats",
+                 {rule_id: self._rule_stats.get(rule_id) for rule_id in self._changed_rule_stats}))
+        if self._changed_interval_starts:
+            records.append(("interval_starts", {
+                rule_id: self._interval_starts[rule_id] for rule_id in self._changed_interval_starts
+            }))
+        self._reset_journal_changes()
+        return records
+
+    # protected by self.lock
+    def save_journal(self):
+        """Append the changes since the last call to the journal"""
+        if self._snapshot_needed:
+            return  # the journal is started again with the next snapshot
+
+        records = self._journal_records()
+        if not records:
+            return
+
+        now = time.time()
+        path = self.settings.paths.status_journal_file.value
+        with path.open(mode='ab') as f:
+            f.write("".join(repr(record) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        self._num_journal_records += len(records)
+        self._logger.verbose("Appended %d changes to %s in %.3fms." % (len(records), path,
+                                                                       (time.time() - now) * 1000))
+
+    # protected by self.lock
+    def save_status(self, snapshot=False):
+        """Persist the current state
+
+        Usually only the journal is written. A new snapshot is created when requested
+        or when the journal has more records than the number of events justify."""
+        if not snapshot and not self._snapshot_needed \
+           and self._num_journal_records <= max(1000, 2 * self.num_existing_events):
+            self.save_journal()
+            return
 
-    def save_status(self):
         now = time.time()
+        self._journal_generation += 1
         status = self.pack_status()
+        status["journal_generation"] = self._journal_generation
         path = self.settings.paths.status_file.value
         path_new = path.parent / (path.name + '.new')
         # Believe it or not: cPickle is more than two times slower than repr()
@@ -3456,6 +3850,20 @@ class EventStatus(object):
             f.flush()
             os.fsync(f.fileno())
         path_new.rename(path)
+
+        # Start a new journal. In case of a crash before, the old journal is ignored because
+        # of its generation.
+        journal_path = self.settings.paths.status_journal_file.value
+        journal_path_new = journal_path.parent / (journal_path.name + '.new')
+        with journal_path_new.open(mode='wb') as f:
+            f.write(repr(("generation", self._journal_generation)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        journal_path_new.rename(journal_path)
+
+        self._reset_journal_changes()
+        self._snapshot_needed = False
+        self._num_journal_records = 0
         elapsed = time.time() - now
         self._logger.verbose("Saved event state to %s in %.3fms." % (path, elapsed * 1000))
 
@@ -3463,8 +3871,10 @@ class EventStatus(object):
         if rule_id:
             if rule_id in self._rule_stats:
                 del self._rule_stats[rule_id]
+                self._changed_rule_stats.add(rule_id)
         else:
             self._rule_stats = {}
+            self._snapshot_needed = True
         self.save_status()
 
     def load_status(self, event_server):
@@ -3473,57 +3883,100 @@ class EventStatus(object):
             try:
                 status = ast.literal_eval(path.read_bytes())
                 self._next_event_id = status["next_event_id"]
-                self._events = status["events"]
                 self._rule_stats = status["rule_stats"]
                 self._interval_starts = status.get("interval_starts", {})
-                self._initialize_event_limit_status()
+                self._journal_generation = status.get("journal_generation", 0)
+                events = self._replay_journal(status["events"])
+                self._set_events(events)
                 self._logger.info("Loaded event state from %s." % path)
             except Exception as e:
                 self._logger.exception("Error loading event state from %s: %s" % (path, e))
                 raise
 
+        self._reset_journal_changes()
+
         # Add new columns
-        for event in self._events:
+        for event in self.events():
             event.setdefault("ipaddress", "")
 
             if "core_host" not in event:
                 event_server.add_core_host_to_event(event)
                 event["host_in_downtime"] = False
 
-    # Called on Event Console initialization from status file to initialize
-    # the current event limit state -> Sets internal counters which are
-    # updated during runtime.
-    def _initialize_event_limit_status(self):
-        self.num_existing_events = len(self._events)
+    def _replay_journal(self, events):
+        """Applies the changes recorded in the journal to the state loaded from the snapshot"""
+        # Without a valid journal the new changes can only be persisted with a new snapshot
+        self._snapshot_needed = True
+        self._num_journal_records = 0
+        path = self.settings.paths.status_journal_file.value
+        try:
+            lines = path.read_bytes().splitlines()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return events
+            raise
 
-        self.num_existing_events_by_host = {}
-        self.num_existing_events_by_rule = {}
-        for event in self._events:
-            self._count_event_add(event)
+        if not lines or ast.literal_eval(lines[0]) != ("generation", self._journal_generation):
+            self._logger.info("Ignoring the outdated journal %s" % path)
+            return events
+        self._snapshot_needed = False
 
-    def _count_event_add(self, event):
-        if event["host"] not in self.num_existing_events_by_host:
-            self.num_existing_events_by_host[event["host"]] = 1
+        events_by_id = OrderedDict((event["id"], event) for event in events)
+        for line_nr, line in enumerate(lines[1:]):
+            try:
+                what, value = ast.literal_eval(line)
+            except (SyntaxError, ValueError):
+                # Most likely a record which was not written completely. The records
+                # after it can not be trusted.
+                self._logger.warning(
+                    "Stopping replay of %s at invalid record in line %d" % (path, line_nr + 2))
+                self._snapshot_needed = True
+                break
+
+            if what in ["new", "update"]:
+                events_by_id[value["id"]] = value
+                self._next_event_id = max(self._next_event_id, value["id"] + 1)
+            elif what == "archive":
+                events_by_id.pop(value, None)
+            elif what == "next_event_id":
+                self._next_event_id = value
+            elif what == "rule_stats":
+                for rule_id, count in value.iteritems():
+                    if count is None:
+                        self._rule_stats.pop(rule_id, None)
+                    else:
+                        self._rule_stats[rule_id] = count
+            elif what == "interval_starts":
+                self._interval_starts.update(value)
+            self._num_journal_records += 1
+
+        self._logger.info("Replayed %d changes from %s" % (self._num_journal_records, path))
+        return sorted(events_by_id.itervalues(), key=lambda e: e["id"])
+
+    # The counters for the event limits are updated together with the indexes
+    def _count_event_add(self, index_keys):
+        rule_id, host, _phase = index_keys
+        if host not in self.num_existing_events_by_host:
+            self.num_existing_events_by_host[host] = 1
         else:
-            self.num_existing_events_by_host[event["host"]] += 1
+            self.num_existing_events_by_host[host] += 1
 
-        if event["rule_id"] not in self.num_existing_events_by_rule:
-            self.num_existing_events_by_rule[event["rule_id"]] = 1
+        if rule_id not in self.num_existing_events_by_rule:
+            self.num_existing_events_by_rule[rule_id] = 1
         else:
-            self.num_existing_events_by_rule[event["rule_id"]] += 1
+            self.num_existing_events_by_rule[rule_id] += 1
 
-    def _count_event_remove(self, event):
-        self.num_existing_events -= 1
-        self.num_existing_events_by_host[event["host"]] -= 1
-        self.num_existing_events_by_rule[event["rule_id"]] -= 1
+    def _count_event_remove(self, index_keys):
+        rule_id, host, _phase = index_keys
+        self.num_existing_events_by_host[host] -= 1
+        self.num_existing_events_by_rule[rule_id] -= 1
 
     def new_event(self, event):
         self._perfcounters.count("events")
         event["id"] = self._next_event_id
         self._next_event_id += 1
-        self._events.append(event)
-        self.num_existing_events += 1
-        self._count_event_add(event)
+        self._add_event(event)
+        self._changed_events[event["id"]] = "new"
         self._history.add(event, "NEW")
 
     def archive_event(self, event):
@@ -3535,21 +3988,15 @@ class EventStatus(object):
 
     def remove_event(self, event):
         try:
-            self._events.remove(event)
-            self._count_event_remove(event)
-        except ValueError:
+            self._delete_event(event["id"])
+        except KeyError:
             self._logger.exception("Cannot remove event %d: not present" % event["id"])
 
-    # protected by self.lock
-    def _remove_event_by_nr(self, index):
-        event = self._events.pop(index)
-        self._count_event_remove(event)
-
     # protected by self.lock
     def remove_oldest_event(self, ty, event):
         if ty == "overall":
             self._logger.verbose("  Removing oldest event")
-            self._remove_event_by_nr(0)
+            self._delete_event(next(self._events.iterkeys()))
         elif ty == "by_rule":
             self._logger.verbose("  Removing oldest event of rule \"%s\"" % event["rule_id"])
             self._remove_oldest_event_of_rule(event["rule_id"])
@@ -3559,17 +4006,15 @@ class EventStatus(object):
 
     # protected by self.lock
     def _remove_oldest_event_of_rule(self, rule_id):
-        for event in self._events:
-            if event["rule_id"] == rule_id:
-                self.remove_event(event)
-                return
+        for event_id in self._events_by_rule.get(rule_id, {}):
+            self._delete_event(event_id)
+            return
 
     # protected by self.lock
     def _remove_oldest_event_of_host(self, hostname):
-        for event in self._events:
-            if event["host"] == hostname:
-                self.remove_event(event)
-                return
+        for event_id in self._events_by_host.get(hostname, {}):
+            self._delete_event(event_id)
+            return
 
     # protected by self.lock
     def get_num_existing_events_by(self, ty, event):
@@ -3587,48 +4032,47 @@ class EventStatus(object):
     def cancel_events(self, event_server, event_columns, new_event, match_groups, rule):
         with self.lock:
             to_delete = []
-            for nr, event in enumerate(self._events):
-                if event["rule_id"] == rule["id"]:
-                    if self.cancelling_match(match_groups, new_event, event, rule):
-                        # Fill a few fields of the cancelled event with data from
-                        # the cancelling event so that action scripts have useful
-                        # values and the logfile entry if more relevant.
-                        previous_phase = event["phase"]
-                        event["phase"] = "closed"
-                        # TODO: Why do we use OK below and not new_event["state"]???
-                        event["state"] = 0  # OK
-                        event["text"] = new_event["text"]
-                        # TODO: This is a hack and partial copy-n-paste from rewrite_events...
-                        if "set_text" in rule:
-                            event["text"] = replace_groups(rule["set_text"], event["text"],
-                                                           match_groups)
-                        event["time"] = new_event["time"]
-                        event["last"] = new_event["time"]
-                        event["priority"] = new_event["priority"]
-                        self._history.add(event, "CANCELLED")
-                        actions = rule.get("cancel_actions", [])
-                        if actions:
-                            if previous_phase != "open" \
-                               and rule.get("cancel_action_phases", "always") == "open":
-                                self._logger.info(
-                                    "Do not execute cancelling actions, event %s's phase "
-                                    "is not 'open' but '%s'" % (event["id"], previous_phase))
-                            else:
-                                cmk.ec.actions.do_event_actions(
-                                    self._history,
-                                    self.settings,
-                                    self._config,
-                                    self._logger,
-                                    event_server,
-                                    event_columns,
-                                    actions,
-                                    event,
-                                    is_cancelling=True)
-
-                        to_delete.append(nr)
-
-            for nr in to_delete[::-1]:
-                self._remove_event_by_nr(nr)
+            for event in self.events_of_rule(rule["id"]):
+                if self.cancelling_match(match_groups, new_event, event, rule):
+                    # Fill a few fields of the cancelled event with data from
+                    # the cancelling event so that action scripts have useful
+                    # values and the logfile entry if more relevant.
+                    previous_phase = event["phase"]
+                    event["phase"] = "closed"
+                    # TODO: Why do we use OK below and not new_event["state"]???
+                    event["state"] = 0  # OK
+                    event["text"] = new_event["text"]
+                    # TODO: This is a hack and partial copy-n-paste from rewrite_events...
+                    if "set_text" in rule:
+                        event["text"] = replace_groups(rule["set_text"], event["text"],
+                                                       match_groups)
+                    event["time"] = new_event["time"]
+                    event["last"] = new_event["time"]
+                    event["priority"] = new_event["priority"]
+                    self._history.add(event, "CANCELLED")
+                    actions = rule.get("cancel_actions", [])
+                    if actions:
+                        if previous_phase != "open" \
+                           and rule.get("cancel_action_phases", "always") == "open":
+                            self._logger.info(
+                                "Do not execute cancelling actions, event %s's phase "
+                                "is not 'open' but '%s'" % (event["id"], previous_phase))
+                        else:
+                            cmk.ec.actions.do_event_actions(
+                                self._history,
+                                self.settings,
+                                self._config,
+                                self._logger,
+                                event_server,
+                                event_columns,
+                                actions,
+                                event,
+                                is_cancelling=True)
+
+                    to_delete.append(event["id"])
+
+            for event_id in to_delete:
+                self._delete_event(event_id)
 
     def cancelling_match(self, match_groups, new_event, event, rule):
         debug = self._config["debug_rules"]
@@ -3706,6 +4150,7 @@ class EventStatus(object):
         with self.lock:
             self._rule_stats.setdefault(rule_id, 0)
             self._rule_stats[rule_id] += 1
+            self._changed_rule_stats.add(rule_id)
 
     def count_event_up(self, found, event):
         # Update event with new information from new occurrance,
@@ -3724,10 +4169,11 @@ class EventStatus(object):
                 preserve["contact"] = found["contact"]
         found.update(event)
         found.update(preserve)
+        self.reindex_event(found)
 
     def count_expected_event(self, event_server, event):
-        for ev in self._events:
-            if ev["rule_id"] == event["rule_id"] and ev["phase"] == "counting":
+        for ev in self.events_of_rule(event["rule_id"]):
+            if ev["phase"] == "counting":
                 self.count_event_up(ev, event)
                 return
 
@@ -3742,31 +4188,35 @@ class EventStatus(object):
         # we do never modify events that are already in the state "open"
         # since the event has been created because the count was too
         # low in the specified period of time.
-        for ev in self._events:
-            if ev["rule_id"] == event["rule_id"]:
-                if ev["phase"] == "ack" and not count["count_ack"]:
-                    continue  # skip acknowledged events
+        if count["separate_host"]:
+            candidates = self._events_by_rule_and_host.get((event["rule_id"], event["host"]), {})
+        else:
+            candidates = self._events_by_rule.get(event["rule_id"], {})
 
-                if count["separate_host"] and ev["host"] != event["host"]:
-                    continue  # treat events with separated hosts separately
+        for ev in candidates.values():
+            if ev["phase"] == "ack" and not count["count_ack"]:
+                continue  # skip acknowledged events
 
-                if count["separate_application"] and ev["application"] != event["application"]:
-                    continue  # same for application
+            if count["separate_host"] and ev["host"] != event["host"]:
+                continue  # treat events with separated hosts separately
 
-                if count["separate_match_groups"] and ev["match_groups"] != event["match_groups"]:
-                    continue
+            if count["separate_application"] and ev["application"] != event["application"]:
+                continue  # same for application
 
-                if count.get("count_duration"
-                            ) is not None and ev["first"] + count["count_duration"] < event["time"]:
-                    # Counting has been discontinued on this event after a certain time
-                    continue
+            if count["separate_match_groups"] and ev["match_groups"] != event["match_groups"]:
+                continue
 
-                if ev["host_in_downtime"] != event["host_in_downtime"]:
-                    continue  # treat events with different downtime states separately
+            if count.get("count_duration"
+                        ) is not None and ev["first"] + count["count_duration"] < event["time"]:
+                # Counting has been discontinued on this event after a certain time
+                continue
 
-                found = ev
-                self.count_event_up(found, event)
-                break
+            if ev["host_in_downtime"] != event["host_in_downtime"]:
+                continue  # treat events with different downtime states separately
+
+            found = ev
+            self.count_event_up(found, event)
+            break
         else:
             event["count"] = 1
             event["phase"] = "counting"
@@ -3776,23 +4226,23 @@ class EventStatus(object):
         # Did we just count the event that was just one too much?
         if found["phase"] == "counting" and found["count"] >= count["count"]:
             found["phase"] = "open"
+            self.reindex_event(found)
             return found  # do event action, return found copy of event
         return False  # do not do event action
 
     # locked with self.lock
     def delete_event(self, event_id, user):
-        for nr, event in enumerate(self._events):
-            if event["id"] == event_id:
-                event["phase"] = "closed"
-                if user:
-                    event["owner"] = user
-                self._history.add(event, "DELETE", user)
-                self._remove_event_by_nr(nr)
-                return
-        raise MKClientError("No event with id %s" % event_id)
+        event = self._events.get(event_id)
+        if event is None:
+            raise MKClientError("No event with id %s" % event_id)
+        event["phase"] = "closed"
+        if user:
+            event["owner"] = user
+        self._history.add(event, "DELETE", user)
+        self._delete_event(event_id)
 
     def get_events(self):
-        return self._events
+        return self.events()
 
     def get_rule_stats(self):
         return sorted(self._rule_stats.iteritems(), key=lambda x: x[0])
@@ -4173,7 +4623,7 @@ def main():
         os.close(pipe)  # Close pipe
 
         logger.verbose("Saving final event state")
-        event_status.save_status()
+        event_status.save_status(snapshot=True)
 
         logger.verbose("Cleaning up sockets")
         settings.paths.unix_socket.value.unlink()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2019             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""Classification of the received messages of the Event Console in worker processes
+
+Creating the events from the received lines and finding the rules hit by them
+is the most expensive part of the event processing and does not depend on the
+state of the event daemon. The event server hands the received lines in batches
+to a pool of worker processes doing this. The results are applied to the event
+state by the event server thread alone, in the order the lines have been
+received. This way the counting and cancelling of events works exactly like
+without the workers.
+
+The workers are forked from the event server and use its rules. When the rules
+change, a new pipeline has to be created."""
+
+import collections
+import errno
+import fcntl
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from typing import Any, Callable, Deque, Iterator, List, Optional, Tuple  # pylint: disable=unused-import
+
+# The classification function of the event server, set in the worker processes
+_classify_lines = None  # type: Optional[Callable[[List[Any]], List[Any]]]
+
+
+def _init_worker(classify_lines):
+    global _classify_lines
+    _classify_lines = classify_lines
+    # The workers are terminated by the event daemon. The signal handlers of
+    # the event daemon must not be executed in the workers.
+    for signum in [signal.SIGHUP, signal.SIGINT, signal.SIGQUIT]:
+        signal.signal(signum, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _reinit_logging_locks()
+
+
+def _reinit_logging_locks():
+    """Give the logging module and all log handlers new locks
+
+    The workers are forked while the other threads of the event daemon keep
+    logging. Python 2 does not reset the locks of the logging module after a
+    fork. A lock held by another thread at that moment is never released in
+    the worker, which would then hang on its first log message."""
+    logging._lock = threading.RLock()  # pylint: disable=protected-access
+    loggers = [logging.getLogger()] + [
+        l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger)
+    ]
+    for logger in loggers:
+        for handler in logger.handlers:
+            handler.createLock()
+
+
+def _classify_batch(batch):
+    return _classify_lines(batch)
+
+
+class EventPipeline(object):
+    """Classifies batches of lines in worker processes and returns the results in order"""
+
+    def __init__(self, logger, num_workers, classify_lines, batch_timeout=60):
+        # type: (Any, int, Callable[[List[Any]], List[Any]], int) -> None
+        super(EventPipeline, self).__init__()
+        self._logger = logger
+        self.num_workers = num_workers
+        self.max_pending_batches = 4 * num_workers
+        self._batch_timeout = batch_timeout
+        self._pending = collections.deque()  # type: Deque[Tuple[float, Any]]
+
+        # The workers wake up the select() of the event server when a batch is done
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        for fd in [self._wakeup_read, self._wakeup_write]:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self._pool = multiprocessing.Pool(num_workers, _init_worker, (classify_lines,))
+        self._logger.info("Started %d event processing workers" % num_workers)
+
+    def fileno(self):
+        # type: () -> int
+        return self._wakeup_read
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._pending)
+
+    def is_full(self):
+        # type: () -> bool
+        return len(self._pending) >= self.max_pending_batches
+
+    def submit(self, batch):
+        # type: (List[Any]) -> None
+        result = self._pool.apply_async(_classify_batch, (batch,), callback=self._wakeup)
+        self._pending.append((time.time(), result))
+
+    def _wakeup(self, _result):
+        try:
+            os.write(self._wakeup_write, "x")
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def results(self, wait=False):
+        # type: (bool) -> Iterator[List[Any]]
+        """Yields the results of the batches in the order they have been submitted
+
+        Stops at the first batch which has not been classified yet, unless wait
+        is set. Then all results are returned."""
+        try:
+            while os.read(self._wakeup_read, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+        while self._pending:
+            submitted, async_result = self._pending[0]
+            if not wait and not async_result.ready():
+                # A batch may get lost when a worker process dies
+                if time.time() - submitted < self._batch_timeout:
+                    return
+            async_result.wait(max(0, submitted + self._batch_timeout - time.time()))
+            self._pending.popleft()
+            try:
+                yield async_result.get(0)
+            except multiprocessing.TimeoutError:
+                self._logger.error("Lost a batch of messages: Not processed within %d seconds" %
+                                   self._batch_timeout)
+            except Exception as e:
+                self._logger.exception("Exception while processing a batch of messages: %s" % e)
+
+    def next_result(self):
+        # type: () -> Optional[List[Any]]
+        """Waits for the oldest pending batch and returns its result"""
+        for result in self.results(wait=True):
+            return result
+        return None
+
+    def close(self):
+        # type: () -> None
+        """Terminates the workers, the pending batches have to be processed before"""
+        self._pool.terminate()
+        self._pool.join()
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
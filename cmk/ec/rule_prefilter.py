@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2019             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""Preselection of the Event Console rules that can match the text of an event
+
+Most message patterns contain a literal text which has to be part of every
+matching message. These literals are extracted from the patterns of all rules
+and searched in the event text at once. Only the rules whose literals have
+been found (and the rules without such a literal) need to be tried.
+
+All literals are handled case insensitive, like the message patterns. Only ASCII
+characters are used for the literals."""
+
+import collections
+import re
+import sre_constants
+import sre_parse
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple  # pylint: disable=unused-import
+
+import six
+
+
+class LiteralScanner(object):
+    """Finds all occurrences of a set of literals in a text with one pass (Aho-Corasick)"""
+
+    def __init__(self, literals):
+        # type: (List[str]) -> None
+        super(LiteralScanner, self).__init__()
+        self._goto = [{}]  # type: List[Dict[str, int]]
+        self._fail = [0]  # type: List[int]
+        self._out = [()]  # type: List[Tuple[int, ...]]
+
+        for literal_nr, literal in enumerate(literals):
+            state = 0
+            for char in literal:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = next_state
+            self._out[state] += (literal_nr,)
+
+        # Compute the failure links breadth first, the states of the first level
+        # fall back to the root state
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].iteritems():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] += self._out[self._fail[next_state]]
+
+    def scan(self, text):
+        # type: (six.text_type) -> Set[int]
+        """Returns the numbers of the literals found in the text"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()  # type: Set[int]
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class RulePrefilter(object):
+    """Selects the candidate rules for an event text, keeping the order of the rules"""
+
+    def __init__(self, rules):
+        # type: (List[Dict[str, Any]]) -> None
+        super(RulePrefilter, self).__init__()
+        self._rules = rules
+        self._positions = {}  # type: Dict[int, int]
+        self._positions_of_literal = []  # type: List[List[int]]
+        # Rules without literals have to be tried for every event
+        self._unconditional = set()  # type: Set[int]
+        # Cache of the split candidate lists of the rule optimizer's hash
+        self._candidate_lists = {}  # type: Dict[int, Tuple[List[Any], List[int], Set[int]]]
+
+        literal_numbers = {}  # type: Dict[str, int]
+        for position, rule in enumerate(rules):
+            self._positions[id(rule)] = position
+            literals = rule_literals(rule)
+            if literals is None:
+                self._unconditional.add(position)
+                continue
+
+            for literal in literals:
+                literal_nr = literal_numbers.setdefault(literal, len(literal_numbers))
+                if literal_nr == len(self._positions_of_literal):
+                    self._positions_of_literal.append([])
+                self._positions_of_literal[literal_nr].append(position)
+
+        self._scanner = LiteralScanner(sorted(literal_numbers, key=literal_numbers.get))
+        self.num_literals = len(literal_numbers)
+        self.num_unconditional = len(self._unconditional)
+
+    def select(self, rule_candidates, text):
+        # type: (List[Dict[str, Any]], six.text_type) -> List[Dict[str, Any]]
+        """Returns the rules of rule_candidates which can match the given text"""
+        if not rule_candidates:
+            return []
+
+        unconditional, positions = self._split_candidates(rule_candidates)
+
+        selected = set(unconditional)
+        for literal_nr in self._scanner.scan(text):
+            selected.update(p for p in self._positions_of_literal[literal_nr] if p in positions)
+
+        rules = self._rules
+        return [rules[p] for p in sorted(selected)]
+
+    def _split_candidates(self, rule_candidates):
+        # type: (List[Dict[str, Any]]) -> Tuple[List[int], Set[int]]
+        try:
+            candidates, unconditional, positions = self._candidate_lists[id(rule_candidates)]
+            if candidates is rule_candidates:
+                return unconditional, positions
+        except KeyError:
+            pass
+
+        positions = set(self._positions[id(rule)] for rule in rule_candidates)
+        unconditional = sorted(positions & self._unconditional)
+        # Keep a reference to the list to make its id unique during the lifetime of the cache
+        self._candidate_lists[id(rule_candidates)] = (rule_candidates, unconditional, positions)
+        return unconditional, positions
+
+
+def rule_literals(rule):
+    # type: (Dict[str, Any]) -> Optional[FrozenSet[str]]
+    """Returns literals of which at least one is part of every text matching the rule
+
+    Returns None when the rule can not be preselected by its message patterns."""
+    if rule.get("invert_matching"):
+        return None
+
+    literals = set()  # type: Set[str]
+    # The rule matches when the message matches either the positive or the cancelling pattern
+    for key in ["match", "match_ok"]:
+        if key not in rule:
+            if key == "match":
+                return None  # matches every message
+            continue
+
+        pattern_literals = pattern_literal_alternatives(rule[key])
+        if pattern_literals is None:
+            return None
+        literals.update(pattern_literals)
+
+    return frozenset(literals)
+
+
+def pattern_literal_alternatives(pattern):
+    """Returns literals of which at least one is part of every text matching the pattern
+
+    The pattern is either a compiled regex or a lower case text which is searched
+    as infix. Returns None when no such literals can be found."""
+    if isinstance(pattern, six.string_types):
+        runs = [run for run in re.split(u"[^\x00-\x7f]+", pattern.lower()) if run]
+        return [str(max(runs, key=len))] if runs else None
+
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except (sre_constants.error, TypeError, ValueError):
+        return None
+    return _best_alternatives(_sequence_alternatives(parsed))
+
+
+def _best_alternatives(alternatives_list):
+    # type: (List[List[str]]) -> Optional[List[str]]
+    """Chooses the most selective alternatives: the ones with the longest shortest literal"""
+    if not alternatives_list:
+        return None
+    return max(alternatives_list, key=lambda alternatives: min(len(l) for l in alternatives))
+
+
+def _sequence_alternatives(items):
+    # type: (Any) -> List[List[str]]
+    """Returns all sets of alternative literals which are required by a sequence"""
+    alternatives_list = []  # type: List[List[str]]
+    run = []  # type: List[str]
+
+    def end_run():
+        if run:
+            alternatives_list.append(["".join(run)])
+            del run[:]
+
+    def walk(items):
+        for op, av in items:
+            if op == sre_constants.LITERAL and av < 128:
+                run.append(chr(av).lower())
+
+            elif op == sre_constants.AT:
+                continue  # zero width: does not interrupt the literal
+
+            elif op == sre_constants.SUBPATTERN:
+                walk(av[-1])  # the content of a group is part of the sequence
+
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+                end_run()
+                min_repeat, _max_repeat, item = av
+                if min_repeat >= 1:
+                    alternatives_list.extend(_sequence_alternatives(item))
+
+            elif op == sre_constants.BRANCH:
+                end_run()
+                branch_alternatives = []  # type: List[str]
+                for branch in av[1]:
+                    best = _best_alternatives(_sequence_alternatives(branch))
+                    if best is None:
+                        break  # one branch without literal: the branch needs no literal
+                    branch_alternatives += best
+                else:
+                    alternatives_list.append(sorted(set(branch_alternatives)))
+
+            else:
+                end_run()
+
+    walk(items)
+    end_run()
+    return alternatives_list
@@ -37,7 +37,8 @@ from pathlib2 import Path
 import livestatus
 
 import cmk.utils.paths
-from cmk.utils.structured_data import StructuredDataTree, Container, Numeration, Attributes
+from cmk.utils.structured_data import (StructuredDataTree, TreeArchive, Container, Numeration,
+                                       Attributes)
 
 import cmk.gui.pages
 import cmk.gui.config as config
@@ -181,6 +182,7 @@ def get_history_deltas(hostname, search_timestamp=None):
             required_timestamps = [search_timestamp]
 
     tree_lookup = {}
+    inventory_archive = TreeArchive(inventory_archive_dir)
 
     def get_tree(timestamp):
         if timestamp is None:
@@ -195,9 +197,7 @@ def get_history_deltas(hostname, search_timestamp=None):
                 return
             tree_lookup[timestamp] = inventory_tree
         else:
-            inventory_archive_path = "%s/%s" % (inventory_archive_dir, timestamp)
-            tree_lookup[timestamp] = _filter_tree(
-                StructuredDataTree().load_from(inventory_archive_path))
+            tree_lookup[timestamp] = _filter_tree(inventory_archive.load(timestamp))
         return tree_lookup[timestamp]
 
     delta_history = []
@@ -220,8 +220,10 @@ def get_history_deltas(hostname, search_timestamp=None):
             continue
 
         try:
-            previous_tree = get_tree(previous_timestamp)
             current_tree = get_tree(timestamp)
+            if current_tree is None and timestamp != latest_timestamp:
+                continue  # Archived tree can not be restored anymore, e.g. the base was removed
+            previous_tree = get_tree(previous_timestamp)
             delta_data = current_tree.compare_with(previous_tree)
             new, changed, removed, delta_tree = delta_data
 
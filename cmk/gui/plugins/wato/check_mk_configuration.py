@@ -4588,6 +4588,28 @@ class RulespecNonInlineSnmpHosts(BinaryHostRulespec):
                  "hosts.")
 
 
+@rulespec_registry.register
+class RulespecBulkSnmpHosts(BinaryHostRulespec):
+    @property
+    def group(self):
+        return RulespecGroupAgentSNMP
+
+    @property
+    def name(self):
+        return "bulk_snmp_hosts"
+
+    @property
+    def title(self):
+        return _("Hosts using the bulk SNMP backend")
+
+    @property
+    def help(self):
+        return _("The bulk SNMP backend walks all columns of an SNMP table at the same time and "
+                 "keeps several requests to the device in flight. This reduces the time needed "
+                 "to fetch large tables from devices with a high latency. It supports SNMP v1 "
+                 "and v2c. SNMP v3 hosts continue to use Inline SNMP or Classic SNMP.")
+
+
 @rulespec_registry.register
 class RulespecUsewalkHosts(BinaryHostRulespec):
     @property
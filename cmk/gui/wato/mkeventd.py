@@ -2930,6 +2930,28 @@ class ConfigVariableEventConsoleRetentionInterval(ConfigVariable):
         )
 
 
+@config_variable_registry.register
+class ConfigVariableEventConsoleStatusJournalInterval(ConfigVariable):
+    def group(self):
+        return ConfigVariableGroupEventConsoleGeneric
+
+    def domain(self):
+        return ConfigDomainEventConsole
+
+    def ident(self):
+        return "status_journal_interval"
+
+    def valuespec(self):
+        return Age(
+            title=_("State Journal Interval"),
+            help=_("In this interval the event daemon appends the changes of its state "
+                   "to a journal file. In case of a crash only the changes of this interval "
+                   "are lost. The complete state is written in the state retention interval "
+                   "when the journal has grown too much."),
+            minvalue=1,
+        )
+
+
 @config_variable_registry.register
 class ConfigVariableEventConsoleHousekeepingInterval(ConfigVariable):
     def group(self):
@@ -3014,6 +3036,30 @@ class ConfigVariableEventConsoleRuleOptimizer(ConfigVariable):
         )
 
 
+@config_variable_registry.register
+class ConfigVariableEventConsoleEventProcessingWorkers(ConfigVariable):
+    def group(self):
+        return ConfigVariableGroupEventConsoleGeneric
+
+    def domain(self):
+        return ConfigDomainEventConsole
+
+    def ident(self):
+        return "event_processing_workers"
+
+    def valuespec(self):
+        return Integer(
+            title=_("Event processing worker processes"),
+            help=_("With this option the creation of the events from the received messages "
+                   "and the matching of the rules is done by the given number of worker "
+                   "processes. This allows the Event Console to use several CPU cores during "
+                   "bursts of messages. The events are processed in the order they have been "
+                   "received. With 0 all messages are processed by the event daemon itself."),
+            minvalue=0,
+            maxvalue=64,
+        )
+
+
 @config_variable_registry.register
 class ConfigVariableEventConsoleActions(ConfigVariable):
     def group(self):
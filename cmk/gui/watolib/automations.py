@@ -29,12 +29,14 @@ and similar things."""
 
 import ast
 import re
+import socket
 import subprocess
 import time
 import requests
 import urllib3
 
 import cmk.utils
+import cmk.utils.paths
 
 import cmk.gui.config as config
 import cmk.gui.hooks as hooks
@@ -87,31 +89,26 @@ def check_mk_local_automation(command, args=None, indata="", stdin_data=None, ti
         call_hook_pre_activate_changes()
 
     cmd = [cmk.utils.make_utf8(a) for a in cmd]
-    try:
-        # This debug output makes problems when doing bulk inventory, because
-        # it garbles the non-HTML response output
-        # if config.debug:
-        #     html.write("<div class=message>Running <tt>%s</tt></div>\n" % " ".join(cmd))
-        auto_logger.info("RUN: %s" % subprocess.list2cmdline(cmd))
-        p = subprocess.Popen(
-            cmd,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            close_fds=True)
-    except Exception as e:
-        raise MKGeneralException("Cannot execute <tt>%s</tt>: %s" % (" ".join(cmd), e))
-
+    # This debug output makes problems when doing bulk inventory, because
+    # it garbles the non-HTML response output
+    # if config.debug:
+    #     html.write("<div class=message>Running <tt>%s</tt></div>\n" % " ".join(cmd))
+    auto_logger.info("RUN: %s" % subprocess.list2cmdline(cmd))
     if stdin_data is not None:
         auto_logger.info("STDIN: %r" % stdin_data)
-        p.stdin.write(stdin_data)
     else:
         auto_logger.info("STDIN: %r" % indata)
-        p.stdin.write(repr(indata))
+        stdin_data = repr(indata)
 
-    p.stdin.close()
-    outdata = p.stdout.read()
-    exitcode = p.wait()
+    # The activation of changes is always done in a separate process
+    result = None
+    if command not in ['restart', 'reload']:
+        result = _execute_by_automation_helper(cmd, stdin_data)
+
+    if result is not None:
+        exitcode, outdata = result
+    else:
+        exitcode, outdata = _execute_automation_process(cmd, stdin_data)
     auto_logger.info("FINISHED: %d" % exitcode)
     auto_logger.debug("OUTPUT: %r" % outdata)
     if exitcode != 0:
@@ -136,6 +133,60 @@ def check_mk_local_automation(command, args=None, indata="", stdin_data=None, ti
             (" ".join(cmd), e, outdata))
 
 
+def _execute_automation_process(cmd, stdin_data):
+    try:
+        p = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            close_fds=True)
+    except Exception as e:
+        raise MKGeneralException("Cannot execute <tt>%s</tt>: %s" % (" ".join(cmd), e))
+
+    p.stdin.write(stdin_data)
+    p.stdin.close()
+    outdata = p.stdout.read()
+    return p.wait(), outdata
+
+
+def _execute_by_automation_helper(cmd, stdin_data):
+    """Hand over the automation call to the automation helper daemon (see cmk_base.automation_helper)
+
+    Returns None in case the daemon is not running or its configuration is outdated.
+    The automation call has to be executed in a separate process then."""
+    helper = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        helper.connect(cmk.utils.paths.automation_helper_socket)
+    except socket.error:
+        helper.close()
+        return None
+
+    try:
+        # cmd is ['check_mk', '--automation', command, '--'] + args
+        helper.sendall(repr((cmd[2], cmd[4:], stdin_data)))
+        helper.shutdown(socket.SHUT_WR)
+        response = []
+        while True:
+            chunk = helper.recv(65536)
+            if not chunk:
+                break
+            response.append(chunk)
+    except socket.error as e:
+        raise MKGeneralException(_("Failed to communicate with the automation helper: %s") % e)
+    finally:
+        helper.close()
+
+    try:
+        status, outdata = "".join(response).split("\n", 1)
+        if status == "stale":
+            return None
+        return int(status), outdata
+    except ValueError:
+        raise MKGeneralException(
+            _("Got an invalid response from the automation helper: %r") % "".join(response))
+
+
 def _hilite_errors(outdata):
     return re.sub("\nError: *([^\n]*)", "\n<div class=err><b>Error:</b> \\1</div>", outdata)
 
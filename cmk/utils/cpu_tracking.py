@@ -25,8 +25,9 @@
 # Boston, MA 02110-1301 USA.
 
 import os
+import threading
 import time
-from typing import Dict, List  # pylint: disable=unused-import
+from typing import Dict, List, Optional  # pylint: disable=unused-import
 
 import cmk_base.console as console
 
@@ -38,13 +39,23 @@ times = {}  # type: Dict[str, List[float]]
 last_time_snapshot = []  # type: List[float]
 phase_stack = []  # type: List[str]
 
+# Phases may also be tracked by other threads than the one which started the
+# tracking, e.g. when the data sources of a host are fetched concurrently.
+# These threads have their own phase stack and only account their times to
+# their own phases, not to "TOTAL". Please note that the times of phases
+# which are executed concurrently may overlap.
+_tracking_thread = None  # type: Optional[threading.Thread]
+_thread_state = threading.local()
+_times_lock = threading.Lock()
+
 
 def start(initial_phase):
     # type: (str) -> None
-    global times, last_time_snapshot
+    global times, last_time_snapshot, _tracking_thread
     console.vverbose("[cpu_tracking] Start with phase '%s'\n" % initial_phase)
     times = {}
     last_time_snapshot = _time_snapshot()
+    _tracking_thread = threading.current_thread()
 
     del phase_stack[:]
     phase_stack.append(initial_phase)
@@ -62,6 +73,10 @@ def push_phase(phase):
     if _is_not_tracking():
         return
 
+    if not _in_tracking_thread():
+        _push_thread_phase(phase)
+        return
+
     console.vverbose("[cpu_tracking] Push phase '%s' (Stack: %r)\n" % (phase, phase_stack))
     _add_times_to_phase()
     phase_stack.append(phase)
@@ -72,6 +87,10 @@ def pop_phase():
     if _is_not_tracking():
         return
 
+    if not _in_tracking_thread():
+        _pop_thread_phase()
+        return
+
     console.vverbose("[cpu_tracking] Pop phase '%s' (Stack: %r)\n" % (phase_stack[-1], phase_stack))
     _add_times_to_phase()
     del phase_stack[-1]
@@ -87,19 +106,63 @@ def _is_not_tracking():
     return not bool(phase_stack)
 
 
+def _in_tracking_thread():
+    # type: () -> bool
+    return _tracking_thread is None or threading.current_thread() is _tracking_thread
+
+
 def _add_times_to_phase():
     # type: () -> None
     global last_time_snapshot
     new_time_snapshot = _time_snapshot()
-    for phase in phase_stack[-1], "TOTAL":
-        phase_times = times.get(phase, [0.0] * len(new_time_snapshot))
-        times[phase] = [
-            phase_times[i] + new_time_snapshot[i] - last_time_snapshot[i]
-            for i in range(len(new_time_snapshot))
-        ]
+    with _times_lock:
+        for phase in phase_stack[-1], "TOTAL":
+            _add_times(phase, last_time_snapshot, new_time_snapshot)
     last_time_snapshot = new_time_snapshot
 
 
+def _add_times(phase, old_time_snapshot, new_time_snapshot):
+    # type: (str, List[float], List[float]) -> None
+    phase_times = times.get(phase, [0.0] * len(new_time_snapshot))
+    times[phase] = [
+        phase_times[i] + new_time_snapshot[i] - old_time_snapshot[i]
+        for i in range(len(new_time_snapshot))
+    ]
+
+
+def _push_thread_phase(phase):
+    # type: (str) -> None
+    thread_phase_stack = getattr(_thread_state, "phase_stack", None)
+    if thread_phase_stack is None:
+        thread_phase_stack = _thread_state.phase_stack = []
+
+    if thread_phase_stack:
+        _add_times_to_thread_phase()
+    else:
+        _thread_state.last_time_snapshot = _time_snapshot()
+
+    thread_phase_stack.append(phase)
+
+
+def _pop_thread_phase():
+    # type: () -> None
+    thread_phase_stack = getattr(_thread_state, "phase_stack", None)
+    if not thread_phase_stack:
+        return
+
+    _add_times_to_thread_phase()
+    del thread_phase_stack[-1]
+
+
+def _add_times_to_thread_phase():
+    # type: () -> None
+    new_time_snapshot = _time_snapshot()
+    with _times_lock:
+        _add_times(_thread_state.phase_stack[-1], _thread_state.last_time_snapshot,
+                   new_time_snapshot)
+    _thread_state.last_time_snapshot = new_time_snapshot
+
+
 def _time_snapshot():
     # type: () -> List[float]
     # TODO: Create a better structure for this data
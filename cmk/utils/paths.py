@@ -58,13 +58,18 @@ var_dir = _omd_path("var/check_mk")
 log_dir = _omd_path("var/log")
 precompiled_checks_dir = _omd_path("var/check_mk/precompiled_checks")
 autochecks_dir = _omd_path("var/check_mk/autochecks")
+autochecks_bulk_file = _omd_path("tmp/check_mk/autochecks.bulk")
 precompiled_hostchecks_dir = _omd_path("var/check_mk/precompiled")
+core_config_fragments_dir = _omd_path("var/check_mk/core_config_fragments")
 snmpwalks_dir = _omd_path("var/check_mk/snmpwalks")
 counters_dir = _omd_path("tmp/check_mk/counters")
 tcp_cache_dir = _omd_path("tmp/check_mk/cache")
 data_source_cache_dir = _omd_path("tmp/check_mk/data_source_cache")
 snmp_scan_cache_dir = _omd_path("tmp/check_mk/snmp_scan_cache")
+snmp_scan_results_dir = _omd_path("tmp/check_mk/snmp_scan_results")
+parsed_sections_cache_dir = _omd_path("tmp/check_mk/parsed_sections_cache")
 include_cache_dir = _omd_path("tmp/check_mk/check_includes")
+check_manifest_file = _omd_path("tmp/check_mk/check_manifest")
 tmp_dir = _omd_path("tmp/check_mk")
 logwatch_dir = _omd_path("var/check_mk/logwatch")
 nagios_objects_file = _omd_path("etc/nagios/conf.d/check_mk_objects.cfg")
@@ -78,6 +83,8 @@ nagios_binary = _omd_path("bin/nagios")
 apache_config_dir = _omd_path("etc/apache")
 htpasswd_file = _omd_path("etc/htpasswd")
 livestatus_unix_socket = _omd_path("tmp/run/live")
+check_helper_socket = _omd_path("tmp/run/cmk-check-helper")
+automation_helper_socket = _omd_path("tmp/run/cmk-automation-helper")
 pnp_rraconf_dir = _omd_path("share/check_mk/pnp-rraconf")
 livebackendsdir = _omd_path("share/check_mk/livestatus")
 inventory_output_dir = _omd_path("var/check_mk/inventory")
@@ -25,9 +25,9 @@
 # Boston, MA 02110-1301 USA.
 
 import os
-from typing import NamedTuple, Generator, Dict, Text, Pattern, Tuple, List  # pylint: disable=unused-import
+from typing import Any, NamedTuple, Generator, Dict, Set, Text, Pattern, Tuple, List  # pylint: disable=unused-import
 
-from cmk.utils.regex import regex
+from cmk.utils.regex import regex, is_regex
 import cmk.utils.paths
 from cmk.utils.exceptions import MKGeneralException
 
@@ -68,14 +68,13 @@ class RulesetMatcher(object):
     done very often in large setups. Be careful when working here.
     """
 
-    def __init__(self, config_cache):
+    def __init__(self, config_cache, host_lookup=None):
         super(RulesetMatcher, self).__init__()
         self._config_cache = config_cache
 
         self.tuple_transformer = RulesetToDictTransformer(
             tag_to_group_map=config_cache.get_tag_to_group_map())
-        self.ruleset_optimizer = RulesetOptimizier(config_cache)
-        self._service_match_cache = {}
+        self.ruleset_optimizer = RulesetOptimizier(config_cache, host_lookup)
 
     def is_matching_host_ruleset(self, match_object, ruleset):
         # type: (RulesetMatchObject, List[Dict]) -> bool
@@ -150,28 +149,11 @@ class RulesetMatcher(object):
         optimized_ruleset = self.ruleset_optimizer.get_service_ruleset(
             ruleset, with_foreign_hosts, is_binary=is_binary)
 
-        for value, hosts, service_conditions in optimized_ruleset:
-            if match_object.host_name not in hosts:
-                continue
-
-            descr_cache_id = match_object.service_description, service_conditions
-            if descr_cache_id in self._service_match_cache:
-                match = self._service_match_cache[descr_cache_id]
-            else:
-                match = self._matches_service_conditions(service_conditions,
-                                                         match_object.service_description)
-                self._service_match_cache[descr_cache_id] = match
-
-            if match:
+        for index in optimized_ruleset.get_matching_rule_indices(match_object.service_description):
+            value, hosts = optimized_ruleset.rules[index]
+            if match_object.host_name in hosts:
                 yield value
 
-    def _matches_service_conditions(self, service_conditions, service_description):
-        # type: (Tuple[bool, Pattern[Text]], Text) -> bool
-        negate, pattern = service_conditions
-        if pattern.match(service_description) is not None:
-            return not negate
-        return negate
-
     # TODO: Find a way to use the generic get_values
     def get_values_for_generic_agent_host(self, ruleset):
         """Compute ruleset for "generic" host
@@ -201,6 +183,94 @@ class RulesetMatcher(object):
         return entries
 
 
+class CompiledServiceRuleset(object):
+    """Service ruleset prepared for matching a large number of service descriptions
+
+    The rules are stored as list of (value, hosts) pairs. The service patterns of
+    all rules are indexed by their literal prefix: Patterns without any regex
+    characters match all service descriptions starting with them, which only needs
+    a dictionary lookup per distinct prefix length. Real regexes are only matched
+    when the service description starts with their literal prefix.
+
+    The indices of the rules matching a service description are computed in one go
+    and memoized per service description.
+    """
+
+    def __init__(self):
+        super(CompiledServiceRuleset, self).__init__()
+        self.rules = []  # type: List[Tuple[Any, Set[str]]]
+        self._negated_indices = set()  # type: Set[int]
+        # Literal pattern -> indices of rules having this pattern
+        self._literals = {}  # type: Dict[Text, List[int]]
+        self._literal_lengths = []  # type: List[int]
+        # Literal prefix of the regex -> (rule index, compiled regex)
+        self._regexes = {}  # type: Dict[Text, List[Tuple[int, Pattern[Text]]]]
+        self._regex_prefix_lengths = []  # type: List[int]
+        self._match_cache = {}  # type: Dict[Text, Tuple[int, ...]]
+
+    def add_rule(self, value, hosts, negate, pattern_parts):
+        # type: (Any, Set[str], bool, List[Text]) -> None
+        index = len(self.rules)
+        self.rules.append((value, hosts))
+        if negate:
+            self._negated_indices.add(index)
+
+        # Inline flags like "(?i)" apply to the whole regex. Keep the patterns of
+        # such a rule together, like they have always been matched.
+        if any("(?" in p for p in pattern_parts):
+            pattern_parts = ["(?:%s)" % "|".join("(?:%s)" % p for p in pattern_parts)]
+
+        for pattern in pattern_parts:
+            if not is_regex(pattern):
+                self._add_to_index(self._literals, self._literal_lengths, pattern, index)
+            else:
+                self._add_to_index(self._regexes, self._regex_prefix_lengths,
+                                   _literal_prefix(pattern), (index, regex(pattern)))
+
+        self._match_cache.clear()
+
+    def _add_to_index(self, index, lengths, prefix, entry):
+        index.setdefault(prefix, []).append(entry)
+        if len(prefix) not in lengths:
+            lengths.append(len(prefix))
+
+    def get_matching_rule_indices(self, service_description):
+        # type: (Text) -> Tuple[int, ...]
+        """Returns the ascending indices of all rules matching the service description"""
+        try:
+            return self._match_cache[service_description]
+        except KeyError:
+            pass
+
+        matched = set()
+        for length in self._literal_lengths:
+            matched.update(self._literals.get(service_description[:length], []))
+
+        for length in self._regex_prefix_lengths:
+            for index, pattern in self._regexes.get(service_description[:length], []):
+                if index not in matched and pattern.match(service_description):
+                    matched.add(index)
+
+        matched.symmetric_difference_update(self._negated_indices)
+        result = self._match_cache[service_description] = tuple(sorted(matched))
+        return result
+
+
+def _literal_prefix(pattern):
+    # type: (Text) -> Text
+    """Returns the literal text a string matching the regex pattern needs to start with"""
+    if "|" in pattern:
+        return u""  # Alternatives may start with anything
+
+    for pos, c in enumerate(pattern):
+        if c in '.?*+^$|[](){}\\':
+            # Quantifiers make the preceding character optional
+            if c in "?*{" and pos > 0:
+                pos -= 1
+            return pattern[:pos]
+    return pattern
+
+
 def in_servicematcher_list(service_conditions, item):
     # type: (Tuple[bool, Pattern[Text]], Text) -> bool
     negate, pattern = service_conditions
@@ -210,7 +280,7 @@ def in_servicematcher_list(service_conditions, item):
 
 
 class RulesetOptimizier(object):
-    def __init__(self, config_cache):
+    def __init__(self, config_cache, host_lookup=None):
         super(RulesetOptimizier, self).__init__()
         self._config_cache = config_cache
 
@@ -231,8 +301,11 @@ class RulesetOptimizier(object):
         # be cleaned up then.
         self._hosttags_without_folder = {}
 
-        # TODO: Clean this one up?
-        self._initialize_host_lookup()
+        if host_lookup is None:
+            # TODO: Clean this one up?
+            self._initialize_host_lookup()
+        else:
+            self._set_host_lookup(*host_lookup)
 
     def get_host_ruleset(self, ruleset, with_foreign_hosts, is_binary):
         cache_id = id(ruleset), with_foreign_hosts
@@ -272,7 +345,7 @@ class RulesetOptimizier(object):
         return cached_ruleset
 
     def _convert_service_ruleset(self, ruleset, with_foreign_hosts, is_binary):
-        new_rules = []
+        compiled_ruleset = CompiledServiceRuleset()
         for rule in ruleset:
             if "options" in rule and "disabled" in rule["options"]:
                 continue
@@ -282,21 +355,20 @@ class RulesetOptimizier(object):
             hosts = self._all_matching_hosts(rule["condition"], with_foreign_hosts)
 
             # And now preprocess the configured patterns in the servlist
-            new_rules.append(
-                (rule["value"], hosts,
-                 self._convert_pattern_list(rule["condition"].get("service_description"))))
+            negate, pattern_parts = self._convert_pattern_list(
+                rule["condition"].get("service_description"))
+            compiled_ruleset.add_rule(rule["value"], hosts, negate, pattern_parts)
 
-        return new_rules
+        return compiled_ruleset
 
     def _convert_pattern_list(self, patterns):
-        # type: (List[Text]) -> Tuple[bool, Pattern[Text]]
-        """Compiles a list of service match patterns to a to a single regex
+        # type: (List[Text]) -> Tuple[bool, List[Text]]
+        """Returns the negation flag and the regex patterns of a service pattern list
 
-        Reducing the number of individual regex matches improves the performance dramatically.
         This function assumes either all or no pattern is negated (like WATO creates the rules).
         """
         if not patterns:
-            return False, regex(u"")  # Match everything
+            return False, [u""]  # Match everything
 
         negate = False
         if isinstance(patterns, dict) and "$nor" in patterns:
@@ -310,7 +382,7 @@ class RulesetOptimizier(object):
             else:
                 pattern_parts.append(p)
 
-        return negate, regex("(?:%s)" % "|".join("(?:%s)" % p for p in pattern_parts))
+        return negate, pattern_parts
 
     def _all_matching_hosts(self, condition, with_foreign_hosts):
         """Returns a set containing the names of hosts that match the given
@@ -519,6 +591,19 @@ class RulesetOptimizier(object):
             self._hosts_grouped_by_tags.setdefault(group_ref, set()).add(hostname)
             self._host_grouped_ref[hostname] = group_ref
 
+    def get_host_lookup(self):
+        """Returns the folders and the hosts grouped by their tags
+
+        They can be handed over to another optimizer to skip the host lookup initialization"""
+        return self._folder_path_set, self._hosts_grouped_by_tags
+
+    def _set_host_lookup(self, folder_path_set, hosts_grouped_by_tags):
+        self._folder_path_set = set(folder_path_set)
+        for group_ref, hostnames in hosts_grouped_by_tags.iteritems():
+            self._hosts_grouped_by_tags[group_ref] = set(hostnames)
+            for hostname in hostnames:
+                self._host_grouped_ref[hostname] = group_ref
+
 
 def in_extraconf_hostlist(hostlist, hostname):
     """Whether or not the given host matches the hostlist.
@@ -28,7 +28,13 @@ This module handles tree structures for HW/SW inventory system and
 structured monitoring data of Check_MK.
 """
 
+import ast
+import difflib
+import errno
 import gzip
+import hashlib
+import marshal
+import os
 import re
 # Just for tests
 import pprint
@@ -125,8 +131,12 @@ class StructuredDataTree(object):
     def save_to(self, path, filename, pretty=False):
         filepath = "%s/%s" % (path, filename)
         output = self.get_raw_tree()
-        store.save_data_to_file(filepath, output, pretty=pretty)
-        gzip.open(filepath + ".gz", "w").write(repr(output) + "\n")
+        formatted_output = repr(output) + "\n"
+        if pretty:
+            store.save_data_to_file(filepath, output, pretty=True)
+        else:
+            store.save_file(filepath, formatted_output)
+        gzip.open(filepath + ".gz", "w").write(formatted_output)
         # Inform Livestatus about the latest inventory update
         store.save_file("%s/.last" % path, "")
 
@@ -134,6 +144,14 @@ class StructuredDataTree(object):
         raw_tree = store.load_data_from_file(filepath)
         return self.create_tree_from_raw_tree(raw_tree)
 
+    def serialize(self):
+        """Returns the tree in a compact binary form which is much faster to
+        load than the Python literal written by save_to()"""
+        return _serialize(self.get_raw_tree())
+
+    def deserialize(self, data):
+        return self.create_tree_from_raw_tree(_deserialize(data))
+
     def create_tree_from_raw_tree(self, raw_tree):
         if raw_tree:
             self._create_hierarchy_from_data(raw_tree, self._root, tuple())
@@ -237,6 +255,11 @@ class StructuredDataTree(object):
 
     #   ---structured tree methods----------------------------------------------
 
+    def get_content_hash(self):
+        """Returns a hash of the tree which does not depend on the order of the
+        dictionary keys. Trees with the same hash are equal."""
+        return hashlib.md5(_canonical_dump(self.get_raw_tree())).hexdigest()
+
     def compare_with(self, old_tree):
         delta_tree = StructuredDataTree()
         num_new, num_changed, num_removed, delta_root_node =\
@@ -1000,6 +1023,125 @@ class Node(object):
         return new_node
 
 
+#.
+#   .--TreeArchive---------------------------------------------------------.
+#   |         _____              _             _     _                     |
+#   |        |_   _| __ ___  ___/ \   _ __ ___| |__ (_)_   _____           |
+#   |          | || '__/ _ \/ _ \/ _ \ | '__/ __| '_ \| \ \ / / _ \          |
+#   |          | || | |  __/  __/ ___ \| | | (__| | | | |\ V /  __/          |
+#   |          |_||_|  \___|\___/_/   \_\_|  \___|_| |_|_| \_/ \___|          |
+#   |                                                                      |
+#   '----------------------------------------------------------------------'
+
+
+class TreeArchive(object):
+    """The former trees of a host, one file per timestamp
+
+    The latest archived tree is always stored completely. When a newer tree
+    is archived, the previous one is replaced by the difference to that newer
+    tree, except every full_tree_interval-th tree, which is kept completely.
+    Removing the oldest files (as the disk space cleanup does) thus never
+    removes a tree the remaining ones are based on. The trees archived by
+    previous versions (Python literals or differences to older trees) are
+    still read."""
+
+    full_tree_interval = 10
+
+    def __init__(self, archive_dir):
+        super(TreeArchive, self).__init__()
+        self._archive_dir = archive_dir
+        self._raw_trees = {}
+
+    def timestamps(self):
+        try:
+            return sorted(e for e in os.listdir(self._archive_dir) if e[0] != ".")
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return []
+            raise
+
+    def load(self, timestamp):
+        """Returns None in case the tree can not be restored, e.g. because a tree
+        it is based on has been removed"""
+        try:
+            raw_tree = self._load_raw_tree("%d" % int(timestamp))
+        except MKGeneralException:
+            return None
+        return StructuredDataTree().create_tree_from_raw_tree(raw_tree)
+
+    def _load_raw_tree(self, timestamp):
+        if timestamp in self._raw_trees:
+            return self._raw_trees[timestamp]
+
+        record = self._load_record(timestamp)
+        if record[0] == "tree":
+            raw_tree = record[1]
+        else:
+            _kind, base_timestamp, patch = record
+            raw_tree = _patch_raw_tree(self._load_raw_tree(base_timestamp), patch)
+
+        self._raw_trees[timestamp] = raw_tree
+        return raw_tree
+
+    def _load_record(self, timestamp):
+        filepath = "%s/%s" % (self._archive_dir, timestamp)
+        try:
+            content = file(filepath).read()
+        except IOError as e:
+            raise MKGeneralException("Cannot read archived tree \"%s\": %s" % (filepath, e))
+
+        try:
+            if not _is_serialized(content):
+                return "tree", (ast.literal_eval(content) if content.strip() else {})
+            return _deserialize(content)
+        except (ValueError, SyntaxError, EOFError) as e:
+            raise MKGeneralException("Cannot parse archived tree \"%s\": %s" % (filepath, e))
+
+    def save(self, timestamp, tree):
+        timestamp = "%d" % int(timestamp)
+        raw_tree = tree.get_raw_tree()
+        timestamps = self.timestamps()
+
+        store.makedirs(self._archive_dir)
+        store.save_file("%s/%s" % (self._archive_dir, timestamp), _serialize(("tree", raw_tree)))
+        self._raw_trees[timestamp] = raw_tree
+
+        older_timestamps = [t for t in timestamps if int(t) < int(timestamp)]
+        if older_timestamps and len(older_timestamps) == len(timestamps):
+            try:
+                self._replace_by_delta(older_timestamps, timestamp, raw_tree)
+            except MKGeneralException:
+                pass  # Keep the previous tree as it is
+
+    def _replace_by_delta(self, older_timestamps, timestamp, raw_tree):
+        """Store the previously latest tree as the difference to the new one,
+        unless the differences based on it have reached the full_tree_interval"""
+        previous_timestamp = older_timestamps[-1]
+        record = self._load_record(previous_timestamp)
+        if record[0] != "tree":
+            return
+
+        num_deltas = 0
+        base_timestamp = previous_timestamp
+        for older_timestamp in older_timestamps[-2::-1]:
+            if num_deltas + 1 >= self.full_tree_interval:
+                return
+            older_record = self._load_record(older_timestamp)
+            if older_record[0] != "delta" or older_record[1] != base_timestamp:
+                break
+            num_deltas += 1
+            base_timestamp = older_timestamp
+
+        if num_deltas + 1 >= self.full_tree_interval:
+            return
+
+        previous_raw_tree = record[1]
+        store.save_file(
+            "%s/%s" % (self._archive_dir, previous_timestamp),
+            _serialize(("delta", timestamp, _diff_raw_trees(raw_tree, previous_raw_tree))))
+        self._raw_trees[previous_timestamp] = previous_raw_tree
+
+
 #.
 #   .--helpers-------------------------------------------------------------.
 #   |                  _          _                                        |
@@ -1058,3 +1200,116 @@ def _changed_delta_tree_node(old_value, new_value):
 
 def _identical_delta_tree_node(value):
     return (value, value)
+
+
+#   ---serialization------------------------------------------------------------
+
+# marshal writes each interned string only once and refers to it afterwards.
+# This makes the many repeated keys of the tree cheap.
+_SERIALIZED_MAGIC = "\x00SDT\x01"
+
+
+def _is_serialized(content):
+    return content.startswith(_SERIALIZED_MAGIC)
+
+
+def _serialize(data):
+    return _SERIALIZED_MAGIC + marshal.dumps(_intern_keys(data), 2)
+
+
+def _deserialize(content):
+    if not _is_serialized(content):
+        raise MKGeneralException("Unknown serialization format")
+    return marshal.loads(content[len(_SERIALIZED_MAGIC):])
+
+
+def _intern_keys(value):
+    if isinstance(value, dict):
+        return {
+            (intern(k) if isinstance(k, str) else k): _intern_keys(v) for k, v in value.iteritems()
+        }
+    if isinstance(value, list):
+        return [_intern_keys(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_intern_keys(v) for v in value)
+    return value
+
+
+def _canonical_dump(value):
+    # Version 0 of the marshal format does not depend on whether strings are interned
+    return marshal.dumps(_canonical_raw_tree(value), 0)
+
+
+def _canonical_raw_tree(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _canonical_raw_tree(v)) for k, v in value.iteritems()))
+    if isinstance(value, list):
+        return [_canonical_raw_tree(v) for v in value]
+    return value
+
+
+#   ---differences of raw trees-------------------------------------------------
+
+# A patch is one of
+#   ("r", value)                           replace the value
+#   ("d", changed, removed_keys, patches)  update a dict, patch some of its values
+#   ("l", [("c", start, end) | ("i", entries), ...])
+#                                          build a list from slices of the old list
+#                                          and inserted entries
+
+
+def _diff_raw_trees(source, target):
+    """Returns the patch turning source into target (see _patch_raw_tree())"""
+    if isinstance(source, dict) and isinstance(target, dict):
+        changed, patches = {}, {}
+        removed_keys = [k for k in source if k not in target]
+        for k, v in target.iteritems():
+            if k not in source:
+                changed[k] = v
+            elif source[k] != v or type(source[k]) is not type(v):
+                patch = _diff_raw_trees(source[k], v)
+                if patch[0] == "r":
+                    changed[k] = v
+                else:
+                    patches[k] = patch
+        return ("d", changed, removed_keys, patches)
+
+    if isinstance(source, list) and isinstance(target, list):
+        operations = []
+        matcher = difflib.SequenceMatcher(None, [_entry_key(e) for e in source],
+                                          [_entry_key(e) for e in target])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                operations.append(("c", i1, i2))
+            elif tag in ["replace", "insert"]:
+                operations.append(("i", target[j1:j2]))
+        return ("l", operations)
+
+    return ("r", target)
+
+
+def _entry_key(entry):
+    return _canonical_dump(entry)
+
+
+def _patch_raw_tree(source, patch):
+    if patch[0] == "r":
+        return patch[1]
+
+    if patch[0] == "l":
+        result = []
+        for operation in patch[1]:
+            if operation[0] == "c":
+                result += source[operation[1]:operation[2]]
+            else:
+                result += operation[1]
+        return result
+
+    _kind, changed, removed_keys, patches = patch
+    result = dict(source)
+    for k in removed_keys:
+        del result[k]
+    result.update(changed)
+    for k, sub_patch in patches.iteritems():
+        result[k] = _patch_raw_tree(source[k], sub_patch)
+    return result
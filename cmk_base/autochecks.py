@@ -24,47 +24,51 @@
 # to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
 # Boston, MA 02110-1301 USA.
 
+import errno
+import marshal
 import os
+import re
 import sys
+from typing import Any, Dict, Iterable, List, Tuple  # pylint: disable=unused-import
 
 import six
 
 import cmk.utils.debug
 import cmk.utils.exceptions
 import cmk.utils.paths
+import cmk.utils.store as store
 
+import cmk_base
 import cmk_base.config
 import cmk_base.console
 
 
+class _UnexpectedLineError(Exception):
+    pass
+
+
+# Compiled parameter strings of the autochecks
+_compiled_parameters = {}  # type: Dict[str, Any]
+
+
 # Read automatically discovered checks of one host.
 # Returns a table with three columns:
 # 1. check_plugin_name
 # 2. item
 # 3. parameters evaluated!
-# TODO: use store.load_data_from_file()
-# TODO: Common code with parse_autochecks_file? Cleanup.
 def read_autochecks_of(hostname):
-    basedir = cmk.utils.paths.autochecks_dir
-    filepath = basedir + '/' + hostname + '.mk'
-
-    if not os.path.exists(filepath):
-        return []
-
-    check_config = cmk_base.config.get_check_variables()
     try:
-        cmk_base.console.vverbose("Loading autochecks from %s\n", filepath)
-        autochecks_raw = eval(file(filepath).read(), check_config, check_config)
-    except SyntaxError as e:
-        cmk_base.console.verbose("Syntax error in file %s: %s\n", filepath, e, stream=sys.stderr)
+        table = _parse_autochecks(hostname, strict=True)
+        check_config = cmk_base.config.get_check_variables() if table else {}
+        autochecks_raw = [(check_plugin_name, item, _evaluate_parameters(paramstring, check_config))
+                          for check_plugin_name, item, paramstring in table]
+    except _UnexpectedLineError:
+        # Not written by Check_MK, e.g. entries spanning multiple lines
+        autochecks_raw = _eval_autochecks_file(_autochecks_path(hostname))
+    except Exception:
         if cmk.utils.debug.enabled():
             raise
-        return []
-    except Exception as e:
-        cmk_base.console.verbose("Error in file %s:\n%s\n", filepath, e, stream=sys.stderr)
-        if cmk.utils.debug.enabled():
-            raise
-        return []
+        autochecks_raw = _eval_autochecks_file(_autochecks_path(hostname))
 
     # Exchange inventorized check parameters with those configured by
     # the user. Also merge with default levels for modern dictionary based checks.
@@ -88,3 +92,304 @@ def read_autochecks_of(hostname):
                            cmk_base.config.compute_check_parameters(hostname, check_plugin_name,
                                                                     item, parameters)))
     return autochecks
+
+
+def _evaluate_parameters(paramstring, check_config):
+    # Most hosts share the same few parameter strings
+    try:
+        code = _compiled_parameters[paramstring]
+    except KeyError:
+        code = _compiled_parameters[paramstring] = compile(paramstring, "<autochecks>", "eval")
+    return eval(code, check_config, check_config)
+
+
+def _eval_autochecks_file(filepath):
+    if not os.path.exists(filepath):
+        return []
+
+    check_config = cmk_base.config.get_check_variables()
+    try:
+        cmk_base.console.vverbose("Loading autochecks from %s\n", filepath)
+        return eval(file(filepath).read(), check_config, check_config)
+    except SyntaxError as e:
+        cmk_base.console.verbose("Syntax error in file %s: %s\n", filepath, e, stream=sys.stderr)
+        if cmk.utils.debug.enabled():
+            raise
+        return []
+    except Exception as e:
+        cmk_base.console.verbose("Error in file %s:\n%s\n", filepath, e, stream=sys.stderr)
+        if cmk.utils.debug.enabled():
+            raise
+        return []
+
+
+def save_autochecks_file(hostname, items):
+    # type: (str, Iterable[Tuple[str, Any, str]]) -> None
+    if not os.path.exists(cmk.utils.paths.autochecks_dir):
+        os.makedirs(cmk.utils.paths.autochecks_dir)
+
+    content = []
+    content.append("[")
+    for check_plugin_name, item, paramstring in items:
+        content.append("  (%r, %r, %s)," % (check_plugin_name, item, paramstring))
+    content.append("]\n")
+    store.save_file(_autochecks_path(hostname), "\n".join(content))
+    _preloaded_autochecks().pop(hostname, None)
+
+
+def remove_autochecks_file(hostname):
+    # type: (str) -> None
+    try:
+        os.remove(_autochecks_path(hostname))
+    except OSError:
+        pass
+    _preloaded_autochecks().pop(hostname, None)
+
+
+def has_autochecks(hostname):
+    # type: (str) -> bool
+    return os.path.exists(_autochecks_path(hostname))
+
+
+def _autochecks_path(hostname):
+    return "%s/%s.mk" % (cmk.utils.paths.autochecks_dir, hostname)
+
+
+#.
+#   .--Bulk loading--------------------------------------------------------.
+#   |         ____        _ _      _                 _ _                   |
+#   |        | __ ) _   _| | | __ | | ___   __ _  __| (_)_ __   __ _       |
+#   |        |  _ \| | | | | |/ / | |/ _ \ / _` |/ _` | | '_ \ / _` |      |
+#   |        | |_) | |_| | |   <  | | (_) | (_| | (_| | | | | | (_| |      |
+#   |        |____/ \__,_|_|_|\_\ |_|\___/ \__,_|\__,_|_|_| |_|\__, |      |
+#   |                                                          |___/       |
+#   +----------------------------------------------------------------------+
+#   | Reading the autochecks files of all hosts one by one takes long with |
+#   | many hosts. The parsed autochecks of all hosts are kept in a single  |
+#   | file together with the inode, mtime and size of the autochecks file  |
+#   | they were parsed from. Only the autochecks files changed since then  |
+#   | are parsed again. The autochecks files stay the primary storage.     |
+#   '----------------------------------------------------------------------'
+
+_BULK_FILE_VERSION = 1
+
+
+def preload_autochecks(hostnames):
+    # type: (Iterable[str]) -> None
+    """Parse the autochecks of the given hosts at once
+
+    The following calls of parse_autochecks_file() and read_autochecks_of() use
+    the preloaded autochecks of these hosts."""
+    bulk_autochecks = _load_bulk_file()
+    preloaded = _preloaded_autochecks()
+    changed = False
+
+    for hostname in hostnames:
+        path = _autochecks_path(hostname)
+        try:
+            stats = os.stat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            preloaded[hostname] = []
+            changed |= bulk_autochecks.pop(hostname, None) is not None
+            continue
+
+        file_id = (stats.st_ino, stats.st_mtime, stats.st_size)
+        entry = bulk_autochecks.get(hostname)
+        if entry is not None and entry[0] == file_id:
+            preloaded[hostname] = entry[1]
+            continue
+
+        try:
+            table = _parse_autochecks_lines(path, file(path), strict=True)
+        except Exception:
+            if cmk.utils.debug.enabled():
+                raise
+            continue  # Leave the error handling to the regular loading
+
+        cmk_base.console.vverbose("Parsed autochecks from %s\n", path)
+        bulk_autochecks[hostname] = file_id, table
+        preloaded[hostname] = table
+        changed = True
+
+    if changed:
+        for hostname in list(bulk_autochecks):
+            if hostname not in preloaded and not has_autochecks(hostname):
+                del bulk_autochecks[hostname]
+        _save_bulk_file(bulk_autochecks)
+
+
+def _preloaded_autochecks():
+    # type: () -> Dict[str, List[Tuple[str, Any, str]]]
+    return cmk_base.config_cache.get_dict("preloaded_autochecks")
+
+
+def _load_bulk_file():
+    try:
+        version, bulk_autochecks = marshal.loads(file(cmk.utils.paths.autochecks_bulk_file).read())
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return {}
+    except (EOFError, ValueError, TypeError):
+        return {}  # Empty (currently being written) or invalid file
+
+    if version != _BULK_FILE_VERSION:
+        return {}
+    return bulk_autochecks
+
+
+def _save_bulk_file(bulk_autochecks):
+    store.save_file(cmk.utils.paths.autochecks_bulk_file,
+                    marshal.dumps((_BULK_FILE_VERSION, bulk_autochecks)))
+
+
+#.
+#   .--Parsing-------------------------------------------------------------.
+#   |                  ____                _                               |
+#   |                 |  _ \ __ _ _ __ ___(_)_ __   __ _                   |
+#   |                 | |_) / _` | '__/ __| | '_ \ / _` |                  |
+#   |                 |  __/ (_| | |  \__ \ | | | | (_| |                  |
+#   |                 |_|   \__,_|_|  |___/_|_| |_|\__, |                  |
+#   |                                              |___/                   |
+#   +----------------------------------------------------------------------+
+#   | Parse the autochecks files without evaluating the parameters         |
+#   '----------------------------------------------------------------------'
+
+_STRING = r"""[uUbB]?[rR]?(?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")"""
+_LITERAL = r"(?:%s|None|-?\d+)" % _STRING
+# The check plugin name and the item of the entries written by Check_MK are simple
+# literals. Everything behind them is the parameter string. In the legacy format
+# the host name comes first. A parameter string can not start with a literal
+# followed by a comma, so a third literal means the legacy format.
+_ENTRY = re.compile(
+    r"\s*(%s)\s*,\s*(%s)\s*,\s*(?:(%s)\s*,\s*)?(.+)$" % (_STRING, _LITERAL, _LITERAL))
+
+
+# Read autochecks, but do not compute final check parameters,
+# also return a forth column with the raw string of the parameters.
+# Returns a table with three columns:
+# 1. check_plugin_name
+# 2. item
+# 3. parameter string, not yet evaluated!
+def parse_autochecks_file(hostname):
+    return _parse_autochecks(hostname, strict=False)
+
+
+def _parse_autochecks(hostname, strict):
+    preloaded = _preloaded_autochecks()
+    if hostname in preloaded:
+        return preloaded[hostname][:]
+
+    path = _autochecks_path(hostname)
+    try:
+        return _parse_autochecks_lines(path, file(path), strict)
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+
+
+def _parse_autochecks_lines(path, lines, strict):
+    """Parse the autochecks file line by line
+
+    Lines not containing a single entry are skipped. In strict mode they are
+    reported, because they are probably part of entries spanning multiple lines."""
+    table = []
+    for lineno, line in enumerate(lines, 1):
+        try:
+            line = line.strip()
+            if not line.startswith("("):
+                if strict and line not in ["", "[", "]"] and not line.startswith("#"):
+                    raise _UnexpectedLineError()
+                continue
+
+            # drop everything after potential '#' (from older versions)
+            i = line.rfind('#')
+            if i > 0:  # make sure # is not contained in string
+                rest = line[i:]
+                if '"' not in rest and "'" not in rest:
+                    line = line[:i].strip()
+
+            if line.endswith(","):
+                line = line[:-1]
+            line = line[1:-1]  # drop brackets
+
+            parts = _split_entry(line)
+            if len(parts) == 4:
+                parts = parts[1:]  # drop hostname, legacy format with host in first column
+            elif len(parts) != 3:
+                raise Exception("Invalid number of parts: %d (%r)" % (len(parts), parts))
+
+            checktypestring, itemstring, paramstring = parts
+
+            item = _eval_literal(itemstring)
+            # With Check_MK 1.2.7i3 items are now defined to be unicode strings. Convert
+            # items from existing autocheck files for compatibility. TODO remove this one day
+            if isinstance(item, str):
+                item = cmk_base.config.decode_incoming_string(item)
+
+            table.append((_eval_literal(checktypestring), item, paramstring))
+        except _UnexpectedLineError:
+            raise
+        except:
+            if cmk.utils.debug.enabled():
+                raise
+            raise Exception("Invalid line %d in autochecks file %s" % (lineno, path))
+    return table
+
+
+def _eval_literal(text):
+    # Shortcut for the plain strings written by Check_MK
+    quoted = text[1:] if text[:1] == "u" else text
+    if len(quoted) >= 2 and quoted[0] == quoted[-1] in "'\"" and "\\" not in quoted \
+       and quoted[0] not in quoted[1:-1]:
+        if quoted is text:
+            return text[1:-1]
+        try:
+            return quoted[1:-1].decode("ascii")
+        except UnicodeDecodeError:
+            pass
+    return eval(text)
+
+
+def _split_entry(line):
+    match = _ENTRY.match(line)
+    if match:
+        return [p.strip() for p in match.groups() if p is not None]
+    return _split_python_tuple(line)
+
+
+def _split_python_tuple(line):
+    parts = []
+    while line is not None:
+        quote = None
+        bracklev = 0
+        backslash = False
+        for i, c in enumerate(line):
+            if backslash:
+                backslash = False
+                continue
+            elif c == '\\':
+                backslash = True
+            elif c == quote:
+                quote = None  # end of quoted string
+            elif c in ['"', "'"] and not quote:
+                quote = c  # begin of quoted string
+            elif quote:
+                continue
+            elif c in ['(', '{', '[']:
+                bracklev += 1
+            elif c in [')', '}', ']']:
+                bracklev -= 1
+            elif bracklev > 0:
+                continue
+            elif c == ',':
+                parts.append(line[0:i].strip())
+                line = line[i + 1:]
+                break
+        else:
+            parts.append(line.strip())
+            line = None
+    return parts
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""Persistent helper for the automation calls of the GUI
+
+Every action of WATO which needs information from Check_MK base executes
+"cmk --automation ...". Each of these processes loads the check plugins and
+the whole configuration before doing the actual work, which is often only
+a matter of milliseconds.
+
+The automation helper daemon keeps the check plugins and the configuration
+loaded in a pool of worker processes. Every request is executed in a process
+forked from a worker, so that an automation call can not influence the
+following ones. The worker does not wait for this process, it answers the
+client on its own. The GUI hands over the automation calls via a local UNIX
+socket and executes them on its own in case the daemon is not running.
+
+Before executing a request the worker verifies that the configuration files
+and check plugins have not been changed since loading them. Otherwise the
+client is told to execute the automation call on its own and the daemon
+restarts itself to load the new configuration.
+"""
+
+import ast
+import cStringIO
+import os
+import signal
+import socket  # pylint: disable=unused-import
+import sys
+import time
+from typing import Dict, Optional  # pylint: disable=unused-import
+
+import cmk.utils.paths
+
+import cmk_base.config as config
+import cmk_base.check_api as check_api
+from cmk_base.helper_daemon import HelperDaemon
+
+# Response telling the client to execute the automation call on its own
+STALE_RESPONSE = "stale\n"
+
+
+class AutomationHelperDaemon(HelperDaemon):
+    def __init__(self):
+        # Determine the generation before loading. A change during loading
+        # must lead to a restart of the daemon.
+        generation = config.get_config_generation()
+
+        config.load_all_checks(check_api.get_check_api_context)
+        config.load(validate_hosts=False)
+
+        super(AutomationHelperDaemon, self).__init__(
+            socket_path=cmk.utils.paths.automation_helper_socket,
+            num_workers=config.automation_helper_daemon_workers,
+            request_timeout=config.automation_helper_daemon_timeout,
+        )
+        self._generation = generation
+        # The processes executing the automation calls of this worker: pid -> start time
+        self._automation_processes = {}  # type: Dict[int, float]
+
+    def _get_generation(self):
+        return config.get_config_generation()
+
+    def handle_request(self, request):
+        # type: (str) -> str
+        if self._get_generation() != self._generation:
+            return STALE_RESPONSE
+
+        command, args, stdin_data = ast.literal_eval(request)
+        return self._execute_automation(command, args, stdin_data)
+
+    def error_response(self, exc):
+        # type: (Exception) -> str
+        return "2\nException in automation helper: %s\n" % exc
+
+    def _accept(self):
+        # type: () -> Optional[socket.socket]
+        self._reap_automation_processes()
+        return super(AutomationHelperDaemon, self)._accept()
+
+    def _serve_connection(self, conn):
+        # type: (socket.socket) -> None
+        """Answer the request in a process forked from the worker
+
+        The worker continues with the next request right away. Long running
+        automation calls (e.g. a service discovery) thus don't delay the other
+        calls of the GUI."""
+        pid = os.fork()
+        if pid == 0:
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                if self._listen_socket is not None:
+                    self._listen_socket.close()
+                super(AutomationHelperDaemon, self)._serve_connection(conn)
+            finally:
+                os._exit(0)  # pylint: disable=protected-access
+
+        conn.close()
+        self._automation_processes[pid] = time.time()
+
+    def _reap_automation_processes(self):
+        # type: () -> None
+        # The automation processes abort on their own once the request timed out.
+        # This only catches processes which do not react to the alarm signal.
+        deadline = time.time() - self._request_timeout - 10
+        for pid, started in self._automation_processes.items():
+            try:
+                reaped_pid = os.waitpid(pid, os.WNOHANG)[0]
+            except OSError:
+                reaped_pid = pid
+
+            if reaped_pid:
+                del self._automation_processes[pid]
+            elif started < deadline:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def _execute_automation(self, command, args, stdin_data):
+        # type: (str, list, str) -> str
+        exit_code = 2
+        output = cStringIO.StringIO()
+        orig_stdin, orig_stdout, orig_stderr = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin = cStringIO.StringIO(stdin_data)
+        sys.stdout = sys.stderr = output
+        try:
+            exit_code = _run_automation(command, args)
+        except SystemExit as e:
+            if e.code is None:
+                exit_code = 0
+            else:
+                exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            output.write("%s\n" % e)
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = orig_stdin, orig_stdout, orig_stderr
+
+        return "%d\n%s" % (exit_code, output.getvalue())
+
+
+def _run_automation(command, args):
+    # type: (str, list) -> int
+    import cmk_base.automations as automations
+    return automations.automations.execute(command, args, preloaded=True)
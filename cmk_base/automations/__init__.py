@@ -60,7 +60,11 @@ class Automations(object):
     def register(self, automation):
         self._automations[automation.cmd] = automation
 
-    def execute(self, cmd, args):
+    def execute(self, cmd, args, preloaded=False):
+        """Execute the automation call
+
+        The checks and the configuration are loaded as needed by the automation,
+        unless they have already been loaded by the caller (preloaded=True)."""
         self._handle_generic_arguments(args)
 
         try:
@@ -69,10 +73,10 @@ class Automations(object):
             except KeyError:
                 raise MKAutomationError("Automation command '%s' is not implemented." % cmd)
 
-            if automation.needs_checks:
+            if automation.needs_checks and not preloaded:
                 config.load_all_checks(check_api.get_check_api_context)
 
-            if automation.needs_config:
+            if automation.needs_config and not preloaded:
                 config.load(validate_hosts=False)
 
             result = automation.execute(args)
@@ -59,6 +59,7 @@ import cmk_base.check_api as check_api
 import cmk_base.parent_scan
 import cmk_base.notify as notify
 import cmk_base.ip_lookup as ip_lookup
+import cmk_base.piggyback as piggyback
 import cmk_base.data_sources as data_sources
 
 
@@ -360,6 +361,9 @@ class AutomationRenameHosts(Automation):
                 if self._rename_host_file(piggybase + piggydir, oldname, newname):
                     actions.append("piggyback-pig")
 
+        if "piggyback-load" in actions or "piggyback-pig" in actions:
+            piggyback.invalidate_index()
+
         # Logwatch
         if self._rename_host_dir(cmk.utils.paths.logwatch_dir, oldname, newname):
             actions.append("logwatch")
@@ -577,7 +581,7 @@ automations.register(AutomationRenameHosts())
 class AutomationAnalyseServices(Automation):
     cmd = "analyse-service"
     needs_config = True
-    needs_checks = True  # TODO: Can we change this?
+    needs_checks = True  # The check variables are needed to load the configuration
 
     def execute(self, args):
         hostname = args[0]
@@ -746,6 +750,7 @@ class AutomationDeleteHosts(Automation):
                 "%s/persisted/%s" % (cmk.utils.paths.var_dir, hostname),
                 "%s/inventory/%s" % (cmk.utils.paths.var_dir, hostname),
                 "%s/inventory/%s.gz" % (cmk.utils.paths.var_dir, hostname),
+                "%s/inventory/.%s.hash" % (cmk.utils.paths.var_dir, hostname),
                 "%s/agent_deployment/%s" % (cmk.utils.paths.var_dir, hostname),
         ]:
             if os.path.exists(path):
@@ -779,12 +784,15 @@ class AutomationDeleteHosts(Automation):
                     os.unlink("%s/%s" % (folder, hostname))
 
         # logwatch and piggyback folders
+        piggyback_dir = "%s/piggyback/%s" % (cmk.utils.paths.tmp_dir, hostname)
         for what_dir in [
                 "%s/%s" % (cmk.utils.paths.logwatch_dir, hostname),
-                "%s/piggyback/%s" % (cmk.utils.paths.tmp_dir, hostname),
+                piggyback_dir,
         ]:
             if os.path.exists(what_dir):
                 shutil.rmtree(what_dir)
+                if what_dir == piggyback_dir:
+                    piggyback.invalidate_index()
 
         return None
 
@@ -972,13 +980,14 @@ automations.register(AutomationGetConfiguration())
 class AutomationGetCheckInformation(Automation):
     cmd = "get-check-information"
     needs_config = False
-    needs_checks = True
+    needs_checks = False  # The information is taken from the check manifest
 
     def execute(self, args):
         manuals = man_pages.all_man_pages()
 
         check_infos = {}
-        for check_plugin_name, check in config.check_info.items():
+        for check_plugin_name, check in config.get_check_manifest(
+                check_api.get_check_api_context)["checks"].items():
             try:
                 manfile = manuals.get(check_plugin_name)
                 # TODO: Use cmk.utils.man_pages module standard functions to read the title
@@ -991,8 +1000,7 @@ class AutomationGetCheckInformation(Automation):
                     check_infos[check_plugin_name]["group"] = check["group"]
                 check_infos[check_plugin_name]["service_description"] = check.get(
                     "service_description", "%s")
-                check_infos[check_plugin_name]["snmp"] = cmk_base.check_utils.is_snmp_check(
-                    check_plugin_name)
+                check_infos[check_plugin_name]["snmp"] = check["snmp"]
             except Exception as e:
                 if cmk.utils.debug.enabled():
                     raise
@@ -1007,13 +1015,14 @@ automations.register(AutomationGetCheckInformation())
 class AutomationGetRealTimeChecks(Automation):
     cmd = "get-real-time-checks"
     needs_config = False
-    needs_checks = True
+    needs_checks = False  # The information is taken from the check manifest
 
     def execute(self, args):
         manuals = man_pages.all_man_pages()
 
         rt_checks = []
-        for check_plugin_name, check in config.check_info.items():
+        for check_plugin_name, check in config.get_check_manifest(
+                check_api.get_check_api_context)["checks"].items():
             if check["handle_real_time_checks"]:
                 # TODO: Use cmk.utils.man_pages module standard functions to read the title
                 title = check_plugin_name
@@ -1037,13 +1046,17 @@ automations.register(AutomationGetRealTimeChecks())
 class AutomationGetCheckManPage(Automation):
     cmd = "get-check-manpage"
     needs_config = False
-    needs_checks = True
+    needs_checks = False  # Only the requested check is loaded
 
     def execute(self, args):
         if len(args) != 1:
             raise MKAutomationError("Need exactly one argument.")
 
         check_plugin_name = args[0]
+        config.load_checks_of_plugins(
+            check_api.get_check_api_context,
+            [check_plugin_name,
+             cmk_base.check_utils.section_name_of(check_plugin_name)])
         manpage = man_pages.load_man_page(args[0])
 
         # Add a few informations from check_info. Note: active checks do not
@@ -1256,6 +1269,8 @@ class AutomationDiagHost(Automation):
                     character_encoding=snmp_config.character_encoding,
                     is_usewalk_host=snmp_config.is_usewalk_host,
                     is_inline_snmp_host=snmp_config.is_inline_snmp_host,
+                    is_bulk_snmp_host=snmp_config.is_bulk_snmp_host and
+                    not isinstance(credentials, tuple),
                 )
 
                 data = snmp.get_snmp_table(
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""SNMP backend walking many OIDs at once over a single UDP socket
+
+SNMP v2c bulkwalk hosts are queried with GETBULK requests, all other hosts
+with GETNEXT requests. Each request carries the next OIDs of several walks.
+Multiple requests are in flight at the same time. Each request is sent again
+after the configured timeout until the configured number of retries is
+exhausted.
+
+SNMP v3 is not supported. These hosts use one of the other backends.
+"""
+
+import collections
+import errno
+import random
+import select
+import socket
+import time
+from typing import Dict, List, Optional, Tuple  # pylint: disable=unused-import
+
+from pyasn1.codec.ber import decoder, encoder
+from pyasn1.error import PyAsn1Error
+from pyasn1.type import univ
+from pysnmp.proto import api, rfc1155, rfc1902, rfc1905
+
+import cmk_base.console as console
+import cmk_base.snmp_utils as snmp_utils
+from cmk_base.exceptions import MKSNMPError
+
+# Number of walks handled by a single request
+_MAX_OIDS_PER_REQUEST = 10
+
+# Default timing of the net-snmp command line tools
+_DEFAULT_TIMEOUT = 1.0
+_DEFAULT_RETRIES = 5
+
+_ERROR_TOO_BIG = 1
+_ERROR_NO_SUCH_NAME = 2
+
+OID = Tuple[int, ...]
+
+
+class BulkSNMPBackend(snmp_utils.ABCSNMPBackend):
+    def __init__(self, window=4):
+        # type: (int) -> None
+        super(BulkSNMPBackend, self).__init__()
+        self._window = window
+
+    def get(self, snmp_config, oid, context_name=None):
+        # type: (snmp_utils.SNMPHostConfig, str, Optional[str]) -> Optional[str]
+        return self.get_many(snmp_config, [oid], context_name)[oid]
+
+    def get_many(self, snmp_config, oids, context_name=None):
+        # type: (snmp_utils.SNMPHostConfig, List[str], Optional[str]) -> Dict[str, Optional[str]]
+        session = SNMPSession(snmp_config, self._window)
+        try:
+            values = session.get([oid for oid in oids if not oid.endswith(".*")])
+            for oid in oids:
+                if oid.endswith(".*"):
+                    values[oid] = self._get_next_in_prefix(session, oid[:-2])
+            return values
+        finally:
+            session.close()
+
+    def _get_next_in_prefix(self, session, oid_prefix):
+        # type: (SNMPSession, str) -> Optional[str]
+        result = session.get_next(oid_prefix)
+        if result is None or not result[0].startswith(oid_prefix + "."):
+            return None
+        return result[1]
+
+    def walk(self, snmp_config, oid, check_plugin_name=None, table_base_oid=None,
+             context_name=None):
+        # type: (snmp_utils.SNMPHostConfig, str, Optional[str], Optional[str], Optional[str]) -> snmp_utils.SNMPRowInfo
+        return self.walk_many(snmp_config, [oid])[oid]
+
+    def walk_many(self,
+                  snmp_config,
+                  oids,
+                  check_plugin_name=None,
+                  table_base_oid=None,
+                  context_name=None):
+        # type: (snmp_utils.SNMPHostConfig, List[str], Optional[str], Optional[str], Optional[str]) -> Dict[str, snmp_utils.SNMPRowInfo]
+        session = SNMPSession(snmp_config, self._window)
+        try:
+            return session.walk(oids)
+        finally:
+            session.close()
+
+
+class _Walk(object):
+    """State of the walk of a single OID"""
+
+    def __init__(self, oid):
+        # type: (str) -> None
+        super(_Walk, self).__init__()
+        self.oid = oid
+        self.root = _oid_to_tuple(oid)
+        self.next_oid = self.root
+        self.rows = []  # type: snmp_utils.SNMPRowInfo
+        self.done = False
+        self._seen = set()  # type: set
+
+    def add(self, oid, value):
+        # type: (OID, Optional[str]) -> None
+        """Adds the next answer of the agent. The walk is done when it leaves the subtree
+
+        Like "snmpwalk -Cc" the OIDs don't need to increase, but a repeated OID ends
+        the walk to protect against looping agents."""
+        if self.done:
+            return
+
+        if value is None or oid[:len(self.root)] != self.root or oid in self._seen:
+            self.done = True
+            return
+
+        self._seen.add(oid)
+        self.rows.append((_tuple_to_oid(oid), value))
+        self.next_oid = oid
+
+
+class _Request(object):
+    def __init__(self, request_id, message, walks):
+        super(_Request, self).__init__()
+        self.request_id = request_id
+        self.message = message
+        self.walks = walks
+        self.tries = 0
+        self.deadline = 0.0
+
+
+class SNMPSession(object):
+    """Sends the requests to a single SNMP agent and dispatches the responses"""
+
+    def __init__(self, snmp_config, window):
+        # type: (snmp_utils.SNMPHostConfig, int) -> None
+        super(SNMPSession, self).__init__()
+        if snmp_utils.is_snmpv3_host(snmp_config):
+            raise MKSNMPError("The bulk SNMP backend does not support SNMP v3")
+
+        self._snmp_config = snmp_config
+        self._window = max(1, window)
+        self._timeout = float(snmp_config.timing.get("timeout", _DEFAULT_TIMEOUT))
+        self._retries = int(snmp_config.timing.get("retries", _DEFAULT_RETRIES))
+        self._max_repetitions = max(1, snmp_config.bulk_walk_size_of)
+        self._max_oids = _MAX_OIDS_PER_REQUEST
+
+        self._use_bulk = snmp_config.is_bulkwalk_host
+        if self._use_bulk or snmp_config.is_snmpv2or3_without_bulkwalk_host:
+            self._proto = api.protoModules[api.protoVersion2c]
+        else:
+            self._proto = api.protoModules[api.protoVersion1]
+
+        self._request_id = random.randint(1, 2**30)
+        self._socket = self._connect()
+
+    def _connect(self):
+        family = socket.AF_INET6 if self._snmp_config.is_ipv6_primary else socket.AF_INET
+        try:
+            address = socket.getaddrinfo(self._snmp_config.ipaddress, self._snmp_config.port,
+                                         family, socket.SOCK_DGRAM)[0][4]
+        except socket.error as e:
+            raise MKSNMPError("Unknown host (%s): %s" % (self._snmp_config.ipaddress, e))
+
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            # Only receive the answers of the agent
+            sock.connect(address)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def close(self):
+        self._socket.close()
+
+    def walk(self, oids):
+        # type: (List[str]) -> Dict[str, snmp_utils.SNMPRowInfo]
+        walks = [_Walk(oid) for oid in oids]
+        queue = collections.deque(walks)
+        pending = {}  # type: Dict[int, _Request]
+
+        while queue or pending:
+            while queue and len(pending) < self._window:
+                batch = [queue.popleft() for _unused in range(min(self._max_oids, len(queue)))]
+                request = self._next_request(batch)
+                self._send(request)
+                pending[request.request_id] = request
+
+            request, response_pdu = self._receive(pending)
+            queue.extend(self._process_walk_response(request, response_pdu))
+
+        # Like snmpwalk: Get the requested OID itself when there is nothing below it
+        empty_walks = [walk for walk in walks if not walk.rows]
+        if empty_walks:
+            values = self.get([walk.oid for walk in empty_walks])
+            for walk in empty_walks:
+                value = values[walk.oid]
+                if value is not None:
+                    walk.rows.append((_tuple_to_oid(walk.root), value))
+
+        return dict((walk.oid, walk.rows) for walk in walks)
+
+    def get(self, oids):
+        # type: (List[str]) -> Dict[str, Optional[str]]
+        values = {}  # type: Dict[str, Optional[str]]
+        for index in xrange(0, len(oids), self._max_oids):
+            values.update(self._get_chunk(oids[index:index + self._max_oids]))
+        return values
+
+    def get_next(self, oid):
+        # type: (str) -> Optional[Tuple[str, Optional[str]]]
+        walk = _Walk(oid)
+        request = self._new_request(self._pdu(self._proto.GetNextRequestPDU), [walk.root], [walk])
+        response_pdu = self._roundtrip(request)
+        if self._error_status(response_pdu) == _ERROR_NO_SUCH_NAME:
+            return None
+        self._raise_error(response_pdu)
+
+        for response_oid, value in self._proto.apiPDU.getVarBinds(response_pdu):
+            return _tuple_to_oid(tuple(response_oid)), _format_value(value)
+        return None
+
+    def _get_chunk(self, oids):
+        values = dict((oid, None) for oid in oids)  # type: Dict[str, Optional[str]]
+        remaining = list(oids)
+        while remaining:
+            var_binds = [_oid_to_tuple(oid) for oid in remaining]
+            request = self._new_request(self._pdu(self._proto.GetRequestPDU), var_binds, [])
+            response_pdu = self._roundtrip(request)
+
+            # SNMP v1 agents answer the whole request with an error. Ask again without the
+            # OID the agent does not know.
+            if self._error_status(response_pdu) == _ERROR_NO_SUCH_NAME:
+                del remaining[self._error_index(response_pdu, len(remaining))]
+                continue
+            self._raise_error(response_pdu)
+
+            for oid, (_unused_oid, value) in zip(remaining,
+                                                 self._proto.apiPDU.getVarBinds(response_pdu)):
+                values[oid] = _format_value(value)
+            break
+        return values
+
+    def _next_request(self, walks):
+        oids = [walk.next_oid for walk in walks]
+        if self._use_bulk:
+            pdu = self._proto.GetBulkRequestPDU()
+            self._proto.apiBulkPDU.setDefaults(pdu)
+            self._proto.apiBulkPDU.setNonRepeaters(pdu, 0)
+            self._proto.apiBulkPDU.setMaxRepetitions(pdu, self._max_repetitions)
+        else:
+            pdu = self._pdu(self._proto.GetNextRequestPDU)
+        return self._new_request(pdu, oids, walks)
+
+    def _pdu(self, pdu_class):
+        pdu = pdu_class()
+        self._proto.apiPDU.setDefaults(pdu)
+        return pdu
+
+    def _new_request(self, pdu, oids, walks):
+        self._request_id = self._request_id % 2**31 + 1
+        self._proto.apiPDU.setRequestID(pdu, self._request_id)
+        self._proto.apiPDU.setVarBinds(pdu, [(oid, self._proto.Null("")) for oid in oids])
+
+        message = self._proto.Message()
+        self._proto.apiMessage.setDefaults(message)
+        self._proto.apiMessage.setCommunity(message, self._snmp_config.credentials)
+        self._proto.apiMessage.setPDU(message, pdu)
+
+        return _Request(self._request_id, encoder.encode(message), walks)
+
+    def _roundtrip(self, request):
+        self._send(request)
+        return self._receive({request.request_id: request})[1]
+
+    def _send(self, request):
+        request.tries += 1
+        request.deadline = time.time() + self._timeout
+        try:
+            self._socket.send(request.message)
+        except socket.error as e:
+            # e.g. ICMP port unreachable of a previous request. Handled like a lost packet.
+            console.vverbose("Failed to send SNMP request: %s\n" % e)
+
+    def _receive(self, pending):
+        # type: (Dict[int, _Request]) -> Tuple[_Request, object]
+        """Wait for the answer to one of the pending requests
+
+        Requests are sent again when their timeout is reached. A request that
+        reached the maximum number of retries aborts the whole session."""
+        while True:
+            now = time.time()
+            for request in pending.values():
+                if request.deadline > now:
+                    continue
+                if request.tries > self._retries:
+                    raise MKSNMPError("Timeout: No Response from %s." % self._snmp_config.ipaddress)
+                self._send(request)
+
+            timeout = max(0.0, min(request.deadline for request in pending.values()) - now)
+            try:
+                readable = select.select([self._socket], [], [], timeout)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if not readable:
+                continue
+
+            try:
+                data = self._socket.recv(65535)
+            except socket.error as e:
+                console.vverbose("Failed to receive SNMP response: %s\n" % e)
+                continue
+
+            response_pdu = self._decode(data)
+            if response_pdu is None:
+                continue
+
+            # Duplicate and late answers to already answered requests are ignored
+            request = pending.pop(int(self._proto.apiPDU.getRequestID(response_pdu)), None)
+            if request is not None:
+                return request, response_pdu
+
+    def _decode(self, data):
+        try:
+            message = decoder.decode(data, asn1Spec=self._proto.Message())[0]
+            if str(self._proto.apiMessage.getCommunity(message)) != self._snmp_config.credentials:
+                return None
+            return self._proto.apiMessage.getPDU(message)
+        except PyAsn1Error as e:
+            console.vverbose("Ignoring invalid SNMP response: %s\n" % e)
+            return None
+
+    def _process_walk_response(self, request, response_pdu):
+        """Adds the received values to the walks and returns the walks to be continued"""
+        error_status = self._error_status(response_pdu)
+        if error_status == _ERROR_TOO_BIG:
+            if self._use_bulk and self._max_repetitions > 1:
+                self._max_repetitions = max(1, self._max_repetitions // 2)
+            elif self._max_oids > 1:
+                self._max_oids = max(1, self._max_oids // 2)
+            else:
+                self._raise_error(response_pdu)
+            return request.walks
+
+        if error_status == _ERROR_NO_SUCH_NAME:
+            # SNMP v1 end of MIB view: The walk of the failed OID is done
+            request.walks[self._error_index(response_pdu, len(request.walks))].done = True
+            return [walk for walk in request.walks if not walk.done]
+
+        self._raise_error(response_pdu)
+
+        var_binds = self._proto.apiPDU.getVarBinds(response_pdu)
+        if not var_binds:
+            return []  # Nothing to continue with
+
+        # GETBULK answers contain the repetitions of all OIDs one after another
+        for index, (oid, value) in enumerate(var_binds):
+            request.walks[index % len(request.walks)].add(tuple(oid), _format_value(value))
+
+        # Walks without any answer in a truncated GETBULK answer are continued
+        # at their current OID with the next request
+        return [walk for walk in request.walks if not walk.done]
+
+    def _error_status(self, response_pdu):
+        return int(self._proto.apiPDU.getErrorStatus(response_pdu))
+
+    def _error_index(self, response_pdu, num_oids):
+        index = int(self._proto.apiPDU.getErrorIndex(response_pdu)) - 1
+        if not 0 <= index < num_oids:
+            self._raise_error(response_pdu, force=True)
+        return index
+
+    def _raise_error(self, response_pdu, force=False):
+        error_status = self._proto.apiPDU.getErrorStatus(response_pdu)
+        if int(error_status) or force:
+            raise MKSNMPError(
+                "SNMP Error on %s: %s" % (self._snmp_config.ipaddress, error_status.prettyPrint()))
+
+
+def _format_value(value):
+    """Converts an SNMP value to the format of the other SNMP backends
+
+    Returns None for the exception values of SNMP v2c (e.g. endOfMibView)."""
+    if isinstance(value, (rfc1905.EndOfMibView, rfc1905.NoSuchObject, rfc1905.NoSuchInstance)):
+        return None
+
+    if isinstance(value, rfc1155.NetworkAddress):
+        value = value.getComponent()
+
+    if isinstance(value, (rfc1155.IpAddress, rfc1902.IpAddress)):
+        return socket.inet_ntoa(value.asOctets())
+
+    if isinstance(value, univ.ObjectIdentifier):
+        return "." + str(value)
+
+    if isinstance(value, univ.OctetString):
+        return value.asOctets()
+
+    if isinstance(value, univ.Integer):
+        return str(int(value))
+
+    if isinstance(value, univ.Null):
+        return ""
+
+    return value.prettyPrint()
+
+
+def _oid_to_tuple(oid):
+    # type: (str) -> OID
+    try:
+        return tuple(int(part) for part in oid.strip(".").split("."))
+    except ValueError:
+        raise MKSNMPError("Invalid OID %s" % oid)
+
+
+def _tuple_to_oid(oid):
+    # type: (OID) -> str
+    return "." + ".".join(str(part) for part in oid)
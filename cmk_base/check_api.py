@@ -507,6 +507,92 @@ def check_levels(value,
     return state, infotext, perfdata
 
 
+def check_levels_many(values,
+                      params,
+                      unit="",
+                      factor=1.0,
+                      scale=1.0,
+                      statemarkers=False,
+                      human_readable_func=None):
+    """Check a whole sequence of values against the same levels
+
+    This is meant for checks producing many metrics with common levels. The
+    levels are scaled and rendered only once instead of once per value.
+
+    values:  Sequence of tuples (value, dsname) or (value, dsname, infoname).
+             The elements have the same meaning as the arguments of
+             check_levels().
+
+    All other arguments are handled like in check_levels(). Returns a list
+    containing the check_levels() result of each value, in the order of
+    values.
+    """
+    values = [v if len(v) == 3 else (v[0], v[1], None) for v in values]
+
+    # Predictive levels are computed per datasource
+    if isinstance(params, dict):
+        return [
+            check_levels(
+                value,
+                dsname,
+                params,
+                unit=unit,
+                factor=factor,
+                scale=scale,
+                statemarkers=statemarkers,
+                human_readable_func=human_readable_func,
+                infoname=infoname) for value, dsname, infoname in values
+        ]
+
+    unit_info = ""
+    if unit.startswith('/'):
+        unit_info = unit
+    elif unit:
+        unit_info = " %s" % unit
+
+    if human_readable_func is None:
+        human_readable_func = lambda x: "%.2f" % (x / scale)
+
+    def scale_value(v):
+        if v is None:
+            return None
+        return v * factor * scale
+
+    # {}, (), None, (None, None), (None, None, None, None) -> do not check any levels
+    if not params or set(params) <= {None}:
+        levels = None
+    else:
+        levels = map(scale_value, _normalize_bounds(params))
+
+    # The levels are the same for all values, render them only once
+    rendered_levels = {}
+
+    def render_level(level):
+        if level not in rendered_levels:
+            rendered_levels[level] = human_readable_func(level)
+        return rendered_levels[level]
+
+    results = []
+    for value, dsname, infoname in values:
+        if infoname:
+            infotext = "%s: %s%s" % (infoname, human_readable_func(value), unit_info)
+        else:
+            infotext = "%s%s" % (human_readable_func(value), unit_info)
+
+        if levels is None:
+            results.append((0, infotext, [(dsname, value)] if dsname else []))
+            continue
+
+        state, levelstext = _check_boundaries(value, levels, render_level, unit_info)
+        infotext += levelstext
+        if statemarkers:
+            infotext += state_markers[state]
+
+        results.append((state, infotext, [(dsname, value, levels[0], levels[1])] if dsname else []))
+
+    return results
+
+
 def get_effective_service_level():
     """Get the service level that applies to the current service.
     This can only be used within check functions, not during discovery nor parsing."""
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""Persistent check helper for the Nagios core
+
+With the Nagios core every Check_MK service is executed by starting the
+precompiled host check of the host. Each of these processes has to import
+cmk_base, load the check plugins and the packed configuration before it
+can start checking.
+
+The check helper daemon keeps all this resident in a pool of worker
+processes. The precompiled host checks only hand over the host name to
+the daemon via a local UNIX socket and print out the result. In case the
+daemon is not running they fall back to checking the host themselves.
+"""
+
+import sys
+from StringIO import StringIO
+
+import cmk.utils.paths
+
+import cmk_base.cleanup
+import cmk_base.config as config
+import cmk_base.checking as checking
+from cmk_base.helper_daemon import HelperDaemon
+
+
+class CheckHelperDaemon(HelperDaemon):
+    def __init__(self):
+        super(CheckHelperDaemon, self).__init__(
+            socket_path=cmk.utils.paths.check_helper_socket,
+            num_workers=config.check_helper_daemon_workers,
+            request_timeout=config.check_helper_daemon_timeout,
+            generation_path=config.PackedConfig().path,
+        )
+
+    def handle_request(self, request):
+        # type: (str) -> str
+        hostname = request.strip()
+        if not hostname:
+            return "3\nUNKNOWN - Got no host name to check\n"
+
+        # The check result is written to stdout by do_check(). Capture it
+        # to send it back to the precompiled host check.
+        orig_stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            status = checking.do_check(hostname, None)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = orig_stdout
+            # The worker is reused for the next host: Drop the host related caches
+            cmk_base.cleanup.cleanup_globals()
+
+        return "%d\n%s" % (status, output)
+
+    def error_response(self, exc):
+        # type: (Exception) -> str
+        return "3\nUNKNOWN - Exception in check helper: %s\n" % exc
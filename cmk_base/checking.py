@@ -26,6 +26,7 @@
 """Performing the actual checks."""
 
 import os
+import select
 import signal
 import tempfile
 import time
@@ -68,6 +69,11 @@ _nagios_command_pipe = None  # Filedescriptor to open nagios command pipe.
 _checkresult_file_fd = None
 _checkresult_file_path = None
 
+# While a host is being checked, the results to be sent to the core are collected
+# here and written all at once by _flush_check_results(). When set to None, the
+# results are written immediately.
+_pending_check_results = None  # type: Optional[List[str]]
+
 _submit_to_core = True
 _show_perfdata = False
 
@@ -106,6 +112,7 @@ def do_check(hostname, ipaddress, only_check_plugin_names=None):
 
         sources = data_sources.DataSources(hostname, ipaddress)
 
+        _start_check_result_batch()
         num_success, missing_sections = \
             _do_all_checks_on_host(sources, host_config, ipaddress, only_check_plugin_names)
 
@@ -153,6 +160,8 @@ def do_check(hostname, ipaddress, only_check_plugin_names=None):
 
         return status, infotexts, long_infotexts, perfdata
     finally:
+        _flush_check_results()
+
         if _checkresult_file_fd is not None:
             _close_checkresult_file()
 
@@ -617,12 +626,42 @@ def _do_submit_to_core(host, service, state, output, cached_at=None, cache_inter
                                  "Must be 'pipe' or 'file'" % config.check_submission)
 
 
+def _start_check_result_batch():
+    global _pending_check_results
+    _pending_check_results = []
+
+
+def _flush_check_results():
+    """Write the collected check results to the core and stop collecting"""
+    global _pending_check_results
+    pending, _pending_check_results = _pending_check_results, None
+    if not pending:
+        return
+
+    if _checkresult_file_fd:
+        os.write(_checkresult_file_fd, "".join(pending))
+
+    elif _nagios_command_pipe:
+        # The core needs every command in one single write() block. Writes to a
+        # pipe are only guaranteed not to be interleaved with the writes of other
+        # processes up to PIPE_BUF bytes. Send as many commands as possible per
+        # write without exceeding that limit.
+        chunk, chunk_size = [], 0
+        for command in pending:
+            if chunk and chunk_size + len(command) > select.PIPE_BUF:
+                _write_to_command_pipe("".join(chunk))
+                chunk, chunk_size = [], 0
+            chunk.append(command)
+            chunk_size += len(command)
+        _write_to_command_pipe("".join(chunk))
+
+
 def _submit_via_check_result_file(host, service, state, output):
     output = output.replace("\n", "\\n")
     _open_checkresult_file()
     if _checkresult_file_fd:
         now = time.time()
-        os.write(
+        _write_check_result(
             _checkresult_file_fd, """host_name=%s
 service_description=%s
 check_type=1
@@ -637,6 +676,13 @@ output=%s
 """ % (host, cmk_base.utils.make_utf8(service), now, now, state, cmk_base.utils.make_utf8(output)))
 
 
+def _write_check_result(fd, record):
+    if _pending_check_results is not None:
+        _pending_check_results.append(record)
+    else:
+        os.write(fd, record)
+
+
 def _open_checkresult_file():
     global _checkresult_file_fd
     global _checkresult_file_path
@@ -662,12 +708,20 @@ def _submit_via_command_pipe(host, service, state, output):
     _open_command_pipe()
     if _nagios_command_pipe:
         # [<timestamp>] PROCESS_SERVICE_CHECK_RESULT;<host_name>;<svc_description>;<return_code>;<plugin_output>
-        _nagios_command_pipe.write("[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n" %
-                                   (int(time.time()), host, cmk_base.utils.make_utf8(service),
-                                    state, cmk_base.utils.make_utf8(output)))
-        # Important: Nagios needs the complete command in one single write() block!
-        # Python buffers and sends chunks of 4096 bytes, if we do not flush.
-        _nagios_command_pipe.flush()
+        command = "[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n" % (
+            int(time.time()), host, cmk_base.utils.make_utf8(service), state,
+            cmk_base.utils.make_utf8(output))
+        if _pending_check_results is not None:
+            _pending_check_results.append(command)
+        else:
+            _write_to_command_pipe(command)
+
+
+def _write_to_command_pipe(data):
+    _nagios_command_pipe.write(data)
+    # Important: Nagios needs the complete command in one single write() block!
+    # Python buffers and sends chunks of 4096 bytes, if we do not flush.
+    _nagios_command_pipe.flush()
 
 
 def _open_command_pipe():
@@ -27,8 +27,10 @@
 from collections import OrderedDict
 import ast
 import copy
+import errno
 import inspect
 import marshal
+import mmap
 import numbers
 import os
 import py_compile
@@ -190,12 +192,12 @@ def _initialize_config():
     load_default_config()
 
 
-def _perform_post_config_loading_actions():
+def _perform_post_config_loading_actions(snapshot=None):
     """These tasks must be performed after loading the Check_MK base configuration"""
     # First cleanup things (needed for e.g. reloading the config)
     cmk_base.config_cache.clear_all()
 
-    get_config_cache().initialize()
+    get_config_cache().initialize(snapshot)
 
     # In case the checks are not loaded yet it seems the current mode
     # is not working with the checks. In this case also don't load the
@@ -287,6 +289,22 @@ def _get_config_file_paths(with_conf_d):
     return list_of_files
 
 
+def get_config_generation():
+    # type: () -> Tuple
+    """Identifies the current state of the configuration files and the check files
+
+    Long running processes use this to find out whether the configuration they
+    have loaded is outdated."""
+    config_files = []
+    for path in _get_config_file_paths(with_conf_d=True):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        config_files.append((path, st.st_mtime, st.st_size))
+    return tuple(config_files), sorted(_check_file_ids().items())
+
+
 def _initialize_derived_config_variables():
     global service_service_levels, host_service_levels
     service_service_levels = extra_service_conf.get("_ec_sl", [])
@@ -414,9 +432,21 @@ class PackedConfig(object):
     def __init__(self):
         super(PackedConfig, self).__init__()
         self._path = os.path.join(cmk.utils.paths.var_dir, "base", "precompiled_check_config.mk")
+        self._snapshot_path = os.path.join(cmk.utils.paths.var_dir, "base", "config_cache_snapshot")
+
+    @property
+    def path(self):
+        return self._path
 
     def save(self):
         self._write(self._pack())
+        ConfigCacheSnapshot(self._snapshot_path).save(get_config_cache(), self._generation())
+
+    def _generation(self):
+        # type: () -> Tuple[float, int]
+        """Identifies the written packed config. The snapshot is only valid for this one"""
+        stat = os.stat(self._path)
+        return stat.st_mtime, stat.st_size
 
     def _pack(self):
         helper_config = ("#!/usr/bin/env python\n"
@@ -531,7 +561,136 @@ class PackedConfig(object):
     def load(self):
         _initialize_config()
         exec (marshal.load(open(self._path)), globals())
-        _perform_post_config_loading_actions()
+
+        snapshot = ConfigCacheSnapshot(self._snapshot_path)  # type: Optional[ConfigCacheSnapshot]
+        if not snapshot.load(self._generation()):
+            snapshot = None
+
+        _perform_post_config_loading_actions(snapshot)
+
+
+class ConfigCacheSnapshot(object):
+    """Precomputed host related parts of the ConfigCache of the packed config
+
+    The snapshot is written together with the PackedConfig. The processes loading
+    the packed config (CMC helpers, precompiled host checks) would otherwise compute
+    the active hosts, the host lookups of the ruleset optimizer and the rule based
+    attributes of the hosts on their own during startup.
+
+    The file is mapped to memory. Only the small header is decoded while loading,
+    the records of the hosts are decoded when a host is accessed for the first time.
+    This way the pages of the file are shared between all processes using it.
+
+    File layout: A fixed size prefix (magic, offset and length of the header),
+    followed by the marshaled host records and the marshaled header which contains
+    the index of the host records.
+    """
+
+    _magic = "CMKSNAP1"
+    _prefix = struct.Struct("!8sQQ")
+
+    def __init__(self, path):
+        # type: (str) -> None
+        super(ConfigCacheSnapshot, self).__init__()
+        self._path = path
+        self._header = {}  # type: Dict[str, Any]
+        self._mmap = None  # type: Optional[mmap.mmap]
+        self._host_records = {}  # type: Dict[str, Dict[str, Any]]
+
+    @property
+    def path(self):
+        # type: () -> str
+        return self._path
+
+    def save(self, config_cache, generation):
+        # type: (ConfigCache, Tuple[float, int]) -> None
+        active_hosts = config_cache.all_active_hosts()
+
+        records, index, offset = [], {}, self._prefix.size
+        for hostname in sorted(active_hosts):
+            record = marshal.dumps(config_cache.get_host_config(hostname).snapshot_record())
+            index[hostname] = offset, len(record)
+            records.append(record)
+            offset += len(record)
+
+        folder_path_set, hosts_grouped_by_tags = \
+            config_cache.ruleset_matcher.ruleset_optimizer.get_host_lookup()
+
+        header = marshal.dumps({
+            "generation": generation,
+            "index": index,
+            "realhosts": config_cache.all_active_realhosts(),
+            "clusters": config_cache.all_active_clusters(),
+            "folder_path_set": folder_path_set,
+            # Contains all configured hosts, since rules may be matched with foreign hosts
+            "hosts_grouped_by_tags": hosts_grouped_by_tags,
+        })
+
+        store.save_file(
+            self._path,
+            self._prefix.pack(self._magic, offset, len(header)) + "".join(records) + header)
+
+    def load(self, generation):
+        # type: (Tuple[float, int]) -> bool
+        """Map the snapshot to memory
+
+        Returns False in case the snapshot does not exist or does not belong to the
+        packed config of the given generation."""
+        try:
+            with open(self._path) as f:
+                snapshot_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, offset, length = self._prefix.unpack_from(snapshot_mmap)
+            if magic != self._magic:
+                raise MKGeneralException("Invalid file format")
+
+            header = marshal.loads(snapshot_mmap[offset:offset + length])
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                console.verbose("Failed to load config cache snapshot: %s\n" % e)
+            return False
+        except Exception as e:
+            if cmk.utils.debug.enabled():
+                raise
+            console.verbose("Failed to load config cache snapshot: %s\n" % e)
+            return False
+
+        if header["generation"] != generation:
+            console.verbose("Config cache snapshot is outdated. Ignoring it.\n")
+            return False
+
+        self._header = header
+        self._mmap = snapshot_mmap
+        return True
+
+    def active_realhosts(self):
+        # type: () -> Set[str]
+        return set(self._header["realhosts"])
+
+    def active_clusters(self):
+        # type: () -> Set[str]
+        return set(self._header["clusters"])
+
+    def host_lookup(self):
+        # type: () -> Tuple[Set[str], Dict[Tuple[str, ...], Set[str]]]
+        return self._header["folder_path_set"], self._header["hosts_grouped_by_tags"]
+
+    def host_record(self, hostname):
+        # type: (str) -> Optional[Dict[str, Any]]
+        """Returns the precomputed attributes of the host or None for unknown hosts"""
+        try:
+            return self._host_records[hostname]
+        except KeyError:
+            pass
+
+        try:
+            offset, length = self._header["index"][hostname]
+        except KeyError:
+            return None
+
+        assert self._mmap is not None
+        record = self._host_records[hostname] = marshal.loads(self._mmap[offset:offset + length])
+        return record
 
 
 #.
@@ -1139,6 +1298,11 @@ _check_variables = {}  # type: Dict[str, List[Any]]
 # keeps the default values of all the check variables
 _check_variable_defaults = {}  # type: Dict[str, Any]
 _all_checks_loaded = False
+# The check files loaded into this process (by file name) and the files
+# which define the loaded check plugins and active checks
+_loaded_check_files = {}  # type: Dict[str, str]
+_check_plugin_files = {}  # type: Dict[str, str]
+_active_check_files = {}  # type: Dict[str, str]
 
 # workaround: set of check-groups that are to be treated as service-checks even if
 #   the item is None
@@ -1166,6 +1330,7 @@ def load_all_checks(get_check_api_context):
     load_checks(get_check_api_context, filelist)
 
     _all_checks_loaded = True
+    _update_check_manifest()
 
 
 def _initialize_data_structures():
@@ -1175,6 +1340,9 @@ def _initialize_data_structures():
 
     _check_variables.clear()
     _check_variable_defaults.clear()
+    _loaded_check_files.clear()
+    _check_plugin_files.clear()
+    _active_check_files.clear()
 
     _check_contexts.clear()
     check_info.clear()
@@ -1225,6 +1393,7 @@ def load_checks(get_check_api_context, filelist):
 
             load_precompiled_plugin(f, check_context)
             loaded_files.add(file_name)
+            _loaded_check_files[file_name] = f
 
         except MKTerminate:
             raise
@@ -1242,9 +1411,11 @@ def load_checks(get_check_api_context, filelist):
         # Now store the check context for all checks found in this file
         for check_plugin_name in new_checks:
             _check_contexts[check_plugin_name] = check_context
+            _check_plugin_files[check_plugin_name] = f
 
         for check_plugin_name in new_active_checks:
             _check_contexts[check_plugin_name] = check_context
+            _active_check_files[check_plugin_name] = f
 
         # Collect all variables that the check file did introduce compared to the
         # default check context
@@ -1306,6 +1477,38 @@ def any_check_loaded():
     return bool(_check_contexts)
 
 
+def load_checks_of_plugins(get_check_api_context, check_plugin_names, active_check_names=None):
+    # type: (Callable, Iterable[str], Optional[Iterable[str]]) -> None
+    """Load only the check files needed for the given check plugins and active checks
+
+    The files are looked up in the check manifest. Section names may be given
+    instead of check plugin names, all files using the section are loaded then.
+    Names which are not known to the manifest do not exist and are skipped.
+    Without a valid manifest all checks are loaded, which creates the manifest."""
+    manifest = _load_check_manifest()
+    if manifest is None:
+        filelist = get_plugin_paths(cmk.utils.paths.local_checks_dir, cmk.utils.paths.checks_dir)
+    else:
+        filelist = []
+        for check_plugin_name in check_plugin_names:
+            entry = manifest["checks"].get(check_plugin_name)
+            if entry:
+                filelist.append(entry["file"])
+            filelist += manifest["sections"].get(check_plugin_name, [])
+        for active_check_name in active_check_names or []:
+            if active_check_name in manifest["active_checks"]:
+                filelist.append(manifest["active_checks"][active_check_name])
+
+    filelist = [f for f in filelist if os.path.basename(f) not in _loaded_check_files]
+    if filelist:
+        load_checks(get_check_api_context, sorted(set(filelist)))
+
+    if manifest is None:
+        global _all_checks_loaded
+        _all_checks_loaded = True
+        _update_check_manifest()
+
+
 # Constructs a new check context dictionary. It contains the whole check API.
 def new_check_context(get_check_api_context):
     # Add the data structures where the checks register with Check_MK
@@ -1600,8 +1803,11 @@ def convert_check_info():
 
             # Include files are related to the check file (= the section_name),
             # not to the (sub-)check. So we keep them in check_includes.
-            check_includes.setdefault(section_name, [])
-            check_includes[section_name] += info.get("includes", [])
+            # The checks may be converted several times when loading them in steps
+            section_includes = check_includes.setdefault(section_name, [])
+            for include_file_name in info.get("includes", []):
+                if include_file_name not in section_includes:
+                    section_includes.append(include_file_name)
 
     # Make sure that setting for node_info of check and subcheck matches
     for check_plugin_name, info in check_info.iteritems():
@@ -1679,6 +1885,130 @@ def initialize_check_type_caches():
             tcp_cache.add(section_name)
 
 
+#.
+#   .--Manifest------------------------------------------------------------.
+#   |                __  __             _  __           _                  |
+#   |               |  \/  | __ _ _ __ (_)/ _| ___  ___| |_                |
+#   |               | |\/| |/ _` | '_ \| | |_ / _ \/ __| __|               |
+#   |               | |  | | (_| | | | | |  _|  __/\__ \ |_                |
+#   |               |_|  |_|\__,_|_| |_|_|_|  \___||___/\__|               |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | The manifest records the check plugins, active checks and sections   |
+#   | defined by the check files, together with a few attributes of the    |
+#   | check plugins. It is created when all checks are loaded and makes it |
+#   | possible to load only the check files which are really needed.       |
+#   '----------------------------------------------------------------------'
+
+_CHECK_MANIFEST_VERSION = 2
+
+# Per process cache of the parsed manifest file: (file id, manifest)
+_g_check_manifest = None  # type: Optional[Tuple[Tuple[int, float, int], Dict[str, Any]]]
+
+
+def get_check_manifest(get_check_api_context):
+    # type: (Callable) -> Dict[str, Any]
+    """Returns the manifest of the current check files
+
+    When there is no valid manifest all checks are loaded to create it."""
+    manifest = _load_check_manifest()
+    if manifest is None:
+        load_all_checks(get_check_api_context)
+        manifest = _create_check_manifest()
+    return manifest
+
+
+def _load_check_manifest():
+    # type: () -> Optional[Dict[str, Any]]
+    """Returns the manifest in case it is valid for the current check files"""
+    global _g_check_manifest
+    path = cmk.utils.paths.check_manifest_file
+    try:
+        st = os.stat(path)
+        file_id = (st.st_ino, st.st_mtime, st.st_size)
+        if _g_check_manifest is None or _g_check_manifest[0] != file_id:
+            _g_check_manifest = file_id, marshal.loads(open(path, "rb").read())
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+
+    manifest = _g_check_manifest[1]
+    if not isinstance(manifest, dict) or manifest.get("version") != _CHECK_MANIFEST_VERSION:
+        return None
+
+    if manifest["files"] != _check_file_ids():
+        return None  # Check files were changed, added or removed
+
+    return manifest
+
+
+def _update_check_manifest():
+    # type: () -> None
+    if _load_check_manifest() is not None:
+        return
+
+    try:
+        store.makedirs(os.path.dirname(cmk.utils.paths.check_manifest_file))
+        store.save_file(cmk.utils.paths.check_manifest_file,
+                        marshal.dumps(_create_check_manifest()))
+    except (IOError, OSError) as e:
+        console.verbose("Cannot save the check manifest: %s\n" % e)
+        if cmk.utils.debug.enabled():
+            raise
+
+
+def _create_check_manifest():
+    # type: () -> Dict[str, Any]
+    """Create the manifest from the checks loaded into this process"""
+    checks = {}
+    sections = {}  # type: Dict[str, List[str]]
+    for check_plugin_name, info in check_info.iteritems():
+        if check_plugin_name not in _check_plugin_files:
+            continue  # Not registered by a check file
+
+        check_file = _check_plugin_files[check_plugin_name]
+        section_files = sections.setdefault(
+            cmk_base.check_utils.section_name_of(check_plugin_name), [])
+        if check_file not in section_files:
+            section_files.append(check_file)
+            section_files.sort()
+
+        checks[check_plugin_name] = {
+            "file": check_file,
+            "service_description": info["service_description"],
+            "group": info["group"],
+            "snmp": cmk_base.check_utils.is_snmp_check(check_plugin_name),
+            "handle_real_time_checks": info["handle_real_time_checks"],
+        }
+
+    return {
+        "version": _CHECK_MANIFEST_VERSION,
+        "files": _check_file_ids(),
+        "checks": checks,
+        "active_checks": dict(_active_check_files),
+        "sections": sections,
+    }
+
+
+def _check_file_ids():
+    # type: () -> Dict[str, Tuple[float, int]]
+    """Identifies the current state of all check and include files"""
+    file_ids = {}
+    for directory in [cmk.utils.paths.local_checks_dir, cmk.utils.paths.checks_dir]:
+        try:
+            file_names = os.listdir(directory)
+        except OSError:
+            continue
+
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            file_ids[path] = (st.st_mtime, st.st_size)
+    return file_ids
+
+
 #.
 #   .--Helpers-------------------------------------------------------------.
 #   |                  _   _      _                                        |
@@ -1973,6 +2303,7 @@ class HostConfig(object):
         self.hostname = hostname
 
         self._config_cache = config_cache
+        self._snapshot = config_cache.host_snapshot(hostname)
 
         self.alias = self._get_alias()
         self.parents = self._get_parents()
@@ -1989,9 +2320,9 @@ class HostConfig(object):
         self.label_sources = self._get_host_label_sources()
 
         # Basic types
-        self.is_tcp_host = self._config_cache.in_binary_hostlist(hostname, tcp_hosts)
-        self.is_snmp_host = self._config_cache.in_binary_hostlist(hostname, snmp_hosts)
-        self.is_usewalk_host = self._config_cache.in_binary_hostlist(hostname, usewalk_hosts)
+        self.is_tcp_host = self._in_binary_hostlist("is_tcp_host", tcp_hosts)
+        self.is_snmp_host = self._in_binary_hostlist("is_snmp_host", snmp_hosts)
+        self.is_usewalk_host = self._in_binary_hostlist("is_usewalk_host", usewalk_hosts)
 
         if self.tag_groups["piggyback"] == "piggyback":
             self.is_piggyback_host = True
@@ -2037,7 +2368,29 @@ class HostConfig(object):
         from cmk_base.data_sources.abstract import has_persisted_agent_sections
         return has_persisted_agent_sections("piggyback", self.hostname)
 
+    def snapshot_record(self):
+        # type: () -> Dict[str, Any]
+        """Returns the rule based attributes of the host stored in the ConfigCacheSnapshot"""
+        return {
+            "alias": self.alias,
+            "parents": self.parents,
+            "label_rules": self._get_host_label_rules(),
+            "is_tcp_host": self.is_tcp_host,
+            "is_snmp_host": self.is_snmp_host,
+            "is_usewalk_host": self.is_usewalk_host,
+            "primary_address_family": self._primary_ip_address_family_of(),
+        }
+
+    def _in_binary_hostlist(self, snapshot_key, ruleset):
+        # type: (str, List) -> bool
+        if self._snapshot is not None:
+            return self._snapshot[snapshot_key]
+        return self._config_cache.in_binary_hostlist(self.hostname, ruleset)
+
     def _primary_ip_address_family_of(self):
+        if self._snapshot is not None:
+            return self._snapshot["primary_address_family"]
+
         rules = self._config_cache.host_extra_conf(self.hostname, primary_address_family)
         if rules:
             return rules[0]
@@ -2045,6 +2398,9 @@ class HostConfig(object):
 
     def _get_alias(self):
         # type: () -> Text
+        if self._snapshot is not None:
+            return self._snapshot["alias"]
+
         aliases = self._config_cache.host_extra_conf(self.hostname, extra_host_conf.get(
             "alias", []))
         if not aliases:
@@ -2058,6 +2414,9 @@ class HostConfig(object):
         """Returns the parents of a host configured via ruleset "parents"
 
         Use only those parents which are defined and active in all_hosts"""
+        if self._snapshot is not None:
+            return self._snapshot["parents"]
+
         used_parents = []
 
         # Respect the ancient parents ruleset. This can not be configured via WATO and should be removed one day
@@ -2079,7 +2438,7 @@ class HostConfig(object):
         """
         labels = {}
         labels.update(self._discovered_labels_of_host())
-        labels.update(self._config_cache.host_extra_conf_merged(self.hostname, host_label_rules))
+        labels.update(self._get_host_label_rules())
         labels.update(host_labels.get(self.hostname, {}))
         return labels
 
@@ -2089,10 +2448,16 @@ class HostConfig(object):
         labels = {}
         labels.update({k: "discovered" for k in self._discovered_labels_of_host().keys()})
         labels.update({k : "ruleset" \
-            for k in self._config_cache.host_extra_conf_merged(self.hostname, host_label_rules)})
+            for k in self._get_host_label_rules()})
         labels.update({k: "explicit" for k in host_labels.get(self.hostname, {}).keys()})
         return labels
 
+    def _get_host_label_rules(self):
+        # type: () -> Dict[str, str]
+        if self._snapshot is not None:
+            return self._snapshot["label_rules"]
+        return self._config_cache.host_extra_conf_merged(self.hostname, host_label_rules)
+
     def _discovered_labels_of_host(self):
         # type: () -> Dict
         return DiscoveredHostLabelsStore(self.hostname).load()
@@ -2116,6 +2481,7 @@ class HostConfig(object):
             character_encoding=self._snmp_character_encoding(),
             is_usewalk_host=self.is_usewalk_host,
             is_inline_snmp_host=self._is_inline_snmp_host(),
+            is_bulk_snmp_host=self._is_bulk_snmp_host(),
         )
 
     def _snmp_credentials(self):
@@ -2182,6 +2548,11 @@ class HostConfig(object):
         return has_inline_snmp and use_inline_snmp \
                and not self._config_cache.in_binary_hostlist(self.hostname, non_inline_snmp_hosts)
 
+    def _is_bulk_snmp_host(self):
+        # The bulk SNMP backend only supports SNMP v1 and v2c
+        return not isinstance(self._snmp_credentials(), tuple) \
+               and self._config_cache.in_binary_hostlist(self.hostname, bulk_snmp_hosts)
+
     def _is_cluster(self):
         """Checks whether or not the given host is a cluster host
         all_configured_clusters() needs to be used, because this function affects
@@ -2611,19 +2982,31 @@ class ConfigCache(object):
         super(ConfigCache, self).__init__()
         self._initialize_caches()
 
-    def initialize(self):
+    def initialize(self, snapshot=None):
+        # type: (Optional[ConfigCacheSnapshot]) -> None
+        """Compute the host related caches of the loaded configuration
+
+        In case a snapshot of the loaded (packed) configuration is given, the
+        computations are replaced by lookups in the snapshot."""
         self._initialize_caches()
-        self._collect_hosttags()
+        self._snapshot = snapshot
         self._setup_clusters_nodes_cache()
 
         self._all_configured_clusters = self._get_all_configured_clusters()
         self._all_configured_realhosts = self._get_all_configured_realhosts()
         self._all_configured_hosts = self._get_all_configured_hosts()
 
-        self.ruleset_matcher = tuple_rulesets.RulesetMatcher(self)
+        if snapshot is None:
+            self._collect_hosttags()
+            self.ruleset_matcher = tuple_rulesets.RulesetMatcher(self)
+            self._all_active_clusters = self._get_all_active_clusters()
+            self._all_active_realhosts = self._get_all_active_realhosts()
+        else:
+            # The host tag lists are computed on demand
+            self.ruleset_matcher = tuple_rulesets.RulesetMatcher(self, snapshot.host_lookup())
+            self._all_active_clusters = snapshot.active_clusters()
+            self._all_active_realhosts = snapshot.active_realhosts()
 
-        self._all_active_clusters = self._get_all_active_clusters()
-        self._all_active_realhosts = self._get_all_active_realhosts()
         self._all_active_hosts = self._get_all_active_hosts()
         self._all_processed_hosts = self._all_active_hosts
 
@@ -2671,6 +3054,9 @@ class ConfigCache(object):
         # Keep HostConfig instances created with the current configuration cache
         self._host_configs = {}
 
+        # Precomputed host attributes of the packed config (see ConfigCacheSnapshot)
+        self._snapshot = None  # type: Optional[ConfigCacheSnapshot]
+
     def get_tag_to_group_map(self):
         tags = cmk.utils.tags.get_effective_tag_config(tag_config)
         return tuple_rulesets.get_tag_to_group_map(tags)
@@ -2689,6 +3075,13 @@ class ConfigCache(object):
         host_config = self._host_configs[hostname] = config_class(self, hostname)
         return host_config
 
+    def host_snapshot(self, hostname):
+        # type: (str) -> Optional[Dict[str, Any]]
+        """Returns the precomputed attributes of a host in case a snapshot is used"""
+        if self._snapshot is None:
+            return None
+        return self._snapshot.host_record(hostname)
+
     def _get_host_paths(self, config_host_paths):
         """Reference hostname -> dirname including /"""
         host_dirs = {}
@@ -2727,7 +3120,12 @@ class ConfigCache(object):
         a host has no tags configured or is not known, it returns an
         empty list."""
         if hostname in host_tags:
-            return self._hosttags[hostname]
+            try:
+                return self._hosttags[hostname]
+            except KeyError:
+                tag_list = self._hosttags[hostname] = self._tag_groups_to_tag_list(
+                    self._host_paths.get(hostname, "/"), host_tags[hostname])
+                return tag_list
 
         # Handle not existing hosts (No need to performance optimize this)
         return self._tag_groups_to_tag_list("/", self.tags_of_host(hostname))
@@ -25,11 +25,16 @@
 # Boston, MA 02110-1301 USA.
 
 import abc
+import errno
+import hashlib
 import numbers
 import os
 import sys
 from typing import Text, Optional, Any, List, Dict  # pylint: disable=unused-import
 
+import six
+
+import cmk
 import cmk.utils.paths
 import cmk.utils.tty as tty
 import cmk.utils.password_store
@@ -38,6 +43,7 @@ from cmk.utils.exceptions import MKGeneralException
 import cmk_base.console as console
 import cmk_base.config as config
 import cmk_base.ip_lookup as ip_lookup
+import cmk_base.autochecks as autochecks
 
 
 class MonitoringCore(object):
@@ -54,6 +60,7 @@ class MonitoringCore(object):
 
 _ignore_ip_lookup_failures = False
 _failed_ip_lookups = []
+_full_rebuild = False
 
 #.
 #   .--Warnings------------------------------------------------------------.
@@ -232,6 +239,8 @@ def create_core_config(core):
 
     _verify_non_duplicate_hosts()
     _verify_non_deprecated_checkgroups()
+    ip_lookup.prefetch_ip_addresses(config.get_config_cache().all_active_hosts())
+    autochecks.preload_autochecks(config.get_config_cache().all_active_hosts())
     core.create_config()
     cmk.utils.password_store.save(config.stored_passwords)
 
@@ -274,6 +283,202 @@ def do_update(core, with_precompile):
         sys.exit(1)
 
 
+def enforce_full_rebuild():
+    """Make the next configuration update recreate the configuration of all hosts"""
+    global _full_rebuild
+    _full_rebuild = True
+
+
+def full_rebuild_enforced():
+    return _full_rebuild
+
+
+#.
+#   .--Fingerprints--------------------------------------------------------.
+#   |      _____ _                              _       _       _          |
+#   |     |  ___(_)_ __   __ _  ___ _ __ _ __  _ __(_)_ __ | |_ ___       |
+#   |     | |_  | | '_ \ / _` |/ _ \ '__| '_ \| '__| | '_ \| __/ __|      |
+#   |     |  _| | | | | | (_| |  __/ |  | |_) | |  | | | | | |_\__ \      |
+#   |     |_|   |_|_| |_|\__, |\___|_|  | .__/|_|  |_|_| |_|\__|___/      |
+#   |                    |___/          |_|                                |
+#   +----------------------------------------------------------------------+
+#   | The fingerprint of a host covers everything its part of the core     |
+#   | configuration is created from. Hosts with an unchanged fingerprint   |
+#   | can reuse their previously created configuration.                    |
+#   '----------------------------------------------------------------------'
+
+# Variables holding host specific settings. They are keyed by the host name.
+_HOST_DICT_VARIABLES = [
+    "host_attributes",
+    "host_labels",
+    "host_paths",
+    "host_tags",
+    "ipaddresses",
+    "ipv6addresses",
+    "explicit_snmp_communities",
+    "management_ipmi_credentials",
+    "management_protocol",
+    "management_snmp_credentials",
+]
+
+
+class HostConfigFingerprints(object):
+    """Computes the fingerprints of the configuration of the hosts
+
+    The configuration is split into a global and a host specific part. The host
+    specific part consists of the host definitions, the rules that explicitly
+    name the host, the discovered services and labels and the cached IP addresses
+    of the host. A rule is host specific when its only host condition is a plain
+    list of configured host names. Such a rule is recorded together with the
+    number of generic rules in front of it, which keeps the rule order intact.
+
+    Everything else (e.g. the check plugins, the version and all rules with tag,
+    folder or regex conditions) is global and changes the fingerprints of all
+    hosts. Clusters and their nodes include each other's host specific parts.
+    """
+
+    def __init__(self, config_cache):
+        super(HostConfigFingerprints, self).__init__()
+        self._config_cache = config_cache
+        self._known_hosts = config_cache.all_configured_hosts()
+        self._host_specific = {}  # type: Dict[str, List[Any]]
+        self._global_fingerprint = self._compute_global_fingerprint()
+
+    def get(self, hostname):
+        # type: (str) -> str
+        host_config = self._config_cache.get_host_config(hostname)
+        related_hosts = [hostname] + sorted(host_config.nodes or []) + sorted(
+            self._config_cache.clusters_of(hostname))
+
+        fingerprint = hashlib.md5(self._global_fingerprint)
+        for name in related_hosts:
+            fingerprint.update(repr((name, self._host_specific.get(name))))
+            fingerprint.update(repr(ip_lookup.cached_ip_addresses(name)))
+            for path in [
+                    os.path.join(cmk.utils.paths.autochecks_dir, name + ".mk"),
+                    str(cmk.utils.paths.discovered_host_labels_dir / (name + ".mk")),
+            ]:
+                fingerprint.update(_file_fingerprint(path))
+
+            fingerprint.update(
+                repr(_directory_stats(str(cmk.utils.paths.discovered_service_labels_dir / name))))
+
+        return fingerprint.hexdigest()
+
+    def _compute_global_fingerprint(self):
+        fingerprint = hashlib.md5(cmk.__version__)
+
+        global_variables = vars(config)
+        for varname in sorted(config.get_variable_names()):
+            value = global_variables[varname]
+            if varname in _HOST_DICT_VARIABLES:
+                for hostname, host_value in value.iteritems():
+                    self._add_host_specific(hostname, (varname, host_value))
+            elif varname == "all_hosts":
+                for entry in value:
+                    self._add_host_specific(entry.split("|", 1)[0], (varname, entry))
+            elif varname == "clusters":
+                for entry, nodes in value.iteritems():
+                    self._add_host_specific(entry.split("|", 1)[0], (varname, entry, nodes))
+            else:
+                fingerprint.update(repr((varname, self._split_ruleset(varname, value))))
+
+        for varname, value in sorted(config.get_check_variables().iteritems()):
+            fingerprint.update(repr((varname, self._split_ruleset(varname, value))))
+
+        for path in sorted(
+                config.get_plugin_paths(cmk.utils.paths.local_checks_dir,
+                                        cmk.utils.paths.checks_dir)):
+            fingerprint.update(repr((path, _file_stats(path))))
+
+        return fingerprint.hexdigest()
+
+    def _split_ruleset(self, varname, value):
+        """Moves the host specific rules of a ruleset to the hosts and returns the rest
+
+        Dictionaries of rulesets (e.g. extra_host_conf) are split per key."""
+        if _is_ruleset(value):
+            generic_rules = []
+            for rule in value:
+                hostnames = _explicit_host_names(rule)
+                if hostnames is None or not self._known_hosts.issuperset(hostnames):
+                    generic_rules.append(rule)
+                    continue
+
+                for hostname in hostnames:
+                    self._add_host_specific(hostname, (varname, len(generic_rules), rule))
+            return generic_rules
+
+        if isinstance(value, dict) and value and all(_is_ruleset(v) for v in value.itervalues()):
+            return sorted((key, self._split_ruleset((varname, key), rules))
+                          for key, rules in value.iteritems())
+
+        return value
+
+    def _add_host_specific(self, hostname, entry):
+        self._host_specific.setdefault(hostname, []).append(entry)
+
+
+def _is_ruleset(value):
+    return isinstance(value, list) and bool(value) and all(
+        isinstance(rule, tuple) or
+        (isinstance(rule, dict) and "condition" in rule and "value" in rule) for rule in value)
+
+
+def _explicit_host_names(rule):
+    """Returns the host names of a rule that only applies to the explicitly listed hosts
+
+    Tuple rules are only recognized in the unambiguous form (value, [hostname, ...])
+    which is e.g. used for the host specific settings in the hosts.mk files."""
+    if isinstance(rule, tuple):
+        if len(rule) != 2 or isinstance(rule[0], list):
+            return None
+        hostnames = rule[1]
+    else:
+        condition = rule["condition"]
+        if any(key.startswith("host_") and key != "host_name" for key in condition):
+            return None
+        hostnames = condition.get("host_name")
+
+    if not isinstance(hostnames, list) or not hostnames:
+        return None
+
+    for hostname in hostnames:
+        if not isinstance(hostname, six.string_types) or hostname[:1] in ["!", "~", "@"]:
+            return None  # negations, regexes and macros like ALL_HOSTS
+
+    return hostnames
+
+
+def _file_fingerprint(path):
+    try:
+        return hashlib.md5(open(path).read()).hexdigest()
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return ""
+        raise
+
+
+def _file_stats(path):
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    return stat.st_mtime, stat.st_size
+
+
+def _directory_stats(path):
+    try:
+        names = sorted(os.listdir(path))
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+    return [(name, _file_stats(os.path.join(path, name))) for name in names]
+
+
 #.
 #   .--Active Checks-------------------------------------------------------.
 #   |       _        _   _              ____ _               _             |
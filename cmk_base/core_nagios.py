@@ -25,15 +25,21 @@
 # Boston, MA 02110-1301 USA.
 """Code for support of Nagios (and compatible) cores"""
 
+import cPickle
+import cStringIO
+import multiprocessing
 import os
+import re
 import sys
 import py_compile
 import tempfile
 import errno
-from typing import Dict  # pylint: disable=unused-import
+from typing import Any, Dict, List, NamedTuple  # pylint: disable=unused-import
 
+import cmk.utils.debug
 import cmk.utils.paths
 import cmk.utils.tty as tty
+import cmk.utils.store as store
 from cmk.utils.exceptions import MKGeneralException
 
 import cmk_base.utils
@@ -65,7 +71,7 @@ class NagiosCore(core_config.MonitoringCore):
                     delete=False) as tmp:
                 tmp_path = tmp.name
                 os.chmod(tmp.name, 0660)
-                create_config(tmp, hostnames=None)
+                create_config(tmp, hostnames=None, incremental=config.incremental_core_config)
                 os.rename(tmp.name, cmk.utils.paths.nagios_objects_file)
 
         except Exception as e:
@@ -81,7 +87,7 @@ class NagiosCore(core_config.MonitoringCore):
 
     def precompile(self):
         console.output("Precompiling host checks...")
-        precompile_hostchecks()
+        precompile_hostchecks(incremental=config.incremental_core_config)
         console.output(tty.ok + "\n")
 
 
@@ -112,7 +118,17 @@ class NagiosConfig(object):
         self.hostcheck_commands_to_define = []
 
 
-def create_config(outfile, hostnames):
+# The configuration of a single host and its contributions to the global objects
+_HostFragment = NamedTuple("_HostFragment", [
+    ("hostname", str),
+    ("output", str),
+    ("cfg", NagiosConfig),
+    ("warnings", List[Any]),
+    ("failed_ip_lookups", List[str]),
+])
+
+
+def create_config(outfile, hostnames, incremental=False):
     if config.host_notification_periods != []:
         core_config.warning(
             "host_notification_periods is not longer supported. Please use extra_host_conf['notification_period'] instead."
@@ -141,8 +157,14 @@ def create_config(outfile, hostnames):
 
     _output_conf_header(cfg)
 
-    for hostname in hostnames:
-        _create_nagios_config_host(cfg, config_cache, hostname)
+    # Addresses resolved without the DNS cache are not covered by the fingerprints
+    if incremental and config.use_dns_cache:
+        fragments = _get_host_fragments(config_cache, hostnames)
+    else:
+        fragments = _create_host_fragments(config_cache, hostnames)
+
+    for fragment in fragments:
+        _add_host_fragment(cfg, fragment)
 
     _create_nagios_config_contacts(cfg, hostnames)
     _create_nagios_config_hostgroups(cfg)
@@ -661,7 +683,7 @@ def _create_nagios_config_commands(cfg):
         outfile.write("\n# ------------------------------------------------------------\n")
         outfile.write("# Dummy check commands and active check commands\n")
         outfile.write("# ------------------------------------------------------------\n\n")
-        for checkname in cfg.checknames_to_define:
+        for checkname in sorted(cfg.checknames_to_define):
             outfile.write(
                 _format_nagios_object(
                     "command", {
@@ -670,7 +692,7 @@ def _create_nagios_config_commands(cfg):
                     }).encode("utf-8"))
 
     # active_checks
-    for acttype in cfg.active_checks_to_define:
+    for acttype in sorted(cfg.active_checks_to_define):
         act_info = config.active_check_info[acttype]
         outfile.write(
             _format_nagios_object(
@@ -680,7 +702,7 @@ def _create_nagios_config_commands(cfg):
                 }).encode("utf-8"))
 
     # custom_checks
-    for command_name in cfg.custom_commands_to_define:
+    for command_name in sorted(cfg.custom_commands_to_define):
         outfile.write(
             _format_nagios_object("command", {
                 "command_name": command_name,
@@ -875,7 +897,7 @@ def _find_check_plugins(checktype):
     return paths
 
 
-def precompile_hostchecks():
+def precompile_hostchecks(incremental=False):
     console.verbose("Creating precompiled host check config...\n")
     config.PackedConfig().save()
 
@@ -885,14 +907,35 @@ def precompile_hostchecks():
     config_cache = config.get_config_cache()
 
     console.verbose("Precompiling host checks...\n")
-    for host in config_cache.all_active_hosts():
-        try:
-            _precompile_hostcheck(config_cache, host)
-        except Exception as e:
-            if cmk.utils.debug.enabled():
-                raise
-            console.error("Error precompiling checks for host %s: %s\n" % (host, e))
-            sys.exit(5)
+    hostnames = config_cache.all_active_hosts()
+
+    host_fingerprints = None
+    if incremental:
+        host_fingerprints = _get_host_fingerprints(config_cache, hostnames)
+        _remove_obsolete_fragments(_precompiled_fingerprints_dir(), hostnames)
+        hostnames = _outdated_hostchecks(host_fingerprints)
+        console.verbose("Precompiling %d outdated host checks...\n" % len(hostnames))
+
+    num_processes = _num_config_processes(len(hostnames))
+    if num_processes > 1:
+        for error in _map_in_processes(_precompile_hostchecks_chunk,
+                                       _shard_hostnames(hostnames, num_processes), num_processes):
+            if error:
+                console.error("Error precompiling checks for host %s: %s\n" % error)
+                sys.exit(5)
+    else:
+        for host in hostnames:
+            try:
+                _precompile_hostcheck(config_cache, host)
+            except Exception as e:
+                if cmk.utils.debug.enabled():
+                    raise
+                console.error("Error precompiling checks for host %s: %s\n" % (host, e))
+                sys.exit(5)
+
+    if host_fingerprints is not None:
+        for hostname in hostnames:
+            _save_hostcheck_fingerprint(hostname, host_fingerprints[hostname])
 
 
 # read python file and strip comments
@@ -946,6 +989,9 @@ def _precompile_hostcheck(config_cache, hostname):
     # to python module names like "random"
     output.write("sys.path.pop(0)\n")
 
+    if config.check_helper_daemon:
+        output.write(_check_helper_client_code(hostname))
+
     output.write("import cmk.utils.log\n")
     output.write("import cmk.utils.debug\n")
     output.write("from cmk.utils.exceptions import MKTerminate\n")
@@ -1078,6 +1124,47 @@ if '-d' in sys.argv:
     console.verbose(" ==> %s.\n", compiled_filename, stream=sys.stderr)
 
 
+def _check_helper_client_code(hostname):
+    """Hand over the check to the check helper daemon (see cmk_base.check_helper)
+
+    This is done before importing any Check_MK module to save the startup
+    costs. When called with arguments (e.g. -v or -d) or in case the daemon
+    is not running the host is checked by this process as usual."""
+    return """
+if len(sys.argv) == 1:
+    import socket
+    _helper = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        _helper.connect(%(socket_path)r)
+    except socket.error:
+        _helper.close()
+    else:
+        try:
+            _helper.settimeout(%(timeout)d)
+            _helper.sendall(%(hostname)r)
+            _helper.shutdown(socket.SHUT_WR)
+            _response = []
+            while True:
+                _chunk = _helper.recv(65536)
+                if not _chunk:
+                    break
+                _response.append(_chunk)
+            _status, _output = "".join(_response).split("\\n", 1)
+        except (socket.error, ValueError), e:
+            sys.stdout.write("UNKNOWN - Failed to communicate with check helper: %%s\\n" %% e)
+            sys.exit(3)
+        finally:
+            _helper.close()
+        sys.stdout.write(_output)
+        sys.exit(int(_status))
+
+""" % {
+        "socket_path": cmk.utils.paths.check_helper_socket,
+        "timeout": config.check_helper_daemon_timeout + 10,
+        "hostname": hostname,
+    }
+
+
 def _get_needed_check_plugin_names(host_config):
     import cmk_base.check_table as check_table
     needed_check_plugin_names = set([])
@@ -1137,3 +1224,284 @@ def _get_needed_check_file_names(needed_check_plugin_names):
                 filenames.append(path)
 
     return filenames
+
+
+#.
+#   .--Parallel------------------------------------------------------------.
+#   |               ____                 _ _      _                        |
+#   |              |  _ \ __ _ _ __ __ _| | | ___| |                       |
+#   |              | |_) / _` | '__/ _` | | |/ _ \ |                       |
+#   |              |  __/ (_| | | | (_| | | |  __/ |                       |
+#   |              |_|   \__,_|_|  \__,_|_|_|\___|_|                       |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | The host specific parts of the configuration are created by multiple |
+#   | forked worker processes. Each of them processes chunks of the host   |
+#   | list. The results are put together in the order of the host list to |
+#   | produce exactly the same output as the serial processing.            |
+#   '----------------------------------------------------------------------'
+
+# Don't start processes which would only care about a few hosts
+_MIN_HOSTS_PER_PROCESS = 50
+
+_HOST_CHECK_COMMAND_REGEX = re.compile(
+    r"^(%s)check-mk-host-custom-(\d+)$" % re.escape("  %-29s " % "check_command"), re.MULTILINE)
+
+
+def _num_config_processes(num_hosts):
+    """Returns the number of processes to be used for processing the hosts"""
+    if cmk.utils.debug.enabled():
+        return 1  # Only the serial processing raises exceptions with the full traceback
+
+    num_processes = config.core_config_processes or multiprocessing.cpu_count()
+    return max(1, min(num_processes, num_hosts / _MIN_HOSTS_PER_PROCESS))
+
+
+def _shard_hostnames(hostnames, num_processes):
+    """Split the host names into chunks, keeping their order
+
+    Create more chunks than processes to balance the load between the processes."""
+    hostnames = list(hostnames)
+    chunk_size = max(1, -(-len(hostnames) // (num_processes * 4)))
+    return [hostnames[i:i + chunk_size] for i in xrange(0, len(hostnames), chunk_size)]
+
+
+def _map_in_processes(func, chunks, num_processes):
+    """Apply func to all chunks in worker processes and yield the results in order
+
+    The workers are forked from the current process and inherit the loaded
+    configuration. func and its results need to be pickleable."""
+    pool = multiprocessing.Pool(num_processes)
+    try:
+        for result in pool.imap(func, chunks):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _create_host_fragments(config_cache, hostnames):
+    """Yields the configuration fragments of the given hosts in the order of the host list"""
+    num_processes = _num_config_processes(len(hostnames))
+    if num_processes <= 1:
+        for hostname in hostnames:
+            yield _create_host_fragment(config_cache, hostname)
+        return
+
+    for fragments in _map_in_processes(_create_host_fragments_chunk,
+                                       _shard_hostnames(hostnames, num_processes), num_processes):
+        for fragment in fragments:
+            yield fragment
+
+
+def _create_host_fragments_chunk(hostnames):
+    """Executed in the worker processes. Returns the configuration fragments of the given hosts"""
+    config_cache = config.get_config_cache()
+    return [_create_host_fragment(config_cache, hostname) for hostname in hostnames]
+
+
+def _create_host_fragment(config_cache, hostname):
+    """Returns the configuration of the host together with the collected objects to be
+    defined, the configuration warnings and the failed IP address lookups"""
+    warnings = core_config.g_configuration_warnings
+    failed_ip_lookups = core_config.failed_ip_lookups()
+    num_warnings, num_failed_ip_lookups = len(warnings), len(failed_ip_lookups)
+
+    cfg = NagiosConfig(cStringIO.StringIO(), [hostname])
+    _create_nagios_config_host(cfg, config_cache, hostname)
+    output = cfg.outfile.getvalue()
+    cfg.outfile = None
+
+    # The messages are added again once the fragment is added to the configuration
+    host_warnings = warnings[num_warnings:]
+    del warnings[num_warnings:]
+    host_failed_ip_lookups = failed_ip_lookups[num_failed_ip_lookups:]
+    del failed_ip_lookups[num_failed_ip_lookups:]
+
+    return _HostFragment(hostname, output, cfg, host_warnings, host_failed_ip_lookups)
+
+
+def _add_host_fragment(cfg, fragment):
+    # The custom host check commands are numbered per fragment. Make the numbers
+    # continue the ones of the previous fragments.
+    output = fragment.output
+    offset = len(cfg.hostcheck_commands_to_define)
+    if offset and fragment.cfg.hostcheck_commands_to_define:
+        output = _HOST_CHECK_COMMAND_REGEX.sub(
+            lambda m: "%scheck-mk-host-custom-%d" % (m.group(1), int(m.group(2)) + offset), output)
+
+    for nr, (_command_name, command_line) in enumerate(fragment.cfg.hostcheck_commands_to_define,
+                                                       offset + 1):
+        cfg.hostcheck_commands_to_define.append(("check-mk-host-custom-%d" % nr, command_line))
+
+    cfg.outfile.write(output)
+    cfg.hostgroups_to_define.update(fragment.cfg.hostgroups_to_define)
+    cfg.servicegroups_to_define.update(fragment.cfg.servicegroups_to_define)
+    cfg.contactgroups_to_define.update(fragment.cfg.contactgroups_to_define)
+    cfg.checknames_to_define.update(fragment.cfg.checknames_to_define)
+    cfg.active_checks_to_define.update(fragment.cfg.active_checks_to_define)
+    cfg.custom_commands_to_define.update(fragment.cfg.custom_commands_to_define)
+
+    core_config.g_configuration_warnings.extend(fragment.warnings)
+    core_config.failed_ip_lookups().extend(fragment.failed_ip_lookups)
+
+
+def _precompile_hostchecks_chunk(hostnames):
+    """Executed in the worker processes. Returns the host name and error message
+    of the first host that failed to be precompiled or None"""
+    config_cache = config.get_config_cache()
+    for hostname in hostnames:
+        try:
+            _precompile_hostcheck(config_cache, hostname)
+        except Exception as e:
+            return hostname, "%s" % e
+    return None
+
+
+#.
+#   .--Incremental---------------------------------------------------------.
+#   |       ___                                          _        _        |
+#   |      |_ _|_ __   ___ _ __ ___ _ __ ___   ___ _ __ | |_ __ _| |       |
+#   |       | || '_ \ / __| '__/ _ \ '_ ` _ \ / _ \ '_ \| __/ _` | |       |
+#   |       | || | | | (__| | |  __/ | | | | |  __/ | | | || (_| | |       |
+#   |      |___|_| |_|\___|_|  \___|_| |_| |_|\___|_| |_|\__\__,_|_|       |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | The configuration fragment of each host is saved together with the  |
+#   | fingerprint of the host configuration. Hosts with an unchanged       |
+#   | fingerprint reuse their fragment and precompiled host check. Only    |
+#   | the changed hosts are processed again.                               |
+#   '----------------------------------------------------------------------'
+
+
+def _get_host_fragments(config_cache, hostnames):
+    """Yields the configuration fragments of the given hosts in the order of the host list
+
+    Outdated fragments are created and saved, all others are loaded from the disk."""
+    host_fingerprints = _get_host_fingerprints(config_cache, hostnames)
+    _remove_obsolete_fragments(_host_fragments_dir(), hostnames)
+
+    full_rebuild = core_config.full_rebuild_enforced()
+    outdated = [
+        hostname for hostname in hostnames
+        if full_rebuild or _load_fragment_fingerprint(hostname) != host_fingerprints[hostname]
+    ]
+    console.verbose("Creating configuration of %d outdated hosts...\n" % len(outdated))
+
+    unsaved = {}
+    for fragment in _create_host_fragments(config_cache, outdated):
+        if fragment.failed_ip_lookups:
+            # Don't keep the fallback address. The next update retries the lookup.
+            _remove_host_fragment(fragment.hostname)
+            unsaved[fragment.hostname] = fragment
+        else:
+            _save_host_fragment(host_fingerprints[fragment.hostname], fragment)
+
+    for hostname in hostnames:
+        fragment = unsaved.get(hostname) or _load_host_fragment(hostname,
+                                                                host_fingerprints[hostname])
+        if fragment is None:
+            fragment = _create_host_fragment(config_cache, hostname)
+        yield fragment
+
+
+def _get_host_fingerprints(config_cache, hostnames):
+    fingerprints = core_config.HostConfigFingerprints(config_cache)
+    return dict((hostname, fingerprints.get(hostname)) for hostname in hostnames)
+
+
+def _host_fragments_dir():
+    return os.path.join(cmk.utils.paths.core_config_fragments_dir, "hosts")
+
+
+def _precompiled_fingerprints_dir():
+    return os.path.join(cmk.utils.paths.core_config_fragments_dir, "precompiled")
+
+
+def _load_fragment_fingerprint(hostname):
+    try:
+        with open(os.path.join(_host_fragments_dir(), hostname)) as f:
+            return f.readline().rstrip("\n")
+    except IOError:
+        return None
+
+
+def _load_host_fragment(hostname, fingerprint):
+    """Returns the saved fragment of the host or None in case it does not match the fingerprint"""
+    try:
+        with open(os.path.join(_host_fragments_dir(), hostname)) as f:
+            if f.readline().rstrip("\n") != fingerprint:
+                return None
+            return cPickle.load(f)
+    except IOError:
+        return None
+    except Exception:
+        if cmk.utils.debug.enabled():
+            raise
+        return None
+
+
+def _save_host_fragment(fingerprint, fragment):
+    store.makedirs(_host_fragments_dir())
+    store.save_file(
+        os.path.join(_host_fragments_dir(), fragment.hostname),
+        "%s\n%s" % (fingerprint, cPickle.dumps(fragment, cPickle.HIGHEST_PROTOCOL)))
+
+
+def _remove_host_fragment(hostname):
+    try:
+        os.unlink(os.path.join(_host_fragments_dir(), hostname))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _remove_obsolete_fragments(path, hostnames):
+    """Remove the files of hosts which are not monitored anymore"""
+    try:
+        names = os.listdir(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+
+    hostnames = set(hostnames)
+    for name in names:
+        if name not in hostnames:
+            os.unlink(os.path.join(path, name))
+
+
+def _outdated_hostchecks(host_fingerprints):
+    """Returns the hosts that need their host check to be precompiled again
+
+    The saved state includes whether or not a precompiled host check exists to detect
+    removed files."""
+    full_rebuild = core_config.full_rebuild_enforced()
+    outdated = []
+    for hostname, fingerprint in host_fingerprints.iteritems():
+        if full_rebuild or _load_hostcheck_fingerprint(hostname) != _hostcheck_fingerprint(
+                hostname, fingerprint):
+            outdated.append(hostname)
+    return outdated
+
+
+def _hostcheck_fingerprint(hostname, fingerprint):
+    compiled_filename = os.path.join(cmk.utils.paths.precompiled_hostchecks_dir, hostname)
+    return "%s %d" % (fingerprint, os.path.lexists(compiled_filename))
+
+
+def _load_hostcheck_fingerprint(hostname):
+    try:
+        return open(os.path.join(_precompiled_fingerprints_dir(), hostname)).read()
+    except IOError:
+        return None
+
+
+def _save_hostcheck_fingerprint(hostname, fingerprint):
+    store.makedirs(_precompiled_fingerprints_dir())
+    store.save_file(
+        os.path.join(_precompiled_fingerprints_dir(), hostname),
+        _hostcheck_fingerprint(hostname, fingerprint))
@@ -43,6 +43,8 @@ import sys
 import time
 from typing import List  # pylint: disable=unused-import
 
+from concurrent import futures
+
 import cmk.utils.paths
 import cmk.utils.debug
 from cmk.utils.exceptions import MKGeneralException
@@ -260,10 +262,7 @@ class DataSources(object):
             import cmk_base.data_sources.abstract as abstract
             abstract.DataSource.set_may_use_cache_file()
 
-        # Special agents can produce data for the same check_plugin_name on the same host, in this case
-        # the section lines need to be extended
-        multi_host_sections = MultiHostSections()
-        for this_hostname, this_ipaddress, these_sources, this_max_cachefile_age in hosts:
+        for _unused_hostname, _unused_ipaddress, these_sources, this_max_cachefile_age in hosts:
             # In case a max_cachefile_age is given with the function call, always use this one
             # instead of the host individual one. This is only used in discovery mode.
             if max_cachefile_age is not None:
@@ -271,8 +270,25 @@ class DataSources(object):
             else:
                 these_sources.set_max_cachefile_age(this_max_cachefile_age)
 
+        # Fetch the data of all sources of all hosts at once. The piggyback sources
+        # are executed afterwards, because they need the piggyback data stored
+        # for the previously processed hosts.
+        fetched_host_sections = _fetch_host_sections([
+            source for _unused_hostname, _unused_ipaddress, these_sources, _unused_age in hosts
+            for source in these_sources.get_data_sources()
+            if not isinstance(source, PiggyBackDataSource)
+        ])
+
+        # Special agents can produce data for the same check_plugin_name on the same host, in this case
+        # the section lines need to be extended
+        multi_host_sections = MultiHostSections()
+        for this_hostname, this_ipaddress, these_sources, _unused_age in hosts:
             for source in these_sources.get_data_sources():
-                host_sections_from_source = source.run()
+                if isinstance(source, PiggyBackDataSource):
+                    host_sections_from_source = source.run()
+                else:
+                    host_sections_from_source = fetched_host_sections[source]
+
                 host_sections = multi_host_sections.add_or_get_host_sections(
                     this_hostname, this_ipaddress)
                 host_sections.update(host_sections_from_source)
@@ -283,3 +299,50 @@ class DataSources(object):
                                                         host_sections.piggybacked_raw_data)
 
         return multi_host_sections
+
+
+def _fetch_host_sections(sources):
+    """Execute the given data sources and return their host sections by source
+
+    The data sources are executed concurrently with a pool of at most
+    max_concurrent_data_sources threads. Data sources that must not run
+    concurrently (see DataSource.may_run_concurrently()) are executed one after
+    another by the same thread."""
+    num_workers = min(config.max_concurrent_data_sources, len(sources))
+    if num_workers <= 1:
+        return {source: source.run() for source in sources}
+
+    def run_serially(serial_sources):
+        return [source.run() for source in serial_sources]
+
+    serial_sources = [source for source in sources if not source.may_run_concurrently()]
+    concurrent_sources = [source for source in sources if source.may_run_concurrently()]
+
+    executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+    try:
+        serial_job = executor.submit(run_serially, serial_sources)
+        concurrent_jobs = [(source, executor.submit(source.run)) for source in concurrent_sources]
+
+        # Exceptions raised by the data sources (only in debug mode) are
+        # raised again by result()
+        host_sections = dict(zip(serial_sources, _wait_for_result(serial_job)))
+        for source, job in concurrent_jobs:
+            host_sections[source] = _wait_for_result(job)
+        return host_sections
+    finally:
+        # Don't wait for the threads in case of an exception (e.g. a timeout). The
+        # data sources will finish their work in the background.
+        executor.shutdown(wait=False)
+
+
+def _wait_for_result(job):
+    """Wait for the result of the given future
+
+    On Python 2 a wait without timeout can not be interrupted by signals. Wait
+    in short steps to give the signal handler of the check timeout (SIGALRM)
+    the chance to raise MKTimeout in the main thread."""
+    while True:
+        try:
+            return job.result(timeout=1)
+        except futures.TimeoutError:
+            continue
@@ -26,6 +26,7 @@
 
 import errno
 import os
+import re
 import socket
 import time
 import abc
@@ -47,7 +48,10 @@ import cmk_base.check_api_utils as check_api_utils
 from cmk_base.exceptions import MKAgentError, MKEmptyAgentData, MKSNMPError, \
                                 MKIPAddressLookupError
 
-from .host_sections import HostSections
+from .host_sections import HostSections, LazySections, RawSectionChunk
+
+# A section header line. See CheckMKAgentDataSource._parse_info() for details.
+_SECTION_HEADER_REGEX = re.compile(r"^[ \t\r\f\v]*(<<<.*>>>)[ \t\r\f\v]*$", re.MULTILINE)
 
 
 class DataSource(object):
@@ -314,6 +318,13 @@ class DataSource(object):
     def _cpu_tracking_id(self):
         raise NotImplementedError()
 
+    def may_run_concurrently(self):
+        """Whether or not the data source may be executed concurrently to other data sources
+
+        Data sources relying on module global state (like the SNMP caches) must
+        be executed one after another."""
+        return True
+
     @abc.abstractmethod
     def id(self):
         """Return a unique identifier for this data source type
@@ -564,28 +575,57 @@ class CheckMKAgentDataSource(DataSource):
         if config.agent_simulator:
             raw_data = cmk_base.agent_simulator.process(raw_data)
 
-        return self._parse_info(raw_data.split("\n"))
+        return self._parse_info(raw_data)
 
-    def _parse_info(self, lines):
+    def _parse_info(self, raw_data):
         """Split agent output in chunks, splits lines by whitespaces.
 
+        The agent output is scanned only once for the section headers. The
+        content of the sections is kept as RawSectionChunk() and only split into
+        lines and columns when the section is used. Piggyback data and persisted
+        sections are handled in the same pass.
+
         Returns a HostSections() object.
         """
-        sections = {}
+        sections = LazySections()
         # Unparsed info for other hosts. A dictionary, indexed by the piggybacked host name.
         # The value is a list of lines which were received for this host.
         piggybacked_raw_data = {}
         persisted_sections = {}  # handle sections with option persist(...)
         host = None
-        section_content = []
+        section_name = None
         section_options = {}
         agent_cache_info = {}
         separator = None
         encoding = None
-        for line in lines:
-            line = line.rstrip("\r")
-            stripped_line = line.strip()
-            if stripped_line[:4] == '<<<<' and stripped_line[-4:] == '>>>>':
+
+        # Start of the content following the last processed header line
+        content_start = 0
+        for match in _SECTION_HEADER_REGEX.finditer(raw_data):
+            stripped_line = match.group(1)
+            is_piggyback_header = stripped_line[:4] == '<<<<' and stripped_line[-4:] == '>>>>'
+
+            # Section headers within piggybacked data are part of the piggybacked data
+            if host and not is_piggyback_header:
+                continue
+
+            # The content ends with the newline before the header line
+            content_end = match.start() - 1
+            if host:  # processing data for an other host
+                if content_start <= content_end:
+                    piggybacked_raw_data.setdefault(host, []).extend(
+                        line.rstrip("\r")
+                        for line in raw_data[content_start:content_end].split("\n"))
+
+            elif section_name is not None:
+                sections.add_raw_chunk(
+                    section_name,
+                    RawSectionChunk(raw_data, content_start, content_end, separator,
+                                    "nostrip" in section_options, encoding))
+
+            content_start = match.end() + 1
+
+            if is_piggyback_header:
                 host = stripped_line[4:-4]
                 if not host:
                     host = None
@@ -600,60 +640,60 @@ class CheckMKAgentDataSource(DataSource):
                     # a) Replace spaces by underscores
                     if host:
                         host = host.replace(" ", "_")
-
-            elif host:  # processing data for an other host
-                piggybacked_raw_data.setdefault(host, []).append(line)
+                continue
 
             # Found normal section header
             # section header has format <<<name:opt1(args):opt2:opt3(args)>>>
-            elif stripped_line[:3] == '<<<' and stripped_line[-3:] == '>>>':
-                section_header = stripped_line[3:-3]
-                headerparts = section_header.split(":")
-                section_name = headerparts[0]
-                section_options = {}
-                for o in headerparts[1:]:
-                    opt_parts = o.split("(")
-                    opt_name = opt_parts[0]
-                    if len(opt_parts) > 1:
-                        opt_args = opt_parts[1][:-1]
-                    else:
-                        opt_args = None
-                    section_options[opt_name] = opt_args
-
-                section_content = sections.get(section_name, None)
-                if section_content is None:  # section appears in output for the first time
-                    section_content = []
-                    sections[section_name] = section_content
-                try:
-                    separator = chr(int(section_options["sep"]))
-                except:
-                    separator = None
-
-                # Split of persisted section for server-side caching
-                if "persist" in section_options:
-                    until = int(section_options["persist"])
-                    cached_at = int(time.time())  # Estimate age of the data
-                    cache_interval = int(until - cached_at)
-                    agent_cache_info[section_name] = (cached_at, cache_interval)
-                    persisted_sections[section_name] = (cached_at, until, section_content)
-
-                if "cached" in section_options:
-                    agent_cache_info[section_name] = tuple(
-                        map(int, section_options["cached"].split(",")))
-
-                # The section data might have a different encoding
-                encoding = section_options.get("encoding")
-
-            elif stripped_line != '':
-                if "nostrip" not in section_options:
-                    line = stripped_line
-
-                if encoding:
-                    line = config.decode_incoming_string(line, encoding)
+            section_header = stripped_line[3:-3]
+            headerparts = section_header.split(":")
+            section_name = headerparts[0]
+            section_options = {}
+            for o in headerparts[1:]:
+                opt_parts = o.split("(")
+                opt_name = opt_parts[0]
+                if len(opt_parts) > 1:
+                    opt_args = opt_parts[1][:-1]
                 else:
-                    line = config.decode_incoming_string(line)
+                    opt_args = None
+                section_options[opt_name] = opt_args
 
-                section_content.append(line.split(separator))
+            # Make the section known, even if it has no content
+            sections.add_raw_chunk(section_name)
+            try:
+                separator = chr(int(section_options["sep"]))
+            except:
+                separator = None
+
+            # Split of persisted section for server-side caching
+            if "persist" in section_options:
+                until = int(section_options["persist"])
+                cached_at = int(time.time())  # Estimate age of the data
+                cache_interval = int(until - cached_at)
+                agent_cache_info[section_name] = (cached_at, cache_interval)
+                persisted_sections[section_name] = (cached_at, until)
+
+            if "cached" in section_options:
+                agent_cache_info[section_name] = tuple(
+                    map(int, section_options["cached"].split(",")))
+
+            # The section data might have a different encoding
+            encoding = section_options.get("encoding")
+
+        # The content following the last header line
+        if host:
+            if content_start <= len(raw_data):
+                piggybacked_raw_data.setdefault(host, []).extend(
+                    line.rstrip("\r") for line in raw_data[content_start:].split("\n"))
+
+        elif section_name is not None:
+            sections.add_raw_chunk(
+                section_name,
+                RawSectionChunk(raw_data, content_start, len(raw_data), separator,
+                                "nostrip" in section_options, encoding))
+
+        # The persisted sections need to be stored, so they are parsed right away
+        for section_name, (cached_at, until) in persisted_sections.items():
+            persisted_sections[section_name] = (cached_at, until, sections[section_name])
 
         return HostSections(sections, agent_cache_info, piggybacked_raw_data, persisted_sections)
 
@@ -24,19 +24,145 @@
 # to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
 # Boston, MA 02110-1301 USA.
 
+import collections
+import cPickle
+import errno
+import hashlib
+import os
 import sys
 
+import cmk
 import cmk.utils.debug
+import cmk.utils.paths
+import cmk.utils.store as store
+import cmk.utils.cpu_tracking as cpu_tracking
+from cmk.utils.exceptions import MKTimeout
 
 import cmk_base.config as config
 import cmk_base.caching as caching
+import cmk_base.cleanup
+import cmk_base.console as console
 import cmk_base.ip_lookup as ip_lookup
 import cmk_base.item_state as item_state
 import cmk_base.check_utils
+import cmk_base.profiling as profiling
 
 from cmk_base.exceptions import MKParseFunctionError
 
 
+class RawSectionChunk(object):
+    """A not yet parsed part of the agent output belonging to a section
+
+    The chunk only references the whole agent output together with the
+    position of the section content. It is split into lines and columns
+    the first time the section content is needed."""
+
+    def __init__(self, raw_data, start, end, separator, nostrip, encoding):
+        super(RawSectionChunk, self).__init__()
+        self._raw_data = raw_data
+        self._start = start
+        self._end = end
+        self._separator = separator
+        self._nostrip = nostrip
+        self._encoding = encoding
+
+    def parse(self):
+        section_content = []
+        if self._start > self._end:
+            return section_content
+
+        for line in self._raw_data[self._start:self._end].split("\n"):
+            line = line.rstrip("\r")
+            stripped_line = line.strip()
+            if stripped_line == '':
+                continue
+
+            if not self._nostrip:
+                line = stripped_line
+
+            if self._encoding:
+                line = config.decode_incoming_string(line, self._encoding)
+            else:
+                line = config.decode_incoming_string(line)
+
+            section_content.append(line.split(self._separator))
+        return section_content
+
+
+class LazySections(collections.MutableMapping):
+    """A dictionary from section_name to the section content which parses sections on demand
+
+    Sections can be added as RawSectionChunk() objects. They are parsed the first
+    time the section content is accessed. Sections that are never used by any
+    check are never parsed."""
+
+    def __init__(self, sections=None):
+        self._sections = dict(sections) if sections is not None else {}
+        self._raw_chunks = {}
+
+    def add_raw_chunk(self, section_name, chunk=None):
+        """Append a chunk to the section (or only make the section known when no chunk is given)"""
+        if section_name in self._sections:
+            if chunk is not None:
+                self._sections[section_name].extend(chunk.parse())
+            return
+
+        chunks = self._raw_chunks.setdefault(section_name, [])
+        if chunk is not None:
+            chunks.append(chunk)
+
+    def is_parsed(self, section_name):
+        return section_name in self._sections
+
+    def extend_from(self, sections):
+        """Append the content of all given sections to the sections of this object
+
+        Sections that have not been parsed yet in both objects are not parsed."""
+        for section_name in sections.keys():
+            if isinstance(sections, LazySections) \
+               and not sections.is_parsed(section_name) \
+               and not self.is_parsed(section_name):
+                raw_chunks = sections._raw_chunks[section_name]  # pylint: disable=protected-access
+                self._raw_chunks.setdefault(section_name, []).extend(raw_chunks)
+            else:
+                self.setdefault(section_name, []).extend(sections[section_name])
+
+    def __getitem__(self, section_name):
+        try:
+            return self._sections[section_name]
+        except KeyError:
+            pass
+
+        chunks = self._raw_chunks.pop(section_name)
+        section_content = self._sections[section_name] = []
+        for chunk in chunks:
+            section_content.extend(chunk.parse())
+        return section_content
+
+    def __setitem__(self, section_name, section_content):
+        self._raw_chunks.pop(section_name, None)
+        self._sections[section_name] = section_content
+
+    def __delitem__(self, section_name):
+        if self._raw_chunks.pop(section_name, None) is None:
+            del self._sections[section_name]
+
+    def __contains__(self, section_name):
+        return section_name in self._sections or section_name in self._raw_chunks
+
+    def __iter__(self):
+        # Accessing the sections while iterating parses them. Iterate over a copy
+        # of the section names to be independent of this.
+        return iter(self._sections.keys() + self._raw_chunks.keys())
+
+    def __len__(self):
+        return len(self._sections) + len(self._raw_chunks)
+
+    def __repr__(self):
+        return "%s(%r, unparsed=%r)" % (self.__class__.__name__, self._sections,
+                                        sorted(self._raw_chunks))
+
+
 class HostSections(object):
     """A wrapper class for the host information read by the data sources
 
@@ -56,7 +182,7 @@ class HostSections(object):
                  piggybacked_raw_data=None,
                  persisted_sections=None):
         super(HostSections, self).__init__()
-        self.sections = sections if sections is not None else {}
+        self.sections = sections if sections is not None else LazySections()
         self.cache_info = cache_info if cache_info is not None else {}
         self.piggybacked_raw_data = piggybacked_raw_data if piggybacked_raw_data is not None else {}
         self.persisted_sections = persisted_sections if persisted_sections is not None else {}
@@ -68,8 +194,11 @@ class HostSections(object):
     #       Would this be correct here?
     def update(self, host_sections):
         """Update this host info object with the contents of another one"""
-        for section_name, lines in host_sections.sections.items():
-            self.sections.setdefault(section_name, []).extend(lines)
+        if isinstance(self.sections, LazySections):
+            self.sections.extend_from(host_sections.sections)
+        else:
+            for section_name, lines in host_sections.sections.items():
+                self.sections.setdefault(section_name, []).extend(lines)
 
         for hostname, lines in host_sections.piggybacked_raw_data.items():
             self.piggybacked_raw_data.setdefault(hostname, []).extend(lines)
@@ -85,6 +214,145 @@ class HostSections(object):
         self.sections[section_name] = section
 
 
+class ParsedSectionsCache(object):
+    """Process wide cache for the results of the parse functions
+
+    The parse results are identified by the host name, the section name and
+    a fingerprint of the section content handed over to the parse function.
+    This way checking, inventory, discovery and extra_sections of other
+    checks share the result of a parse function as long as they hand over
+    the same section content.
+
+    When persisting is requested for a section (persisted or cached agent
+    sections), its parse result is also stored on disk and reused by the
+    next run, as long as the section content is unchanged.
+    """
+    _MAX_HOSTS = 32
+
+    def __init__(self):
+        super(ParsedSectionsCache, self).__init__()
+        self.clear()
+        self.reset_statistics()
+
+    def clear(self):
+        # hostname -> {section_name: (fingerprint, parsed)}
+        self._cache = collections.OrderedDict()
+        # hostname -> {section_name: (fingerprint, parsed)}, loaded from disk
+        self._persisted = {}
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.persisted_hits = 0
+        self.misses = 0
+
+    def get_statistics(self):
+        return [
+            ("Hits", self.hits),
+            ("Hits (persisted)", self.persisted_hits),
+            ("Misses", self.misses),
+        ]
+
+    def get(self, hostname, section_name, section_content, parse_function, persist=False):
+        """Returns the parse result of the section content and parses it if needed"""
+        fingerprint = hashlib.md5(repr(section_content)).hexdigest()
+        host_cache = self._get_host_cache(hostname)
+
+        try:
+            cached_fingerprint, parsed = host_cache[section_name]
+            if cached_fingerprint == fingerprint:
+                self.hits += 1
+                return parsed
+        except KeyError:
+            pass
+
+        if persist:
+            try:
+                cached_fingerprint, parsed = self._get_persisted(hostname)[section_name]
+                if cached_fingerprint == fingerprint:
+                    self.persisted_hits += 1
+                    host_cache[section_name] = (fingerprint, parsed)
+                    return parsed
+            except KeyError:
+                pass
+
+        self.misses += 1
+        cpu_tracking.push_phase("parse")
+        try:
+            parsed = parse_function(section_content)
+        finally:
+            cpu_tracking.pop_phase()
+
+        host_cache[section_name] = (fingerprint, parsed)
+        if persist:
+            self._persist(hostname, section_name, fingerprint, parsed)
+        return parsed
+
+    def _get_host_cache(self, hostname):
+        try:
+            return self._cache[hostname]
+        except KeyError:
+            while len(self._cache) >= self._MAX_HOSTS:
+                oldest_hostname = self._cache.popitem(last=False)[0]
+                self._persisted.pop(oldest_hostname, None)
+            host_cache = self._cache[hostname] = {}
+            return host_cache
+
+    def _file_path(self, hostname):
+        return os.path.join(cmk.utils.paths.parsed_sections_cache_dir, hostname)
+
+    def _get_persisted(self, hostname):
+        try:
+            return self._persisted[hostname]
+        except KeyError:
+            pass
+
+        persisted = {}
+        try:
+            version, entries = cPickle.loads(open(self._file_path(hostname), "rb").read())
+            if version == cmk.__version__:
+                persisted = entries
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                console.verbose("Cannot read parsed sections of %s: %s\n" % (hostname, e))
+        except MKTimeout:
+            raise
+        except Exception as e:
+            if cmk.utils.debug.enabled():
+                raise
+            console.verbose("Cannot read parsed sections of %s: %s\n" % (hostname, e))
+
+        self._persisted[hostname] = persisted
+        return persisted
+
+    def _persist(self, hostname, section_name, fingerprint, parsed):
+        persisted = self._get_persisted(hostname)
+        persisted[section_name] = (fingerprint, parsed)
+        try:
+            content = cPickle.dumps((cmk.__version__, persisted), cPickle.HIGHEST_PROTOCOL)
+        except MKTimeout:
+            raise
+        except Exception as e:
+            # Some parse functions create objects which can not be pickled.
+            # These are only cached in memory.
+            del persisted[section_name]
+            console.vverbose("Not persisting parsed section %s: %s\n" % (section_name, e))
+            return
+
+        store.makedirs(cmk.utils.paths.parsed_sections_cache_dir)
+        store.save_file(self._file_path(hostname), content)
+
+
+_parsed_sections_cache = ParsedSectionsCache()
+
+
+def cleanup_parsed_sections_cache():
+    _parsed_sections_cache.clear()
+
+
+cmk_base.cleanup.register_cleanup(cleanup_parsed_sections_cache)
+profiling.register_statistics("Parse function cache", _parsed_sections_cache.get_statistics)
+
+
 class MultiHostSections(object):
     """Container object for wrapping the host sections of a host being processed
     or multiple hosts when a cluster is processed. Also holds the functionality for
@@ -182,15 +450,20 @@ class MultiHostSections(object):
         # Now get the section_content from the required hosts and merge them together to
         # a single section_content. For each host optionally add the node info.
         section_content = None
+        is_cached_section = False
         for host_entry in host_entries:
             if nodes_of_clustered_service and host_entry[0] not in nodes_of_clustered_service:
                 continue
 
             try:
-                host_section_content = self._multi_host_sections[host_entry].sections[section_name]
+                host_sections = self._multi_host_sections[host_entry]
+                host_section_content = host_sections.sections[section_name]
             except KeyError:
                 continue
 
+            if section_name in host_sections.cache_info:
+                is_cached_section = True
+
             host_section_content = self._update_with_node_column(
                 host_section_content, check_plugin_name, host_entry[0], for_discovery)
 
@@ -204,7 +477,8 @@ class MultiHostSections(object):
 
         assert isinstance(section_content, list)
 
-        section_content = self._update_with_parse_function(section_content, section_name)
+        section_content = self._update_with_parse_function(section_content, section_name, hostname,
+                                                           is_cached_section)
         section_content = self._update_with_extra_sections(section_content, hostname, ipaddress,
                                                            section_name, for_discovery)
         return section_content
@@ -273,11 +547,14 @@ class MultiHostSections(object):
 
         return section_content
 
-    def _update_with_parse_function(self, section_content, section_name):
+    def _update_with_parse_function(self, section_content, section_name, hostname,
+                                    is_cached_section):
         """Transform the section_content using the defined parse functions.
 
         Some checks define a parse function that is used to transform the section_content
-        somehow. It is applied by this function.
+        somehow. It is applied by this function. The results are shared through the
+        parsed sections cache. Results of cached or persisted sections may be kept on
+        disk for the next run (see "persist_parsed_sections").
 
         Please note that this is not a check/subcheck individual setting. This option is related
         to the agent section.
@@ -297,7 +574,12 @@ class MultiHostSections(object):
         orig_item_state_prefix = item_state.get_item_state_prefix()
         try:
             item_state.set_item_state_prefix(section_name, None)
-            return parse_function(section_content)
+            return _parsed_sections_cache.get(
+                hostname,
+                section_name,
+                section_content,
+                parse_function,
+                persist=is_cached_section and config.persist_parsed_sections)
         except Exception:
             if cmk.utils.debug.enabled():
                 raise
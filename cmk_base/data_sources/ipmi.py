@@ -85,6 +85,9 @@ class IPMIManagementBoardDataSource(ManagementBoardDataSource, CheckMKAgentDataS
     def _cpu_tracking_id(self):
         return self.id()
 
+    def may_run_concurrently(self):
+        return False
+
     def _gather_check_plugin_names(self):
         return ["mgmt_ipmi_sensors"]
 
@@ -71,6 +71,9 @@ class SNMPDataSource(DataSource):
     def _cpu_tracking_id(self):
         return "snmp"
 
+    def may_run_concurrently(self):
+        return False
+
     def describe(self):
         snmp_config = self._host_config.snmp_config(self._ipaddress)
         if snmp_config.is_usewalk_host:
@@ -159,7 +162,8 @@ class SNMPDataSource(DataSource):
         check_plugin_names = self.get_check_plugin_names()
 
         snmp_config = self._host_config.snmp_config(self._ipaddress)
-        info = {}
+        sections_to_fetch = []
+        fetched_section_names = set()
         for check_plugin_name in self._sort_check_plugin_names(check_plugin_names):
             # Is this an SNMP table check? Then snmp_info specifies the OID to fetch
             # Please note, that if the check_plugin_name is foo.bar then we lookup the
@@ -189,11 +193,22 @@ class SNMPDataSource(DataSource):
                 continue
 
             # Prevent duplicate data fetching of identical section in case of SNMP sub checks
-            if section_name in info:
+            if section_name in fetched_section_names:
                 self._logger.debug(
                     "%s: Skip fetching data (section already fetched)" % (check_plugin_name))
                 continue
 
+            fetched_section_names.add(section_name)
+            sections_to_fetch.append((check_plugin_name, section_name, oid_info))
+
+        # Walk the OIDs of all sections at once. Overlapping subtrees are walked only once.
+        oid_infos = [(check_plugin_name, entry)
+                     for check_plugin_name, _section_name, oid_info in sections_to_fetch
+                     for entry in (oid_info if isinstance(oid_info, list) else [oid_info])]
+        snmp.prefetch_snmp_tables(snmp_config, oid_infos, self._use_snmpwalk_cache)
+
+        info = {}
+        for check_plugin_name, section_name, oid_info in sections_to_fetch:
             self._logger.debug("%s: Fetching data" % (check_plugin_name))
 
             # oid_info can now be a list: Each element  of that list is interpreted as one real oid_info
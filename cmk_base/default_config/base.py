@@ -44,7 +44,14 @@ snmp_ports = []  # UDP ports used for SNMP
 tcp_connect_timeout = 5.0
 tcp_connect_timeouts = []
 use_dns_cache = True  # prevent DNS by using own cache file
+max_concurrent_dns_lookups = 32  # number of DNS lookups executed in parallel when resolving many hosts
+dns_lookup_timeout = 5  # secs, a single lookup exceeding this time fails
 delay_precompile = False  # delay Python compilation to Nagios execution
+check_helper_daemon = False  # let precompiled host checks use the check helper daemon
+check_helper_daemon_workers = 4  # number of worker processes of the check helper daemon
+check_helper_daemon_timeout = 60  # secs, maximum duration of a single host check
+automation_helper_daemon_workers = 2  # number of worker processes of the automation helper daemon
+automation_helper_daemon_timeout = 600  # secs, maximum duration of a single automation call
 restart_locking = "abort"  # also possible: "wait", None
 check_submission = "file"  # alternative: "pipe"
 agent_min_version = 0  # warn, if plugin has not at least version
@@ -53,6 +60,8 @@ default_host_group = 'check_mk'
 check_max_cachefile_age = 0  # per default do not use cache files when checking
 cluster_max_cachefile_age = 90  # secs.
 piggyback_max_cachefile_age = 3600  # secs
+max_concurrent_data_sources = 8  # number of data sources of a host (and its nodes) fetched in parallel
+persist_parsed_sections = False  # keep parse results of cached/persisted sections between runs
 piggyback_translation = []  # Ruleset for translating piggyback host names
 service_description_translation = []  # Ruleset for translating service descriptions
 simulation_mode = False
@@ -76,6 +85,8 @@ http_proxies = {}  # Global setting for managing HTTP proxy configs
 use_inline_snmp = True
 non_inline_snmp_hosts = []  # Ruleset to disable Inline-SNMP per host when
 # use_inline_snmp is enabled.
+bulk_snmp_hosts = []  # Ruleset to query SNMP v1/v2c hosts with the bulk SNMP backend
+bulk_snmp_window = 4  # Maximum number of parallel requests of the bulk SNMP backend
 
 snmp_limit_oid_range = []  # Ruleset to recduce fetched OIDs of a check, only inline SNMP
 snmp_bulk_size = []  # Ruleset to customize bulk size
@@ -110,6 +121,8 @@ inventory_check_autotrigger = True  # Automatically trigger inv-check after auto
 always_cleanup_autochecks = None  # For compatiblity with old configuration
 
 periodic_discovery = []
+marked_host_discovery_workers = 8  # number of marked hosts discovered in parallel
+marked_host_discovery_host_timeout = 60  # secs, the discovery of a single marked host exceeding this time is aborted
 
 # Nagios templates and other settings concerning generation
 # of Nagios configuration files. No need to change these values.
@@ -125,6 +138,8 @@ summary_service_template = 'check_mk_summarized'
 service_dependency_template = 'check_mk'
 generate_hostconf = True
 generate_dummy_commands = True
+core_config_processes = None  # processes creating the core configuration (None: number of CPUs)
+incremental_core_config = True  # only recreate the core configuration of changed hosts
 dummy_check_commandline = 'echo "ERROR - you did an active check on this service - please disable active checks" && exit 1'
 nagios_illegal_chars = '`;~!$%^&*|\'"<>?,()='
 
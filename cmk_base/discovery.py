@@ -24,20 +24,23 @@
 # to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
 # Boston, MA 02110-1301 USA.
 
+import cStringIO
 import os
 import socket
+import sys
 import time
 import signal
-from typing import Callable, List, Text, Optional, Dict, Tuple  # pylint: disable=unused-import
-from pathlib2 import Path
+import traceback
+from typing import Any, Callable, List, Text, Optional, Dict, Set, Tuple  # pylint: disable=unused-import
 
 from cmk.utils.regex import regex
 import cmk.utils.tty as tty
 import cmk.utils.debug
 import cmk.utils.paths
-from cmk.utils.exceptions import MKGeneralException, MKTimeout
 import cmk.utils.store as store
+from cmk.utils.exceptions import MKGeneralException, MKTimeout
 
+import cmk_base.autochecks
 import cmk_base.crash_reporting
 import cmk_base.config as config
 import cmk_base.console as console
@@ -452,14 +455,14 @@ class DiscoveryTimeout(Exception):
     pass
 
 
-def _handle_discovery_timeout():
+def _handle_discovery_timeout(signum, stackframe):
     raise DiscoveryTimeout()
 
 
-def _set_discovery_timeout():
+def _set_discovery_timeout(timeout):
     signal.signal(signal.SIGALRM, _handle_discovery_timeout)
     # Add an additional 10 seconds as grace period
-    signal.alarm(_marked_host_discovery_timeout + 10)
+    signal.alarm(timeout + 10)
 
 
 def _clear_discovery_timeout():
@@ -470,6 +473,10 @@ def _get_autodiscovery_dir():
     return cmk.utils.paths.var_dir + '/autodiscovery'
 
 
+def _get_autodiscovery_status_file():
+    return cmk.utils.paths.tmp_dir + '/autodiscovery.status'
+
+
 def discover_marked_hosts(core):
     console.verbose("Doing discovery for all marked hosts:\n")
     autodiscovery_dir = _get_autodiscovery_dir()
@@ -482,7 +489,7 @@ def discover_marked_hosts(core):
     config_cache = config.get_config_cache()
 
     now_ts = time.time()
-    end_time_ts = now_ts + _marked_host_discovery_timeout  # don't run for more than 2 minutes
+    end_time_ts = now_ts + _marked_host_discovery_timeout  # don't start hosts after 2 minutes
     oldest_queued = _queue_age()
     hosts = os.listdir(autodiscovery_dir)
     if not hosts:
@@ -490,32 +497,59 @@ def discover_marked_hosts(core):
 
     # Fetch host state information from livestatus
     host_states = _fetch_host_states()
-    activation_required = False
 
-    try:
-        _set_discovery_timeout()
-        for hostname in hosts:
-            host_config = config_cache.get_host_config(hostname)
+    queue = []
+    for hostname in hosts:
+        if not _discover_marked_host_exists(config_cache, hostname):
+            continue
 
-            if not _discover_marked_host_exists(config_cache, hostname):
-                continue
+        # Only try to discover hosts with UP state
+        if host_states and host_states.get(hostname) != 0:
+            continue
 
-            # Only try to discover hosts with UP state
-            if host_states and host_states.get(hostname) != 0:
-                continue
+        queue.append(hostname)
 
-            if _discover_marked_host(config_cache, host_config, now_ts, oldest_queued):
-                activation_required = True
+    status = _MarkedHostDiscoveryStatus(len(hosts), len(queue), oldest_queued)
+    status.save()
 
+    activation_required = False
+    running = {}  # type: Dict[int, Tuple[str, float]]
+    while queue or running:
+        while queue and len(running) < max(1, config.marked_host_discovery_workers):
             if time.time() > end_time_ts:
                 console.verbose(
-                    "  Timeout of %d seconds reached. Lets do the remaining hosts next time." %
-                    _marked_host_discovery_timeout)
+                    "  Timeout of %d seconds reached. Lets do the remaining %d hosts next time.\n" %
+                    (_marked_host_discovery_timeout, len(queue)))
+                del queue[:]
                 break
-    except DiscoveryTimeout:
-        pass
-    finally:
-        _clear_discovery_timeout()
+
+            hostname = _next_marked_host(config_cache, queue, running)
+            if hostname is None:
+                break  # The remaining hosts have to wait for the running ones
+
+            queue.remove(hostname)
+            running[_fork_marked_host_discovery(config_cache, hostname, now_ts,
+                                                oldest_queued)] = (hostname, time.time())
+
+        if not running:
+            break
+
+        pid, exit_status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            _kill_hanging_marked_host_discoveries(running)
+            time.sleep(0.05)
+            continue
+
+        running.pop(pid, None)
+        result = os.WEXITSTATUS(exit_status) if os.WIFEXITED(exit_status) else None
+        if result == _DISCOVERY_ACTIVATION_REQUIRED:
+            activation_required = True
+        status.host_done(
+            failed=result not in (_DISCOVERY_UNCHANGED, _DISCOVERY_ACTIVATION_REQUIRED))
+        status.save()
+
+    status.finish()
+    status.save()
 
     if activation_required:
         console.verbose("\nRestarting monitoring core with updated configuration...\n")
@@ -525,6 +559,130 @@ def discover_marked_hosts(core):
             cmk_base.core.do_restart(core)
 
 
+def _next_marked_host(config_cache, queue, running):
+    # type: (config.ConfigCache, List[str], Dict[int, Tuple[str, float]]) -> Optional[str]
+    """Returns the first queued host which can be discovered in parallel to the running ones
+
+    The discovery of a cluster changes the autochecks of its nodes. Hosts sharing
+    autochecks files are not discovered at the same time, otherwise one of the
+    discoveries would overwrite the changes of the other one."""
+    busy_hosts = set()  # type: Set[str]
+    for hostname, _started in running.itervalues():
+        busy_hosts.update(_hosts_with_changed_autochecks(config_cache, hostname))
+
+    for hostname in queue:
+        if busy_hosts.isdisjoint(_hosts_with_changed_autochecks(config_cache, hostname)):
+            return hostname
+    return None
+
+
+def _hosts_with_changed_autochecks(config_cache, hostname):
+    # type: (config.ConfigCache, str) -> Set[str]
+    return set([hostname] + (config_cache.get_host_config(hostname).nodes or []))
+
+
+# Exit codes of the processes discovering a single marked host
+_DISCOVERY_UNCHANGED = 0
+_DISCOVERY_ACTIVATION_REQUIRED = 1
+_DISCOVERY_FAILED = 2
+
+
+def _fork_marked_host_discovery(config_cache, hostname, now_ts, oldest_queued):
+    # type: (config.ConfigCache, str, float, float) -> int
+    """Discover the services of a marked host in a child process
+
+    The discovery is dominated by waiting for the agents and SNMP devices, so the
+    hosts are processed in parallel. The output of the child is collected and written
+    in one piece to keep the output of the hosts readable."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+
+    exit_code = _DISCOVERY_FAILED
+    output = cStringIO.StringIO()
+    sys.stdout = sys.stderr = output
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        _set_discovery_timeout(config.marked_host_discovery_host_timeout)
+        host_config = config_cache.get_host_config(hostname)
+        if _discover_marked_host(config_cache, host_config, now_ts, oldest_queued):
+            exit_code = _DISCOVERY_ACTIVATION_REQUIRED
+        else:
+            exit_code = _DISCOVERY_UNCHANGED
+    except DiscoveryTimeout:
+        console.verbose("  Timeout of %d seconds reached. Lets try again next time.\n" %
+                        config.marked_host_discovery_host_timeout)
+    except Exception:
+        if cmk.utils.debug.enabled():
+            traceback.print_exc(file=output)
+        else:
+            console.verbose("  failed: %s\n" % sys.exc_info()[1])
+    finally:
+        _clear_discovery_timeout()
+        try:
+            os.write(1, output.getvalue())
+        except OSError:
+            pass
+        os._exit(exit_code)  # pylint: disable=protected-access
+
+
+def _kill_hanging_marked_host_discoveries(running):
+    # type: (Dict[int, Tuple[str, float]]) -> None
+    # The child processes abort on their own. This only catches processes which
+    # do not react to the alarm signal, e.g. while being stuck in a system call.
+    deadline = time.time() - config.marked_host_discovery_host_timeout - 20
+    for pid, (hostname, started) in running.items():
+        if started < deadline:
+            console.verbose("  Killing hanging discovery of %s\n" % hostname)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+            running[pid] = (hostname, time.time())
+
+
+class _MarkedHostDiscoveryStatus(object):
+    """Progress of the discovery of the marked hosts
+
+    Saved to a file while the discovery is running, so that the length of the queue
+    of marked hosts and the progress of the current run can be monitored."""
+
+    def __init__(self, num_queued, num_scheduled, oldest_queued):
+        # type: (int, int, float) -> None
+        super(_MarkedHostDiscoveryStatus, self).__init__()
+        self._status = {
+            "pid": os.getpid(),
+            "started": time.time(),
+            "finished": None,
+            "queued": num_queued,
+            "oldest_queued": oldest_queued if num_queued else None,
+            "scheduled": num_scheduled,
+            "done": 0,
+            "failed": 0,
+        }  # type: Dict[str, Any]
+
+    def host_done(self, failed):
+        # type: (bool) -> None
+        self._status["done"] += 1
+        if failed:
+            self._status["failed"] += 1
+
+    def finish(self):
+        # type: () -> None
+        self._status["finished"] = time.time()
+        try:
+            # Hosts which were not discovered remain queued
+            self._status["queued"] = len(os.listdir(_get_autodiscovery_dir()))
+        except OSError:
+            self._status["queued"] = 0
+
+    def save(self):
+        # type: () -> None
+        store.save_data_to_file(_get_autodiscovery_status_file(), self._status)
+
+
 def _fetch_host_states():
     host_states = {}
     try:
@@ -1232,119 +1390,20 @@ def get_check_preview(hostname, use_caches, do_snmp_scan, on_error):
 #   '----------------------------------------------------------------------'
 
 
-# Read autochecks, but do not compute final check parameters,
-# also return a forth column with the raw string of the parameters.
-# Returns a table with three columns:
-# 1. check_plugin_name
-# 2. item
-# 3. parameter string, not yet evaluated!
-# TODO: use store.load_data_from_file()
 def parse_autochecks_file(hostname):
-    def split_python_tuple(line):
-        quote = None
-        bracklev = 0
-        backslash = False
-        for i, c in enumerate(line):
-            if backslash:
-                backslash = False
-                continue
-            elif c == '\\':
-                backslash = True
-            elif c == quote:
-                quote = None  # end of quoted string
-            elif c in ['"', "'"] and not quote:
-                quote = c  # begin of quoted string
-            elif quote:
-                continue
-            elif c in ['(', '{', '[']:
-                bracklev += 1
-            elif c in [')', '}', ']']:
-                bracklev -= 1
-            elif bracklev > 0:
-                continue
-            elif c == ',':
-                value = line[0:i]
-                rest = line[i + 1:]
-                return value.strip(), rest
-
-        return line.strip(), None
-
-    path = "%s/%s.mk" % (cmk.utils.paths.autochecks_dir, hostname)
-    if not os.path.exists(path):
-        return []
-
-    lineno = 0
-    table = []
-    for line in file(path):
-        lineno += 1
-        try:
-            line = line.strip()
-            if not line.startswith("("):
-                continue
-
-            # drop everything after potential '#' (from older versions)
-            i = line.rfind('#')
-            if i > 0:  # make sure # is not contained in string
-                rest = line[i:]
-                if '"' not in rest and "'" not in rest:
-                    line = line[:i].strip()
-
-            if line.endswith(","):
-                line = line[:-1]
-            line = line[1:-1]  # drop brackets
-
-            # First try old format - with hostname
-            parts = []
-            while True:
-                try:
-                    part, line = split_python_tuple(line)
-                    parts.append(part)
-                except:
-                    break
-            if len(parts) == 4:
-                parts = parts[1:]  # drop hostname, legacy format with host in first column
-            elif len(parts) != 3:
-                raise Exception("Invalid number of parts: %d (%r)" % (len(parts), parts))
-
-            checktypestring, itemstring, paramstring = parts
-
-            item = eval(itemstring)
-            # With Check_MK 1.2.7i3 items are now defined to be unicode strings. Convert
-            # items from existing autocheck files for compatibility. TODO remove this one day
-            if isinstance(item, str):
-                item = config.decode_incoming_string(item)
-
-            table.append((eval(checktypestring), item, paramstring))
-        except:
-            if cmk.utils.debug.enabled():
-                raise
-            raise Exception("Invalid line %d in autochecks file %s" % (lineno, path))
-    return table
+    return cmk_base.autochecks.parse_autochecks_file(hostname)
 
 
 def _has_autochecks(hostname):
-    return os.path.exists(cmk.utils.paths.autochecks_dir + "/" + hostname + ".mk")
+    return cmk_base.autochecks.has_autochecks(hostname)
 
 
 def _remove_autochecks_file(hostname):
-    filepath = cmk.utils.paths.autochecks_dir + "/" + hostname + ".mk"
-    try:
-        os.remove(filepath)
-    except OSError:
-        pass
+    cmk_base.autochecks.remove_autochecks_file(hostname)
 
 
 def _save_autochecks_file(hostname, items):
-    if not os.path.exists(cmk.utils.paths.autochecks_dir):
-        os.makedirs(cmk.utils.paths.autochecks_dir)
-
-    filepath = Path(cmk.utils.paths.autochecks_dir) / ("%s.mk" % hostname)
-    content = []
-    content.append("[")
-    for check_plugin_name, item, paramstring in items:
-        content.append("  (%r, %r, %s)," % (check_plugin_name, item, paramstring))
-    content.append("]\n")
-    store.save_file(str(filepath), "\n".join(content))
+    cmk_base.autochecks.save_autochecks_file(hostname, items)
 
 
 def set_autochecks_of(host_config, new_items):
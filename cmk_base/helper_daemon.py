@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""Generic pre-forking daemon answering requests on a local UNIX socket
+
+The master process sets up everything that is expensive to initialize
+(configuration, check plugins, ...) once and then forks a fixed number
+of worker processes which share this state copy-on-write. The workers
+accept connections on the shared listening socket and answer one
+request per connection.
+
+A request is everything the client sends until it shuts down its
+writing side of the connection. The response is sent back and the
+connection is closed afterwards.
+
+The master watches a "generation" file (e.g. the packed configuration
+written by "cmk -O"). Once it changes, the workers are stopped and the
+master restarts itself to pick up the new state. Subclasses may identify
+the generation differently by overriding _get_generation().
+"""
+
+import abc
+import errno
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, Optional  # pylint: disable=unused-import
+
+import cmk.utils.debug
+import cmk.utils.store as store
+from cmk.utils.exceptions import MKTimeout
+
+import cmk_base.console as console
+
+
+class HelperDaemon(object):
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, socket_path, num_workers, request_timeout, generation_path=None):
+        # type: (str, int, int, Optional[str]) -> None
+        super(HelperDaemon, self).__init__()
+        self._socket_path = socket_path
+        self._num_workers = max(1, num_workers)
+        self._request_timeout = request_timeout
+        self._generation_path = generation_path
+
+        self._listen_socket = None  # type: Optional[socket.socket]
+        self._workers = {}  # type: Dict[int, int]
+        self._master_pid = os.getpid()
+        self._generation = None  # type: Any
+        self._terminate = False
+
+    @abc.abstractmethod
+    def handle_request(self, request):
+        # type: (str) -> str
+        """Compute the response for a single request. Called in the worker processes."""
+
+    def error_response(self, exc):
+        # type: (Exception) -> str
+        """Response to send in case handle_request() raised an exception"""
+        return "ERROR: %s\n" % exc
+
+    def initialize_worker(self):
+        # type: () -> None
+        """Hook executed once in every worker process after forking"""
+        pass
+
+    def run(self):
+        # type: () -> None
+        if self._generation is None:
+            self._generation = self._get_generation()
+        self._listen_socket = self._open_listen_socket()
+
+        signal.signal(signal.SIGTERM, self._handle_terminate)
+        signal.signal(signal.SIGINT, self._handle_terminate)
+
+        console.verbose("Serving requests on %s with %d workers\n", self._socket_path,
+                        self._num_workers)
+        try:
+            while not self._terminate:
+                self._reap_workers()
+                self._spawn_workers()
+
+                if self._get_generation() != self._generation:
+                    console.verbose("Configuration generation changed. Restarting.\n")
+                    self._stop_workers()
+                    self._close_listen_socket()
+                    self._restart()
+                    return
+
+                time.sleep(1)
+        finally:
+            self._stop_workers()
+            self._close_listen_socket()
+
+    def _handle_terminate(self, signum, frame):
+        self._terminate = True
+
+    def _restart(self):
+        # type: () -> None
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def _get_generation(self):
+        # type: () -> Any
+        if self._generation_path is None:
+            return None
+        try:
+            return os.stat(self._generation_path).st_mtime
+        except OSError:
+            return None
+
+    def _open_listen_socket(self):
+        # type: () -> socket.socket
+        store.makedirs(os.path.dirname(self._socket_path))
+        try:
+            os.remove(self._socket_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self._socket_path)
+        os.chmod(self._socket_path, 0660)
+        sock.listen(128)
+        # All workers wait for the same socket. Only one of them gets the
+        # connection, the others must not block in accept().
+        sock.setblocking(0)
+        return sock
+
+    def _close_listen_socket(self):
+        # type: () -> None
+        if self._listen_socket is None:
+            return
+
+        self._listen_socket.close()
+        self._listen_socket = None
+        try:
+            os.remove(self._socket_path)
+        except OSError:
+            pass
+
+    #
+    # Worker management (master process)
+    #
+
+    def _spawn_workers(self):
+        # type: () -> None
+        while len(self._workers) < self._num_workers:
+            pid = os.fork()
+            if pid == 0:
+                self._worker_main()
+                os._exit(0)  # pylint: disable=protected-access
+            self._workers[pid] = pid
+
+    def _reap_workers(self):
+        # type: () -> None
+        while self._workers:
+            try:
+                pid, _status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    self._workers.clear()
+                    return
+                raise
+
+            if pid == 0:
+                return
+
+            if self._workers.pop(pid, None) is not None:
+                console.verbose("Worker %d terminated\n", pid)
+
+    def _stop_workers(self):
+        # type: () -> None
+        if os.getpid() != self._master_pid:
+            return
+
+        for pid in self._workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+        for pid in list(self._workers):
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            del self._workers[pid]
+
+    #
+    # Request processing (worker processes)
+    #
+
+    def _worker_main(self):
+        # type: () -> None
+        self._terminate = False
+        signal.signal(signal.SIGTERM, self._handle_terminate)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        try:
+            self.initialize_worker()
+
+            while not self._terminate and os.getppid() == self._master_pid:
+                conn = self._accept()
+                if conn is not None:
+                    self._serve_connection(conn)
+        except Exception as e:
+            if cmk.utils.debug.enabled():
+                raise
+            console.error("Worker %d crashed: %s\n" % (os.getpid(), e))
+
+    def _accept(self):
+        # type: () -> Optional[socket.socket]
+        assert self._listen_socket is not None
+        try:
+            readable = select.select([self._listen_socket], [], [], 1.0)[0]
+            if not readable:
+                return None
+            conn = self._listen_socket.accept()[0]
+        except (select.error, socket.error) as e:
+            if e.args[0] in (errno.EINTR, errno.EAGAIN):
+                return None
+            raise
+
+        conn.setblocking(1)
+        return conn
+
+    def _serve_connection(self, conn):
+        # type: (socket.socket) -> None
+        try:
+            conn.settimeout(self._request_timeout)
+            request = self._receive_request(conn)
+            response = self._handle_request_with_timeout(request)
+            conn.sendall(response)
+        except socket.error as e:
+            console.verbose("Failed to communicate with client: %s\n", e)
+        finally:
+            conn.close()
+
+    def _receive_request(self, conn):
+        # type: (socket.socket) -> str
+        chunks = []
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return "".join(chunks)
+
+    def _handle_request_with_timeout(self, request):
+        # type: (str) -> str
+        previous_handler = signal.signal(signal.SIGALRM, self._raise_request_timeout)
+        signal.alarm(self._request_timeout)
+        try:
+            return self.handle_request(request)
+        except Exception as e:
+            if cmk.utils.debug.enabled():
+                raise
+            return self.error_response(e)
+        finally:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    def _raise_request_timeout(self, signum, stackframe):
+        raise MKTimeout(
+            "Request timed out. The timeout of %d seconds was reached." % self._request_timeout)
@@ -37,7 +37,7 @@ import cmk.utils.paths
 import cmk.utils.store
 import cmk.utils.tty as tty
 from cmk.utils.exceptions import MKGeneralException
-from cmk.utils.structured_data import StructuredDataTree
+from cmk.utils.structured_data import StructuredDataTree, TreeArchive
 import cmk.utils.debug
 
 import cmk_base.utils
@@ -137,10 +137,12 @@ def do_inv_check(hostname, options):
                              check_api_utils.state_markers[_inv_sw_missing])
             status = max(status, _inv_sw_missing)
 
+        old_tree = None
         if old_timestamp:
-            path = "%s/%s/%d" % (cmk.utils.paths.inventory_archive_dir, hostname, old_timestamp)
-            old_tree = StructuredDataTree().load_from(path)
+            archive_dir = "%s/%s" % (cmk.utils.paths.inventory_archive_dir, hostname)
+            old_tree = TreeArchive(archive_dir).load(old_timestamp)
 
+        if old_tree is not None:
             if not old_tree.is_equal(inventory_tree, edges=["software"]):
                 infotext = "software changes"
                 if _inv_sw_changes:
@@ -377,6 +379,12 @@ def _save_inventory_tree(hostname, inventory_tree):
     old_time = None
     filepath = cmk.utils.paths.inventory_output_dir + "/" + hostname
     if not inventory_tree.is_empty():
+        # Comparing the hashes saves loading the old tree in the common case
+        content_hash = inventory_tree.get_content_hash()
+        if _load_inventory_hash(filepath) == content_hash:
+            console.verbose("Inventory was unchanged\n")
+            return None
+
         old_tree = StructuredDataTree().load_from(filepath)
         old_tree.normalize_nodes()
         if old_tree.is_equal(inventory_tree):
@@ -388,9 +396,9 @@ def _save_inventory_tree(hostname, inventory_tree):
                 console.verbose("Inventory tree has changed\n")
                 old_time = os.stat(filepath).st_mtime
                 arcdir = "%s/%s" % (cmk.utils.paths.inventory_archive_dir, hostname)
-                cmk.utils.store.makedirs(arcdir)
-                os.rename(filepath, arcdir + ("/%d" % old_time))
+                TreeArchive(arcdir).save(old_time, old_tree)
             inventory_tree.save_to(cmk.utils.paths.inventory_output_dir, hostname)
+        _save_inventory_hash(filepath, content_hash)
 
     else:
         if os.path.exists(
@@ -398,10 +406,36 @@ def _save_inventory_tree(hostname, inventory_tree):
             os.remove(filepath)
         if os.path.exists(filepath + ".gz"):
             os.remove(filepath + ".gz")
+        if os.path.exists(_inventory_hash_path(filepath)):
+            os.remove(_inventory_hash_path(filepath))
 
     return old_time
 
 
+def _inventory_hash_path(filepath):
+    dirname, filename = os.path.split(filepath)
+    return "%s/.%s.hash" % (dirname, filename)
+
+
+def _load_inventory_hash(filepath):
+    """The hash of the saved tree, as long as the file has not been changed since"""
+    try:
+        mtime = os.stat(filepath).st_mtime
+        saved_mtime, content_hash = cmk.utils.store.load_data_from_file(
+            _inventory_hash_path(filepath), default=(None, None))
+    except (OSError, MKGeneralException, TypeError, ValueError):
+        return None
+
+    if saved_mtime != mtime:
+        return None
+    return content_hash
+
+
+def _save_inventory_hash(filepath, content_hash):
+    cmk.utils.store.save_data_to_file(
+        _inventory_hash_path(filepath), (os.stat(filepath).st_mtime, content_hash), pretty=False)
+
+
 def _save_status_data_tree(hostname, status_data_tree):
     if status_data_tree and not status_data_tree.is_empty():
         cmk.utils.store.makedirs(cmk.utils.paths.status_data_dir)
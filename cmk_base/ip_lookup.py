@@ -27,7 +27,10 @@
 import socket
 import errno
 import os
-from typing import Optional  # pylint: disable=unused-import
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union  # pylint: disable=unused-import
+
+from concurrent import futures
 
 import cmk.utils.paths
 import cmk.utils.debug
@@ -41,6 +44,8 @@ from cmk_base.exceptions import MKIPAddressLookupError
 _fake_dns = None  # type: Optional[str]
 _enforce_localhost = False
 
+CacheID = Tuple[str, int]
+
 
 def enforce_fake_dns(address):
     global _fake_dns
@@ -70,6 +75,19 @@ def lookup_ipv6_address(hostname):
 # FIXME: This different handling is bad. Clean this up!
 def lookup_ip_address(hostname, family=None):
     # type: (str, Optional[int]) -> Optional[str]
+    if family is None:  # choose primary family
+        family = 6 if config.get_config_cache().get_host_config(hostname).is_ipv6_primary else 4
+
+    ipa = _configured_ip_address(hostname, family)
+    if ipa is not None:
+        return ipa
+
+    return cached_dns_lookup(hostname, family)
+
+
+def _configured_ip_address(hostname, family):
+    # type: (str, int) -> Optional[str]
+    """Returns the IP address of the host in case it is not looked up via DNS"""
     # Quick hack, where all IP addresses are faked (--fake-dns)
     if _fake_dns:
         return _fake_dns
@@ -79,9 +97,6 @@ def lookup_ip_address(hostname, family=None):
     config_cache = config.get_config_cache()
     host_config = config_cache.get_host_config(hostname)
 
-    if family is None:  # choose primary family
-        family = 6 if host_config.is_ipv6_primary else 4
-
     # Honor simulation mode und usewalk hosts. Never contact the network.
     if config.simulation_mode or _enforce_localhost or \
          (host_config.is_usewalk_host and host_config.is_snmp_host):
@@ -104,7 +119,7 @@ def lookup_ip_address(hostname, family=None):
     if config_cache.in_binary_hostlist(hostname, config.dyndns_hosts):
         return hostname
 
-    return cached_dns_lookup(hostname, family)
+    return None
 
 
 # Variables needed during the renaming of hosts (see automation.py)
@@ -136,13 +151,12 @@ def cached_dns_lookup(hostname, family):
 
     # Now do the actual DNS lookup
     try:
-        ipa = socket.getaddrinfo(hostname, None, family == 4 and socket.AF_INET or
-                                 socket.AF_INET6)[0][4][0]
+        ipa = _dns_lookup(cache_id)
 
         # Update our cached address if that has changed or was missing
         if ipa != cached_ip:
             console.verbose("Updating IPv%d DNS cache for %s: %s\n" % (family, hostname, ipa))
-            _update_ip_lookup_cache(cache_id, ipa)
+            _update_ip_lookup_cache({cache_id: ipa})
 
         cache[cache_id] = ipa  # Update in-memory-cache
         return ipa
@@ -159,6 +173,13 @@ def cached_dns_lookup(hostname, family):
                 "Failed to lookup IPv%d address of %s via DNS: %s" % (family, hostname, e))
 
 
+def cached_ip_addresses(hostname):
+    # type: (str) -> Tuple[Optional[str], Optional[str]]
+    """Returns the IPv4 and IPv6 address of the host stored in the DNS cache file"""
+    ip_lookup_cache = _initialize_ip_lookup_cache()
+    return ip_lookup_cache.get((hostname, 4)), ip_lookup_cache.get((hostname, 6))
+
+
 def _initialize_ip_lookup_cache():
     # Already created and initialized. Simply return it!
     if cmk_base.config_cache.exists("ip_lookup"):
@@ -197,7 +218,9 @@ def _convert_legacy_ip_lookup_cache(ip_lookup_cache):
     ip_lookup_cache.update(new_cache)
 
 
-def _update_ip_lookup_cache(cache_id, ipa):
+def _update_ip_lookup_cache(updates, is_stale=None):
+    # type: (Dict[CacheID, str], Optional[Callable[[CacheID], bool]]) -> None
+    """Applies the updates to the cache file and removes the entries is_stale() is true for"""
     ip_lookup_cache = cmk_base.config_cache.get_dict("ip_lookup")
 
     # Read already known data
@@ -207,11 +230,11 @@ def _update_ip_lookup_cache(cache_id, ipa):
 
         _convert_legacy_ip_lookup_cache(data_from_file)
         ip_lookup_cache.update(data_from_file)
-        ip_lookup_cache[cache_id] = ipa
+        ip_lookup_cache.update(updates)
+        if is_stale is not None:
+            for cache_id in [c for c in ip_lookup_cache if is_stale(c)]:
+                del ip_lookup_cache[cache_id]
 
-        # (I don't like this)
-        # TODO: this file always grows... there should be a cleanup mechanism
-        #       maybe on "cmk --update-dns-cache"
         # The cache_path is already locked from a previous function call..
         cmk.utils.store.save_data_to_file(cache_path, ip_lookup_cache)
     finally:
@@ -233,31 +256,182 @@ def update_dns_cache():
         if e.errno != errno.ENOENT:
             raise
 
+    # Forget the addresses already loaded from the cache file. Otherwise the entries of
+    # removed hosts would be written to the new file again.
+    for cache_name in ["ip_lookup", "cached_dns_lookup", "prefetched_dns_lookup"]:
+        cmk_base.config_cache.get_dict(cache_name).clear()
+
     config_cache = config.get_config_cache()
+    hostnames = config_cache.all_active_hosts()
 
     console.verbose("Updating DNS cache...\n")
-    for hostname in config_cache.all_active_hosts():
-        host_config = config_cache.get_host_config(hostname)
+    prefetch_ip_addresses(hostnames)
 
+    for hostname in hostnames:
         # Use intelligent logic. This prevents DNS lookups for hosts
         # with statically configured addresses, etc.
-        for family in [4, 6]:
-            if (family == 4 and host_config.is_ipv4_host) \
-               or (family == 6 and host_config.is_ipv6_host):
-                console.verbose("%s (IPv%d)..." % (hostname, family))
-                try:
-                    if family == 4:
-                        ip = lookup_ipv4_address(hostname)
-                    else:
-                        ip = lookup_ipv6_address(hostname)
+        for family in _address_families_of(config_cache.get_host_config(hostname)):
+            console.verbose("%s (IPv%d)..." % (hostname, family))
+            try:
+                if family == 4:
+                    ip = lookup_ipv4_address(hostname)
+                else:
+                    ip = lookup_ipv6_address(hostname)
+
+                console.verbose("%s\n" % ip)
+                updated += 1
+            except Exception as e:
+                failed.append(hostname)
+                console.verbose("lookup failed: %s\n" % e)
+                if cmk.utils.debug.enabled():
+                    raise
+                continue
+
+    return updated, failed
 
-                    console.verbose("%s\n" % ip)
-                    updated += 1
+
+def _address_families_of(host_config):
+    # type: (config.HostConfig) -> List[int]
+    families = []
+    if host_config.is_ipv4_host:
+        families.append(4)
+    if host_config.is_ipv6_host:
+        families.append(6)
+    return families
+
+
+#.
+#   .--Prefetching---------------------------------------------------------.
+#   |          ____            __      _       _     _                     |
+#   |         |  _ \ _ __ ___ / _| ___| |_ ___| |__ (_)_ __   __ _         |
+#   |         | |_) | '__/ _ \ |_ / _ \ __/ __| '_ \| | '_ \ / _` |        |
+#   |         |  __/| | |  __/  _|  __/ || (__| | | | | | | | (_| |        |
+#   |         |_|   |_|  \___|_|  \___|\__\___|_| |_|_|_| |_|\__, |        |
+#   |                                                        |___/         |
+#   +----------------------------------------------------------------------+
+#   | Resolve the addresses of many hosts concurrently before they are     |
+#   | looked up one after another.                                         |
+#   '----------------------------------------------------------------------'
+
+
+def prefetch_ip_addresses(hostnames):
+    # type: (Iterable[str]) -> None
+    """Resolves the addresses of the given hosts which are not known yet via DNS
+
+    At most max_concurrent_dns_lookups lookups are executed at the same time. The
+    results are used by the following calls of lookup_ip_address(). Failed lookups
+    raise the same exception as before when the address is looked up. Changed
+    addresses are written to the DNS cache file at once. The entries of hosts and
+    address families which are not configured anymore are removed at the same time."""
+    config_cache = config.get_config_cache()
+    memory_cache = cmk_base.config_cache.get_dict("cached_dns_lookup")
+    ip_lookup_cache = _initialize_ip_lookup_cache()
+
+    cache_ids = []  # type: List[CacheID]
+    for hostname in hostnames:
+        host_config = config_cache.get_host_config(hostname)
+        if host_config.is_no_ip_host:
+            continue
+
+        for family in _address_families_of(host_config):
+            cache_id = hostname, family
+            if cache_id in memory_cache or _configured_ip_address(hostname, family) is not None:
+                continue
+            if config.use_dns_cache and ip_lookup_cache.get(cache_id):
+                continue
+            cache_ids.append(cache_id)
+
+    updates = {}  # type: Dict[CacheID, str]
+    # A single address is not worth it, it is looked up as usual
+    if len(cache_ids) > 1:
+        console.verbose("Resolving %d addresses...\n" % len(cache_ids))
+        results = _resolve_concurrently(cache_ids)
+        cmk_base.config_cache.get_dict("prefetched_dns_lookup").update(results)
+
+        for (hostname, family), ipa in sorted(results.items()):
+            if isinstance(ipa, Exception) or ipa == ip_lookup_cache.get((hostname, family)):
+                continue
+            console.verbose("Updating IPv%d DNS cache for %s: %s\n" % (family, hostname, ipa))
+            updates[(hostname, family)] = ipa
+
+    def is_stale(cache_id):
+        # type: (CacheID) -> bool
+        return _is_stale_cache_entry(config_cache, cache_id)
+
+    if updates or any(is_stale(cache_id) for cache_id in ip_lookup_cache):
+        _update_ip_lookup_cache(updates, is_stale)
+
+
+def _is_stale_cache_entry(config_cache, cache_id):
+    # type: (config.ConfigCache, CacheID) -> bool
+    hostname, family = cache_id
+    if hostname not in config_cache.all_configured_hosts():
+        return True
+    return family not in _address_families_of(config_cache.get_host_config(hostname))
+
+
+def _resolve_concurrently(cache_ids):
+    # type: (List[CacheID]) -> Dict[CacheID, Union[str, Exception]]
+    """Looks up the addresses with a pool of threads
+
+    A lookup that takes longer than dns_lookup_timeout seconds fails. The thread
+    executing it is left behind, because the lookup can not be interrupted."""
+    timeout = config.dns_lookup_timeout
+    results = {}  # type: Dict[CacheID, Union[str, Exception]]
+    started = {}  # type: Dict[CacheID, float]
+
+    def resolve(cache_id):
+        started[cache_id] = time.time()
+        return _resolve(cache_id)
+
+    executor = futures.ThreadPoolExecutor(
+        max_workers=max(1, min(config.max_concurrent_dns_lookups, len(cache_ids))))
+    try:
+        jobs = {executor.submit(resolve, cache_id): cache_id for cache_id in cache_ids}
+        while jobs:
+            now = time.time()
+            deadlines = [
+                started[cache_id] + timeout for cache_id in jobs.values() if cache_id in started
+            ]
+            wait_timeout = max(0.0, min(deadlines) - now) if deadlines else timeout
+            done, _not_done = futures.wait(
+                jobs.keys(), timeout=wait_timeout, return_when=futures.FIRST_COMPLETED)
+
+            for job in done:
+                cache_id = jobs.pop(job)
+                try:
+                    results[cache_id] = job.result()
                 except Exception as e:
-                    failed.append(hostname)
-                    console.verbose("lookup failed: %s\n" % e)
-                    if cmk.utils.debug.enabled():
-                        raise
-                    continue
+                    results[cache_id] = e
+
+            now = time.time()
+            for job, cache_id in jobs.items():
+                if cache_id in started and now - started[cache_id] >= timeout:
+                    del jobs[job]
+                    results[cache_id] = MKIPAddressLookupError(
+                        "Timed out after %s seconds" % timeout)
+    finally:
+        # Don't wait for the lookups which timed out
+        executor.shutdown(wait=False)
 
-    return updated, failed
+    return results
+
+
+def _dns_lookup(cache_id):
+    # type: (CacheID) -> str
+    prefetched = cmk_base.config_cache.get_dict("prefetched_dns_lookup")
+    try:
+        result = prefetched.pop(cache_id)
+    except KeyError:
+        return _resolve(cache_id)
+
+    if isinstance(result, Exception):
+        raise result  # pylint: disable=raising-bad-type
+    return result
+
+
+def _resolve(cache_id):
+    # type: (CacheID) -> str
+    hostname, family = cache_id
+    return socket.getaddrinfo(hostname, None, family == 4 and socket.AF_INET or
+                              socket.AF_INET6)[0][4][0]
@@ -39,8 +39,14 @@ Do not store long-time things here. Also do not store complex
 structures like log files or stuff.
 """
 
+import ast
+import errno
+import marshal
+import mmap
 import os
+import struct
 import traceback
+import zlib
 
 import cmk.utils.paths
 import cmk.utils.store
@@ -67,6 +73,200 @@ class MKCounterWrapped(Exception):
         return self.reason
 
 
+class ItemStateFile(object):
+    """Compact on-disk representation of the item states of one host
+
+    The file starts with a magic marker followed by a sequence of records.
+    Each record consists of a fixed size header (flags, key length, value
+    length, value capacity, checksum of key and value), the marshaled key and
+    a value slot of "capacity" bytes holding the marshaled value. Slots are allocated with some headroom,
+    so that an updated value normally fits into its existing slot and is
+    written in place. Removed keys and values that outgrow their slot turn
+    the old record into a dead one; a new record is appended in the latter
+    case. Once dead records make up the larger part of the file it is
+    rewritten from scratch.
+
+    Updating a record in place is not atomic. A record torn by an interrupted
+    write does not match its checksum anymore and is skipped while reading.
+    Since key length and capacity of a record never change, the following
+    records are still found.
+
+    Files written by previous versions (repr() of a dict) are read
+    transparently and converted to this format on the next write.
+
+    All writing methods expect the caller to hold the lock on the file.
+    """
+    MAGIC = "CMKIS\x00\x02\n"
+    _HEADER = struct.Struct("<BIIII")
+    _FLAG_DEAD = 0
+    _FLAG_LIVE = 1
+    _MIN_COMPACT_SIZE = 65536
+
+    def __init__(self, path):
+        super(ItemStateFile, self).__init__()
+        self.path = path
+        self._reset_index()
+
+    def _reset_index(self):
+        # key -> (record offset, key length, value capacity)
+        self._index = {}
+        self._end = len(self.MAGIC)
+        self._dead_bytes = 0
+        self._valid = False
+
+    def read(self):
+        """Returns all item states of the file and rebuilds the record index"""
+        self._reset_index()
+        try:
+            f = open(self.path, "rb")
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return {}
+
+        try:
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                if not size:
+                    return {}  # May be created empty during locking
+
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    if buf[:len(self.MAGIC)] != self.MAGIC:
+                        if buf[:len(self.MAGIC) - 2] == self.MAGIC[:-2]:
+                            return {}  # Other version of this format. Will be rewritten.
+                        return self._read_legacy(buf[:])
+                    return self._read_records(buf, size)
+                finally:
+                    buf.close()
+        except Exception as e:
+            self._reset_index()
+            raise MKGeneralException("Cannot read file \"%s\": %s" % (self.path, e))
+
+    def _read_legacy(self, content):
+        content = content.strip()
+        if not content:
+            return {}
+        return ast.literal_eval(content)
+
+    def _read_records(self, buf, size):
+        states = {}
+        header_size = self._HEADER.size
+        offset = len(self.MAGIC)
+        while offset + header_size <= size:
+            flags, key_len, value_len, capacity, checksum = self._HEADER.unpack_from(buf, offset)
+            record_end = offset + header_size + key_len + capacity
+            if record_end > size:
+                break  # Truncated by an interrupted append. Will be overwritten.
+
+            key_start = offset + header_size
+            value_start = key_start + key_len
+            key_data = buf[key_start:value_start]
+            value_data = buf[value_start:value_start + min(value_len, capacity)]
+            if flags == self._FLAG_LIVE and checksum == self._checksum(key_data, value_data):
+                key = marshal.loads(key_data)
+                states[key] = marshal.loads(value_data)
+                self._index[key] = (offset, key_len, capacity)
+            else:
+                self._dead_bytes += record_end - offset
+
+            offset = record_end
+
+        self._end = offset
+        self._valid = True
+        return states
+
+    def write(self, states, changed_keys):
+        """Brings the file in sync with states
+
+        Only the records of the changed_keys are touched. The file is
+        completely rewritten in case it is not in the current format yet
+        or is mostly made of dead records."""
+        if not self._valid or self._needs_compaction():
+            self.rewrite(states)
+            return
+
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            if os.fstat(fd).st_size > self._end:
+                os.ftruncate(fd, self._end)
+
+            for key in changed_keys:
+                if key in states:
+                    self._put_record(fd, key, states[key])
+                else:
+                    self._kill_record(fd, key)
+        finally:
+            os.close(fd)
+
+    def _needs_compaction(self):
+        return self._dead_bytes > max(self._MIN_COMPACT_SIZE, self._end / 2)
+
+    def _put_record(self, fd, key, value):
+        value_data = marshal.dumps(value, 2)
+        entry = self._index.get(key)
+        if entry is not None and len(value_data) <= entry[2]:
+            offset, _key_len, capacity = entry
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, self._record_head(marshal.dumps(key, 2), value_data, capacity))
+            return
+
+        if entry is not None:
+            self._kill_record(fd, key)
+
+        record = self._record(key, value_data, self._index, self._end)
+        os.lseek(fd, self._end, os.SEEK_SET)
+        os.write(fd, record)
+        self._end += len(record)
+
+    def _kill_record(self, fd, key):
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+
+        offset, key_len, capacity = entry
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, chr(self._FLAG_DEAD))
+        self._dead_bytes += self._HEADER.size + key_len + capacity
+
+    def rewrite(self, states):
+        """Writes all states to a new file which replaces the current one"""
+        self._reset_index()
+        index = {}
+        chunks = [self.MAGIC]
+        offset = len(self.MAGIC)
+        for key, value in states.iteritems():
+            record = self._record(key, marshal.dumps(value, 2), index, offset)
+            chunks.append(record)
+            offset += len(record)
+
+        cmk.utils.store.save_file(self.path, "".join(chunks))
+
+        self._index = index
+        self._end = offset
+        self._valid = True
+
+    def _record(self, key, value_data, index, offset):
+        """Creates a new record and registers it in the given index"""
+        key_data = marshal.dumps(key, 2)
+        capacity = len(value_data) + max(8, len(value_data) / 2)
+        index[key] = (offset, len(key_data), capacity)
+        return self._record_head(key_data, value_data,
+                                 capacity) + "\x00" * (capacity - len(value_data))
+
+    def _record_head(self, key_data, value_data, capacity):
+        """Header, key and value of a live record, without the free space of the value slot"""
+        return "".join([
+            self._HEADER.pack(self._FLAG_LIVE, len(key_data), len(value_data), capacity,
+                              self._checksum(key_data, value_data)),
+            key_data,
+            value_data,
+        ])
+
+    def _checksum(self, key_data, value_data):
+        return zlib.crc32(value_data, zlib.crc32(key_data)) & 0xffffffff
+
+
 class CachedItemStates(object):
     def __init__(self):
         super(CachedItemStates, self).__init__()
@@ -84,17 +284,26 @@ class CachedItemStates(object):
         self._last_mtime = None  # timestamp of last modification
         self._removed_item_state_keys = []
         self._updated_item_states = {}
+        self._item_state_file = None
+
+    def _get_item_state_file(self, filename):
+        if self._item_state_file is None or self._item_state_file.path != filename:
+            self._item_state_file = ItemStateFile(filename)
+            self._last_mtime = None
+        return self._item_state_file
 
     def load(self, hostname):
         filename = cmk.utils.paths.counters_dir + "/" + hostname
+        item_state_file = self._get_item_state_file(filename)
         try:
             # TODO: refactoring. put these two values into a named tuple
-            self._item_states = cmk.utils.store.load_data_from_file(filename, default={}, lock=True)
+            cmk.utils.store.aquire_lock(filename)
+            self._item_states = item_state_file.read()
             self._last_mtime = os.stat(filename).st_mtime
         finally:
             cmk.utils.store.release_lock(filename)
 
-    # TODO: self._last_mtime needs be updated accordingly after the save_data_to_file operation
+    # TODO: self._last_mtime needs be updated accordingly after the write operation
     #       right now, the current mechanism is sufficient enough, since the save() function is only
     #       called as the final operation, just before the lifecycle of the CachedItemState ends
     def save(self, hostname):
@@ -102,7 +311,7 @@ class CachedItemStates(object):
         It simply returns, if it detects that the data wasn't changed at all since the last loading
         If the data on disk has been changed in the meantime, the cached data is updated from disk.
         Afterwards only the actual modifications (update/remove) are applied to the updated cached
-        data before it is written back to disk.
+        data and only the records of the modified keys are written back to disk.
         """
         filename = cmk.utils.paths.counters_dir + "/" + hostname
         if not self._removed_item_state_keys and not self._updated_item_states:
@@ -112,10 +321,11 @@ class CachedItemStates(object):
             if not os.path.exists(cmk.utils.paths.counters_dir):
                 os.makedirs(cmk.utils.paths.counters_dir)
 
+            item_state_file = self._get_item_state_file(filename)
             cmk.utils.store.aquire_lock(filename)
             last_mtime = os.stat(filename).st_mtime
             if last_mtime != self._last_mtime:
-                self._item_states = cmk.utils.store.load_data_from_file(filename, default={})
+                self._item_states = item_state_file.read()
 
                 # Remove obsolete keys
                 for key in self._removed_item_state_keys:
@@ -127,7 +337,9 @@ class CachedItemStates(object):
                 # Add updated keys
                 self._item_states.update(self._updated_item_states)
 
-            cmk.utils.store.save_data_to_file(filename, self._item_states, pretty=False)
+            changed_keys = set(self._removed_item_state_keys)
+            changed_keys.update(self._updated_item_states)
+            item_state_file.write(self._item_states, changed_keys)
         except Exception:
             raise MKGeneralException("Cannot write to %s: %s" % (filename, traceback.format_exc()))
         finally:
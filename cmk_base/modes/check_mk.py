@@ -1102,8 +1102,10 @@ modes.register(
 
 
 def mode_update(options):
-    from cmk_base.core_config import do_update
-    do_update(create_core(options), with_precompile=True)
+    import cmk_base.core_config as core_config
+    if options.get("full-rebuild"):
+        core_config.enforce_full_rebuild()
+    core_config.do_update(create_core(options), with_precompile=True)
 
 
 modes.register(
@@ -1119,6 +1121,9 @@ modes.register(
             "CEE only: When using the Check_MK Microcore, the core is created "
             "and the configuration for the Check_MK check helpers is being created.",
             "The agent bakery is updating the agents.",
+            "With incremental_core_config enabled only the configuration of hosts "
+            "with a changed configuration is recreated. Use --full-rebuild to "
+            "recreate the configuration of all hosts.",
         ],
         sub_options=[
             Option(
@@ -1127,6 +1132,10 @@ modes.register(
                 argument_descr="X",
                 short_help="Relative filename for CMC config file",
             ),
+            Option(
+                long_option="full-rebuild",
+                short_help="Recreate the configuration of all hosts",
+            ),
         ],
     ))
 
@@ -1632,6 +1641,63 @@ modes.register(
             ),
         ]))
 
+#.
+#   .--check-helper-daemon-------------------------------------------------.
+#   |                 _               _      _          _                  |
+#   |             ___| |__   ___  ___| | __ | |__   ___| |_ __   ___ _ __  |
+#   |            / __| '_ \ / _ \/ __| |/ / | '_ \ / _ \ | '_ \ / _ \ '__| |
+#   |           | (__| | | |  __/ (__|   <  | | | |  __/ | |_) |  __/ |    |
+#   |            \___|_| |_|\___|\___|_|\_\ |_| |_|\___|_| .__/ \___|_|    |
+#   |                                                    |_|               |
+#   '----------------------------------------------------------------------'
+
+
+def mode_check_helper_daemon():
+    import cmk_base.check_helper as check_helper
+    config.load_packed_config()
+    check_helper.CheckHelperDaemon().run()
+
+
+modes.register(
+    Mode(
+        long_option="check-helper-daemon",
+        handler_function=mode_check_helper_daemon,
+        needs_config=False,
+        short_help="Serve host checks of the precompiled host checks",
+        long_help=[
+            "Start a pool of persistent worker processes which execute the "
+            "Check_MK checks of hosts on behalf of the precompiled host checks. "
+            "The check plugins and the activated configuration are loaded only "
+            "once. The daemon restarts itself after the configuration has been "
+            "activated again with 'cmk -O' or 'cmk -R'.",
+            "The precompiled host checks only use the daemon when the option "
+            "check_helper_daemon is enabled.",
+        ],
+    ))
+
+
+def mode_automation_helper_daemon():
+    import cmk_base.automation_helper as automation_helper
+    automation_helper.AutomationHelperDaemon().run()
+
+
+modes.register(
+    Mode(
+        long_option="automation-helper-daemon",
+        handler_function=mode_automation_helper_daemon,
+        needs_config=False,
+        needs_checks=False,
+        short_help="Serve the automation calls of the GUI",
+        long_help=[
+            "Start a pool of persistent worker processes which execute the "
+            "automation calls of the GUI. The check plugins and the configuration "
+            "are loaded only once. Each automation call is executed in a separate "
+            "process forked from a worker. The daemon restarts itself once the "
+            "configuration files or the check plugins have been changed.",
+            "The GUI uses the daemon automatically in case it is running.",
+        ],
+    ))
+
 #.
 #   .--version-------------------------------------------------------------.
 #   |                                     _                                |
@@ -24,9 +24,11 @@
 # to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
 # Boston, MA 02110-1301 USA.
 
+import cPickle
 import errno
 import os
 import tempfile
+import time
 
 import cmk.utils.paths
 import cmk.utils.translations
@@ -36,6 +38,9 @@ from cmk.utils.exceptions import MKGeneralException
 import cmk_base.utils
 import cmk_base.console as console
 
+# Cache of the last loaded piggyback index: (inode, mtime, size) of the file and the index
+_g_index = (None, None)
+
 
 def get_piggyback_raw_data(piggyback_max_cachefile_age, hostname):
     """Returns the usable piggyback data for the given host
@@ -69,56 +74,27 @@ def has_piggyback_raw_data(piggyback_max_cachefile_age, hostname):
 def get_piggyback_files(piggyback_max_cachefile_age, hostname):
     """Gather a list of piggyback files to read for further processing.
 
+    The piggyback index only contains the files of the latest batch of
+    each source host that is still sending piggyback data. Files that are
+    not part of it are outdated, so only the age needs to be checked here.
+
     Please note that there may be multiple parallel calls executing the
     get_piggyback_files(), store_piggyback_raw_data() or cleanup_piggyback_files()
     functions. Therefor all these functions needs to deal with suddenly vanishing or
     updated files/directories.
     """
     files = []
-    host_piggyback_dir = cmk.utils.paths.piggyback_dir / hostname
-
-    # cleanup_piggyback_files() may remove stale piggyback files of one source
-    # host and also the directory "hostname" when the last piggyback file for the
-    # current host was removed. This may cause the os.listdir() to fail. We treat
-    # this as regular case: No piggyback files for the current host.
-    try:
-        source_host_names = [e.name for e in host_piggyback_dir.iterdir()]
-    except OSError as e:
-        if e.errno == errno.ENOENT:
-            return files
-        else:
-            raise
-
-    for source_host in source_host_names:
-        if source_host.startswith("."):
-            continue
-
-        piggyback_file_path = host_piggyback_dir / source_host
-
-        try:
-            file_age = cmk_base.utils.cachefile_age(str(piggyback_file_path))
-        except MKGeneralException:
-            continue  # File might've been deleted. That's ok.
+    now = time.time()
+    for source_host, timestamp in _load_index()["targets"].get(hostname, {}).items():
+        piggyback_file_path = cmk.utils.paths.piggyback_dir / hostname / source_host
 
         # Skip piggyback files that are outdated at all
+        file_age = now - timestamp
         if file_age > piggyback_max_cachefile_age:
             console.verbose("Piggyback file %s is outdated (%d seconds too old). Skip processing.\n"
                             % (piggyback_file_path, file_age - piggyback_max_cachefile_age))
             continue
 
-        status_file_path = _piggyback_source_status_path(source_host)
-        if not os.path.exists(status_file_path):
-            console.verbose(
-                "Piggyback file %s is outdated (Source not sending piggyback). Skip processing.\n" %
-                piggyback_file_path)
-            continue
-
-        if _is_piggyback_file_outdated(status_file_path, str(piggyback_file_path)):
-            console.verbose(
-                "Piggyback file %s is outdated (Not updated by source). Skip processing.\n" %
-                piggyback_file_path)
-            continue
-
         files.append((source_host, str(piggyback_file_path)))
 
     return files
@@ -157,7 +133,12 @@ def remove_source_status_file(source_host):
     """Remove the source_status_file of this piggyback host which will
     mark the piggyback data from this source as outdated."""
     source_status_path = _piggyback_source_status_path(source_host)
-    return _remove_piggyback_file(source_status_path)
+    removed = _remove_piggyback_file(source_status_path)
+
+    if source_host in _load_index()["sources"]:
+        _update_index(lambda index: _remove_source(index, source_host))
+
+    return removed
 
 
 def store_piggyback_raw_data(source_host, piggybacked_raw_data):
@@ -173,11 +154,22 @@ def store_piggyback_raw_data(source_host, piggybacked_raw_data):
     # We use the mtime of this file later for comparison.
     # Only do this for hosts that sent piggyback data this turn, cleanup the status file when no
     # piggyback data was sent this turn.
-    if piggybacked_raw_data:
-        status_file_path = _piggyback_source_status_path(source_host)
-        _store_status_file_of(status_file_path, piggyback_file_paths)
-    else:
+    if not piggybacked_raw_data:
         remove_source_status_file(source_host)
+        return
+
+    status_file_path = _piggyback_source_status_path(source_host)
+    timestamp = _store_status_file_of(status_file_path, piggyback_file_paths)
+
+    # Replace the whole batch of this source at once. The files of the hosts that
+    # are not part of this batch anymore are outdated now.
+    def replace_batch(index):
+        dropped_hosts = _remove_source(index, source_host) - set(piggybacked_raw_data)
+        _add_source(index, source_host, timestamp, piggybacked_raw_data)
+        return dropped_hosts
+
+    for piggybacked_host in _update_index(replace_batch):
+        _remove_piggybacked_file(piggybacked_host, source_host, "Not updated by source")
 
 
 def _store_status_file_of(status_file_path, piggyback_file_paths):
@@ -201,6 +193,21 @@ def _store_status_file_of(status_file_path, piggyback_file_paths):
                 else:
                     raise
     os.rename(tmp_path, status_file_path)
+    return tmp_stats.st_mtime
+
+
+def _remove_piggybacked_file(piggybacked_host, source_host, reason):
+    """Remove the piggyback file and the directory of the piggybacked host once it is empty"""
+    backed_host_dir_path = cmk.utils.paths.piggyback_dir / piggybacked_host
+    piggyback_file_path = str(backed_host_dir_path / source_host)
+    console.verbose("Removing outdated piggyback file (%s) %s\n" % (reason, piggyback_file_path))
+    _remove_piggyback_file(piggyback_file_path)
+
+    try:
+        os.rmdir(str(backed_host_dir_path))
+    except OSError as e:
+        if e.errno not in [errno.ENOTEMPTY, errno.ENOENT]:
+            raise
 
 
 def cleanup_piggyback_files(piggyback_max_cachefile_age):
@@ -247,63 +254,186 @@ def _cleanup_old_piggybacked_files(piggyback_max_cachefile_age):
     """Remove piggyback data that is not needed anymore
 
     The monitoring (get_piggyback_files()) is already skipping these files,
-    but we need some cleanup mechanism.
+    but we need some cleanup mechanism. Files of former batches have already
+    been removed when the source stored its latest batch. The index tells us
+    which files remain, so there is no need to walk the whole directory tree.
 
     - Remove all piggyback files created by sources without status file
-    - Remove all piggyback files that are older that the current status file of the source host
+    - Remove all piggyback files that are older than piggyback_max_cachefile_age
     - Cleanup empty backed host directories below "piggyback"
     """
-    keep_sources = set(os.listdir(str(cmk.utils.paths.piggyback_source_dir)))
+    keep_sources = set(
+        e for e in os.listdir(str(cmk.utils.paths.piggyback_source_dir)) if e[0] != ".")
+    now = time.time()
+
+    def remove_outdated(index):
+        outdated = []
+        for source_host, (timestamp, piggybacked_hosts) in index["sources"].items():
+            if source_host not in keep_sources:
+                reason = "Source not sending piggyback data"
+            elif now - timestamp > piggyback_max_cachefile_age:
+                reason = "%d seconds too old" % (now - timestamp - piggyback_max_cachefile_age)
+            else:
+                continue
 
-    base_dir = os.path.join(cmk.utils.paths.tmp_dir, "piggyback")
-    for backed_host_name in os.listdir(base_dir):
-        if backed_host_name[0] == ".":
-            continue
+            _remove_source(index, source_host)
+            outdated += [(host, source_host, reason) for host in piggybacked_hosts]
+        return outdated
+
+    for piggybacked_host, source_host, reason in _update_index(remove_outdated):
+        _remove_piggybacked_file(piggybacked_host, source_host, reason)
+
+
+#.
+#   .--Index---------------------------------------------------------------.
+#   |                     ___           _                                  |
+#   |                    |_ _|_ __   __| | _____  __                       |
+#   |                     | || '_ \ / _` |/ _ \ \/ /                       |
+#   |                     | || | | | (_| |  __/>  <                        |
+#   |                    |___|_| |_|\__,_|\___/_/\_\                       |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | The piggyback index holds the latest batch of every source host that |
+#   | is still sending piggyback data: The piggybacked hosts it was sent   |
+#   | for and the time it was stored. The reverse mapping from piggybacked |
+#   | host to its valid source hosts is part of the index to make looking  |
+#   | up the data of a host a single dictionary access.                    |
+#   |                                                                      |
+#   | The piggyback files are still the primary data. The index can always |
+#   | be recreated from them, for example after the host files have been   |
+#   | renamed or removed (see invalidate_index()).                         |
+#   '----------------------------------------------------------------------'
+
+
+def _index_path():
+    return str(cmk.utils.paths.piggyback_source_dir / ".index")
+
+
+def _load_index():
+    """Returns the current piggyback index
+
+    The file is only read again when it has been replaced in the meantime.
+    A missing index is created from the piggyback files."""
+    global _g_index
+    path = _index_path()
+    try:
+        with open(path, "rb") as f:
+            stats = os.fstat(f.fileno())
+            file_id = (stats.st_ino, stats.st_mtime, stats.st_size)
+            if file_id == _g_index[0]:
+                return _g_index[1]
+            index = _parse_index(f.read())
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        index = None
 
-        # Cleanup piggyback files from sources that we have no status file for
-        backed_host_dir_path = os.path.join(base_dir, backed_host_name)
-        for source_host_name in os.listdir(backed_host_dir_path):
-            if source_host_name[0] == ".":
-                continue
+    if index is None:
+        # The index is missing or currently being created (empty lock file)
+        _update_index(lambda index: None)
+        return _load_index()
 
-            piggyback_file_path = os.path.join(backed_host_dir_path, source_host_name)
+    _g_index = (file_id, index)
+    return index
 
-            delete_reason = _shall_cleanup_piggyback_file(
-                piggyback_max_cachefile_age, piggyback_file_path, source_host_name, keep_sources)
-            if delete_reason:
-                console.verbose("Removing outdated piggyback file (%s) %s\n" %
-                                (delete_reason, piggyback_file_path))
-                _remove_piggyback_file(piggyback_file_path)
 
-        # Remove empty backed host directory
-        try:
-            os.rmdir(backed_host_dir_path)
-        except OSError as e:
-            if e.errno == errno.ENOTEMPTY:
-                pass
-            else:
-                raise
+def _parse_index(content):
+    if not content:
+        return None
+    try:
+        return cPickle.loads(content)
+    except Exception as e:
+        console.verbose("Ignoring invalid piggyback index: %s\n" % e)
+        return None
+
+
+def _update_index(update_func):
+    """Apply update_func() to the index while holding the lock and write it back
+
+    Returns the result of update_func()."""
+    path = _index_path()
+    store.aquire_lock(path)
+    try:
+        index = _parse_index(file(path, "rb").read())
+        if index is None:
+            index = _create_index()
 
+        result = update_func(index)
+        store.save_file(path, cPickle.dumps(index, cPickle.HIGHEST_PROTOCOL))
+        return result
+    finally:
+        store.release_lock(path)
 
-def _shall_cleanup_piggyback_file(piggyback_max_cachefile_age, piggyback_file_path,
-                                  source_host_name, keep_sources):
-    if source_host_name not in keep_sources:
-        return "Source not sending piggyback data"
 
+def invalidate_index():
+    """Make the next access recreate the index from the piggyback files
+
+    This needs to be done after changing the piggyback files without the
+    functions of this module, e.g. when renaming or removing hosts."""
+    path = _index_path()
+    store.aquire_lock(path)
     try:
-        file_age = cmk_base.utils.cachefile_age(piggyback_file_path)
-    except MKGeneralException:
-        return None  # File might've been deleted. That's ok.
+        _remove_piggyback_file(path)
+    finally:
+        store.release_lock(path)
+
+
+def _add_source(index, source_host, timestamp, piggybacked_hosts):
+    index["sources"][source_host] = (timestamp, set(piggybacked_hosts))
+    for piggybacked_host in piggybacked_hosts:
+        index["targets"].setdefault(piggybacked_host, {})[source_host] = timestamp
+
 
-    # Skip piggyback files that are outdated at all
-    if file_age > piggyback_max_cachefile_age:
-        return "%d seconds too old" % (file_age - piggyback_max_cachefile_age)
+def _remove_source(index, source_host):
+    """Remove the current batch of the source from the index and return its piggybacked hosts"""
+    _timestamp, piggybacked_hosts = index["sources"].pop(source_host, (None, set()))
+    for piggybacked_host in piggybacked_hosts:
+        source_hosts = index["targets"].get(piggybacked_host, {})
+        source_hosts.pop(source_host, None)
+        if not source_hosts:
+            index["targets"].pop(piggybacked_host, None)
+    return piggybacked_hosts
 
-    status_file_path = _piggyback_source_status_path(source_host_name)
-    if not os.path.exists(status_file_path):
-        return "Source not sending piggyback"
 
-    if _is_piggyback_file_outdated(status_file_path, piggyback_file_path):
-        return "Not updated by source"
+def _create_index():
+    """Create the index from the piggyback files
+
+    Files not written together with the current status file of their source
+    host are outdated. They are removed right away, as the cleanup only
+    removes the files known to the index."""
+    console.verbose("Creating piggyback index\n")
+    index = {"sources": {}, "targets": {}}
+
+    status_times = {}
+    for source_host in _listdir(str(cmk.utils.paths.piggyback_source_dir)):
+        try:
+            status_times[source_host] = os.stat(_piggyback_source_status_path(source_host)).st_mtime
+        except OSError:
+            continue  # File might've been deleted. That's ok.
 
-    return None
+    batches = {}
+    for piggybacked_host in _listdir(str(cmk.utils.paths.piggyback_dir)):
+        backed_host_dir_path = cmk.utils.paths.piggyback_dir / piggybacked_host
+        for source_host in _listdir(str(backed_host_dir_path)):
+            piggyback_file_path = str(backed_host_dir_path / source_host)
+            if source_host not in status_times:
+                _remove_piggybacked_file(piggybacked_host, source_host,
+                                         "Source not sending piggyback data")
+            elif _is_piggyback_file_outdated(
+                    _piggyback_source_status_path(source_host), piggyback_file_path):
+                _remove_piggybacked_file(piggybacked_host, source_host, "Not updated by source")
+            else:
+                batches.setdefault(source_host, []).append(piggybacked_host)
+
+    for source_host, piggybacked_hosts in batches.items():
+        _add_source(index, source_host, status_times[source_host], piggybacked_hosts)
+    return index
+
+
+def _listdir(path):
+    try:
+        return [e for e in os.listdir(path) if e[0] != "."]
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
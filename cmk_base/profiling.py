@@ -31,6 +31,7 @@ import cmk_base.console as console
 
 _profile = None
 _profile_path = "profile.out"
+_statistics = []  # List of (title, function returning a list of (name, value))
 
 
 def enable():
@@ -45,6 +46,19 @@ def enabled():
     return _profile is not None
 
 
+def register_statistics(title, get_statistics):
+    """Register a function providing statistics (e.g. cache hits) to be shown
+    together with the profile"""
+    _statistics.append((title, get_statistics))
+
+
+def output_statistics():
+    for title, get_statistics in _statistics:
+        console.output("%s:\n" % title, stream=sys.stderr)
+        for name, value in get_statistics():
+            console.output("  %-20s %s\n" % (name + ":", value), stream=sys.stderr)
+
+
 def output_profile():
     if not _profile:
         return
@@ -58,5 +72,7 @@ def output_profile():
                 "stats.sort_stats('time').print_stats()\n" % _profile_path)
     os.chmod(show_profile, 0755)
 
+    output_statistics()
+
     console.output(
         "Profile '%s' written. Please run %s.\n" % (_profile_path, show_profile), stream=sys.stderr)
@@ -24,6 +24,7 @@
 # to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
 # Boston, MA 02110-1301 USA.
 
+import marshal
 import os
 import subprocess
 from typing import Tuple, Optional, Any, Dict, List  # pylint: disable=unused-import
@@ -56,6 +57,11 @@ _g_single_oid_ipaddress = None
 _g_single_oid_cache = None
 # TODO: Move to StoredWalkSNMPBackend?
 _g_walk_cache = {}  # type: Dict[str, List[str]]
+# Results of the walks planned by prefetch_snmp_tables()
+_PlannedWalkKey = Tuple[str, Optional[str], Tuple[Optional[str], ...]]
+_g_planned_walks = {}  # type: Dict[_PlannedWalkKey, Dict[str, snmp_utils.SNMPRowInfo]]
+# Walks of cachable columns loaded from the walk cache files of the hosts
+_g_snmpwalk_cache = {}  # type: Dict[str, Dict[str, snmp_utils.SNMPRowInfo]]
 
 #.
 #   .--caching-------------------------------------------------------------.
@@ -85,6 +91,32 @@ def initialize_single_oid_cache(snmp_config, from_disk=False):
             _g_single_oid_cache = {}
 
 
+def prefetch_single_oids(snmp_config, oids):
+    # type: (snmp_utils.SNMPHostConfig, List[str]) -> None
+    """Add the given OIDs to the single OID cache with as few requests as possible
+
+    With SNMPv3 contexts the OIDs are left to get_single_oid(), because the
+    contexts depend on the check plugin."""
+    oids = [oid for oid in oids if not _is_in_single_oid_cache(snmp_config, oid)]
+    if not oids or (snmp_utils.is_snmpv3_host(snmp_config) and snmp_config.snmpv3_contexts):
+        return
+
+    console.vverbose("       Getting OIDs %s: " % ", ".join(oids))
+    try:
+        snmp_backend = SNMPBackendFactory().factory(
+            snmp_config, enforce_stored_walks=_enforce_stored_walks)
+        values = snmp_backend.get_many(snmp_config, oids)
+    except:
+        if cmk.utils.debug.enabled():
+            raise
+        console.vverbose("failed.\n")
+        return
+
+    console.vverbose("%s%d values%s\n" % (tty.bold, len(values), tty.normal))
+    for oid, value in values.iteritems():
+        set_single_oid_cache(snmp_config, oid, value)
+
+
 def write_single_oid_cache(snmp_config):
     # type: (snmp_utils.SNMPHostConfig) -> None
     if not _g_single_oid_cache:
@@ -118,8 +150,10 @@ def _load_single_oid_cache(snmp_config):
 
 def cleanup_host_caches():
     # type: () -> None
-    global _g_walk_cache
+    global _g_walk_cache, _g_planned_walks, _g_snmpwalk_cache
     _g_walk_cache = {}
+    _g_planned_walks = {}
+    _g_snmpwalk_cache = {}
     _clear_other_hosts_oid_cache(None)
     if inline_snmp:
         inline_snmp.cleanup_inline_snmp_globals()
@@ -186,6 +220,9 @@ def get_snmp_table(snmp_config, check_plugin_name, oid_info, use_snmpwalk_cache)
         max_len = 0
         max_len_col = -1
 
+        prefetched_rowinfos = _prefetch_snmpwalks(snmp_config, check_plugin_name, oid, suboid,
+                                                  targetcolumns)
+
         for colno, column in enumerate(targetcolumns):
             fetchoid, value_encoding = _compute_fetch_oid(oid, suboid, column)
 
@@ -210,8 +247,10 @@ def get_snmp_table(snmp_config, check_plugin_name, oid_info, use_snmpwalk_cache)
                 index_format = column
                 continue
 
-            rowinfo = _get_snmpwalk(snmp_config, check_plugin_name, oid, fetchoid, column,
-                                    use_snmpwalk_cache)
+            rowinfo = prefetched_rowinfos.get(fetchoid)
+            if rowinfo is None:
+                rowinfo = _get_snmpwalk(snmp_config, check_plugin_name, oid, fetchoid, column,
+                                        use_snmpwalk_cache)
 
             columns.append((fetchoid, rowinfo, value_encoding))
             number_of_rows = len(rowinfo)
@@ -264,6 +303,92 @@ def get_snmp_table(snmp_config, check_plugin_name, oid_info, use_snmpwalk_cache)
     return info
 
 
+def prefetch_snmp_tables(snmp_config, tables, use_snmpwalk_cache):
+    # type: (snmp_utils.SNMPHostConfig, List[Tuple[str, Any]], bool) -> None
+    """Walk the columns of all SNMP tables of a host with as few walks as possible
+
+    The tables are given as pairs of the check plugin name and the oid_info
+    handed over to get_snmp_table() later. Different sections often request
+    overlapping subtrees. Each OID is walked only once and a column which is
+    part of the subtree of another requested OID is taken from the walk of
+    that OID. The results are used by get_snmp_table() until the host caches
+    are cleaned up.
+
+    The walks are performed in the order of the tables (e.g. CPU utilization
+    sections first, see SNMPDataSource)."""
+    global _g_planned_walks
+    _g_planned_walks = {}
+
+    fetchoids_by_contexts = {}  # type: Dict[Tuple[Optional[str], ...], List[str]]
+    for check_plugin_name, oid_info in tables:
+        snmp_contexts = tuple(_get_snmp_contexts(snmp_config, check_plugin_name))
+        fetchoids = fetchoids_by_contexts.setdefault(snmp_contexts, [])
+        for fetchoid, column in _table_fetch_oids(oid_info):
+            if use_snmpwalk_cache and _is_snmpwalk_cachable(column) \
+               and _get_cached_snmpwalk(snmp_config.hostname, fetchoid) is not None:
+                continue
+            if fetchoid not in fetchoids:
+                fetchoids.append(fetchoid)
+
+    for snmp_contexts, fetchoids in fetchoids_by_contexts.iteritems():
+        if not fetchoids:
+            continue
+
+        walk_plan = _plan_snmpwalks(fetchoids)
+        console.vverbose("  Walking %d OIDs for %d requested OIDs\n", len(walk_plan),
+                         len(fetchoids))
+        walks = _perform_snmpwalks_in_contexts(snmp_config, snmp_contexts, None, None,
+                                               [walk_oid for walk_oid, _covered in walk_plan])
+
+        planned_walks = _g_planned_walks.setdefault(
+            (snmp_config.hostname, snmp_config.ipaddress, snmp_contexts), {})
+        for walk_oid, covered_oids in walk_plan:
+            rows = walks[walk_oid]
+            for fetchoid in covered_oids:
+                if fetchoid == walk_oid:
+                    planned_walks[fetchoid] = rows
+                else:
+                    planned_walks[fetchoid] = [(o, value)
+                                               for o, value in rows
+                                               if o == fetchoid or o.startswith(fetchoid + ".")]
+
+
+def _table_fetch_oids(oid_info):
+    """Returns the fetch OIDs and the columns of an oid_info which are walked"""
+    if len(oid_info) == 2:
+        oid, targetcolumns = oid_info
+        suboids = [None]
+    else:
+        oid, suboids, targetcolumns = oid_info
+
+    for suboid in suboids:
+        for column in targetcolumns:
+            if column in [
+                    snmp_utils.OID_END, snmp_utils.OID_STRING, snmp_utils.OID_BIN,
+                    snmp_utils.OID_END_BIN, snmp_utils.OID_END_OCTET_STRING
+            ]:
+                continue
+            yield _compute_fetch_oid(oid, suboid, column)[0], column
+
+
+def _plan_snmpwalks(fetchoids):
+    # type: (List[str]) -> List[Tuple[str, List[str]]]
+    """Returns the OIDs to walk together with the requested OIDs covered by each walk
+
+    An OID is not walked when it is part of the subtree of another requested OID.
+    The walks keep the order in which they were first requested."""
+    rank = {fetchoid: index for index, fetchoid in enumerate(fetchoids)}
+
+    covered_oids = {}  # type: Dict[str, List[str]]
+    current = None
+    for fetchoid in sorted(fetchoids, key=lambda o: _oid_to_intlist(o.lstrip("."))):
+        if current is None or not fetchoid.startswith(current + "."):
+            current = fetchoid
+        covered_oids.setdefault(current, []).append(fetchoid)
+
+    return sorted(covered_oids.iteritems(), key=lambda entry: min(rank[oid] for oid in entry[1]))
+
+
 # Contextes can only be used when check_plugin_name is given.
 def get_single_oid(snmp_config, oid, check_plugin_name=None, do_snmp_scan=True):
     # type: (snmp_utils.SNMPHostConfig, str, Optional[str], bool) -> Optional[str]
@@ -320,6 +445,10 @@ class SNMPBackendFactory(object):
         if enforce_stored_walks or snmp_config.is_usewalk_host:
             return StoredWalkSNMPBackend()
 
+        if snmp_config.is_bulk_snmp_host:
+            import cmk_base.bulk_snmp as bulk_snmp
+            return bulk_snmp.BulkSNMPBackend(window=config.bulk_snmp_window)
+
         if snmp_config.is_inline_snmp_host:
             return inline_snmp.InlineSNMPBackend()
 
@@ -543,42 +672,91 @@ def _get_snmpwalk(snmp_config, check_plugin_name, oid, fetchoid, column, use_snm
     return rowinfo
 
 
+def _prefetch_snmpwalks(snmp_config, check_plugin_name, oid, suboid, targetcolumns):
+    """Walk all uncached columns of a table at once
+
+    Backends supporting this (e.g. the bulk SNMP backend) fetch the columns in
+    parallel instead of one after another."""
+    fetchoids = []
+    for column in targetcolumns:
+        if column in [
+                snmp_utils.OID_END, snmp_utils.OID_STRING, snmp_utils.OID_BIN,
+                snmp_utils.OID_END_BIN, snmp_utils.OID_END_OCTET_STRING
+        ] or _is_snmpwalk_cachable(column):
+            continue
+        fetchoid = _compute_fetch_oid(oid, suboid, column)[0]
+        if fetchoid not in fetchoids:
+            fetchoids.append(fetchoid)
+
+    if len(fetchoids) < 2:
+        return {}
+
+    return _perform_snmpwalks(snmp_config, check_plugin_name, oid, fetchoids)
+
+
 def _perform_snmpwalk(snmp_config, check_plugin_name, base_oid, fetchoid):
-    added_oids = set([])
-    rowinfo = []
+    return _perform_snmpwalks(snmp_config, check_plugin_name, base_oid, [fetchoid])[fetchoid]
+
+
+def _get_snmp_contexts(snmp_config, check_plugin_name):
     if snmp_utils.is_snmpv3_host(snmp_config):
-        snmp_contexts = _snmpv3_contexts_of(snmp_config, check_plugin_name)
-    else:
-        snmp_contexts = [None]
+        return _snmpv3_contexts_of(snmp_config, check_plugin_name)
+    return [None]
+
+
+def _perform_snmpwalks(snmp_config, check_plugin_name, base_oid, fetchoids):
+    snmp_contexts = tuple(_get_snmp_contexts(snmp_config, check_plugin_name))
+
+    # Use the results of the walks done by prefetch_snmp_tables()
+    planned_walks = _g_planned_walks.get(
+        (snmp_config.hostname, snmp_config.ipaddress, snmp_contexts), {})
+    rowinfos = {
+        fetchoid: planned_walks[fetchoid] for fetchoid in fetchoids if fetchoid in planned_walks
+    }
 
+    missing_oids = [fetchoid for fetchoid in fetchoids if fetchoid not in rowinfos]
+    if missing_oids:
+        rowinfos.update(
+            _perform_snmpwalks_in_contexts(snmp_config, snmp_contexts, check_plugin_name, base_oid,
+                                           missing_oids))
+    return rowinfos
+
+
+def _perform_snmpwalks_in_contexts(snmp_config, snmp_contexts, check_plugin_name, base_oid,
+                                   fetchoids):
+    added_oids = dict((fetchoid, set([])) for fetchoid in fetchoids)
+    rowinfos = dict((fetchoid, []) for fetchoid in fetchoids)
     for context_name in snmp_contexts:
         snmp_backend = SNMPBackendFactory().factory(
             snmp_config, enforce_stored_walks=_enforce_stored_walks)
 
-        rows = snmp_backend.walk(
+        walks = snmp_backend.walk_many(
             snmp_config,
-            fetchoid,
+            fetchoids,
             check_plugin_name=check_plugin_name,
             table_base_oid=base_oid,
             context_name=context_name)
 
-        # I've seen a broken device (Mikrotik Router), that broke after an
-        # update to RouterOS v6.22. It would return 9 time the same OID when
-        # .1.3.6.1.2.1.1.1.0 was being walked. We try to detect these situations
-        # by removing any duplicate OID information
-        if len(rows) > 1 and rows[0][0] == rows[1][0]:
-            console.vverbose(
-                "Detected broken SNMP agent. Ignoring duplicate OID %s.\n" % rows[0][0])
-            rows = rows[:1]
-
-        for row_oid, val in rows:
-            if row_oid in added_oids:
-                console.vverbose("Duplicate OID found: %s (%s)\n" % (row_oid, val))
-            else:
-                rowinfo.append((row_oid, val))
-                added_oids.add(row_oid)
+        for fetchoid in fetchoids:
+            rows = walks[fetchoid]
+
+            # I've seen a broken device (Mikrotik Router), that broke after an
+            # update to RouterOS v6.22. It would return 9 time the same OID when
+            # .1.3.6.1.2.1.1.1.0 was being walked. We try to detect these situations
+            # by removing any duplicate OID information
+            if len(rows) > 1 and rows[0][0] == rows[1][0]:
+                console.vverbose(
+                    "Detected broken SNMP agent. Ignoring duplicate OID %s.\n" % rows[0][0])
+                rows = rows[:1]
+
+            for row_oid, val in rows:
+                if row_oid in added_oids[fetchoid]:
+                    console.vverbose("Duplicate OID found: %s (%s)\n" % (row_oid, val))
+                else:
+                    rowinfos[fetchoid].append((row_oid, val))
+                    added_oids[fetchoid].add(row_oid)
 
-    return rowinfo
+    return rowinfos
 
 
 def _compute_fetch_oid(oid, suboid, column):
@@ -700,29 +878,49 @@ def _is_snmpwalk_cachable(column):
 
 
 def _get_cached_snmpwalk(hostname, fetchoid):
-    path = _snmpwalk_cache_path(hostname, fetchoid)
-    try:
-        console.vverbose("  Loading %s from walk cache %s\n" % (fetchoid, path))
-        return store.load_data_from_file(path)
-    except:
-        if cmk.utils.debug.enabled():
-            raise
-        console.verbose("  Failed loading walk cache. Continue without it.\n" % path)
-        return None
+    rowinfo = _load_snmpwalk_cache(hostname).get(fetchoid)
+    if rowinfo is not None:
+        console.vverbose("  Loaded %s from walk cache\n" % fetchoid)
+    return rowinfo
 
 
 def _save_snmpwalk_cache(hostname, fetchoid, rowinfo):
-    path = _snmpwalk_cache_path(hostname, fetchoid)
+    walks = _load_snmpwalk_cache(hostname)
+    walks[fetchoid] = rowinfo
 
-    if not os.path.exists(os.path.dirname(path)):
-        os.makedirs(os.path.dirname(path))
+    path = _snmpwalk_cache_path(hostname)
+    store.makedirs(os.path.dirname(path))
 
     console.vverbose("  Saving walk of %s to walk cache %s\n" % (fetchoid, path))
-    store.save_data_to_file(path, rowinfo, pretty=False)
+    store.save_file(path, marshal.dumps(walks))
+
+
+def _load_snmpwalk_cache(hostname):
+    # type: (str) -> Dict[str, snmp_utils.SNMPRowInfo]
+    """The cachable walks of a host are stored together in one marshaled file"""
+    try:
+        return _g_snmpwalk_cache[hostname]
+    except KeyError:
+        pass
+
+    path = _snmpwalk_cache_path(hostname)
+    try:
+        with open(path, "rb") as f:
+            walks = marshal.load(f)
+    except IOError:
+        walks = {}
+    except Exception:
+        if cmk.utils.debug.enabled():
+            raise
+        console.verbose("  Failed loading walk cache %s. Continue without it.\n" % path)
+        walks = {}
+
+    _g_snmpwalk_cache[hostname] = walks
+    return walks
 
 
-def _snmpwalk_cache_path(hostname, fetchoid):
-    return os.path.join(cmk.utils.paths.var_dir, "snmp_cache", hostname, fetchoid)
+def _snmpwalk_cache_path(hostname):
+    return os.path.join(cmk.utils.paths.var_dir, "snmp_cache", "%s.walks" % hostname)
 
 
 #.
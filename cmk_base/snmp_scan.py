@@ -24,7 +24,15 @@
 # to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
 # Boston, MA 02110-1301 USA.
 
+import hashlib
+import marshal
+import os
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple  # pylint: disable=unused-import
+
+import cmk
 from cmk.utils.exceptions import MKGeneralException
+import cmk.utils.paths
+import cmk.utils.store as store
 import cmk.utils.tty as tty
 
 import cmk_base.check_utils
@@ -32,8 +40,14 @@ import cmk_base.config as config
 import cmk_base.console as console
 from cmk_base.exceptions import MKSNMPError
 import cmk_base.snmp as snmp
+import cmk_base.snmp_utils as snmp_utils
 import cmk_base.check_api_utils as check_api_utils
 
+OID_SYS_DESCR = ".1.3.6.1.2.1.1.1.0"
+OID_SYS_OBJ_ID = ".1.3.6.1.2.1.1.2.0"
+
+ScanPlugins = List[Tuple[str, Optional[Callable]]]
+
 
 # gather auto_discovered check_plugin_names for this host
 def gather_snmp_check_plugin_names(host_config,
@@ -65,7 +79,7 @@ def _snmp_scan(host_config,
                for_inv=False,
                do_snmp_scan=True,
                for_mgmt_board=False):
-    import cmk_base.inventory_plugins as inventory_plugins
+    scan_index = get_snmp_scan_index(for_inv)
 
     # Make hostname globally available for scan functions.
     # This is rarely used, but e.g. the scan for if/if64 needs
@@ -74,10 +88,18 @@ def _snmp_scan(host_config,
 
     snmp.initialize_single_oid_cache(host_config)
     console.vverbose("  SNMP scan:\n")
+
+    scan_plugins = _get_scan_plugins(host_config, for_inv)
+    scan_result_store = SNMPScanResultStore(host_config, for_inv, for_mgmt_board)
+    fingerprint = _scan_fingerprint(scan_plugins, for_inv)
+    scan_result = scan_result_store.load(fingerprint)
+    if scan_result is not None:
+        # Fetch all OIDs the scan functions read during the last scan at once
+        snmp.prefetch_single_oids(host_config, sorted(scan_result["oids"]))
+
     if not config.get_config_cache().in_binary_hostlist(host_config.hostname,
                                                         config.snmp_without_sys_descr):
-        for oid, name in [(".1.3.6.1.2.1.1.1.0", "system description"),
-                          (".1.3.6.1.2.1.1.2.0", "system object")]:
+        for oid, name in [(OID_SYS_DESCR, "system description"), (OID_SYS_OBJ_ID, "system object")]:
             value = snmp.get_single_oid(host_config, oid, do_snmp_scan=do_snmp_scan)
             if value is None:
                 raise MKSNMPError(
@@ -89,18 +111,41 @@ def _snmp_scan(host_config,
         # Fake OID values to prevent issues with a lot of scan functions
         console.vverbose("       Skipping system description OID "
                          "(Set .1.3.6.1.2.1.1.1.0 and .1.3.6.1.2.1.1.2.0 to \"\")\n")
-        snmp.set_single_oid_cache(host_config, ".1.3.6.1.2.1.1.1.0", "")
-        snmp.set_single_oid_cache(host_config, ".1.3.6.1.2.1.1.2.0", "")
+        snmp.set_single_oid_cache(host_config, OID_SYS_DESCR, "")
+        snmp.set_single_oid_cache(host_config, OID_SYS_OBJ_ID, "")
+
+    if scan_result is not None and _oids_unchanged(host_config, scan_result["oids"], do_snmp_scan):
+        console.vverbose("       Using result of last scan (OID values unchanged)\n")
+        found_check_plugin_names = scan_result["found"]
+    else:
+        found_check_plugin_names, read_oids = _execute_scan_functions(
+            host_config, scan_plugins, scan_index, on_error, do_snmp_scan)
+        if read_oids is not None:
+            scan_result_store.save(fingerprint, found_check_plugin_names, read_oids)
+
+    filtered = config.filter_by_management_board(
+        host_config.hostname,
+        found_check_plugin_names,
+        for_mgmt_board,
+        for_discovery=True,
+        for_inventory=for_inv)
+
+    _output_snmp_check_plugins("SNMP filtered check plugin names", filtered)
+    snmp.write_single_oid_cache(host_config)
+    return sorted(filtered)
+
+
+def _get_scan_plugins(host_config, for_inv):
+    # type: (snmp_utils.SNMPHostConfig, bool) -> ScanPlugins
+    """Returns the SNMP plugins to be scanned for together with their scan functions"""
+    import cmk_base.inventory_plugins as inventory_plugins
 
-    found_check_plugin_names = []
     if for_inv:
         items = inventory_plugins.inv_info.items()
     else:
         items = config.check_info.items()
 
-    positive_found = []
-    default_found = []
-
+    scan_plugins = []  # type: ScanPlugins
     for check_plugin_name, _unused_check in items:
         if config.service_ignored(host_config.hostname, check_plugin_name, None):
             continue
@@ -110,24 +155,52 @@ def _snmp_scan(host_config,
             elif not for_inv and not cmk_base.check_utils.is_snmp_check(check_plugin_name):
                 continue
 
-        section_name = cmk_base.check_utils.section_name_of(check_plugin_name)
-        # The scan function should be assigned to the section_name, because
-        # subchecks sharing the same SNMP info of course should have
-        # an identical scan function. But some checks do not do this
-        # correctly
-        if check_plugin_name in config.snmp_scan_functions:
-            scan_function = config.snmp_scan_functions[check_plugin_name]
-        elif section_name in config.snmp_scan_functions:
-            scan_function = config.snmp_scan_functions[section_name]
-        elif section_name in inventory_plugins.inv_info:
-            scan_function = inventory_plugins.inv_info[section_name].get("snmp_scan_function")
-        else:
-            scan_function = None
+        scan_plugins.append((check_plugin_name, _get_scan_function(check_plugin_name)))
+    return scan_plugins
 
+
+def _get_scan_function(check_plugin_name):
+    # type: (str) -> Optional[Callable]
+    import cmk_base.inventory_plugins as inventory_plugins
+
+    section_name = cmk_base.check_utils.section_name_of(check_plugin_name)
+    # The scan function should be assigned to the section_name, because
+    # subchecks sharing the same SNMP info of course should have
+    # an identical scan function. But some checks do not do this
+    # correctly
+    if check_plugin_name in config.snmp_scan_functions:
+        return config.snmp_scan_functions[check_plugin_name]
+    elif section_name in config.snmp_scan_functions:
+        return config.snmp_scan_functions[section_name]
+    elif section_name in inventory_plugins.inv_info:
+        return inventory_plugins.inv_info[section_name].get("snmp_scan_function")
+    return None
+
+
+def _execute_scan_functions(host_config, scan_plugins, scan_index, on_error, do_snmp_scan):
+    # type: (snmp_utils.SNMPHostConfig, ScanPlugins, SNMPScanIndex, str, bool) -> Tuple[List[str], Optional[Set[str]]]
+    """Returns the found plugins and the OIDs read by the scan functions
+
+    The OIDs are None when a scan function failed. Such a result must not be
+    reused, because it may be caused by a temporary problem."""
+    read_oids = set([OID_SYS_DESCR, OID_SYS_OBJ_ID])  # type: Optional[Set[str]]
+    candidates = scan_index.candidates(
+        snmp.get_single_oid(host_config, OID_SYS_OBJ_ID, do_snmp_scan=do_snmp_scan))
+
+    found_check_plugin_names = []
+    positive_found = []
+    default_found = []
+
+    for check_plugin_name, scan_function in scan_plugins:
         if scan_function:
+            if candidates is not None and check_plugin_name not in candidates:
+                continue  # The scan function is known to be negative for this sysObjectID
+
             try:
 
                 def oid_function(oid, default_value=None, cp_name=check_plugin_name):
+                    if read_oids is not None:
+                        read_oids.add(oid)
                     value = snmp.get_single_oid(
                         host_config, oid, cp_name, do_snmp_scan=do_snmp_scan)
                     return default_value if value is None else value
@@ -147,6 +220,7 @@ def _snmp_scan(host_config,
                 # should be raised through this
                 raise
             except:
+                read_oids = None
                 if on_error == "warn":
                     console.warning("   Exception in SNMP scan function of %s" % check_plugin_name)
                 elif on_error == "raise":
@@ -159,16 +233,264 @@ def _snmp_scan(host_config,
     if default_found:
         _output_snmp_check_plugins("SNMP without scan function", default_found)
 
-    filtered = config.filter_by_management_board(
-        host_config.hostname,
-        found_check_plugin_names,
-        for_mgmt_board,
-        for_discovery=True,
-        for_inventory=for_inv)
+    return found_check_plugin_names, read_oids
 
-    _output_snmp_check_plugins("SNMP filtered check plugin names", filtered)
-    snmp.write_single_oid_cache(host_config)
-    return sorted(filtered)
+
+#.
+#   .--Scan results--------------------------------------------------------.
+#   |        ____                                        _ _               |
+#   |       / ___|  ___ __ _ _ __    _ __ ___  ___ _   _| | |_ ___         |
+#   |       \___ \ / __/ _` | '_ \  | '__/ _ \/ __| | | | | __/ __|        |
+#   |        ___) | (_| (_| | | | | | | |  __/\__ \ |_| | | |_\__ \        |
+#   |       |____/ \___\__,_|_| |_| |_|  \___||___/\__,_|_|\__|___/        |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | The result of a scan is saved together with the OIDs read by the     |
+#   | scan functions. As long as the values of these OIDs do not change,   |
+#   | the scan functions would come to the same result.                    |
+#   '----------------------------------------------------------------------'
+
+
+class SNMPScanResultStore(object):
+    """Persists the result of the last SNMP scan of a host"""
+
+    def __init__(self, host_config, for_inv, for_mgmt_board):
+        # type: (snmp_utils.SNMPHostConfig, bool, bool) -> None
+        super(SNMPScanResultStore, self).__init__()
+        self._host_config = host_config
+        kind = "inventory" if for_inv else "checks"
+        suffix = ".mgmt" if for_mgmt_board else ""
+        file_name = "%s.%s.%s%s" % (host_config.hostname, host_config.ipaddress, kind, suffix)
+        self._path = os.path.join(cmk.utils.paths.snmp_scan_results_dir, file_name)
+
+    def _is_enabled(self):
+        # type: () -> bool
+        # The contexts depend on the check plugin, which prevents fetching the OIDs at once
+        return not (snmp_utils.is_snmpv3_host(self._host_config) and
+                    self._host_config.snmpv3_contexts)
+
+    def load(self, fingerprint):
+        # type: (str) -> Optional[Dict[str, Any]]
+        if not self._is_enabled():
+            return None
+
+        scan_result = store.load_data_from_file(self._path)
+        if not scan_result or scan_result.get("fingerprint") != fingerprint:
+            return None
+        return scan_result
+
+    def save(self, fingerprint, found_check_plugin_names, read_oids):
+        # type: (str, List[str], Set[str]) -> None
+        if not self._is_enabled():
+            return
+
+        store.makedirs(cmk.utils.paths.snmp_scan_results_dir)
+        store.save_data_to_file(
+            self._path, {
+                "fingerprint": fingerprint,
+                "found": found_check_plugin_names,
+                "oids": {
+                    oid: snmp.get_single_oid(self._host_config, oid, do_snmp_scan=False)
+                    for oid in read_oids
+                },
+            },
+            pretty=False)
+
+
+def _oids_unchanged(host_config, oids, do_snmp_scan):
+    # type: (snmp_utils.SNMPHostConfig, Dict[str, Optional[str]], bool) -> bool
+    for oid, value in oids.iteritems():
+        if snmp.get_single_oid(host_config, oid, do_snmp_scan=do_snmp_scan) != value:
+            console.vverbose("       Value of OID %s changed, executing scan functions\n" % oid)
+            return False
+    return True
+
+
+_scan_function_fingerprints = {}  # type: Dict[Callable, str]
+
+
+def _scan_fingerprint(scan_plugins, for_inv):
+    # type: (ScanPlugins, bool) -> str
+    """Identifies the scan functions and the settings they may depend on
+
+    Some scan functions evaluate check parameters (e.g. if_disable_if64_hosts),
+    which is why the check variables are part of the fingerprint."""
+    fingerprint = hashlib.md5(repr((cmk.__version__, for_inv)))
+    fingerprint.update(repr(sorted(config.get_check_variables().items())))
+    for check_plugin_name, scan_function in sorted(scan_plugins):
+        fingerprint.update(check_plugin_name)
+        if scan_function is not None:
+            fingerprint.update(_scan_function_fingerprint(scan_function))
+    return fingerprint.hexdigest()
+
+
+def _scan_function_fingerprint(scan_function):
+    # type: (Callable) -> str
+    try:
+        return _scan_function_fingerprints[scan_function]
+    except KeyError:
+        pass
+
+    try:
+        code = marshal.dumps(scan_function.func_code)
+    except (AttributeError, ValueError):
+        code = repr(scan_function)  # Contains the id of the object: Not reused between runs
+    fingerprint = _scan_function_fingerprints[scan_function] = hashlib.md5(code).hexdigest()
+    return fingerprint
+
+
+#.
+#   .--Scan index----------------------------------------------------------.
+#   |          ____                    _           _                       |
+#   |         / ___|  ___ __ _ _ __   (_)_ __   __| | _____  __            |
+#   |         \___ \ / __/ _` | '_ \  | | '_ \ / _` |/ _ \ \/ /            |
+#   |          ___) | (_| (_| | | | | | | | | | (_| |  __/>  <             |
+#   |         |____/ \___\__,_|_| |_| |_|_| |_|\__,_|\___/_/\_\            |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | Most scan functions only compare the sysObjectID with some prefixes  |
+#   | or values before reading anything else. Each scan function is once   |
+#   | executed with a probe instead of the sysObjectID which records these |
+#   | comparisons. The scan function only needs to be executed for hosts   |
+#   | with a sysObjectID matching one of the recorded values.              |
+#   '----------------------------------------------------------------------'
+
+
+class SNMPScanIndex(object):
+    """Maps sysObjectID prefixes to the plugins which may be found on such a device"""
+
+    def __init__(self):
+        # type: () -> None
+        super(SNMPScanIndex, self).__init__()
+        self._unindexed = set()  # type: Set[str]
+        self._prefixes = {}  # type: Dict[str, Set[str]]
+        self._values = {}  # type: Dict[str, Set[str]]
+
+    def add(self, check_plugin_name, scan_function):
+        # type: (str, Callable) -> None
+        probe = _SysObjectIDProbe()
+        try:
+            result = scan_function(probe.oid_function)
+        except Exception:
+            result = probe  # Can not be indexed
+
+        indexable = probe.is_indexable and probe.was_read
+        if not indexable or isinstance(result, _SysObjectIDProbe) or result:
+            self._unindexed.add(check_plugin_name)
+            return
+
+        for prefix in probe.prefixes:
+            self._prefixes.setdefault(prefix, set()).add(check_plugin_name)
+        for value in probe.values:
+            self._values.setdefault(value, set()).add(check_plugin_name)
+
+    def candidates(self, sys_object_id):
+        # type: (Optional[str]) -> Optional[Set[str]]
+        """Returns the plugins whose scan functions need to be executed
+
+        None means that all scan functions need to be executed."""
+        if not isinstance(sys_object_id, str):
+            return None
+
+        candidates = set(self._unindexed)
+        candidates.update(self._values.get(sys_object_id, []))
+        for length in xrange(len(sys_object_id) + 1):
+            candidates.update(self._prefixes.get(sys_object_id[:length], []))
+        return candidates
+
+
+class _NotIndexable(Exception):
+    pass
+
+
+class _SysObjectIDProbe(object):
+    """Stands in for the sysObjectID while a scan function is probed
+
+    Only startswith() and comparisons for (in)equality are allowed. They are
+    recorded and answered as if the sysObjectID did not match. Everything else
+    makes the scan function unindexable: It depends on more than the sysObjectID
+    or uses the sysObjectID in a way that can not be recorded."""
+
+    def __init__(self):
+        # type: () -> None
+        super(_SysObjectIDProbe, self).__init__()
+        self.is_indexable = True
+        self.was_read = False
+        self.prefixes = set()  # type: Set[str]
+        self.values = set()  # type: Set[str]
+
+    def oid_function(self, oid, default_value=None):
+        if oid.lstrip(".") != OID_SYS_OBJ_ID.lstrip("."):
+            return self._not_indexable()
+        self.was_read = True
+        return self
+
+    def _not_indexable(self, *args, **kwargs):
+        self.is_indexable = False
+        raise _NotIndexable()
+
+    def startswith(self, prefix, *args):
+        if args:
+            return self._not_indexable()
+        prefixes = prefix if isinstance(prefix, tuple) else (prefix,)
+        if not all(isinstance(p, str) for p in prefixes):
+            return self._not_indexable()
+        self.prefixes.update(prefixes)
+        return False
+
+    def __eq__(self, other):
+        if not isinstance(other, str):
+            return self._not_indexable()
+        self.values.add(other)
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = __nonzero__ = __len__ = __iter__ = __contains__ = __getitem__ = _not_indexable
+    __lt__ = __le__ = __gt__ = __ge__ = __cmp__ = __add__ = __radd__ = _not_indexable
+    __mod__ = __rmod__ = __str__ = __repr__ = __unicode__ = __format__ = _not_indexable
+
+    def __getattr__(self, name):
+        return self._not_indexable()
+
+
+_scan_indexes = {}  # type: Dict[bool, Tuple[List[Tuple[str, Callable]], SNMPScanIndex]]
+
+
+def get_snmp_scan_index(for_inv):
+    # type: (bool) -> SNMPScanIndex
+    """Returns the index of the scan functions of all SNMP plugins
+
+    The index is computed once per process and recomputed when the scan
+    functions change, e.g. after reloading the check plugins."""
+    import cmk_base.inventory_plugins as inventory_plugins
+
+    if for_inv:
+        plugin_names = [
+            name for name in inventory_plugins.inv_info if inventory_plugins.is_snmp_plugin(name)
+        ]
+    else:
+        plugin_names = [
+            name for name in config.check_info if cmk_base.check_utils.is_snmp_check(name)
+        ]
+
+    scan_functions = sorted((name, _get_scan_function(name)) for name in plugin_names)
+    scan_functions = [(name, f) for name, f in scan_functions if f]
+
+    cached = _scan_indexes.get(for_inv)
+    if cached is not None and cached[0] == scan_functions:
+        return cached[1]
+
+    # Scan functions using the settings of a host can not be indexed
+    check_api_utils.reset_hostname()
+
+    index = SNMPScanIndex()
+    for check_plugin_name, scan_function in scan_functions:
+        index.add(check_plugin_name, scan_function)
+
+    _scan_indexes[for_inv] = (scan_functions, index)
+    return index
 
 
 def _output_snmp_check_plugins(title, collection):
@@ -26,7 +26,7 @@
 
 import abc
 import functools
-from typing import List, NamedTuple, Union, Tuple, Optional  # pylint: disable=unused-import
+from typing import Dict, List, NamedTuple, Union, Tuple, Optional  # pylint: disable=unused-import
 
 OID_END = 0  # Suffix-part of OID that was not specified
 OID_STRING = -1  # Complete OID as string ".1.3.6.1.4.1.343...."
@@ -102,6 +102,7 @@ SNMPHostConfig = NamedTuple(
         ("character_encoding", Optional[str]),
         ("is_usewalk_host", bool),
         ("is_inline_snmp_host", bool),
+        ("is_bulk_snmp_host", bool),
     ])
 
 SNMPRowInfo = List[Tuple[str, str]]
@@ -120,12 +121,40 @@ class ABCSNMPBackend(object):
         """
         raise NotImplementedError()
 
+    def get_many(self, snmp_config, oids, context_name=None):
+        # type: (SNMPHostConfig, List[str], Optional[str]) -> Dict[str, Optional[str]]
+        """Fetch several OIDs from the given host in the given SNMP context
+
+        Backends may fetch the OIDs at once. The default is to get them one
+        after another."""
+        return {oid: self.get(snmp_config, oid, context_name) for oid in oids}
+
     @abc.abstractmethod
     def walk(self, snmp_config, oid, check_plugin_name=None, table_base_oid=None,
              context_name=None):
         # type: (SNMPHostConfig, str, Optional[str], Optional[str], Optional[str]) -> SNMPRowInfo
         return []
 
+    def walk_many(self,
+                  snmp_config,
+                  oids,
+                  check_plugin_name=None,
+                  table_base_oid=None,
+                  context_name=None):
+        # type: (SNMPHostConfig, List[str], Optional[str], Optional[str], Optional[str]) -> Dict[str, SNMPRowInfo]
+        """Walk several OIDs of the given host
+
+        Backends may fetch the OIDs at once. The default is to walk them one
+        after another."""
+        return {
+            oid: self.walk(
+                snmp_config,
+                oid,
+                check_plugin_name=check_plugin_name,
+                table_base_oid=table_base_oid,
+                context_name=context_name) for oid in oids
+        }
+
 
 class MutexScanRegistry(object):
     """Register scan functions that are checked before a fallback is used
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""Load generator for the event processing of the Event Console
+
+Usage: python ec_pipeline_bench.py [NUM_RULES [NUM_MESSAGES [WORKERS,...]]]
+       python ec_pipeline_bench.py send HOST PORT [NUM_MESSAGES]
+
+Runs in a site context (needs cmk.ec to be importable). The first form creates
+an event server in a temporary directory with NUM_RULES rules (default: 1000)
+and feeds NUM_MESSAGES syslog messages (default: 20000) to it, once processed by
+the event server itself and once per given number of worker processes of the
+event pipeline (default: 1,2,4). The resulting events have to be the same.
+
+The second form sends NUM_MESSAGES (default: 100000) syslog messages via UDP to
+a running event daemon as fast as possible. The processing rate can be seen in
+the status of the Event Console.
+"""
+
+import logging
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import pathlib2 as pathlib
+
+import cmk.ec.defaults
+import cmk.ec.settings
+from cmk.ec.main import ECLock, EventServer, EventStatus, Perfcounters, StatusTableEvents, \
+        default_slave_status_master
+
+WORDS = [
+    "disk", "link", "failed", "error", "timeout", "user", "login", "session", "backup", "job",
+    "database", "connection", "refused", "interface", "power", "supply", "fan", "temperature",
+    "license", "certificate", "expired", "queue", "memory", "process", "service"
+]
+
+
+class NoHistory(object):
+    def add(self, event, what, who="", addinfo=""):
+        pass
+
+
+def _make_rule_packs(num_rules):
+    rules = []
+    for index in range(num_rules):
+        rule = {
+            "id": "rule_%d" % index,
+            "match": "(\\d+) %s %s%d on (\\S+)$" % (random.choice(WORDS), random.choice(WORDS),
+                                                    index),
+            "state": -1,
+            "sl": {
+                "value": 0,
+                "precedence": "message"
+            },
+        }
+        if index % 10 == 0:
+            rule["match_ok"] = rule["match"].replace(" on ", " ok on ")
+        rules.append(rule)
+    return [{"id": "bench", "disabled": False, "rules": rules}]
+
+
+def _make_messages(rule_packs, num_messages):
+    rules = rule_packs[0]["rules"]
+    messages = []
+    for index in range(num_messages):
+        if index % 4 == 0:
+            # Hits one of the rules
+            text = rules[random.randrange(len(rules))]["match"].replace("(\\d+)", "12").replace(
+                " (\\S+)$", " eth%d" % (index % 8))
+        else:
+            text = "%s %s %s for service%d" % tuple(random.sample(WORDS, 3) + [index])
+        messages.append("<78>Oct 18 13:37:42 host%d app[%d]: %s\n" % (index % 50, index, text))
+    return messages
+
+
+def _process(settings, rule_packs, messages, num_workers):
+    config = cmk.ec.defaults.default_config()
+    config.update({
+        "rule_packs": rule_packs,
+        "event_processing_workers": num_workers,
+        "last_reload": 0,
+        "event_limit": {
+            "by_host": {
+                "action": "stop",
+                "limit": 100000
+            },
+            "by_rule": {
+                "action": "stop",
+                "limit": 100000
+            },
+            "overall": {
+                "action": "stop",
+                "limit": 100000
+            },
+        },
+    })
+
+    logger = logging.getLogger("cmk.mkeventd")
+    perfcounters = Perfcounters(logger)
+    history = NoHistory()
+    event_status = EventStatus(settings, config, perfcounters, history, logger)
+    event_server = EventServer(logger,
+                               settings, config, default_slave_status_master(), perfcounters,
+                               ECLock(logger), history, event_status, StatusTableEvents.columns)
+    event_server.host_config.get_by_event_host_name = lambda host_name, deflt=None: deflt
+    event_server.compile_rules([], rule_packs)
+    event_server._update_pipeline()  # pylint: disable=protected-access
+
+    start = time.time()
+    for index in range(0, len(messages), 50):
+        event_server.process_raw_lines("".join(messages[index:index + 50]), ("127.0.0.1", 514))
+        if event_server._pipeline is not None:  # pylint: disable=protected-access
+            event_server._dispatch_received_lines()  # pylint: disable=protected-access
+    event_server._stop_pipeline()  # pylint: disable=protected-access
+    duration = time.time() - start
+
+    events = [(e["id"], e["rule_id"], e["host"], e["text"]) for e in event_status.events()]
+    return duration, events
+
+
+def _benchmark(args):
+    num_rules = int(args[0]) if len(args) > 0 else 1000
+    num_messages = int(args[1]) if len(args) > 1 else 20000
+    worker_counts = [int(w) for w in args[2].split(",")] if len(args) > 2 else [1, 2, 4]
+
+    random.seed(42)
+    rule_packs = _make_rule_packs(num_rules)
+    messages = _make_messages(rule_packs, num_messages)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        settings = cmk.ec.settings.settings("1.6.0", pathlib.Path(tmp_dir),
+                                            pathlib.Path(tmp_dir) / "etc", ["mkeventd"])
+        settings.paths.event_pipe.value.parent.mkdir(parents=True)
+
+        duration, expected = _process(settings, rule_packs, messages, 0)
+        print "%d rules, %d messages, %d open events" % (num_rules, num_messages, len(expected))
+        print "%-18s %12s" % ("", "messages/s")
+        print "%-18s %12.0f" % ("without workers", num_messages / duration)
+
+        for num_workers in worker_counts:
+            duration, events = _process(settings, rule_packs, messages, num_workers)
+            assert events == expected, "different events with %d workers" % num_workers
+            print "%-18s %12.0f" % ("%d workers" % num_workers, num_messages / duration)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def _send(args):
+    address = (args[0], int(args[1]))
+    num_messages = int(args[2]) if len(args) > 2 else 100000
+
+    random.seed(42)
+    messages = _make_messages(_make_rule_packs(1000), min(num_messages, 10000))
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.time()
+    for index in range(num_messages):
+        sock.sendto(messages[index % len(messages)], address)
+    duration = time.time() - start
+    print "Sent %d messages in %.1f s (%.0f messages/s)" % (num_messages, duration,
+                                                            num_messages / duration)
+
+
+def main(args):
+    if args and args[0] == "send":
+        _send(args[1:])
+    else:
+        _benchmark(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""Compares the Event Console rule matching with and without the rule prefilter
+
+Usage: python ec_rule_bench.py [NUM_RULES [NUM_MESSAGES]]
+
+Runs in a site context (needs cmk.ec to be importable). NUM_RULES rules
+(default: 3000) are created, most of them with a message pattern that contains
+a literal text, some without. NUM_MESSAGES messages (default: 2000) are matched
+against them like the EventServer does: the rules are tried in order until the
+first one matches. Without the prefilter all rules are tried, with the prefilter
+only the rules selected by cmk.ec.rule_prefilter.RulePrefilter.
+"""
+
+import random
+import sys
+import time
+
+import cmk.utils.log
+from cmk.ec.main import EventServer, RuleMatcher
+from cmk.ec.rule_prefilter import RulePrefilter
+
+WORDS = [
+    "disk", "link", "failed", "error", "timeout", "user", "login", "session", "backup", "job",
+    "database", "connection", "refused", "interface", "power", "supply", "fan", "temperature",
+    "license", "certificate", "expired", "queue", "memory", "process", "service"
+]
+
+# Patterns producing a text with "12 [WORD1] [WORD2] on host"
+PATTERNS = [
+    "%s %s",
+    "%s %s on \\S+",
+    "^(\\d+) %s %s",
+    "%s (%s|warning)",
+    "(\\d+) %s %s on host\\d+$",
+]
+
+
+def _make_rules(num_rules):
+    rules, rule_words = [], []
+    for index in range(num_rules):
+        rule = {
+            "id": "rule_%d" % index,
+            "pack": "pack_%d" % (index / 100),
+        }
+        if index % 50 == 0:
+            words = None
+            pattern = "^\\d+$"  # No literal text
+        else:
+            words = random.choice(WORDS), "%s%d" % (random.choice(WORDS), index)
+            pattern = random.choice(PATTERNS) % words
+        rule["match"] = EventServer._compile_matching_value("match", pattern)
+        rules.append(rule)
+        rule_words.append(words)
+    return rules, rule_words
+
+
+def _make_messages(rule_words, num_messages):
+    messages = []
+    for index in range(num_messages):
+        words = random.choice(rule_words)
+        if index % 4 == 0 and words:
+            text = "12 %s %s on host%d" % (words + (index,))  # Hits one of the rules
+        else:
+            text = "%s %s %s for host%d" % tuple(random.sample(WORDS, 3) + [index])
+        messages.append({
+            "text": text,
+            "host": "host%d" % index,
+            "ipaddress": "127.0.0.1",
+            "application": "app",
+            "facility": 1,
+            "priority": 3,
+        })
+    return messages
+
+
+def _match(rule_matcher, rules, event):
+    for rule in rules:
+        if rule_matcher.event_rule_matches_non_inverted(rule, event):
+            return rule
+    return None
+
+
+def main(args):
+    num_rules = int(args[0]) if len(args) > 0 else 3000
+    num_messages = int(args[1]) if len(args) > 1 else 2000
+
+    random.seed(42)
+    rules, rule_words = _make_rules(num_rules)
+    messages = _make_messages(rule_words, num_messages)
+    rule_matcher = RuleMatcher(cmk.utils.log.get_logger("mkeventd"), {"debug_rules": False})
+
+    start = time.time()
+    prefilter = RulePrefilter(rules)
+    compile_duration = time.time() - start
+
+    start = time.time()
+    expected = [_match(rule_matcher, rules, event) for event in messages]
+    duration_without = time.time() - start
+
+    start = time.time()
+    result = [
+        _match(rule_matcher, prefilter.select(rules, event["text"]), event) for event in messages
+    ]
+    duration_with = time.time() - start
+
+    assert result == expected, "different rules matched"
+
+    print "%d rules (%d literals, %d without literal), %d messages, %d hits" % (
+        num_rules, prefilter.num_literals, prefilter.num_unconditional, num_messages,
+        len([r for r in expected if r is not None]))
+    print "Building the prefilter: %.1f ms" % (compile_duration * 1000)
+    print "%-18s %12s" % ("", "messages/s")
+    print "%-18s %12.0f" % ("without prefilter", num_messages / duration_without)
+    print "%-18s %12.0f" % ("with prefilter", num_messages / duration_with)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""Compares load/save times of the item state (counter) file formats
+
+Usage: python item_state_bench.py [NUM_KEYS ...]
+
+Runs in a site context (needs cmk_base to be importable). For each number of
+keys (default: 1000, 10000 and 100000) the legacy format (repr() written,
+ast.literal_eval() read) is compared with the record based format of
+cmk_base.item_state.ItemStateFile. The save case simulates a check cycle
+that updates the counters of 10% of the keys.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import cmk.utils.store
+import cmk_base.item_state as item_state
+
+
+def _make_states(num_keys, now):
+    states = {}
+    for index in range(num_keys):
+        item = u"Interface %d" % index
+        states[("if", item, "in_octets")] = (now, index * 1234567)
+    return states
+
+
+def _measure(func, repeat=5):
+    best = None
+    for _run in range(repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def _bench(tmp_dir, num_keys):
+    now = time.time()
+    states = _make_states(num_keys, now)
+    changed = dict((key, (now + 60, value[1] + 1))
+                   for index, (key, value) in enumerate(states.iteritems())
+                   if index % 10 == 0)
+
+    legacy_path = os.path.join(tmp_dir, "legacy-%d" % num_keys)
+    cmk.utils.store.save_data_to_file(legacy_path, states, pretty=False)
+
+    def legacy_load():
+        return cmk.utils.store.load_data_from_file(legacy_path, default={})
+
+    def legacy_save():
+        loaded = legacy_load()
+        loaded.update(changed)
+        cmk.utils.store.save_data_to_file(legacy_path, loaded, pretty=False)
+
+    binary_path = os.path.join(tmp_dir, "binary-%d" % num_keys)
+    item_state.ItemStateFile(binary_path).rewrite(states)
+
+    def binary_load():
+        return item_state.ItemStateFile(binary_path).read()
+
+    def binary_save():
+        item_state_file = item_state.ItemStateFile(binary_path)
+        loaded = item_state_file.read()
+        loaded.update(changed)
+        item_state_file.write(loaded, changed)
+
+    return [
+        ("legacy", legacy_load, legacy_save, os.stat(legacy_path).st_size),
+        ("binary", binary_load, binary_save, os.stat(binary_path).st_size),
+    ]
+
+
+def main(args):
+    sizes = [int(a) for a in args] or [1000, 10000, 100000]
+    tmp_dir = tempfile.mkdtemp(prefix="item_state_bench")
+    try:
+        print "%8s %-7s %10s %12s %16s" % ("keys", "format", "size", "load [ms]", "load+save [ms]")
+        for num_keys in sizes:
+            for name, load, save, size in _bench(tmp_dir, num_keys):
+                print "%8d %-7s %10d %12.1f %16.1f" % (num_keys, name, size, _measure(load) * 1000,
+                                                       _measure(save) * 1000)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
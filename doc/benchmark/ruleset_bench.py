@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+"""Compares the service ruleset matching with and without the compiled rule index
+
+Usage: python ruleset_bench.py [NUM_HOSTS [NUM_RULESETS [RULES_PER_RULESET]]]
+
+Runs in a site context (needs cmk to be importable). A synthetic configuration
+with NUM_HOSTS hosts (default: 100000) having a typical mix of services is
+created. Each service of each host is looked up in NUM_RULESETS rulesets
+(default: 10) with RULES_PER_RULESET rules (default: 30) each. The previous
+approach, matching the combined regex of every rule (memoized per rule and
+service description), is compared with the CompiledServiceRuleset.
+"""
+
+import random
+import sys
+import time
+
+from cmk.utils.regex import regex
+import cmk.utils.rulesets.tuple_rulesets as tuple_rulesets
+
+SERVICES = [u"CPU load", u"CPU utilization", u"Memory", u"Uptime", u"Check_MK",
+            u"Check_MK Discovery", u"NTP Time", u"Kernel Process Creations"] + \
+           [u"Interface %d" % i for i in range(1, 25)] + \
+           [u"Filesystem %s" % p for p in ["/", "/var", "/var/log", "/home", "/opt", "/tmp"]]
+
+PATTERNS = [
+    u"CPU", u"Memory$", u"Interface", u"Interface \\d$", u"Interface 1\\d$", u"Filesystem /var",
+    u"Filesystem /(home|opt)$", u"Filesystem /va?r", u"Check_MK$", u"Kernel", u"NTP Time",
+    u"Uptime", u".*log$", u"Interface 2"
+]
+
+
+def _make_rulesets(hosts, num_rulesets, num_rules):
+    rulesets = []
+    for _ruleset in range(num_rulesets):
+        rules = []
+        for rule_index in range(num_rules):
+            matching_hosts = set(random.sample(hosts, len(hosts) / random.randint(1, 10)))
+            patterns = random.sample(PATTERNS, random.randint(1, 3))
+            rules.append((rule_index, matching_hosts, random.random() < 0.1, patterns))
+        rulesets.append(rules)
+    return rulesets
+
+
+def _legacy_lookup(rulesets, host_services):
+    converted = [[(value, hosts, (negate, regex("(?:%s)" % "|".join("(?:%s)" % p
+                                                                    for p in patterns))))
+                  for value, hosts, negate, patterns in rules]
+                 for rules in rulesets]
+
+    match_cache = {}
+    num_values = 0
+    for hostname, services in host_services:
+        for service in services:
+            for rules in converted:
+                for _value, hosts, service_conditions in rules:
+                    if hostname not in hosts:
+                        continue
+
+                    cache_id = service, service_conditions
+                    try:
+                        match = match_cache[cache_id]
+                    except KeyError:
+                        match = match_cache[cache_id] = tuple_rulesets.in_servicematcher_list(
+                            service_conditions, service)
+
+                    if match:
+                        num_values += 1
+    return num_values
+
+
+def _compiled_lookup(rulesets, host_services):
+    compiled_rulesets = []
+    for rules in rulesets:
+        compiled = tuple_rulesets.CompiledServiceRuleset()
+        for value, hosts, negate, patterns in rules:
+            compiled.add_rule(value, hosts, negate, patterns)
+        compiled_rulesets.append(compiled)
+
+    num_values = 0
+    for hostname, services in host_services:
+        for service in services:
+            for compiled in compiled_rulesets:
+                for index in compiled.get_matching_rule_indices(service):
+                    if hostname in compiled.rules[index][1]:
+                        num_values += 1
+    return num_values
+
+
+def main(args):
+    num_hosts = int(args[0]) if len(args) > 0 else 100000
+    num_rulesets = int(args[1]) if len(args) > 1 else 10
+    num_rules = int(args[2]) if len(args) > 2 else 30
+
+    random.seed(4711)
+    hosts = ["host%06d" % i for i in range(num_hosts)]
+    host_services = [(h, random.sample(SERVICES, random.randint(5, len(SERVICES)))) for h in hosts]
+    rulesets = _make_rulesets(hosts, num_rulesets, num_rules)
+    num_lookups = sum(len(s) for _h, s in host_services) * num_rulesets
+    print "%d hosts, %d service ruleset lookups" % (num_hosts, num_lookups)
+
+    results = []
+    for name, lookup in [("legacy", _legacy_lookup), ("compiled", _compiled_lookup)]:
+        start = time.time()
+        results.append(lookup(rulesets, host_services))
+        print "%-10s %8.2f sec" % (name, time.time() - start)
+
+    if results[0] != results[1]:
+        raise Exception("Different results: %r" % results)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -121,6 +121,8 @@ def fake_version_and_paths():
                         os.path.join(tmp_dir, "var/check_mk/precompiled_checks"))
     monkeypatch.setattr("cmk.utils.paths.include_cache_dir",
                         os.path.join(tmp_dir, "check_mk/check_includes"))
+    monkeypatch.setattr("cmk.utils.paths.check_manifest_file",
+                        os.path.join(tmp_dir, "check_mk/check_manifest"))
     monkeypatch.setattr("cmk.utils.paths.check_mk_config_dir",
                         os.path.join(tmp_dir, "etc/check_mk/conf.d"))
     monkeypatch.setattr("cmk.utils.paths.default_config_dir", os.path.join(tmp_dir, "etc/check_mk"))
@@ -135,6 +135,7 @@ def snmp_config(request, snmpsim, monkeypatch):
         character_encoding=None,
         is_usewalk_host=backend_name == "stored_snmp",
         is_inline_snmp_host=backend_name == "inline_snmp",
+        is_bulk_snmp_host=False,
     )
 
 
@@ -0,0 +1,238 @@
+# pylint: disable=redefined-outer-name
+
+import pathlib2 as pathlib
+import pytest  # type: ignore
+
+import cmk.utils.log
+import cmk.ec.defaults
+import cmk.ec.settings
+from cmk.ec.main import EventStatus, Perfcounters
+
+logger = cmk.utils.log.get_logger("mkeventd")
+
+
+class FakeHistory(object):
+    def __init__(self):
+        super(FakeHistory, self).__init__()
+        self.entries = []
+
+    def add(self, event, what, who="", addinfo=""):
+        self.entries.append((event["id"], what))
+
+
+class FakeEventServer(object):
+    def __init__(self, event_status):
+        super(FakeEventServer, self).__init__()
+        self._event_status = event_status
+
+    def new_event_respecting_limits(self, event):
+        self._event_status.new_event(event)
+        return True
+
+
+@pytest.fixture()
+def event_status():
+    return EventStatus(None, cmk.ec.defaults.default_config(), Perfcounters(logger), FakeHistory(),
+                       logger)
+
+
+def _event(rule_id, host, phase="open", **kwargs):
+    event = {
+        "rule_id": rule_id,
+        "host": host,
+        "phase": phase,
+        "application": "",
+        "match_groups": (),
+        "host_in_downtime": False,
+        "first": 1000.0,
+        "time": 1000.0,
+    }
+    event.update(kwargs)
+    return event
+
+
+def _ids(events):
+    return [e["id"] for e in events]
+
+
+def test_event_indexes(event_status):
+    for rule_id, host in [("r1", "h1"), ("r2", "h1"), ("r1", "h2"), ("r1", "h1")]:
+        event_status.new_event(_event(rule_id, host))
+
+    assert _ids(event_status.events()) == [1, 2, 3, 4]
+    assert event_status.event(3)["host"] == "h2"
+    assert event_status.event(5) is None
+    assert _ids(event_status.events_of_rule("r1")) == [1, 3, 4]
+    assert _ids(event_status.events_of_hosts(["h1", "h2"])) == [1, 2, 3, 4]
+    assert _ids(event_status.events_of_hosts(["h2", "h3"])) == [3]
+    assert event_status.num_existing_events == 4
+    assert event_status.num_existing_events_by_rule == {"r1": 3, "r2": 1}
+    assert event_status.num_existing_events_by_host == {"h1": 3, "h2": 1}
+
+    event_status.remove_oldest_event("by_rule", event_status.event(4))
+    assert _ids(event_status.events()) == [2, 3, 4]
+    event_status.remove_oldest_event("by_host", event_status.event(4))
+    assert _ids(event_status.events()) == [3, 4]
+    event_status.remove_oldest_event("overall", None)
+    assert _ids(event_status.events()) == [4]
+    assert event_status.num_existing_events == 1
+    assert event_status.num_existing_events_by_rule == {"r1": 1, "r2": 0}
+    assert event_status.num_existing_events_by_host == {"h1": 1, "h2": 0}
+
+    event_status.delete_event(4, "me")
+    assert event_status.events() == []
+    assert event_status.events_of_rule("r1") == []
+
+
+def test_pack_and_unpack_status(event_status):
+    for rule_id, host in [("r1", "h1"), ("r2", "h2")]:
+        event_status.new_event(_event(rule_id, host))
+
+    status = event_status.pack_status()
+    assert _ids(status["events"]) == [1, 2]
+
+    event_status.flush()
+    assert event_status.events() == []
+    event_status.unpack_status(status)
+    assert _ids(event_status.events()) == [1, 2]
+    assert _ids(event_status.events_of_rule("r2")) == [2]
+    assert event_status.num_existing_events_by_host == {"h1": 1, "h2": 1}
+
+
+def test_reindex_event(event_status):
+    for host in ["h1", "h2", "h1"]:
+        event_status.new_event(_event("r1", host, phase="counting"))
+
+    event = event_status.event(1)
+    event["phase"] = "open"
+    event["host"] = "h2"
+    event_status.reindex_event(event)
+
+    assert _ids(event_status.events_in_phase("counting")) == [2, 3]
+    assert _ids(event_status.events_in_phase("open")) == [1]
+    # The event keeps its position by age
+    assert _ids(event_status.events_of_hosts(["h2"])) == [1, 2]
+    assert event_status.num_existing_events_by_host == {"h1": 1, "h2": 2}
+
+    event_status.remove_event(event)
+    assert _ids(event_status.events_in_phase("open")) == []
+    assert event_status.num_existing_events_by_host == {"h1": 1, "h2": 1}
+
+
+def test_pop_expired_events(event_status):
+    event_status.new_event(_event("r1", "h1", phase="delayed", delay_until=110.0))
+    event_status.new_event(_event("r1", "h1", live_until=100.0))
+    event_status.new_event(_event("r1", "h1"))
+    event_status.new_event(_event("r1", "h1", live_until=200.0))
+
+    assert event_status.pop_expired_events(50.0) == []
+    assert _ids(event_status.pop_expired_events(120.0)) == [2, 1]
+    assert event_status.pop_expired_events(120.0) == []
+
+    # Opening the delayed event schedules its livetime
+    event = event_status.event(1)
+    event["phase"] = "open"
+    event["live_until"] = 300.0
+    event_status.reindex_event(event)
+    event_status.remove_event(event_status.event(4))
+    assert event_status.pop_expired_events(250.0) == []
+    assert _ids(event_status.pop_expired_events(300.0)) == [1]
+
+
+@pytest.mark.parametrize("separate_host,expected_counts", [
+    (True, [1, 1]),
+    (False, [2]),
+])
+def test_count_event(event_status, separate_host, expected_counts):
+    event_server = FakeEventServer(event_status)
+    count = {
+        "count": 2,
+        "period": 60,
+        "count_ack": False,
+        "separate_host": separate_host,
+        "separate_application": False,
+        "separate_match_groups": False,
+    }
+
+    assert event_status.count_event(event_server, _event("r1", "h1"), {}, count) is False
+    event_status.count_event(event_server, _event("r1", "h2"), {}, count)
+    assert [e["count"] for e in event_status.events()] == expected_counts
+
+
+@pytest.fixture()
+def persisted_event_status(tmp_path):
+    settings = cmk.ec.settings.settings("1.6.0", pathlib.Path(str(tmp_path)),
+                                        pathlib.Path(str(tmp_path)) / "etc", ["mkeventd"])
+    settings.paths.status_file.value.parent.mkdir(parents=True)
+
+    def make():
+        event_status = EventStatus(settings, cmk.ec.defaults.default_config(), Perfcounters(logger),
+                                   FakeHistory(), logger)
+        event_status.load_status(FakeEventServer(event_status))
+        return event_status
+
+    return make
+
+
+def _state(event_status):
+    status = event_status.pack_status()
+    status["events"] = [dict(e) for e in status["events"]]
+    return status
+
+
+def test_status_journal(persisted_event_status):
+    event_status = persisted_event_status()
+    for host in ["h1", "h2", "h3"]:
+        event_status.new_event(_event("r1", host, core_host=host, ipaddress=""))
+    event_status.count_rule_match("r1")
+    event_status.save_status()  # No journal yet: snapshot
+    assert event_status.settings.paths.status_journal_file.value.read_bytes().count("\n") == 1
+
+    event = event_status.event(2)
+    event["comment"] = "bla"
+    event_status.reindex_event(event)
+    event_status.remove_event(event_status.event(1))
+    event_status.new_event(_event("r2", "h4", core_host="h4", ipaddress=""))
+    event_status.count_rule_match("r1")
+    event_status.count_rule_match("r2")
+    event_status.reset_counters("r2")
+    event_status.start_next_interval("r2", 3600)
+    event_status.save_journal()
+
+    # Only the journal is appended
+    assert _ids(persisted_event_status().events()) == [2, 3, 4]
+    assert _state(persisted_event_status()) == _state(event_status)
+    assert persisted_event_status().event(2)["comment"] == "bla"
+
+    # Unsaved changes are lost
+    event_status.new_event(_event("r2", "h5", core_host="h5", ipaddress=""))
+    assert _ids(persisted_event_status().events()) == [2, 3, 4]
+
+    # A new snapshot starts the journal again
+    event_status.save_status(snapshot=True)
+    journal = event_status.settings.paths.status_journal_file.value
+    assert journal.read_bytes().count("\n") == 1
+    assert _state(persisted_event_status()) == _state(event_status)
+
+
+def test_status_journal_incomplete_record(persisted_event_status):
+    event_status = persisted_event_status()
+    event_status.save_status(snapshot=True)
+    for host in ["h1", "h2"]:
+        event_status.new_event(_event("r1", host, core_host=host, ipaddress=""))
+        event_status.save_journal()
+
+    journal = event_status.settings.paths.status_journal_file.value
+    content = journal.read_bytes()
+    journal.write_bytes(content[:content.rindex("('new'") + 20])
+
+    restored = persisted_event_status()
+    assert _ids(restored.events()) == [1]
+    assert restored._next_event_id == 2
+
+    # The journal can not be continued, the next save writes a snapshot
+    restored.new_event(_event("r1", "h3", core_host="h3", ipaddress=""))
+    restored.save_journal()
+    assert _ids(persisted_event_status().events()) == [1]
+    restored.save_status()
+    assert _ids(persisted_event_status().events()) == [1, 2]
@@ -0,0 +1,113 @@
+# pylint: disable=redefined-outer-name
+
+import pathlib2 as pathlib
+import pytest  # type: ignore
+
+import cmk.utils.log
+import cmk.ec.defaults
+import cmk.ec.settings
+from cmk.ec.history import History, HistoryFileIndex
+from cmk.ec.main import QueryGET, StatusTableEvents, StatusTableHistory
+
+logger = cmk.utils.log.get_logger("mkeventd")
+
+
+class FakeStatusServer(object):
+    def __init__(self, history):
+        super(FakeStatusServer, self).__init__()
+        self._table_history = StatusTableHistory(logger, history)
+
+    def table(self, name):
+        assert name == "history"
+        return self._table_history
+
+
+@pytest.fixture()
+def history(tmp_path):
+    settings = cmk.ec.settings.settings("1.6.0", pathlib.Path(str(tmp_path)),
+                                        pathlib.Path(str(tmp_path)) / "etc", ["mkeventd"])
+    return History(settings, cmk.ec.defaults.default_config(), logger, StatusTableEvents.columns,
+                   StatusTableHistory.columns)
+
+
+def _add_events(history, num_events):
+    for nr in range(1, num_events + 1):
+        history.add({
+            "id": nr,
+            "host": "host%d" % (nr % 3),
+            "rule_id": "rule%d" % (nr % 2),
+            "application": "app%d" % (nr % 2),
+            "text": "Event %d" % nr,
+        }, "NEW")
+
+
+def _query(history, *headers):
+    raw_query = ["GET history", "Columns: history_line event_id"] + list(headers)
+    query = QueryGET(FakeStatusServer(history), raw_query, logger)
+    return [tuple(row) for row in list(query.table.query(query))[1:]]
+
+
+def test_history_query_newest_first(history):
+    _add_events(history, 5)
+    assert _query(history) == [(5, 5), (4, 4), (3, 3), (2, 2), (1, 1)]
+    assert _query(history, "Limit: 2") == [(5, 5), (4, 4)]
+    assert _query(history, "Filter: event_text = Event 2") == [(2, 2)]
+
+
+@pytest.mark.parametrize("headers,expected_ids", [
+    (["Filter: event_id = 4"], [4]),
+    (["Filter: event_id in 1 2 300"], [2, 1]),
+    (["Filter: event_host = host1"], [4, 1]),
+    (["Filter: event_host = host1", "Filter: event_rule_id = rule0"], [4]),
+    (["Filter: event_rule_id in rule0 rule7"], [6, 4, 2]),
+    (["Filter: event_application = app0", "Limit: 1"], [6]),
+    (["Filter: event_application = app"], []),
+    (["Filter: event_application = app1", "Filter: event_host = host0"], [3]),
+    (["Filter: event_host = host1", "Filter: event_text ~~ EVENT 4"], [4]),
+])
+def test_history_query_index(history, headers, expected_ids):
+    _add_events(history, 6)
+    assert [event_id for _line, event_id in _query(history, *headers)] == expected_ids
+
+
+def test_history_file_index(history):
+    _add_events(history, 4)
+    assert [event_id for _line, event_id in _query(history)] == [4, 3, 2, 1]
+
+    # The index of the current log file is saved when it has been created
+    log_path, = history._settings.paths.history_dir.value.glob("*.log")
+    index = HistoryFileIndex.load(log_path.with_suffix(".idx"))
+    assert index.num_lines == 4
+    assert index.line_numbers("event_host", ["host1"]) == {0, 3}
+
+    # Appended lines are added to the index, incomplete lines are skipped
+    _add_events(history, 2)
+    with log_path.open(mode="ab") as f:
+        f.write("123.4\tNEW")
+    assert [event_id for _line, event_id in _query(history, "Filter: event_id = 2")] == [2, 2]
+    index = history._file_indexes[log_path]
+    assert index.num_lines == 6
+    assert index.line_numbers("event_id", [2]) == {1, 5}
+
+    # A replaced log file is indexed again
+    log_path.unlink()
+    _add_events(history, 1)
+    assert _query(history, "Filter: event_id = 1") == [(1, 1)]
+
+
+def test_history_query_time_range(history, monkeypatch):
+    for nr, timestamp in enumerate([100.0, 200.0, 300.0]):
+        monkeypatch.setattr("time.time", lambda timestamp=timestamp: timestamp)
+        _add_events(history, nr + 1)
+
+    result = _query(history, "Filter: history_time >= 150", "Filter: history_time < 300")
+    assert [event_id for _line, event_id in result] == [2, 1]
+    assert _query(history, "Filter: history_time > 300") == []
+
+
+def test_history_flush(history):
+    _add_events(history, 1)
+    assert _query(history) == [(1, 1)]
+    history.flush()
+    assert list(history._settings.paths.history_dir.value.iterdir()) == []
+    assert _query(history) == []
@@ -0,0 +1,179 @@
+# pylint: disable=redefined-outer-name
+
+import cStringIO
+import logging
+import threading
+
+import pathlib2 as pathlib
+import pytest  # type: ignore
+
+import cmk.utils.log
+import cmk.ec.defaults
+import cmk.ec.pipeline
+import cmk.ec.settings
+from cmk.ec.main import ECLock, EventServer, EventStatus, Perfcounters, StatusTableEvents, \
+        default_slave_status_master
+
+logger = cmk.utils.log.get_logger("mkeventd")
+
+
+class FakeHistory(object):
+    def __init__(self):
+        super(FakeHistory, self).__init__()
+        self.entries = []
+
+    def add(self, event, what, who="", addinfo=""):
+        self.entries.append((event["id"], what))
+
+
+def _rule(rule_id, match, **kwargs):
+    rule = {
+        "id": rule_id,
+        "match": match,
+        "state": -1,
+        "sl": {
+            "value": 0,
+            "precedence": "message"
+        },
+    }
+    rule.update(kwargs)
+    return rule
+
+
+RULE_PACKS = [
+    {
+        "id": "skipped",
+        "disabled": False,
+        "rules": [
+            _rule("skip", "skip", drop="skip_pack"),
+            _rule("never", "skip"),
+        ],
+    },
+    {
+        "id": "default",
+        "disabled": False,
+        "rules": [
+            _rule("drop", "noise", drop=True),
+            _rule("link", "link down", match_ok="link up"),
+            _rule(
+                "disk",
+                "disk (\\d+) full",
+                count={
+                    "count": 3,
+                    "period": 3600,
+                    "algorithm": "interval",
+                    "count_ack": False,
+                    "separate_host": True,
+                    "separate_application": False,
+                    "separate_match_groups": True,
+                }),
+            _rule("other", ""),
+        ],
+    },
+]
+
+MESSAGES = [
+    "link down on eth0",
+    "disk 1 full",
+    "noise",
+    "skip this",
+    "link up on eth0",
+    "disk 2 full",
+    "something else",
+    "disk 1 full",
+]
+
+
+@pytest.fixture()
+def make_event_server(tmp_path, monkeypatch):
+    settings = cmk.ec.settings.settings("1.6.0", pathlib.Path(str(tmp_path)),
+                                        pathlib.Path(str(tmp_path)) / "etc", ["mkeventd"])
+    settings.paths.event_pipe.value.parent.mkdir(parents=True)
+
+    def make(num_workers):
+        config = cmk.ec.defaults.default_config()
+        config.update({
+            "rule_packs": RULE_PACKS,
+            "event_processing_workers": num_workers,
+            "last_reload": 0,
+        })
+        perfcounters = Perfcounters(logger)
+        history = FakeHistory()
+        event_status = EventStatus(settings, config, perfcounters, history, logger)
+        event_server = EventServer(logger, settings,
+                                   config, default_slave_status_master(), perfcounters,
+                                   ECLock(logger), history, event_status, StatusTableEvents.columns)
+        monkeypatch.setattr(
+            event_server.host_config, "get_by_event_host_name", lambda host_name, deflt=None: deflt)
+        event_server.compile_rules([], config["rule_packs"])
+        return event_server
+
+    return make
+
+
+def _process(event_server, lines):
+    event_server._update_pipeline()
+    for nr in range(0, len(lines), 7):
+        event_server.process_raw_lines("".join(lines[nr:nr + 7]), ("127.0.0.1", 514))
+        if event_server._pipeline is not None:
+            event_server._dispatch_received_lines()
+    event_server._stop_pipeline()
+
+    event_status = event_server._event_status
+    events = [(e["id"], e["rule_id"], e["host"], e["phase"], e.get("count"), e["text"])
+              for e in event_status.events()]
+    return events, event_status.get_rule_stats(), event_server._history.entries
+
+
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_pipeline_processes_events_in_order(make_event_server, num_workers):
+    lines = []
+    for nr in range(150):
+        message = MESSAGES[nr % len(MESSAGES)]
+        lines.append("<78>Oct 18 13:37:42 host%d app: %s\n" % (nr % 4, message))
+
+    expected = _process(make_event_server(0), lines)
+    assert _process(make_event_server(num_workers), lines) == expected
+
+    events, rule_stats, history = expected
+    assert "never" not in dict(rule_stats)
+    assert dict(rule_stats)["skip"] > 0
+    assert set(e[1] for e in events) == set(["disk", "other"])
+    assert "CANCELLED" in [what for _event_id, what in history]
+
+
+worker_logger = logging.getLogger("cmk.test_pipeline_worker")
+
+
+def _log_and_count(lines):
+    worker_logger.error("Classifying %d lines" % len(lines))
+    return [len(lines)]
+
+
+def test_pipeline_worker_logs_while_lock_was_held_at_fork():
+    handler = logging.StreamHandler(cStringIO.StringIO())
+    worker_logger.addHandler(handler)
+
+    # Another thread of the event daemon is logging while the workers are forked
+    locked, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with handler.lock:
+            locked.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait()
+    try:
+        pipeline = cmk.ec.pipeline.EventPipeline(logger, 1, _log_and_count, batch_timeout=5)
+    finally:
+        release.set()
+        thread.join()
+        worker_logger.removeHandler(handler)
+
+    try:
+        pipeline.submit(["a", "b", "c"])
+        assert list(pipeline.results(wait=True)) == [[3]]
+    finally:
+        pipeline.close()
@@ -0,0 +1,102 @@
+import re
+
+import pytest  # type: ignore
+
+from cmk.ec.main import EventServer, match
+from cmk.ec.rule_prefilter import LiteralScanner, RulePrefilter, pattern_literal_alternatives
+
+
+@pytest.mark.parametrize("pattern,literals", [
+    ("Disk full", ["disk full"]),
+    ("ORA-\\d+: (.*)", ["ora-"]),
+    ("foo(bar|baz)\\d+", ["fooba"]),
+    ("(error|fail(ed|ure)) on disk", [" on disk"]),
+    ("(error|failure) on", ["error", "failure"]),
+    ("^Link (up|down)\\b", ["link "]),
+    ("(?:abc)+ .*", ["abc"]),
+    ("x*y?", None),
+    ("^\\s*$", None),
+    ("(error|.*) on", [" on"]),
+    ("(error|\\d+)", None),
+    (u"F\xfcnf Fehler", ["nf fehler"]),
+])
+def test_pattern_literal_alternatives(pattern, literals):
+    assert pattern_literal_alternatives(re.compile(pattern, re.IGNORECASE)) == literals
+
+
+def test_pattern_literal_alternatives_infix():
+    assert pattern_literal_alternatives("disk full") == ["disk full"]
+    assert pattern_literal_alternatives(u"gr\xfc\xdfe aus") == ["e aus"]
+
+
+def test_literal_scanner():
+    scanner = LiteralScanner(["he", "she", "his", "hers", "disk"])
+    assert scanner.scan(u"USHERS") == set([0, 1, 3])
+    assert scanner.scan("ahishers") == set([0, 1, 2, 3])
+    assert scanner.scan("dis dIsK") == set([4])
+    assert scanner.scan("") == set()
+
+
+RULES = [
+    ("r1", {
+        "match": "Disk (full|failure)"
+    }),
+    ("r2", {
+        "match": "link down",
+        "match_ok": "link up"
+    }),
+    ("r3", {}),
+    ("r4", {
+        "match": "^\\d+$"
+    }),
+    ("r5", {
+        "match": "ORA-\\d+",
+        "invert_matching": True
+    }),
+    ("r6", {
+        "match": "(timeout|refused) on port \\d+"
+    }),
+    ("r7", {
+        "match": "disk"
+    }),
+]
+
+TEXTS = [
+    "Disk full on /var",
+    "disk FAILURE",
+    "LINK DOWN on eth0",
+    "link up on eth0",
+    "1234",
+    "ORA-01555 snapshot too old",
+    "Connection refused on port 22",
+    "nothing interesting",
+    u"Fehler: Festplatte voll",
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_rule_prefilter_select(text):
+    rules = []
+    for rule_id, conditions in RULES:
+        rule = {"id": rule_id}
+        for key, value in conditions.items():
+            rule[key] = EventServer._compile_matching_value(key, value) \
+                    if key.startswith("match") else value
+        rules.append(rule)
+
+    prefilter = RulePrefilter(rules)
+    assert prefilter.num_unconditional == 3
+
+    selected = prefilter.select(rules, text)
+    assert [r["id"] for r in selected] == [r["id"] for r in rules if r in selected]
+
+    for rule in rules:
+        message_matches = match(rule.get("match"), text, complete=False) is not False
+        if "match_ok" in rule:
+            message_matches |= match(rule["match_ok"], text, complete=False) is not False
+        if message_matches or rule.get("invert_matching"):
+            assert rule in selected, rule["id"]
+
+    # Only a part of the hash is selected from
+    assert prefilter.select(rules[3:], text) == [r for r in selected if r in rules[3:]]
+    assert prefilter.select([], text) == []
@@ -1228,6 +1228,7 @@ def test_grouped_rulespecs():
             'snmpv3_contexts',
             'snmp_timing',
             'non_inline_snmp_hosts',
+            'bulk_snmp_hosts',
             'usewalk_hosts',
             'snmp_ports',
             'snmp_limit_oid_range',
@@ -10722,6 +10723,21 @@ expected_rulespecs = {
         'title': u'MSSQL Datafile and Transactionlog Discovery',
         'valuespec_class_name': 'Dictionary'
     },
+    'bulk_snmp_hosts': {
+        'factory_default': [],
+        'group_name': 'agent/snmp',
+        'help': u'The bulk SNMP backend walks all columns of an SNMP table at the same time and keeps several requests to the device in flight. This reduces the time needed to fetch large tables from devices with a high latency. It supports SNMP v1 and v2c. SNMP v3 hosts continue to use Inline SNMP or Classic SNMP.',
+        'is_deprecated': False,
+        'is_optional': False,
+        'item_enum': None,
+        'item_help': None,
+        'item_name': None,
+        'item_spec_class_name': 'NoneType',
+        'item_type': None,
+        'match_type': 'first',
+        'title': u'Hosts using the bulk SNMP backend',
+        'valuespec_class_name': 'NoneType'
+    },
     'non_inline_snmp_hosts': {
         'factory_default': [],
         'group_name': 'agent/snmp',
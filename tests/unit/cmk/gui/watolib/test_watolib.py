@@ -113,6 +113,7 @@ def test_registered_configvars():
         'enable_sounds',
         'escape_plugin_output',
         'event_limit',
+        'event_processing_workers',
         'eventsocket_queue_len',
         'failed_notification_horizon',
         'graph_timeranges',
@@ -199,6 +200,7 @@ def test_registered_configvars():
         'staleness_threshold',
         'start_url',
         'statistics_interval',
+        'status_journal_interval',
         'table_row_limit',
         'tcp_connect_timeout',
         'topology_default_filter_group',
@@ -254,3 +254,51 @@ def test_hosttags_match_taglist_negate():
 # TODO: convert_pattern_list
 # TODO: in_extraconf_servicelist
 # TODO: in_servicematcher_list
+
+
+@pytest.mark.parametrize("pattern,prefix", [
+    (u"", u""),
+    (u"CPU load", u"CPU load"),
+    (u"Interface 1$", u"Interface 1"),
+    (u"Interface \\d+", u"Interface "),
+    (u"Filesystem /va?r", u"Filesystem /v"),
+    (u"Filesystem /var*", u"Filesystem /va"),
+    (u"ab{0,2}", u"a"),
+    (u"ab+", u"ab"),
+    (u"^CPU", u""),
+    (u"Mem|CPU", u""),
+    (u"(?i)cpu", u""),
+])
+def test_literal_prefix(pattern, prefix):
+    assert tuple_rulesets._literal_prefix(pattern) == prefix
+
+
+def _matches_uncompiled(negate, patterns, description):
+    pattern = tuple_rulesets.regex("(?:%s)" % "|".join("(?:%s)" % p for p in patterns))
+    return tuple_rulesets.in_servicematcher_list((negate, pattern), description)
+
+
+def test_compiled_service_ruleset():
+    rules = [
+        (False, [u""]),
+        (False, [u"CPU"]),
+        (False, [u"CPU load$"]),
+        (True, [u"Interface", u"CPU"]),
+        (False, [u"Interface \\d+$", u"Mem"]),
+        (False, [u"Interface 1", u"(?i)mem"]),
+        (True, [u"Filesystem /va?r"]),
+        (False, [u"Fi|Me"]),
+    ]
+    compiled = tuple_rulesets.CompiledServiceRuleset()
+    for index, (negate, patterns) in enumerate(rules):
+        compiled.add_rule(str(index), set(), negate, patterns)
+
+    for description in [
+            u"CPU load", u"CPU loads", u"Interface 1", u"Interface 10", u"Interface X", u"Memory",
+            u"memory", u"Filesystem /vr", u"Filesystem /var", u"Filesystem /", u"Fan", u""
+    ]:
+        expected = tuple(index for index, (negate, patterns) in enumerate(rules)
+                         if _matches_uncompiled(negate, patterns, description))
+        assert compiled.get_matching_rule_indices(description) == expected, description
+        # Memoized result
+        assert compiled.get_matching_rule_indices(description) == expected
@@ -1,10 +1,13 @@
+import ast
 import time
 import pprint
 import pytest
 from testlib import repo_path, cmk_path, cmc_path, cme_path, CMKWebSession
 
 from cmk.utils.exceptions import MKGeneralException
-from cmk.utils.structured_data import StructuredDataTree, Container, Attributes, Numeration, Node
+import cmk.utils.store as store
+import cmk.utils.structured_data as structured_data
+from cmk.utils.structured_data import StructuredDataTree, TreeArchive, Container, Attributes, Numeration, Node
 
 # Convention: test functions are named like
 #   test_structured_data_INFIX_METHODNAME where
@@ -786,3 +789,108 @@ def test_delta_structured_data_tree_serialization(two_tree_filenames):
     new_raw_delta_tree = new_delta_tree.get_raw_tree()
 
     assert raw_delta_tree == new_raw_delta_tree
+
+
+@pytest.mark.parametrize("tree", trees)
+def test_structured_data_StructuredDataTree_serialize(tree):
+    assert tree.is_equal(StructuredDataTree().deserialize(tree.serialize()))
+
+
+def test_structured_data_StructuredDataTree_get_content_hash():
+    hashes = [tree.get_content_hash() for tree in trees]
+    assert len(set(hashes)) == len(trees)
+
+    for tree in trees:
+        copied_tree = StructuredDataTree().create_tree_from_raw_tree(
+            ast.literal_eval(repr(tree.get_raw_tree())))
+        assert copied_tree.get_content_hash() == tree.get_content_hash()
+
+
+def test_structured_data_StructuredDataTree_get_content_hash_key_order():
+    tree_a = StructuredDataTree()
+    tree_a.get_dict("a.b.").update([("x%d" % i, i) for i in range(100)])
+    tree_b = StructuredDataTree()
+    tree_b.get_dict("a.b.").update(reversed([("x%d" % i, i) for i in range(100)]))
+    assert tree_a.get_content_hash() == tree_b.get_content_hash()
+
+    tree_b.get_dict("a.b.")["x0"] = "0"
+    assert tree_a.get_content_hash() != tree_b.get_content_hash()
+
+
+@pytest.mark.parametrize("tree_source", trees)
+@pytest.mark.parametrize("tree_target", trees)
+def test_structured_data_diff_and_patch_raw_trees(tree_source, tree_target):
+    source, target = tree_source.get_raw_tree(), tree_target.get_raw_tree()
+    patch = structured_data._diff_raw_trees(source, target)
+    assert structured_data._patch_raw_tree(source, patch) == target
+
+
+def test_structured_data_TreeArchive(tmpdir):
+    archive_dir = "%s" % tmpdir
+    # Trees archived by former versions are Python literals
+    store.save_data_to_file("%s/1000" % archive_dir, tree_old_heute.get_raw_tree())
+
+    archive = TreeArchive(archive_dir)
+    archive.full_tree_interval = 3
+    for nr, tree in enumerate(trees):
+        archive.save(1001 + nr, tree)
+    assert archive.timestamps() == ["%d" % (1000 + nr) for nr in range(len(trees) + 1)]
+
+    for nr, tree in enumerate([tree_old_heute] + trees):
+        archived_tree = TreeArchive(archive_dir).load(1000 + nr)
+        assert tree.is_equal(archived_tree)
+        assert archived_tree.is_equal(tree)
+
+    kinds = [
+        structured_data._deserialize(tmpdir.join("%d" % (1000 + nr)).read())[0]
+        for nr in range(len(trees) + 1)
+    ]
+    assert kinds == ["delta", "delta", "tree"] * 4 + ["tree"]
+
+
+def test_structured_data_TreeArchive_remove_oldest(tmpdir):
+    archive = TreeArchive("%s" % tmpdir)
+    archive.full_tree_interval = 3
+    for nr, tree in enumerate(trees):
+        archive.save(1000 + nr, tree)
+
+    # The disk space cleanup removes the oldest files first
+    for nr, tree in enumerate(trees):
+        tmpdir.join("%d" % (1000 + nr)).remove()
+        for remaining_nr in range(nr + 1, len(trees)):
+            archived_tree = TreeArchive("%s" % tmpdir).load(1000 + remaining_nr)
+            assert trees[remaining_nr].is_equal(archived_tree)
+
+
+def test_structured_data_TreeArchive_missing_base(tmpdir):
+    archive = TreeArchive("%s" % tmpdir)
+    archive.full_tree_interval = 3
+    for nr, tree in enumerate(trees[:4]):
+        archive.save(1000 + nr, tree)
+
+    tmpdir.join("1002").remove()
+    archive = TreeArchive("%s" % tmpdir)
+    assert archive.load(1000) is None
+    assert archive.load(1001) is None
+    assert trees[3].is_equal(archive.load(1003))
+
+
+def test_structured_data_TreeArchive_small_change(tmpdir):
+    tree = StructuredDataTree()
+    packages = tree.get_list("software.packages:")
+    packages += [{"name": "package-%d" % i, "version": "1.%d" % i} for i in range(1000)]
+
+    changed_tree = tree.copy()
+    changed_tree.get_sub_numeration(["software", "packages"]).get_child_data()[500] = {
+        "name": "package-500",
+        "version": "2.0",
+    }
+
+    assert len(tree.serialize()) < len(repr(tree.get_raw_tree()))
+
+    archive = TreeArchive("%s" % tmpdir)
+    archive.save(1000, tree)
+    archive.save(1001, changed_tree)
+    assert tmpdir.join("1000").size() < 1000
+    assert TreeArchive("%s" % tmpdir).load(1000).is_equal(tree)
+    assert TreeArchive("%s" % tmpdir).load(1001).is_equal(changed_tree)
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import threading
+
 import cmk.utils.cpu_tracking as cpu_tracking
 
 
@@ -82,3 +84,29 @@ def test_cpu_tracking_add_times(monkeypatch):
     assert times["TOTAL"][4] == 7.0
     assert times["busy"][4] == 2.0
     assert times["agent"][4] == 5.0
+
+
+def test_cpu_tracking_other_thread(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 0.0)
+    cpu_tracking.start("busy")
+
+    def fetch():
+        cpu_tracking.push_phase("agent")
+        monkeypatch.setattr("time.time", lambda: 3.0)
+        cpu_tracking.pop_phase()
+
+    thread = threading.Thread(target=fetch)
+    thread.start()
+    thread.join()
+
+    monkeypatch.setattr("time.time", lambda: 4.0)
+    cpu_tracking.end()
+
+    times = cpu_tracking.get_times()
+    assert len(times) == 3
+
+    # The times of the thread are not accounted to TOTAL and to the phase of
+    # the tracking thread
+    assert times["TOTAL"][4] == 4.0
+    assert times["busy"][4] == 4.0
+    assert times["agent"][4] == 3.0
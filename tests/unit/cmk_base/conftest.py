@@ -8,3 +8,6 @@ def clear_config_caches(monkeypatch):
     import cmk_base.caching
     monkeypatch.setattr(cmk_base, "config_cache", cmk_base.caching.CacheManager())
     monkeypatch.setattr(cmk_base, "runtime_cache", cmk_base.caching.CacheManager())
+    import cmk_base.data_sources.host_sections as host_sections
+    monkeypatch.setattr(host_sections, "_parsed_sections_cache",
+                        host_sections.ParsedSectionsCache())
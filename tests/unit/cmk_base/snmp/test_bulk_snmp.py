@@ -0,0 +1,284 @@
+# pylint: disable=redefined-outer-name
+
+import bisect
+import socket
+import threading
+
+import pytest  # type: ignore
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+
+import cmk.utils.paths
+from cmk_base.exceptions import MKSNMPError
+import cmk_base.bulk_snmp as bulk_snmp
+import cmk_base.snmp as snmp
+import cmk_base.snmp_utils as snmp_utils
+
+WALK = """.1.3.6.1.2.1.1.1.0 Linux zeus 4.8.6.5-smp #2 SMP Sun Nov 13 14:58:11 CDT 2016 i686
+.1.3.6.1.2.1.1.2.0 .1.3.6.1.4.1.8072.3.2.10
+.1.3.6.1.2.1.1.3.0 449613886
+.1.3.6.1.2.1.1.5.0 new system name
+.1.3.6.1.2.1.2.2.1.1.1 1
+.1.3.6.1.2.1.2.2.1.1.2 2
+.1.3.6.1.2.1.2.2.1.1.3 3
+.1.3.6.1.2.1.2.2.1.2.1 lo
+.1.3.6.1.2.1.2.2.1.2.2 eth0
+.1.3.6.1.2.1.2.2.1.2.3 eth1
+.1.3.6.1.2.1.2.2.1.3.1 24
+.1.3.6.1.2.1.2.2.1.3.2 6
+.1.3.6.1.2.1.2.2.1.3.3 6
+.1.3.6.1.2.1.2.2.1.10.1 1234
+.1.3.6.1.2.1.2.2.1.10.2 5678
+.1.3.6.1.2.1.2.2.1.10.3 9012
+.1.3.6.1.2.1.4.1.0 2
+"""
+
+
+class SimulatedAgent(threading.Thread):
+    """Answers GET, GETNEXT and GETBULK requests with the data of a stored walk"""
+
+    def __init__(self, walk, community="public", drop=False, max_var_binds=None):
+        super(SimulatedAgent, self).__init__()
+        self.daemon = True
+        self._oids = []
+        self._values = []
+        for line in walk.splitlines():
+            oid, value = line.split(" ", 1)
+            self._oids.append(tuple(int(p) for p in oid.strip(".").split(".")))
+            self._values.append(value)
+        self._community = community
+        self._drop = drop
+        self._max_var_binds = max_var_binds
+        self.num_requests = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.port = self.socket.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                data, address = self.socket.recvfrom(65535)
+            except socket.error:
+                return
+            self.num_requests += 1
+            response = self._answer(data)
+            if response is not None and not self._drop:
+                self.socket.sendto(response, address)
+
+    def stop(self):
+        self.socket.close()
+
+    def _answer(self, data):
+        proto = api.protoModules[api.decodeMessageVersion(data)]
+        message = decoder.decode(data, asn1Spec=proto.Message())[0]
+        if str(proto.apiMessage.getCommunity(message)) != self._community:
+            return None
+
+        request_pdu = proto.apiMessage.getPDU(message)
+        oids = [tuple(oid) for oid, _unused in proto.apiPDU.getVarBinds(request_pdu)]
+
+        response_pdu = proto.apiPDU.getResponse(request_pdu)
+        proto.apiPDU.setErrorStatus(response_pdu, 0)
+        proto.apiPDU.setErrorIndex(response_pdu, 0)
+
+        var_binds = []
+        if isinstance(request_pdu, proto.GetRequestPDU):
+            for oid in oids:
+                var_binds.append(self._get(proto, oid))
+
+        elif isinstance(request_pdu, proto.GetNextRequestPDU):
+            for oid in oids:
+                var_binds.append(self._get_next(proto, oid))
+
+        else:
+            max_repetitions = int(proto.apiBulkPDU.getMaxRepetitions(request_pdu))
+            for _unused in range(max_repetitions):
+                row = [self._get_next(proto, oid) for oid in oids]
+                var_binds += row
+                oids = [tuple(oid) for oid, _unused_value in row]
+            # Agents may truncate GETBULK answers to fit them into a single packet
+            var_binds = var_binds[:self._max_var_binds]
+
+        for index, (oid, value) in enumerate(var_binds):
+            if value is None:
+                # SNMP v1 agents report unknown OIDs with an error
+                proto.apiPDU.setErrorStatus(response_pdu, 2)
+                proto.apiPDU.setErrorIndex(response_pdu, index + 1)
+                var_binds = [(o, proto.Null("")) for o in oids]
+                break
+
+        proto.apiPDU.setVarBinds(response_pdu, var_binds)
+        proto.apiMessage.setPDU(message, response_pdu)
+        return encoder.encode(message)
+
+    def _get(self, proto, oid):
+        index = bisect.bisect_left(self._oids, oid)
+        if index < len(self._oids) and self._oids[index] == oid:
+            return oid, self._value(proto, self._values[index])
+        if proto is api.protoModules[api.protoVersion1]:
+            return oid, None
+        return oid, proto.NoSuchObject("")
+
+    def _get_next(self, proto, oid):
+        index = bisect.bisect_right(self._oids, oid)
+        if index < len(self._oids):
+            return self._oids[index], self._value(proto, self._values[index])
+        if proto is api.protoModules[api.protoVersion1]:
+            return oid, None
+        return oid, proto.EndOfMibView("")
+
+    def _value(self, proto, value):
+        if value.startswith("."):
+            return proto.ObjectIdentifier(value[1:])
+        if value.isdigit():
+            return proto.Integer(int(value))
+        return proto.OctetString(value)
+
+
+@pytest.fixture()
+def agent():
+    agent = SimulatedAgent(WALK)
+    agent.start()
+    yield agent
+    agent.stop()
+
+
+@pytest.fixture()
+def stored_walk(tmp_path, monkeypatch):
+    tmp_path.joinpath("localhost").write_bytes(WALK)
+    monkeypatch.setattr(cmk.utils.paths, "snmpwalks_dir", str(tmp_path))
+    monkeypatch.setattr(snmp, "_g_walk_cache", {})
+
+
+def _snmp_config(port, bulk, v2c=True, credentials="public", timing=None):
+    return snmp_utils.SNMPHostConfig(
+        is_ipv6_primary=False,
+        hostname="localhost",
+        ipaddress="127.0.0.1",
+        credentials=credentials,
+        port=port,
+        is_bulkwalk_host=bulk,
+        is_snmpv2or3_without_bulkwalk_host=v2c and not bulk,
+        bulk_walk_size_of=2,
+        timing=timing or {},
+        oid_range_limits=[],
+        snmpv3_contexts=[],
+        character_encoding=None,
+        is_usewalk_host=False,
+        is_inline_snmp_host=False,
+        is_bulk_snmp_host=True,
+    )
+
+
+OIDS = [
+    ".1.3.6.1.2.1.1",
+    ".1.3.6.1.2.1.2.2.1.1",
+    ".1.3.6.1.2.1.2.2.1.2",
+    ".1.3.6.1.2.1.2.2.1.3",
+    ".1.3.6.1.2.1.2.2.1.10",
+    ".1.3.6.1.2.1.2.2.1.99",
+    ".1.3.6.1.2.1.4.1.0",
+    ".1.3.6.1.2.1.4.1",
+]
+
+
+@pytest.mark.parametrize("bulk,v2c", [
+    (True, True),
+    (False, True),
+    (False, False),
+])
+@pytest.mark.parametrize("window", [1, 4])
+def test_walk_many_like_stored_walk(agent, stored_walk, bulk, v2c, window):
+    snmp_config = _snmp_config(agent.port, bulk, v2c)
+    result = bulk_snmp.BulkSNMPBackend(window=window).walk_many(snmp_config, OIDS)
+
+    stored_backend = snmp.StoredWalkSNMPBackend()
+    for oid in OIDS:
+        assert result[oid] == stored_backend.walk(snmp_config, oid), oid
+
+
+def test_walk_many_combines_walks(agent):
+    snmp_config = _snmp_config(agent.port, bulk=True)
+    result = bulk_snmp.BulkSNMPBackend().walk_many(snmp_config, OIDS[1:5])
+    assert [len(rows) for rows in result.values()] == [3, 3, 3, 3]
+    # 4 columns with 3 rows and 2 repetitions per request: 2 requests for all walks
+    assert agent.num_requests == 2
+
+
+@pytest.mark.parametrize("max_var_binds", [1, 3])
+def test_walk_many_truncated_answers(stored_walk, max_var_binds):
+    agent = SimulatedAgent(WALK, max_var_binds=max_var_binds)
+    agent.start()
+    try:
+        snmp_config = _snmp_config(agent.port, bulk=True)
+        result = bulk_snmp.BulkSNMPBackend().walk_many(snmp_config, OIDS)
+    finally:
+        agent.stop()
+
+    stored_backend = snmp.StoredWalkSNMPBackend()
+    for oid in OIDS:
+        assert result[oid] == stored_backend.walk(snmp_config, oid), oid
+
+
+def test_get_snmp_table(agent):
+    snmp_config = _snmp_config(agent.port, bulk=True)
+    oid_info = (".1.3.6.1.2.1.2.2.1", [snmp_utils.OID_END, "2", "10"])
+    table = snmp.get_snmp_table(snmp_config, "if", oid_info, use_snmpwalk_cache=False)
+    assert table == [
+        ["1", "lo", "1234"],
+        ["2", "eth0", "5678"],
+        ["3", "eth1", "9012"],
+    ]
+    # Both columns are walked together
+    assert agent.num_requests == 2
+
+
+@pytest.mark.parametrize("v2c", [True, False])
+def test_get(agent, v2c):
+    backend = bulk_snmp.BulkSNMPBackend()
+    snmp_config = _snmp_config(agent.port, bulk=False, v2c=v2c)
+    assert backend.get(snmp_config, ".1.3.6.1.2.1.1.5.0") == "new system name"
+    assert backend.get(snmp_config, ".1.3.6.1.2.1.1.2.0") == ".1.3.6.1.4.1.8072.3.2.10"
+    assert backend.get(snmp_config, ".1.3.6.1.2.1.1.3.0") == "449613886"
+    assert backend.get(snmp_config, ".1.3.6.1.2.1.1.4.0") is None
+    assert backend.get(snmp_config, ".1.3.6.1.2.1.2.2.1.2.*") == "lo"
+    assert backend.get(snmp_config, ".1.3.6.1.2.1.3.*") is None
+
+
+def test_get_many(agent):
+    snmp_config = _snmp_config(agent.port, bulk=True)
+    assert bulk_snmp.BulkSNMPBackend().get_many(
+        snmp_config, [".1.3.6.1.2.1.1.5.0", ".1.3.6.1.2.1.1.4.0", ".1.3.6.1.2.1.2.2.1.2.*"]) == {
+            ".1.3.6.1.2.1.1.5.0": "new system name",
+            ".1.3.6.1.2.1.1.4.0": None,
+            ".1.3.6.1.2.1.2.2.1.2.*": "lo",
+        }
+    assert agent.num_requests == 2
+
+
+def test_timeout():
+    agent = SimulatedAgent(WALK, drop=True)
+    agent.start()
+    try:
+        snmp_config = _snmp_config(agent.port, bulk=True, timing={"timeout": 0.05, "retries": 2})
+        with pytest.raises(MKSNMPError, match="Timeout"):
+            bulk_snmp.BulkSNMPBackend().walk_many(snmp_config, OIDS)
+        assert agent.num_requests == 3  # All OIDs fit into one request
+    finally:
+        agent.stop()
+
+
+def test_wrong_community(agent):
+    snmp_config = _snmp_config(
+        agent.port, bulk=True, credentials="dingdong", timing={
+            "timeout": 0.05,
+            "retries": 0
+        })
+    with pytest.raises(MKSNMPError, match="Timeout"):
+        bulk_snmp.BulkSNMPBackend().get(snmp_config, ".1.3.6.1.2.1.1.5.0")
+
+
+def test_snmpv3_not_supported():
+    snmp_config = _snmp_config(1337, bulk=True, credentials=("noAuthNoPriv", "user"))
+    with pytest.raises(MKSNMPError, match="does not support"):
+        bulk_snmp.BulkSNMPBackend().get(snmp_config, ".1.3.6.1.2.1.1.5.0")
@@ -3,8 +3,10 @@
 import pytest  # type: ignore
 from testlib.base import Scenario
 
+import cmk.utils.paths
 import cmk_base.config as config
 import cmk_base.snmp as snmp
+import cmk_base.snmp_utils as snmp_utils
 
 
 @pytest.mark.parametrize(
@@ -38,3 +40,129 @@ def test_is_bulkwalk_host(monkeypatch):
     config_cache = ts.apply(monkeypatch)
     assert config_cache.get_host_config("abc").snmp_config("").is_bulkwalk_host is False
     assert config_cache.get_host_config("localhost").snmp_config("").is_bulkwalk_host is True
+
+
+WALK = """.1.3.6.1.2.1.2.2.1.1.1 1
+.1.3.6.1.2.1.2.2.1.1.2 2
+.1.3.6.1.2.1.2.2.1.2.1 lo
+.1.3.6.1.2.1.2.2.1.2.2 eth0
+.1.3.6.1.2.1.2.2.1.10.1 1234
+.1.3.6.1.2.1.2.2.1.10.2 5678
+.1.3.6.1.2.1.31.1.1.1.1.1 lo
+.1.3.6.1.2.1.31.1.1.1.1.2 eth0
+"""
+
+
+class RecordingSNMPBackend(snmp.StoredWalkSNMPBackend):
+    def __init__(self):
+        super(RecordingSNMPBackend, self).__init__()
+        self.walked_oids = []
+
+    def walk(self, snmp_config, oid, check_plugin_name=None, table_base_oid=None,
+             context_name=None):
+        self.walked_oids.append(oid)
+        return super(RecordingSNMPBackend, self).walk(snmp_config, oid, check_plugin_name,
+                                                      table_base_oid, context_name)
+
+
+@pytest.fixture()
+def backend(monkeypatch, tmp_path):
+    tmp_path.joinpath("localhost").write_bytes(WALK)
+    monkeypatch.setattr(cmk.utils.paths, "snmpwalks_dir", str(tmp_path))
+    monkeypatch.setattr(cmk.utils.paths, "var_dir", str(tmp_path / "var"))
+    snmp.cleanup_host_caches()
+
+    backend = RecordingSNMPBackend()
+    monkeypatch.setattr(snmp.SNMPBackendFactory, "factory",
+                        staticmethod(lambda snmp_config, enforce_stored_walks: backend))
+    yield backend
+    snmp.cleanup_host_caches()
+
+
+def _snmp_config():
+    return snmp_utils.SNMPHostConfig(
+        is_ipv6_primary=False,
+        hostname="localhost",
+        ipaddress="127.0.0.1",
+        credentials="public",
+        port=161,
+        is_bulkwalk_host=False,
+        is_snmpv2or3_without_bulkwalk_host=False,
+        bulk_walk_size_of=10,
+        timing={},
+        oid_range_limits=[],
+        snmpv3_contexts=[],
+        character_encoding=None,
+        is_usewalk_host=True,
+        is_inline_snmp_host=False,
+        is_bulk_snmp_host=False,
+    )
+
+
+def test_plan_snmpwalks():
+    assert snmp._plan_snmpwalks([
+        ".1.3.6.1.2.1.2.2.1.10",
+        ".1.3.6.1.2.1.2.2.1.1",
+        ".1.3.6.1.2.1.2",
+        ".1.3.6.1.2.1.20.1",
+        ".1.3.6.1.2.1.2.2.1.2",
+    ]) == [
+        (".1.3.6.1.2.1.2", [
+            ".1.3.6.1.2.1.2",
+            ".1.3.6.1.2.1.2.2.1.1",
+            ".1.3.6.1.2.1.2.2.1.2",
+            ".1.3.6.1.2.1.2.2.1.10",
+        ]),
+        (".1.3.6.1.2.1.20.1", [".1.3.6.1.2.1.20.1"]),
+    ]
+
+
+TABLES = [
+    ("if", (".1.3.6.1.2.1.2.2.1", [snmp_utils.OID_END, "2", "10"])),
+    ("if_brief", (".1.3.6.1.2.1.2.2.1", ["1", "2"])),
+    ("if_all", (".1.3.6.1.2.1.2.2", ["1"])),
+    ("if_names", (".1.3.6.1.2.1.31.1.1.1", ["1"])),
+]
+
+
+def test_prefetch_snmp_tables(backend):
+    snmp_config = _snmp_config()
+    expected = [
+        snmp.get_snmp_table(snmp_config, name, oid_info, use_snmpwalk_cache=False)
+        for name, oid_info in TABLES
+    ]
+    assert len(backend.walked_oids) == 6
+
+    snmp.cleanup_host_caches()
+    del backend.walked_oids[:]
+
+    snmp.prefetch_snmp_tables(snmp_config, TABLES, use_snmpwalk_cache=False)
+    assert backend.walked_oids == [".1.3.6.1.2.1.2.2.1", ".1.3.6.1.2.1.31.1.1.1.1"]
+
+    assert [
+        snmp.get_snmp_table(snmp_config, name, oid_info, use_snmpwalk_cache=False)
+        for name, oid_info in TABLES
+    ] == expected
+    assert len(backend.walked_oids) == 2
+
+
+def test_snmpwalk_cache(backend):
+    snmp_config = _snmp_config()
+    oid_info = (".1.3.6.1.2.1.2.2.1", [snmp_utils.OID_END, snmp_utils.CACHED_OID(2)])
+    expected = [[u"1", u"lo"], [u"2", u"eth0"]]
+
+    assert snmp.get_snmp_table(snmp_config, "if", oid_info, use_snmpwalk_cache=True) == expected
+    assert backend.walked_oids == [".1.3.6.1.2.1.2.2.1.2"]
+
+    # The cached column is neither walked by the planner nor by get_snmp_table
+    snmp.cleanup_host_caches()
+    snmp.prefetch_snmp_tables(snmp_config, [("if", oid_info)], use_snmpwalk_cache=True)
+    assert snmp.get_snmp_table(snmp_config, "if", oid_info, use_snmpwalk_cache=True) == expected
+    assert backend.walked_oids == [".1.3.6.1.2.1.2.2.1.2"]
+
+    assert snmp._load_snmpwalk_cache("localhost") == {
+        ".1.3.6.1.2.1.2.2.1.2": [
+            (".1.3.6.1.2.1.2.2.1.2.1", "lo"),
+            (".1.3.6.1.2.1.2.2.1.2.2", "eth0"),
+        ],
+    }
@@ -0,0 +1,134 @@
+# pylint: disable=redefined-outer-name
+
+import pytest  # type: ignore
+
+import cmk.utils.paths
+import cmk_base
+import cmk_base.caching
+import cmk_base.config as config
+import cmk_base.autochecks as autochecks
+
+AUTOCHECKS = """[
+  ('df', u'/', {}),
+  ('df', u'/opt', df_default_levels),
+  ('uptime', None, None),
+  ('hr_cpu', None, (80.0, 90.0)),
+  ('ntp.time', None, "ntp_default_levels" if True else {}),
+  ('ps', u'proc, "with" \\'quotes\\'', {'levels': (1, 1, 99, 99), 'match': '~a,b'}), # comment
+  ("legacy-host", 'mem', None, {'levels': (80.0, 90.0)}),
+  ('lnx_if', '2', {'state': ['1'], 'speed': 10000000}),
+]
+"""
+
+PARSED = [
+    ('df', u'/', "{}"),
+    ('df', u'/opt', "df_default_levels"),
+    ('uptime', None, "None"),
+    ('hr_cpu', None, "(80.0, 90.0)"),
+    ('ntp.time', None, '"ntp_default_levels" if True else {}'),
+    ('ps', u'proc, "with" \'quotes\'', "{'levels': (1, 1, 99, 99), 'match': '~a,b'}"),
+    ('mem', None, "{'levels': (80.0, 90.0)}"),
+    ('lnx_if', u'2', "{'state': ['1'], 'speed': 10000000}"),
+]
+
+
+@pytest.fixture()
+def autochecks_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(cmk_base, "config_cache", cmk_base.caching.CacheManager())
+    monkeypatch.setattr(cmk.utils.paths, "autochecks_dir", str(tmp_path / "autochecks"))
+    monkeypatch.setattr(cmk.utils.paths, "autochecks_bulk_file", str(tmp_path / "autochecks.bulk"))
+    (tmp_path / "autochecks").mkdir()
+    (tmp_path / "autochecks" / "host.mk").write_bytes(AUTOCHECKS)
+    return tmp_path / "autochecks"
+
+
+def test_parse_autochecks_file(autochecks_dir):
+    assert autochecks.parse_autochecks_file("host") == PARSED
+    assert autochecks.parse_autochecks_file("nohost") == []
+
+
+@pytest.mark.parametrize("line,parts", [
+    ("'df', u'/', {}", ["'df'", "u'/'", "{}"]),
+    ("'df', ('a', 'b'), {}", ["'df'", "('a', 'b')", "{}"]),
+    ("'host', 'df', None, {}", ["'host'", "'df'", "None", "{}"]),
+    ("'df', None, 'x' % (1, 2)", ["'df'", "None", "'x' % (1, 2)"]),
+    ("'df', None", ["'df'", "None"]),
+])
+def test_split_entry(line, parts):
+    assert autochecks._split_entry(line) == parts
+    assert autochecks._split_python_tuple(line) == parts
+
+
+@pytest.mark.parametrize("text,value", [
+    ("'df'", "df"),
+    ('"df"', "df"),
+    ("u'/'", u"/"),
+    ("u'\\xe4'", u"\xe4"),
+    ("u'a' + u'b'", u"ab"),
+    ("None", None),
+    ("'it''s'", "its"),
+])
+def test_eval_literal(text, value):
+    assert autochecks._eval_literal(text) == value
+    assert type(autochecks._eval_literal(text)) is type(value)
+
+
+def test_parse_autochecks_file_invalid(autochecks_dir):
+    (autochecks_dir / "host.mk").write_bytes("[\n  ('df', u'/'),\n]\n")
+    with pytest.raises(Exception, match="Invalid line 2"):
+        autochecks.parse_autochecks_file("host")
+
+
+def _unchanged_check_parameters(_hostname, _check_plugin_name, _item, params):
+    return params
+
+
+def test_read_autochecks_of(monkeypatch, autochecks_dir):
+    monkeypatch.setattr(config, "get_check_variables", lambda: {"df_default_levels": (80, 90)})
+    monkeypatch.setattr(config, "compute_check_parameters", _unchanged_check_parameters)
+    assert autochecks.read_autochecks_of("host")[:5] == [
+        ('df', u'/', {}),
+        ('df', u'/opt', (80, 90)),
+        ('uptime', None, None),
+        ('hr_cpu', None, (80.0, 90.0)),
+        ('ntp.time', None, "ntp_default_levels"),
+    ]
+
+    # Hand written files are still evaluated as a whole
+    (autochecks_dir / "host.mk").write_bytes("[('df', u'/',\n  {'levels': (80, 90)})]\n")
+    assert autochecks.read_autochecks_of("host") == [('df', u'/', {'levels': (80, 90)})]
+
+
+def test_preload_autochecks(monkeypatch, autochecks_dir):
+    (autochecks_dir / "other.mk").write_bytes("[\n  ('uptime', None, None),\n]\n")
+    autochecks.preload_autochecks(["host", "other", "nohost"])
+    assert autochecks_dir.parent.joinpath("autochecks.bulk").exists()
+
+    monkeypatch.setattr(cmk_base, "config_cache", cmk_base.caching.CacheManager())
+    parse = autochecks._parse_autochecks_lines
+    parsed = []
+
+    def parse_and_remember(path, lines, strict):
+        parsed.append(path)
+        return parse(path, lines, strict)
+
+    monkeypatch.setattr(autochecks, "_parse_autochecks_lines", parse_and_remember)
+
+    autochecks.preload_autochecks(["host", "other", "nohost"])
+    assert parsed == []
+    assert autochecks.parse_autochecks_file("host") == PARSED
+    assert autochecks.parse_autochecks_file("other") == [('uptime', None, "None")]
+    assert autochecks.parse_autochecks_file("nohost") == []
+
+    # Only changed files are parsed again
+    monkeypatch.setattr(cmk_base, "config_cache", cmk_base.caching.CacheManager())
+    (autochecks_dir / "other.mk").write_bytes("[\n  ('uptime', None, {}),\n]\n")
+    autochecks.preload_autochecks(["host", "other", "nohost"])
+    assert parsed == [str(autochecks_dir / "other.mk")]
+    assert autochecks.parse_autochecks_file("other") == [('uptime', None, "{}")]
+
+    # Saving updates the preloaded autochecks
+    autochecks.save_autochecks_file("other", [('uptime', None, "None")])
+    assert autochecks.parse_autochecks_file("other") == [('uptime', None, "None")]
+    autochecks.remove_autochecks_file("other")
+    assert autochecks.parse_autochecks_file("other") == []
@@ -0,0 +1,129 @@
+# pylint: disable=redefined-outer-name
+import os
+import socket
+import sys
+import time
+
+import pytest  # type: ignore
+
+import cmk.utils.paths
+import cmk_base.config as config
+import cmk_base.automation_helper as automation_helper
+
+
+def _run_automation(command, args):
+    if args == ["exit"]:
+        sys.exit(3)
+    if args == ["fail"]:
+        raise Exception("Failed")
+    if args == ["sleep"]:
+        time.sleep(1)
+    config.__dict__["_echo_modified"] = True
+    sys.stdout.write("%r\n" % {
+        "command": command,
+        "args": args,
+        "stdin": sys.stdin.read(),
+        "pid": os.getpid()
+    })
+    return 0
+
+
+@pytest.fixture()
+def daemon(monkeypatch, tmpdir):
+    loads = []
+    monkeypatch.setattr(config, "load_all_checks", lambda get_check_api_context: loads.append(1))
+    monkeypatch.setattr(config, "load", lambda validate_hosts=True: loads.append(2))
+    monkeypatch.setattr(config, "get_config_generation", lambda: "gen1")
+    monkeypatch.setattr(cmk.utils.paths, "automation_helper_socket",
+                        "%s/automation-helper" % tmpdir)
+    monkeypatch.setattr(automation_helper, "_run_automation", _run_automation)
+
+    daemon = automation_helper.AutomationHelperDaemon()
+    assert loads == [1, 2]
+    yield daemon
+
+    for pid in daemon._automation_processes:
+        os.waitpid(pid, 0)
+
+
+def _connect(daemon, request):
+    server, client = socket.socketpair()
+    client.sendall(request)
+    client.shutdown(socket.SHUT_WR)
+    daemon._serve_connection(server)
+    return client
+
+
+def _receive(client):
+    response = []
+    while True:
+        chunk = client.recv(1024)
+        if not chunk:
+            break
+        response.append(chunk)
+    client.close()
+    return "".join(response)
+
+
+def test_serve_connection(daemon):
+    response = _receive(_connect(daemon, repr(("echo", ["a", "b"], "'input'"))))
+    status, output = response.split("\n", 1)
+    assert status == "0"
+
+    result = eval(output)  # pylint: disable=eval-used
+    assert result["command"] == "echo"
+    assert result["args"] == ["a", "b"]
+    assert result["stdin"] == "'input'"
+    # Executed in a separate process without influencing the daemon
+    assert result["pid"] != os.getpid()
+    assert "_echo_modified" not in config.__dict__
+
+
+def test_serve_connection_does_not_wait(daemon):
+    started = time.time()
+    clients = [_connect(daemon, repr(("echo", ["sleep"], ""))) for _i in range(3)]
+    assert time.time() - started < 0.5
+    assert len(daemon._automation_processes) == 3
+
+    for client in clients:
+        assert _receive(client).startswith("0\n")
+    assert time.time() - started < 2.5
+
+    for _i in range(50):
+        daemon._reap_automation_processes()
+        if not daemon._automation_processes:
+            break
+        time.sleep(0.1)
+    assert daemon._automation_processes == {}
+
+
+@pytest.mark.parametrize("args,response", [
+    (["exit"], "3\n"),
+    (["fail"], "2\nFailed\n"),
+])
+def test_handle_request_errors(daemon, args, response):
+    assert daemon.handle_request(repr(("echo", args, ""))) == response
+
+
+def test_handle_request_stale(monkeypatch, daemon):
+    monkeypatch.setattr(config, "get_config_generation", lambda: "gen2")
+    assert daemon.handle_request(repr(("echo", [], ""))) == automation_helper.STALE_RESPONSE
+
+
+def test_config_generation(monkeypatch, tmp_path):
+    monkeypatch.setattr(cmk.utils.paths, "main_config_file", str(tmp_path / "main.mk"))
+    monkeypatch.setattr(cmk.utils.paths, "check_mk_config_dir", str(tmp_path / "conf.d"))
+    monkeypatch.setattr(cmk.utils.paths, "local_checks_dir", str(tmp_path / "checks"))
+    tmp_path.joinpath("main.mk").write_bytes("")
+    tmp_path.joinpath("conf.d").mkdir()
+    tmp_path.joinpath("checks").mkdir()
+
+    generation = config.get_config_generation()
+    assert config.get_config_generation() == generation
+
+    tmp_path.joinpath("conf.d", "hosts.mk").write_bytes("all_hosts += []\n")
+    assert config.get_config_generation() != generation
+
+    generation = config.get_config_generation()
+    tmp_path.joinpath("checks", "my_check").write_bytes("")
+    assert config.get_config_generation() != generation
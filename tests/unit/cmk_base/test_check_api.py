@@ -263,3 +263,26 @@ def test_get_effective_service_level(monkeypatch):
     assert check_api.get_effective_service_level() == 10
     check_api_utils.set_hostname("testhost3")
     assert check_api.get_effective_service_level() == 0
+
+
+@pytest.mark.parametrize("params, kwargs", [
+    (None, {}),
+    ((None, None), {}),
+    ((4, 8), {
+        "unit": "years"
+    }),
+    ((4, 8, 2, 1), {
+        "unit": "/s",
+        "statemarkers": True
+    }),
+    ((None, None, 2, 1), {
+        "factor": 2.0,
+        "human_readable_func": check_api.get_percent_human_readable
+    }),
+])
+def test_check_levels_many(params, kwargs):
+    values = [(0.5, "a"), (1.5, "b", "B"), (3, None), (5, "d", "D"), (9, "e"), (16, "f")]
+    assert check_api.check_levels_many(values, params, **kwargs) == [
+        check_api.check_levels(
+            v[0], v[1], params, infoname=v[2] if len(v) == 3 else None, **kwargs) for v in values
+    ]
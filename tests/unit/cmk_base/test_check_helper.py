@@ -0,0 +1,34 @@
+# pylint: disable=redefined-outer-name
+import pytest  # type: ignore
+
+import cmk_base.check_helper as check_helper
+
+
+@pytest.fixture()
+def cleanups(monkeypatch):
+    calls = []
+    monkeypatch.setattr(check_helper.cmk_base.cleanup,
+                        "cleanup_globals", lambda: calls.append(True))
+    return calls
+
+
+@pytest.fixture()
+def daemon():
+    # The socket and the workers are not needed to handle a single request
+    return check_helper.CheckHelperDaemon.__new__(check_helper.CheckHelperDaemon)
+
+
+def test_handle_request_cleans_up_globals(monkeypatch, cleanups, daemon):
+    monkeypatch.setattr(check_helper.checking, "do_check", lambda hostname, ipaddress: 0)
+    assert daemon.handle_request("host1\n") == "0\n"
+    assert len(cleanups) == 1
+
+
+def test_handle_request_cleans_up_globals_on_error(monkeypatch, cleanups, daemon):
+    def do_check(hostname, ipaddress):
+        raise Exception("Failed to check %s" % hostname)
+
+    monkeypatch.setattr(check_helper.checking, "do_check", do_check)
+    with pytest.raises(Exception):
+        daemon.handle_request("host1\n")
+    assert len(cleanups) == 1
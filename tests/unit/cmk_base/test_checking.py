@@ -1,3 +1,4 @@
+import select
 import pytest
 import cmk_base.core
 import cmk_base.config
@@ -152,3 +153,39 @@ def test_determine_check_parameters(monkeypatch, rules, active_timeperiods, expe
 
 def _check_timeperiod(timeperiod, active_timeperiods):
     return timeperiod in active_timeperiods
+
+
+class _RecordingPipe(object):
+    def __init__(self):
+        self.writes = []
+        self._buf = ""
+
+    def write(self, data):
+        self._buf += data
+
+    def flush(self):
+        self.writes.append(self._buf)
+        self._buf = ""
+
+
+def test_submit_via_command_pipe_batched(monkeypatch):
+    pipe = _RecordingPipe()
+    monkeypatch.setattr(cmk_base.checking, "_nagios_command_pipe", pipe)
+
+    cmk_base.checking._start_check_result_batch()
+    for index in range(200):
+        cmk_base.checking._submit_via_command_pipe("host", u"Interface %d" % index, 0,
+                                                   "OK - output\nlong output")
+    assert pipe.writes == []
+
+    cmk_base.checking._flush_check_results()
+    assert 1 < len(pipe.writes) < 200
+    assert all(len(w) <= select.PIPE_BUF and w.endswith("\n") for w in pipe.writes)
+
+    commands = "".join(pipe.writes).splitlines()
+    assert len(commands) == 200
+    assert commands[7].endswith(";host;Interface 7;0;OK - output\\nlong output")
+
+    # Without an active batch the results are written immediately
+    cmk_base.checking._submit_via_command_pipe("host", u"CPU load", 0, "OK - output")
+    assert len(commands) + 1 == len("".join(pipe.writes).splitlines())
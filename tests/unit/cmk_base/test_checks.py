@@ -1,8 +1,11 @@
 # pylint: disable=redefined-outer-name
 
+import os
+
 import pytest  # type: ignore
 from testlib.base import Scenario
 
+import cmk.utils.paths
 import cmk_base.config as config
 import cmk_base.check_utils
 import cmk_base.check_api as check_api
@@ -50,6 +53,73 @@ def test_discoverable_tcp_checks():
     assert "logwatch" in config.discoverable_tcp_checks()
 
 
+@pytest.fixture()
+def check_manifest(monkeypatch, tmp_path):
+    monkeypatch.setattr(cmk.utils.paths, "check_manifest_file", str(tmp_path / "check_manifest"))
+    config.load_all_checks(check_api.get_check_api_context)
+    yield
+    config.load_all_checks(check_api.get_check_api_context)
+
+
+def test_check_manifest(check_manifest):
+    manifest = config.get_check_manifest(check_api.get_check_api_context)
+    assert sorted(manifest["checks"]) == sorted(config.check_info)
+    assert manifest["checks"]["df"]["file"] == os.path.join(cmk.utils.paths.checks_dir, "df")
+    assert manifest["checks"]["brocade.fan"]["file"] == os.path.join(cmk.utils.paths.checks_dir,
+                                                                     "brocade")
+    assert manifest["checks"]["brocade.fan"]["snmp"] is True
+    assert manifest["checks"]["df"]["snmp"] is False
+    assert manifest["checks"]["df"]["group"] == "filesystem"
+    assert manifest["active_checks"]["http"] == os.path.join(cmk.utils.paths.checks_dir,
+                                                             "check_http")
+    assert manifest["sections"]["brocade"] == [os.path.join(cmk.utils.paths.checks_dir, "brocade")]
+
+
+def test_check_manifest_invalidated(monkeypatch, tmp_path, check_manifest):
+    assert config._load_check_manifest() is not None
+
+    monkeypatch.setattr(cmk.utils.paths, "local_checks_dir", str(tmp_path / "local_checks"))
+    tmp_path.joinpath("local_checks").mkdir()
+    assert config._load_check_manifest() is not None
+
+    tmp_path.joinpath("local_checks", "df").write_bytes(
+        open(os.path.join(cmk.utils.paths.checks_dir, "df")).read())
+    assert config._load_check_manifest() is None
+
+    # The manifest is recreated when loading the checks, the local file now defines "df"
+    manifest = config.get_check_manifest(check_api.get_check_api_context)
+    assert manifest["checks"]["df"]["file"] == str(tmp_path / "local_checks" / "df")
+    assert config._load_check_manifest() == manifest
+
+
+def test_load_checks_of_plugins(check_manifest):
+    config._initialize_data_structures()
+    config.load_checks_of_plugins(check_api.get_check_api_context, ["brocade.fan", "not_existing"],
+                                  ["http"])
+    assert sorted(config.check_info) == ["brocade.fan", "brocade.power", "brocade.temp"]
+    assert list(config.active_check_info) == ["http"]
+    assert not config.all_checks_loaded()
+
+    config.load_checks_of_plugins(check_api.get_check_api_context, ["df"])
+    assert "df" in config.check_info
+    assert "brocade.fan" in config.check_info
+
+
+def test_load_checks_of_plugins_by_section(check_manifest):
+    config._initialize_data_structures()
+    config.load_checks_of_plugins(check_api.get_check_api_context, ["brocade"])
+    assert sorted(config.check_info) == ["brocade.fan", "brocade.power", "brocade.temp"]
+
+
+def test_load_checks_of_plugins_without_manifest(monkeypatch, tmp_path):
+    monkeypatch.setattr(cmk.utils.paths, "check_manifest_file", str(tmp_path / "check_manifest"))
+    config._initialize_data_structures()
+    config.load_checks_of_plugins(check_api.get_check_api_context, ["df"])
+    assert config.all_checks_loaded()
+    assert len(config.check_info) > 1000
+    assert config._load_check_manifest() is not None
+
+
 ############ Management board checks
 
 
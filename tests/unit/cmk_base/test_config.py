@@ -1639,3 +1639,86 @@ def test_host_config_service_level(monkeypatch, hostname, result):
     )
     config_cache = ts.apply(monkeypatch)
     assert config_cache.get_host_config(hostname).service_level == result
+
+
+@pytest.fixture()
+def snapshot_scenario(monkeypatch):
+    ts = Scenario()
+    ts.add_host("test-host", tags={"agent": "no-agent", "snmp_ds": "snmp-v2"})
+    ts.add_host("xyz")
+    ts.add_host("offline-host", tags={"criticality": "offline"})
+    ts.add_cluster("cluster", nodes=["xyz"])
+    ts.set_ruleset("only_hosts", [
+        (["!offline"], config.ALL_HOSTS),
+    ])
+    ts.set_ruleset("host_label_rules", [
+        ({
+            "from-rule": "rule1"
+        }, ["no-agent"], config.ALL_HOSTS, {}),
+    ])
+    ts.set_option("extra_host_conf", {
+        "alias": [(u"Alias of xyz", [], ["xyz"], {})],
+    })
+    return ts.apply(monkeypatch)
+
+
+def _load_snapshot(tmp_path, config_cache, generation=(1.0, 1)):
+    path = str(tmp_path / "config_cache_snapshot")
+    config.ConfigCacheSnapshot(path).save(config_cache, generation=(1.0, 1))
+    snapshot = config.ConfigCacheSnapshot(path)
+    return snapshot if snapshot.load(generation) else None
+
+
+def test_config_cache_snapshot(monkeypatch, tmp_path, snapshot_scenario):
+    snapshot = _load_snapshot(tmp_path, snapshot_scenario)
+    assert snapshot is not None
+
+    config_cache = config.ConfigCache()
+    config_cache.initialize(snapshot)
+
+    # Rule based host attributes are not computed anymore
+    monkeypatch.setattr(config_cache, "host_extra_conf", lambda *args: 1 / 0)
+    monkeypatch.setattr(config_cache, "in_binary_hostlist", lambda *args: 1 / 0)
+
+    assert config_cache.all_active_hosts() == set(["test-host", "xyz", "cluster"])
+    assert config_cache.all_active_clusters() == set(["cluster"])
+    assert config_cache.host_snapshot("offline-host") is None
+
+    for hostname in ["test-host", "xyz", "cluster"]:
+        expected = snapshot_scenario.get_host_config(hostname)
+        host_config = config_cache.get_host_config(hostname)
+        for attr in [
+                "alias", "parents", "tags", "tag_groups", "labels", "label_sources", "is_tcp_host",
+                "is_snmp_host", "is_usewalk_host", "is_ipv6_primary", "nodes", "part_of_clusters"
+        ]:
+            assert getattr(host_config, attr) == getattr(expected, attr), (hostname, attr)
+
+    assert config_cache.get_host_config("xyz").alias == u"Alias of xyz"
+    assert config_cache.get_host_config("test-host").labels == {"from-rule": "rule1"}
+
+    config_cache.set_all_processed_hosts(["xyz"])
+    assert config_cache.all_processed_hosts() == set(["xyz", "cluster"])
+
+
+def test_config_cache_snapshot_foreign_hosts(monkeypatch, tmp_path, snapshot_scenario):
+    snapshot = _load_snapshot(tmp_path, snapshot_scenario)
+    assert snapshot is not None
+
+    config_cache = config.ConfigCache()
+    config_cache.initialize(snapshot)
+
+    # Hosts are matched by their tag groups with a high similarity of the processed hosts
+    monkeypatch.setattr(config_cache, "_all_processed_hosts_similarity", 3)
+    optimizer = config_cache.ruleset_matcher.ruleset_optimizer
+    condition = {"host_tags": {"criticality": "offline"}}
+    assert optimizer._all_matching_hosts(
+        condition, with_foreign_hosts=True) == set(["offline-host"])
+    assert optimizer._all_matching_hosts(condition, with_foreign_hosts=False) == set()
+
+
+def test_config_cache_snapshot_outdated(tmp_path, snapshot_scenario):
+    assert _load_snapshot(tmp_path, snapshot_scenario, generation=(2.0, 1)) is None
+
+
+def test_config_cache_snapshot_missing(tmp_path):
+    assert not config.ConfigCacheSnapshot(str(tmp_path / "missing")).load((1.0, 1))
@@ -1,6 +1,7 @@
 # encoding: utf-8
 # pylint: disable=redefined-outer-name
 import itertools
+import os
 from StringIO import StringIO
 
 import pytest  # type: ignore
@@ -187,3 +188,123 @@ def test_create_nagios_host_spec(hostname, result, monkeypatch):
 
     host_spec = core_nagios._create_nagios_host_spec(cfg, config_cache, hostname, host_attrs)
     assert host_spec == result
+
+
+def test_create_config_parallel(monkeypatch):
+    ts = Scenario()
+    hostnames = ["host%02d" % i for i in range(20)]
+    for hostname in hostnames:
+        ts.add_host(hostname)
+    ts.set_option("ipaddresses", {h: "127.0.0.%d" % i for i, h in enumerate(hostnames, 1)})
+    ts.set_option("host_check_commands", [
+        ("agent", [], hostnames[3:5] + hostnames[12:13]),
+        (("service", "CPU load"), [], hostnames[17:]),
+    ])
+    ts.set_option("extra_host_conf", {
+        "_SERVICE_PERIOD": [("24X7", hostnames[:10]),],
+    })
+    ts.apply(monkeypatch)
+
+    def create_config():
+        core_config.initialize_warnings()
+        outfile = StringIO()
+        core_nagios.create_config(outfile, hostnames)
+        return outfile.getvalue()
+
+    monkeypatch.setattr(core_nagios, "_MIN_HOSTS_PER_PROCESS", 1)
+
+    monkeypatch.setattr(core_nagios.config, "core_config_processes", 1)
+    serial_config = create_config()
+    assert "check-mk-host-custom-6" in serial_config
+    assert create_config() == serial_config
+
+    monkeypatch.setattr(core_nagios.config, "core_config_processes", 3)
+    assert core_nagios._num_config_processes(len(hostnames)) == 3
+    assert create_config() == serial_config
+
+
+def test_shard_hostnames():
+    hostnames = ["host%02d" % i for i in range(10)]
+    chunks = core_nagios._shard_hostnames(hostnames, 2)
+    assert len(chunks) == 5
+    assert sum(chunks, []) == hostnames
+
+
+def _incremental_scenario(monkeypatch, aliases):
+    ts = Scenario()
+    hostnames = ["host%02d" % i for i in range(6)]
+    for hostname in hostnames:
+        ts.add_host(hostname)
+    ts.set_option("ipaddresses", {h: "127.0.0.%d" % i for i, h in enumerate(hostnames, 1)})
+    ts.set_option("extra_host_conf", {
+        "alias": [(alias, [hostname]) for hostname, alias in sorted(aliases.items())],
+    })
+    ts.apply(monkeypatch)
+    return hostnames
+
+
+def test_create_config_incremental(monkeypatch, tmp_path):
+    monkeypatch.setattr(core_nagios.cmk.utils.paths, "core_config_fragments_dir", str(tmp_path))
+
+    created = []
+    orig_create_host_fragment = core_nagios._create_host_fragment
+
+    def create_host_fragment(config_cache, hostname):
+        created.append(hostname)
+        return orig_create_host_fragment(config_cache, hostname)
+
+    monkeypatch.setattr(core_nagios, "_create_host_fragment", create_host_fragment)
+
+    def create_config(hostnames, incremental):
+        core_config.initialize_warnings()
+        del created[:]
+        outfile = StringIO()
+        core_nagios.create_config(outfile, hostnames, incremental=incremental)
+        return outfile.getvalue()
+
+    hostnames = _incremental_scenario(monkeypatch, {"host01": "first", "host04": "fourth"})
+    full_config = create_config(hostnames, incremental=False)
+    assert create_config(hostnames, incremental=True) == full_config
+    assert created == hostnames
+
+    assert create_config(hostnames, incremental=True) == full_config
+    assert created == []
+
+    # Only the host with the changed alias is created again
+    hostnames = _incremental_scenario(monkeypatch, {"host01": "first", "host04": "changed"})
+    full_config = create_config(hostnames, incremental=False)
+    assert "changed" in full_config
+    assert create_config(hostnames, incremental=True) == full_config
+    assert created == ["host04"]
+
+    # Removed hosts are cleaned up
+    incremental_config = create_config(hostnames[:3], incremental=True)
+    assert incremental_config == create_config(hostnames[:3], incremental=False)
+    assert sorted(os.listdir(str(tmp_path / "hosts"))) == hostnames[:3]
+
+    monkeypatch.setattr(core_config, "_full_rebuild", True)
+    assert create_config(hostnames, incremental=True) == full_config
+    assert created == hostnames
+
+
+def test_outdated_hostchecks(monkeypatch, tmp_path):
+    monkeypatch.setattr(core_nagios.cmk.utils.paths, "core_config_fragments_dir",
+                        str(tmp_path / "fragments"))
+    monkeypatch.setattr(core_nagios.cmk.utils.paths, "precompiled_hostchecks_dir",
+                        str(tmp_path / "precompiled"))
+    (tmp_path / "precompiled").mkdir()
+    (tmp_path / "precompiled" / "host1").write_text(u"")
+
+    host_fingerprints = {"host1": "abc", "host2": "def"}
+    assert sorted(core_nagios._outdated_hostchecks(host_fingerprints)) == ["host1", "host2"]
+
+    for hostname, fingerprint in host_fingerprints.items():
+        core_nagios._save_hostcheck_fingerprint(hostname, fingerprint)
+    assert core_nagios._outdated_hostchecks(host_fingerprints) == []
+
+    # Changed fingerprint and removed precompiled host check
+    (tmp_path / "precompiled" / "host1").unlink()
+    assert sorted(core_nagios._outdated_hostchecks({
+        "host1": "abc",
+        "host2": "xyz"
+    })) == ["host1", "host2"]
@@ -1,5 +1,8 @@
 # pylint: disable=redefined-outer-name
 
+import signal
+import threading
+
 import pytest  # type: ignore
 from testlib.base import Scenario
 
@@ -13,6 +16,7 @@ import cmk_base.data_sources.tcp
 import cmk_base.ip_lookup as ip_lookup
 import cmk_base.config as config
 import cmk_base.exceptions
+from cmk.utils.exceptions import MKTimeout
 
 
 def test_data_source_cache_default(monkeypatch):
@@ -225,3 +229,68 @@ def test_data_sources_of_hosts(monkeypatch, hostname, settings):
     sources = cmk_base.data_sources.DataSources(hostname, "127.0.0.1")
     source_names = [s.__class__.__name__ for s in sources.get_data_sources()]
     assert settings["sources"] == source_names, "Wrong sources for %s" % hostname
+
+
+class _FakeDataSource(object):
+    def __init__(self, name, concurrent, running):
+        self._name = name
+        self._concurrent = concurrent
+        self._running = running
+
+    def may_run_concurrently(self):
+        return self._concurrent
+
+    def run(self):
+        self._running.append(self._name)
+        # Serial sources must never overlap with other serial sources
+        assert self._concurrent or "serial" not in self._running[:-1]
+        self._running.remove(self._name)
+        return cmk_base.data_sources.host_sections.HostSections(sections={self._name: [[]]})
+
+
+@pytest.mark.parametrize("max_concurrent", [1, 2, 8])
+def test_fetch_host_sections(monkeypatch, max_concurrent):
+    monkeypatch.setattr(config, "max_concurrent_data_sources", max_concurrent)
+
+    running = []
+    sources = [
+        _FakeDataSource("agent", True, running),
+        _FakeDataSource("serial", False, running),
+        _FakeDataSource("special", True, running),
+        _FakeDataSource("serial", False, running),
+    ]
+
+    host_sections = cmk_base.data_sources._fetch_host_sections(sources)
+    assert len(host_sections) == 4
+    for source in sources:
+        assert host_sections[source].sections == {source._name: [[]]}
+
+
+class _HangingDataSource(_FakeDataSource):
+    def __init__(self, released):
+        super(_HangingDataSource, self).__init__("hanging", True, [])
+        self._released = released
+
+    def run(self):
+        self._released.wait()
+        return super(_HangingDataSource, self).run()
+
+
+def test_fetch_host_sections_timeout(monkeypatch):
+    monkeypatch.setattr(config, "max_concurrent_data_sources", 2)
+
+    def raise_timeout(signum, stackframe):
+        raise MKTimeout("Timeout")
+
+    released = threading.Event()
+    sources = [_HangingDataSource(released), _HangingDataSource(released)]
+
+    previous_handler = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, 0.5)
+    try:
+        with pytest.raises(MKTimeout):
+            cmk_base.data_sources._fetch_host_sections(sources)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+        released.set()
@@ -0,0 +1,117 @@
+# pylint: disable=redefined-outer-name
+
+import time
+
+import pytest  # type: ignore
+from testlib.base import Scenario
+
+import cmk.utils.paths
+import cmk.utils.store as store
+import cmk_base.config as config
+import cmk_base.core
+import cmk_base.discovery as discovery
+
+
+@pytest.fixture()
+def marked_hosts(monkeypatch, tmp_path):
+    ts = Scenario()
+    for hostname in ["host1", "host2", "host3", "host4", "down"]:
+        ts.add_host(hostname)
+    ts.apply(monkeypatch)
+
+    monkeypatch.setattr(cmk.utils.paths, "var_dir", str(tmp_path))
+    monkeypatch.setattr(cmk.utils.paths, "tmp_dir", str(tmp_path))
+    tmp_path.joinpath("autodiscovery").mkdir()
+    for hostname in ["host1", "host2", "host3", "host4", "down", "removed"]:
+        tmp_path.joinpath("autodiscovery", hostname).write_bytes("")
+
+    monkeypatch.setattr(discovery, "_fetch_host_states", lambda: {
+        "host1": 0,
+        "host2": 0,
+        "host3": 0,
+        "host4": 0,
+        "down": 1,
+    })
+
+    def discover_marked_host(config_cache, host_config, now_ts, oldest_queued):
+        time.sleep(0.5)
+        if host_config.hostname == "host3":
+            raise Exception("broken")
+        tmp_path.joinpath("autodiscovery", host_config.hostname).unlink()
+        return host_config.hostname == "host2"
+
+    monkeypatch.setattr(discovery, "_discover_marked_host", discover_marked_host)
+
+    reloads = []
+    monkeypatch.setattr(cmk_base.core, "do_reload", reloads.append)
+    monkeypatch.setattr(cmk_base.core, "do_restart", reloads.append)
+    monkeypatch.setattr(config, "marked_host_discovery_workers", 4)
+    return reloads
+
+
+def test_discover_marked_hosts(tmp_path, marked_hosts):
+    started = time.time()
+    discovery.discover_marked_hosts("core")
+    # All hosts are discovered in parallel
+    assert time.time() - started < 1.5
+
+    assert marked_hosts == ["core"]
+    assert sorted(p.name for p in tmp_path.joinpath("autodiscovery").iterdir()) == ["down", "host3"]
+
+    status = store.load_data_from_file(str(tmp_path / "autodiscovery.status"))
+    assert status["scheduled"] == 4
+    assert status["done"] == 4
+    assert status["failed"] == 1
+    assert status["queued"] == 2
+    assert status["finished"] >= status["started"]
+
+
+def test_discover_marked_hosts_sequential(monkeypatch, tmp_path, marked_hosts):
+    monkeypatch.setattr(config, "marked_host_discovery_workers", 1)
+    started = time.time()
+    discovery.discover_marked_hosts("core")
+    assert time.time() - started >= 2.0
+    assert marked_hosts == ["core"]
+
+
+def test_discover_marked_hosts_without_changes(tmp_path, marked_hosts):
+    tmp_path.joinpath("autodiscovery", "host2").unlink()
+    discovery.discover_marked_hosts("core")
+    assert marked_hosts == []
+
+
+def test_discover_marked_hosts_cluster_nodes(monkeypatch, tmp_path):
+    ts = Scenario()
+    for hostname in ["node1", "node2", "host3"]:
+        ts.add_host(hostname)
+    ts.add_cluster("cluster", nodes=["node1", "node2"])
+    ts.apply(monkeypatch)
+
+    monkeypatch.setattr(cmk.utils.paths, "var_dir", str(tmp_path))
+    monkeypatch.setattr(cmk.utils.paths, "tmp_dir", str(tmp_path))
+    tmp_path.joinpath("autodiscovery").mkdir()
+    tmp_path.joinpath("running").mkdir()
+    for hostname in ["cluster", "node1", "node2", "host3"]:
+        tmp_path.joinpath("autodiscovery", hostname).write_bytes("")
+    monkeypatch.setattr(discovery, "_fetch_host_states", lambda: {})
+    monkeypatch.setattr(config, "marked_host_discovery_workers", 4)
+
+    def discover_marked_host(config_cache, host_config, now_ts, oldest_queued):
+        # The discovery of the cluster changes the autochecks of the nodes
+        hostnames = [host_config.hostname] + (host_config.nodes or [])
+        running = tmp_path.joinpath("running")
+        if any(running.joinpath(h).exists() for h in hostnames):
+            return False  # Keeps the host marked
+        for h in hostnames:
+            running.joinpath(h).write_bytes("")
+        time.sleep(0.3)
+        for h in hostnames:
+            running.joinpath(h).unlink()
+        tmp_path.joinpath("autodiscovery", host_config.hostname).unlink()
+        return False
+
+    monkeypatch.setattr(discovery, "_discover_marked_host", discover_marked_host)
+
+    discovery.discover_marked_hosts("core")
+    # No discovery found its autochecks changed by another one at the same time
+    assert list(tmp_path.joinpath("autodiscovery").iterdir()) == []
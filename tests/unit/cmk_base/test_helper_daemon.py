@@ -0,0 +1,75 @@
+# pylint: disable=redefined-outer-name
+import socket
+import time
+
+import pytest  # type: ignore
+
+from cmk_base.helper_daemon import HelperDaemon
+
+
+class EchoDaemon(HelperDaemon):
+    def handle_request(self, request):
+        if request == "sleep":
+            time.sleep(5)
+        return request.upper()
+
+
+@pytest.fixture()
+def daemon(tmpdir):
+    return EchoDaemon(
+        socket_path="%s/helper" % tmpdir,
+        num_workers=1,
+        request_timeout=1,
+    )
+
+
+def _request(daemon, request):
+    server, client = socket.socketpair()
+    client.sendall(request)
+    client.shutdown(socket.SHUT_WR)
+    daemon._serve_connection(server)
+
+    response = []
+    while True:
+        chunk = client.recv(1024)
+        if not chunk:
+            break
+        response.append(chunk)
+    client.close()
+    return "".join(response)
+
+
+def test_serve_connection(daemon):
+    assert _request(daemon, "abc") == "ABC"
+
+
+def test_serve_connection_empty_request(daemon):
+    assert _request(daemon, "") == ""
+
+
+def test_serve_connection_timeout(daemon):
+    assert _request(daemon, "sleep").startswith("ERROR: Request timed out")
+
+
+def test_generation(tmpdir):
+    generation_path = tmpdir.join("config.mk")
+    daemon = EchoDaemon(
+        socket_path="%s/helper" % tmpdir,
+        num_workers=1,
+        request_timeout=1,
+        generation_path="%s" % generation_path,
+    )
+    assert daemon._get_generation() is None
+
+    generation_path.write("")
+    assert daemon._get_generation() == generation_path.stat().mtime
+
+
+def test_open_listen_socket(daemon, tmpdir):
+    sock = daemon._open_listen_socket()
+    try:
+        assert tmpdir.join("helper").check()
+    finally:
+        daemon._listen_socket = sock
+        daemon._close_listen_socket()
+    assert not tmpdir.join("helper").check()
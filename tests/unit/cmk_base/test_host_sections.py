@@ -91,3 +91,113 @@ def test_get_section_content(monkeypatch, hostname, nodes, host_entries, cluster
         hostname, "127.0.0.1", "check_plugin_name", False, service_description=service_descr)
     assert expected_result == section_content,\
            "Section content: Expected '%s' but got '%s'" % (expected_result, section_content)
+
+
+def _chunk(raw_data, separator=None):
+    return host_sections.RawSectionChunk(raw_data, 0, len(raw_data), separator, False, None)
+
+
+def test_lazy_sections_parse_on_access():
+    sections = host_sections.LazySections()
+    sections.add_raw_chunk("a", _chunk("1 2\n\n 3 4 \n"))
+    sections.add_raw_chunk("a", _chunk("5;6", separator=";"))
+    sections.add_raw_chunk("b")
+
+    assert sorted(sections.keys()) == ["a", "b"]
+    assert "a" in sections
+    assert not sections.is_parsed("a")
+
+    assert sections["a"] == [[u"1", u"2"], [u"3", u"4"], [u"5", u"6"]]
+    assert sections.is_parsed("a")
+    assert not sections.is_parsed("b")
+    assert sections["b"] == []
+
+
+def test_host_sections_update_keeps_sections_unparsed():
+    sections1 = host_sections.LazySections()
+    sections1.add_raw_chunk("a", _chunk("1"))
+    sections2 = host_sections.LazySections({"b": [[u"x"]]})
+    sections2.add_raw_chunk("a", _chunk("2"))
+
+    merged = host_sections.HostSections()
+    merged.update(host_sections.HostSections(sections1))
+    merged.update(host_sections.HostSections(sections2))
+
+    assert not merged.sections.is_parsed("a")
+    assert merged.sections == {"a": [[u"1"], [u"2"]], "b": [[u"x"]]}
+
+
+@pytest.fixture()
+def parsed_sections_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(host_sections.cmk.utils.paths, "parsed_sections_cache_dir",
+                        str(tmp_path / "parsed_sections_cache"))
+    cache = host_sections.ParsedSectionsCache()
+    monkeypatch.setattr(host_sections, "_parsed_sections_cache", cache)
+    return cache
+
+
+def test_parsed_sections_cache_shared_between_consumers(monkeypatch, parsed_sections_cache):
+    Scenario().add_host("heute").apply(monkeypatch)
+    calls = []
+
+    def parse_function(info):
+        calls.append(info)
+        return {"parsed": info}
+
+    monkeypatch.setitem(host_sections.config.check_info, "check_plugin_name", {
+        "parse_function": parse_function,
+        "node_info": False,
+        "extra_sections": [],
+    })
+
+    multi_host_sections = host_sections.MultiHostSections()
+    multi_host_sections.add_or_get_host_sections(
+        "heute", "127.0.0.1", host_sections.HostSections(sections={"check_plugin_name": node1}))
+
+    for for_discovery in [False, True]:
+        assert multi_host_sections.get_section_content("heute", "127.0.0.1", "check_plugin_name",
+                                                       for_discovery) == {
+                                                           "parsed": node1
+                                                       }
+
+    assert len(calls) == 1
+    assert parsed_sections_cache.hits == 1
+    assert parsed_sections_cache.misses == 1
+
+    other_sections = host_sections.MultiHostSections()
+    other_sections.add_or_get_host_sections(
+        "heute", "127.0.0.1", host_sections.HostSections(sections={"check_plugin_name": node2}))
+    assert other_sections.get_section_content("heute", "127.0.0.1", "check_plugin_name", False) == {
+        "parsed": node2
+    }
+    assert len(calls) == 2
+
+
+def test_parsed_sections_cache_persisted(parsed_sections_cache):
+    calls = []
+
+    def parse_function(info):
+        calls.append(info)
+        return len(info)
+
+    assert parsed_sections_cache.get("heute", "sec", node1, parse_function, persist=True) == 2
+
+    cache = host_sections.ParsedSectionsCache()
+    assert cache.get("heute", "sec", node1, parse_function, persist=True) == 2
+    assert cache.persisted_hits == 1
+    assert len(calls) == 1
+
+    cache = host_sections.ParsedSectionsCache()
+    assert cache.get("heute", "sec", node1 + node2, parse_function, persist=True) == 4
+    assert cache.misses == 1
+    assert len(calls) == 2
+
+
+def test_parsed_sections_cache_not_picklable(parsed_sections_cache):
+    parse_function = lambda info: lambda: info
+    parsed = parsed_sections_cache.get("heute", "sec", node1, parse_function, persist=True)
+    assert parsed() == node1
+
+    cache = host_sections.ParsedSectionsCache()
+    assert cache.get("heute", "sec", node1, parse_function, persist=True)() == node1
+    assert cache.misses == 1
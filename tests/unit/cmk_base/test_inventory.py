@@ -0,0 +1,64 @@
+# pylint: disable=redefined-outer-name
+
+import os
+
+import pytest  # type: ignore
+
+import cmk.utils.paths
+from cmk.utils.structured_data import StructuredDataTree, TreeArchive
+import cmk_base.inventory as inventory
+
+
+@pytest.fixture()
+def inventory_dirs(monkeypatch, tmp_path):
+    monkeypatch.setattr(cmk.utils.paths, "inventory_output_dir", str(tmp_path / "inventory"))
+    monkeypatch.setattr(cmk.utils.paths, "inventory_archive_dir",
+                        str(tmp_path / "inventory_archive"))
+    return tmp_path
+
+
+def _tree(version):
+    tree = StructuredDataTree()
+    tree.get_dict("hardware.system.")["product"] = "Server"
+    tree.get_list("software.packages:").extend([
+        {
+            "name": "checkmk",
+            "version": version
+        },
+        {
+            "name": "python",
+            "version": "2.7"
+        },
+    ])
+    tree.normalize_nodes()
+    return tree
+
+
+def test_save_inventory_tree(monkeypatch, inventory_dirs):
+    assert inventory._save_inventory_tree("host", _tree("1.6")) is None
+    inventory_file = inventory_dirs / "inventory" / "host"
+    assert StructuredDataTree().load_from(str(inventory_file)).is_equal(_tree("1.6"))
+    assert (inventory_dirs / "inventory" / "host.gz").exists()
+
+    # Unchanged trees are detected without loading the saved tree
+    with monkeypatch.context() as m:
+        m.setattr(StructuredDataTree, "load_from", lambda self, path: pytest.fail("loaded"))
+        assert inventory._save_inventory_tree("host", _tree("1.6")) is None
+
+    old_time = int(os.stat(str(inventory_file)).st_mtime)
+    os.utime(str(inventory_file), (old_time - 10, old_time - 10))
+
+    # The saved tree is still compared when the file has been changed in the meantime
+    assert inventory._save_inventory_tree("host", _tree("1.6")) is None
+    assert inventory._save_inventory_tree("host", _tree("1.7")) == old_time - 10
+
+    archive = TreeArchive(str(inventory_dirs / "inventory_archive" / "host"))
+    assert archive.timestamps() == ["%d" % (old_time - 10)]
+    assert archive.load(old_time - 10).is_equal(_tree("1.6"))
+    assert StructuredDataTree().load_from(str(inventory_file)).is_equal(_tree("1.7"))
+
+
+def test_save_inventory_tree_empty(inventory_dirs):
+    inventory._save_inventory_tree("host", _tree("1.6"))
+    inventory._save_inventory_tree("host", StructuredDataTree())
+    assert os.listdir(str(inventory_dirs / "inventory")) == [".last"]
@@ -0,0 +1,143 @@
+# pylint: disable=redefined-outer-name
+
+import socket
+import threading
+import time
+
+import pytest  # type: ignore
+from testlib.base import Scenario
+
+import cmk.utils.paths
+import cmk.utils.store as store
+import cmk_base
+import cmk_base.caching
+import cmk_base.config as config
+import cmk_base.ip_lookup as ip_lookup
+from cmk_base.exceptions import MKIPAddressLookupError
+
+
+class StubResolver(object):
+    def __init__(self, addresses, delay=0.05):
+        super(StubResolver, self).__init__()
+        self.addresses = addresses
+        self.delay = delay
+        self.lookups = []
+        self.max_concurrent = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, cache_id):
+        with self._lock:
+            self.lookups.append(cache_id)
+            self._running += 1
+            self.max_concurrent = max(self.max_concurrent, self._running)
+        try:
+            time.sleep(self.delay(cache_id) if callable(self.delay) else self.delay)
+            try:
+                return self.addresses[cache_id]
+            except KeyError:
+                raise socket.gaierror(-2, "Name or service not known")
+        finally:
+            with self._lock:
+                self._running -= 1
+
+
+@pytest.fixture()
+def resolver(monkeypatch, tmp_path):
+    monkeypatch.setattr(cmk_base, "config_cache", cmk_base.caching.CacheManager())
+
+    ts = Scenario()
+    for hostname in ["host1", "host2", "host3", "unknown"]:
+        ts.add_host(hostname)
+    ts.add_host("static")
+    ts.set_option("ipaddresses", {"static": "10.0.0.99"})
+    ts.add_host("dual", tags={"address_family": "ip-v4v6"})
+    ts.apply(monkeypatch)
+
+    monkeypatch.setattr(cmk.utils.paths, "var_dir", str(tmp_path))
+    monkeypatch.setattr(config, "max_concurrent_dns_lookups", 3)
+
+    resolver = StubResolver({
+        ("host1", 4): "10.0.0.1",
+        ("host2", 4): "10.0.0.2",
+        ("host3", 4): "10.0.0.3",
+        ("dual", 4): "10.0.0.4",
+        ("dual", 6): "fe80::4",
+    })
+    monkeypatch.setattr(ip_lookup, "_resolve", resolver)
+    return resolver
+
+
+def test_update_dns_cache(monkeypatch, tmp_path, resolver):
+    store.save_data_to_file(
+        str(tmp_path / "ipaddresses.cache"), {
+            ("removed", 4): "10.0.0.100",
+            ("host1", 4): "10.0.0.101",
+        })
+    ip_lookup.cached_ip_addresses("host1")  # Load the cache file
+
+    saved = []
+    save_data_to_file = store.save_data_to_file
+
+    def save_and_remember(path, data, pretty=True):
+        saved.append(path)
+        save_data_to_file(path, data, pretty)
+
+    monkeypatch.setattr(store, "save_data_to_file", save_and_remember)
+
+    updated, failed = ip_lookup.update_dns_cache()
+    assert updated == 6
+    assert failed == ["unknown"]
+
+    assert sorted(resolver.lookups) == [("dual", 4), ("dual", 6), ("host1", 4), ("host2", 4),
+                                        ("host3", 4), ("unknown", 4)]
+    assert 1 < resolver.max_concurrent <= 3
+
+    assert saved == [str(tmp_path / "ipaddresses.cache")]
+    assert store.load_data_from_file(str(tmp_path / "ipaddresses.cache")) == {
+        ("dual", 4): "10.0.0.4",
+        ("dual", 6): "fe80::4",
+        ("host1", 4): "10.0.0.1",
+        ("host2", 4): "10.0.0.2",
+        ("host3", 4): "10.0.0.3",
+    }
+
+
+def test_prefetch_ip_addresses(resolver):
+    ip_lookup.prefetch_ip_addresses(["host1", "host2", "static", "unknown"])
+    assert sorted(resolver.lookups) == [("host1", 4), ("host2", 4), ("unknown", 4)]
+
+    assert ip_lookup.lookup_ip_address("host1") == "10.0.0.1"
+    assert ip_lookup.lookup_ip_address("static") == "10.0.0.99"
+    with pytest.raises(MKIPAddressLookupError, match="Name or service not known"):
+        ip_lookup.lookup_ip_address("unknown")
+    assert len(resolver.lookups) == 3
+
+
+def test_prefetch_ip_addresses_expires_stale_entries(tmp_path, resolver):
+    store.save_data_to_file(
+        str(tmp_path / "ipaddresses.cache"), {
+            ("removed", 4): "10.0.0.100",
+            ("host1", 4): "10.0.0.1",
+            ("host1", 6): "fe80::1",
+            ("dual", 6): "fe80::4",
+        })
+
+    ip_lookup.prefetch_ip_addresses(["host1", "host2", "dual"])
+    assert store.load_data_from_file(str(tmp_path / "ipaddresses.cache")) == {
+        ("host1", 4): "10.0.0.1",
+        ("host2", 4): "10.0.0.2",
+        ("dual", 4): "10.0.0.4",
+        ("dual", 6): "fe80::4",
+    }
+
+
+def test_prefetch_ip_addresses_timeout(monkeypatch, resolver):
+    monkeypatch.setattr(config, "dns_lookup_timeout", 0.1)
+    resolver.delay = lambda cache_id: 0.5 if cache_id[0] == "host2" else 0.01
+
+    ip_lookup.prefetch_ip_addresses(["host1", "host2", "host3"])
+    assert ip_lookup.lookup_ip_address("host1") == "10.0.0.1"
+    assert ip_lookup.lookup_ip_address("host3") == "10.0.0.3"
+    with pytest.raises(MKIPAddressLookupError, match="Timed out after 0.1 seconds"):
+        ip_lookup.lookup_ip_address("host2")
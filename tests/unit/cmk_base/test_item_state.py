@@ -0,0 +1,169 @@
+# encoding: utf-8
+# pylint: disable=redefined-outer-name
+
+import os
+import pytest  # type: ignore
+
+import cmk.utils.paths
+import cmk_base.item_state as item_state
+
+
+@pytest.fixture()
+def counters_dir(monkeypatch, tmp_path):
+    path = tmp_path / "counters"
+    path.mkdir()
+    monkeypatch.setattr(cmk.utils.paths, "counters_dir", str(path))
+    return path
+
+
+def _load(hostname):
+    cached = item_state.CachedItemStates()
+    cached.load(hostname)
+    return cached
+
+
+def test_save_and_load(counters_dir):
+    cached = _load("heute")
+    cached.set_item_state_prefix(("if", u"eth0"))
+    cached.set_item_state("in", (1549000000.0, 2**64 - 1))
+    cached.set_item_state("avg", {"x": [1, 2.5, None]})
+    cached.save("heute")
+
+    assert (counters_dir / "heute").open("rb").read(len(
+        item_state.ItemStateFile.MAGIC)) == item_state.ItemStateFile.MAGIC
+    assert _load("heute").get_all_item_states() == {
+        ("if", u"eth0", "in"): (1549000000.0, 2**64 - 1),
+        ("if", u"eth0", "avg"): {
+            "x": [1, 2.5, None]
+        },
+    }
+
+
+def test_update_in_place(counters_dir):
+    cached = _load("heute")
+    for index in range(100):
+        cached.set_item_state(index, (1.0, index))
+    cached.save("heute")
+    size = os.stat(str(counters_dir / "heute")).st_size
+
+    cached = _load("heute")
+    cached.set_item_state(5, (2.0, 500))
+    cached.clear_item_state(6)
+    cached.save("heute")
+
+    assert os.stat(str(counters_dir / "heute")).st_size == size
+    cached = _load("heute")
+    assert len(cached.get_all_item_states()) == 99
+    assert cached.get_item_state(5) == (2.0, 500)
+    assert cached.get_item_state(6) is None
+
+
+def test_grown_value_is_appended(counters_dir):
+    cached = _load("heute")
+    cached.set_item_state("a", "x")
+    cached.set_item_state("b", "y")
+    cached.save("heute")
+
+    cached = _load("heute")
+    cached.set_item_state("a", "x" * 1000)
+    cached.save("heute")
+
+    assert _load("heute").get_all_item_states() == {("a",): "x" * 1000, ("b",): "y"}
+
+
+def test_merge_concurrent_modification(counters_dir):
+    cached = _load("heute")
+    cached.set_item_state("a", 1)
+    cached.set_item_state("b", 1)
+    cached.save("heute")
+
+    first = _load("heute")
+    second = _load("heute")
+    first.set_item_state("a", 2)
+    first.save("heute")
+    # Ensure the modification is detected by the mtime check
+    os.utime(str(counters_dir / "heute"), (0, 0))
+    second.set_item_state("b", 3)
+    second.clear_item_state("a")
+    second.save("heute")
+
+    assert _load("heute").get_all_item_states() == {("b",): 3}
+
+
+def test_compaction(counters_dir):
+    cached = _load("heute")
+    for index in range(10000):
+        cached.set_item_state(index, (1.0, index))
+    cached.save("heute")
+    size = os.stat(str(counters_dir / "heute")).st_size
+
+    for _run in range(3):
+        cached = _load("heute")
+        for index in range(10000):
+            cached.set_item_state(index, (1.0, "x" * 50))
+        cached.save("heute")
+
+    assert os.stat(str(counters_dir / "heute")).st_size < 4 * size
+    assert _load("heute").get_item_state(9999) == (1.0, "x" * 50)
+
+
+def test_migrate_legacy_file(counters_dir):
+    (counters_dir / "heute").write_bytes(b"{('cpu.loads', None, 'x'): (1.0, 2)}\n")
+
+    cached = _load("heute")
+    assert cached.get_all_item_states() == {('cpu.loads', None, 'x'): (1.0, 2)}
+
+    cached.set_item_state("y", 1)
+    cached.save("heute")
+
+    assert (counters_dir / "heute").open("rb").read(len(
+        item_state.ItemStateFile.MAGIC)) == item_state.ItemStateFile.MAGIC
+    assert _load("heute").get_all_item_states() == {
+        ('cpu.loads', None, 'x'): (1.0, 2),
+        ("y",): 1,
+    }
+
+
+def test_truncated_record_is_ignored(counters_dir):
+    cached = _load("heute")
+    cached.set_item_state("a", 1)
+    cached.set_item_state("b", 2)
+    cached.save("heute")
+
+    path = counters_dir / "heute"
+    path.write_bytes(path.read_bytes()[:-3])
+
+    cached = _load("heute")
+    assert len(cached.get_all_item_states()) == 1
+    cached.set_item_state("c", 3)
+    cached.save("heute")
+    assert len(_load("heute").get_all_item_states()) == 2
+
+
+def test_torn_record_is_skipped(counters_dir):
+    cached = _load("heute")
+    cached.set_item_state("a", "x" * 20)
+    cached.set_item_state("b", "y" * 20)
+    cached.save("heute")
+
+    # Simulate a crash in the middle of updating the value of "a" in place
+    path = counters_dir / "heute"
+    content = path.read_bytes()
+    index = content.index("x" * 20)
+    path.write_bytes(content[:index] + "z" * 10 + content[index + 10:])
+
+    cached = _load("heute")
+    assert cached.get_all_item_states() == {("b",): "y" * 20}
+    cached.set_item_state("a", 1)
+    cached.save("heute")
+    assert _load("heute").get_all_item_states() == {("a",): 1, ("b",): "y" * 20}
+
+
+def test_other_format_version_is_replaced(counters_dir):
+    (counters_dir / "heute").write_bytes(item_state.ItemStateFile.MAGIC[:-2] + "\x01\n\x01")
+
+    cached = _load("heute")
+    assert cached.get_all_item_states() == {}
+    cached.set_item_state("a", 1)
+    cached.save("heute")
+    assert _load("heute").get_all_item_states() == {("a",): 1}
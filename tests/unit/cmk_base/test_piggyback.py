@@ -37,6 +37,9 @@ def test_config():
 
     os.utime(str(source_file), (source_stat.st_atime, source_stat.st_mtime))
 
+    # The files have been written without the piggyback module
+    piggyback.invalidate_index()
+
 
 def test_get_piggyback_raw_data_no_data():
     assert piggyback.get_piggyback_raw_data(piggyback_max_cachefile_age, "nohost") == []
@@ -109,3 +112,49 @@ def test_store_piggyback_raw_data_second_source():
                                                        ('source1', '<<<check_mk>>>\nlala\n'),
                                                        ('source2', '<<<check_mk>>>\nlulu\n'),
                                                    ],)
+
+
+def test_store_piggyback_raw_data_replaces_batch():
+    piggyback.store_piggyback_raw_data("source1", {"test-host2": [u"<<<check_mk>>>", u"lulu"]})
+
+    assert not (cmk.utils.paths.piggyback_dir / "test-host" / "source1").exists()
+    assert piggyback.get_piggyback_raw_data(piggyback_max_cachefile_age, "test-host") == []
+    assert piggyback.get_piggyback_raw_data(piggyback_max_cachefile_age, "test-host2") == [
+        ('source1', '<<<check_mk>>>\nlulu\n'),
+    ]
+
+
+def test_get_piggyback_files_uses_index(monkeypatch):
+    assert piggyback.has_piggyback_raw_data(piggyback_max_cachefile_age, "test-host") is True
+
+    monkeypatch.setattr(os, "listdir", lambda path: pytest.fail("listdir(%s)" % path))
+    monkeypatch.setattr(piggyback.cPickle, "loads", lambda content: pytest.fail("index loaded"))
+    assert piggyback.get_piggyback_files(piggyback_max_cachefile_age, "test-host") == [
+        ("source1", str(cmk.utils.paths.piggyback_dir / "test-host" / "source1")),
+    ]
+    assert piggyback.get_piggyback_files(piggyback_max_cachefile_age, "nohost") == []
+
+
+def test_create_index_removes_outdated_files():
+    outdated_file = cmk.utils.paths.piggyback_dir / "test-host" / "source3"
+    with outdated_file.open(mode="w", encoding="utf-8") as f:  # pylint: disable=no-member
+        f.write(u"<<<check_mk>>>\nlulu\n")
+
+    piggyback.invalidate_index()
+    assert piggyback.get_piggyback_raw_data(piggyback_max_cachefile_age,
+                                            "test-host") == [('source1', '<<<check_mk>>>\nlala\n')]
+    assert not outdated_file.exists()
+
+
+def test_cleanup_piggyback_files():
+    piggyback.store_piggyback_raw_data("source2", {"pig": [u"<<<check_mk>>>", u"lulu"]})
+    piggyback.cleanup_piggyback_files(piggyback_max_cachefile_age)
+    assert (cmk.utils.paths.piggyback_dir / "test-host" / "source1").exists()
+    assert (cmk.utils.paths.piggyback_dir / "pig" / "source2").exists()
+
+    (cmk.utils.paths.piggyback_source_dir / "source2").unlink()
+    piggyback.cleanup_piggyback_files(-1)
+    assert not (cmk.utils.paths.piggyback_source_dir / "source1").exists()
+    assert not (cmk.utils.paths.piggyback_dir / "test-host" / "source1").exists()
+    assert not (cmk.utils.paths.piggyback_dir / "pig").exists()
+    assert piggyback.get_piggyback_raw_data(piggyback_max_cachefile_age, "test-host") == []
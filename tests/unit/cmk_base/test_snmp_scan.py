@@ -0,0 +1,168 @@
+# pylint: disable=redefined-outer-name
+
+import pytest  # type: ignore
+from testlib.base import Scenario
+
+import cmk.utils.paths
+import cmk_base.check_api_utils as check_api_utils
+import cmk_base.check_utils
+import cmk_base.config as config
+import cmk_base.snmp as snmp
+import cmk_base.snmp_scan as snmp_scan
+import cmk_base.snmp_utils as snmp_utils
+
+SYS_DESCR = ".1.3.6.1.2.1.1.1.0"
+SYS_OBJ_ID = ".1.3.6.1.2.1.1.2.0"
+
+
+@pytest.mark.parametrize("scan_function,prefixes,values", [
+    (lambda oid: oid(SYS_OBJ_ID).startswith(".1.3.6.1.4.1.9."), [".1.3.6.1.4.1.9."], []),
+    (lambda oid: oid(SYS_OBJ_ID).startswith((".1.3.6.1.4.1.9.", ".1.3.6.1.4.1.11.")),
+     [".1.3.6.1.4.1.9.", ".1.3.6.1.4.1.11."], []),
+    (lambda oid: oid(SYS_OBJ_ID) == ".1.3.6.1.4.1.9.1", [], [".1.3.6.1.4.1.9.1"]),
+    (lambda oid: oid(SYS_OBJ_ID) in [".1.3.6.1.4.1.9.1", ".1.3.6.1.4.1.9.2"], [],
+     [".1.3.6.1.4.1.9.1", ".1.3.6.1.4.1.9.2"]),
+    (lambda oid: oid(SYS_OBJ_ID[1:]).startswith(".1.3.6.1.4.1.9.") and oid(".1.3.6.1.4.1.9.1.0"),
+     [".1.3.6.1.4.1.9."], []),
+])
+def test_scan_index_indexable(scan_function, prefixes, values):
+    index = snmp_scan.SNMPScanIndex()
+    index.add("plugin", scan_function)
+    assert index.candidates(".1.3.6.1.4.1.2.3") == set()
+    for value in prefixes:
+        assert index.candidates(value + "1.2") == set(["plugin"])
+    for value in values:
+        assert index.candidates(value) == set(["plugin"])
+        assert index.candidates(value + ".1") == set()
+
+
+@pytest.mark.parametrize("scan_function", [
+    lambda oid: "cisco" in oid(SYS_DESCR).lower(),
+    lambda oid: oid(SYS_OBJ_ID).lower().startswith(".1.3.6.1.4.1.9."),
+    lambda oid: oid(SYS_OBJ_ID)[:15] == ".1.3.6.1.4.1.9.",
+    lambda oid: oid(SYS_OBJ_ID) in ".1.3.6.1.4.1.9.1",
+    lambda oid: not oid(SYS_OBJ_ID).startswith(".1.3.6.1.4.1.9."),
+    lambda oid: check_api_utils.host_name() == "abc",
+    lambda oid: False,
+    lambda oid: 1 / 0,
+])
+def test_scan_index_not_indexable(scan_function):
+    index = snmp_scan.SNMPScanIndex()
+    index.add("plugin", scan_function)
+    assert index.candidates(".1.3.6.1.4.1.2.3") == set(["plugin"])
+    assert index.candidates(None) is None
+
+
+class FakeSNMPBackend(snmp_utils.ABCSNMPBackend):
+    def __init__(self, values):
+        super(FakeSNMPBackend, self).__init__()
+        self.values = values
+        self.requests = []
+
+    def get(self, snmp_config, oid, context_name=None):
+        self.requests.append([oid])
+        return self.values.get(oid)
+
+    def get_many(self, snmp_config, oids, context_name=None):
+        self.requests.append(sorted(oids))
+        return {oid: self.values.get(oid) for oid in oids}
+
+    def walk(self, snmp_config, oid, check_plugin_name=None, table_base_oid=None,
+             context_name=None):
+        return []
+
+
+@pytest.fixture()
+def scan_calls(monkeypatch):
+    calls = []
+
+    def scan_cisco(oid):
+        calls.append("cisco_plugin")
+        return oid(SYS_OBJ_ID).startswith(".1.3.6.1.4.1.9.")
+
+    def scan_linux(oid):
+        calls.append("linux_plugin")
+        return "linux" in oid(SYS_DESCR).lower() and oid(".1.3.6.1.4.1.2021.4.5.0") is not None
+
+    monkeypatch.setattr(config, "check_info", {
+        "cisco_plugin": {},
+        "linux_plugin": {},
+        "no_scan_plugin": {},
+    })
+    monkeypatch.setattr(config, "snmp_scan_functions", {
+        "cisco_plugin": scan_cisco,
+        "linux_plugin": scan_linux,
+    })
+    monkeypatch.setattr(cmk_base.check_utils, "is_snmp_check", lambda name: True)
+
+    # Ignore the probing of the scan functions while building the index
+    snmp_scan.get_snmp_scan_index(for_inv=False)
+    del calls[:]
+    return calls
+
+
+@pytest.fixture()
+def backend(monkeypatch, tmp_path):
+    Scenario().add_host(
+        "snmp-host", tags={
+            "snmp_ds": "snmp-v2",
+            "agent": "no-agent"
+        }).apply(monkeypatch)
+    monkeypatch.setattr(cmk.utils.paths, "snmp_scan_cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(cmk.utils.paths, "snmp_scan_results_dir", str(tmp_path / "results"))
+
+    backend = FakeSNMPBackend({
+        SYS_DESCR: "Linux router",
+        SYS_OBJ_ID: ".1.3.6.1.4.1.9.1.1208",
+        ".1.3.6.1.4.1.2021.4.5.0": "1024",
+    })
+    monkeypatch.setattr(snmp.SNMPBackendFactory, "factory",
+                        staticmethod(lambda snmp_config, enforce_stored_walks: backend))
+    return backend
+
+
+def _scan():
+    snmp.cleanup_host_caches()
+    return snmp_scan._snmp_scan(
+        snmp_utils.SNMPHostConfig(
+            is_ipv6_primary=False,
+            hostname="snmp-host",
+            ipaddress="127.0.0.1",
+            credentials="public",
+            port=161,
+            is_bulkwalk_host=True,
+            is_snmpv2or3_without_bulkwalk_host=False,
+            bulk_walk_size_of=10,
+            timing={},
+            oid_range_limits=[],
+            snmpv3_contexts=[],
+            character_encoding=None,
+            is_usewalk_host=False,
+            is_inline_snmp_host=False,
+            is_bulk_snmp_host=False,
+        ),
+        on_error="raise")
+
+
+def test_snmp_scan_reuses_result(scan_calls, backend):
+    assert _scan() == ["cisco_plugin", "linux_plugin", "no_scan_plugin"]
+    assert sorted(scan_calls) == ["cisco_plugin", "linux_plugin"]
+    assert backend.requests == [[SYS_DESCR], [SYS_OBJ_ID], [".1.3.6.1.4.1.2021.4.5.0"]]
+
+    # All OIDs read by the scan functions are fetched at once, the scan functions are skipped
+    del scan_calls[:]
+    del backend.requests[:]
+    assert _scan() == ["cisco_plugin", "linux_plugin", "no_scan_plugin"]
+    assert scan_calls == []
+    assert backend.requests == [sorted([SYS_DESCR, SYS_OBJ_ID, ".1.3.6.1.4.1.2021.4.5.0"])]
+
+    # A changed OID makes the scan functions run again
+    backend.values[SYS_DESCR] = "Cisco IOS"
+    assert _scan() == ["cisco_plugin", "no_scan_plugin"]
+    assert sorted(scan_calls) == ["cisco_plugin", "linux_plugin"]
+
+
+def test_snmp_scan_skips_indexed_scan_functions(scan_calls, backend):
+    backend.values[SYS_OBJ_ID] = ".1.3.6.1.4.1.2.3.4"
+    assert _scan() == ["linux_plugin", "no_scan_plugin"]
+    assert scan_calls == ["linux_plugin"]